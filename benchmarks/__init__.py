@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks
+    ~~~~~~~~~~
+
+    Performance benchmarks for hot paths, run against synthetic repositories (see `core.synthetic`).
+
+    Benchmarks are not collected by a plain `py.test` run, start them with
+
+        py.test benchmarks --synthetic-nodes=10000,100000 --benchmark-autosave
+
+    and compare the results of different commits with `py.test-benchmark compare`.
+
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
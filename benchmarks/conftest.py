@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    The benchmarks use the test database from test_mediatum.cfg, but in contrast to the unit tests, they don't drop
+    the schema and commit their data. Generated repositories are kept between runs, so they are only created
+    once per size. Running the unit tests drops them.
+"""
+import subprocess
+
+from pytest import fixture, yield_fixture
+
+from core.synthetic import SyntheticRepositoryGenerator
+
+
+#: changing these parameters changes the generated repositories and makes results incomparable to older runs
+SYNTHETIC_REPOSITORY_PARAMS = dict(depth=3, fanout=10, restricted_ratio=0.1, fulltext_words=300, seed=0)
+
+
+def pytest_addoption(parser):
+    parser.addoption("--synthetic-nodes", default="",
+                     help="comma separated sizes of the synthetic repositories, like 10000,100000,1000000. "
+                          "Benchmarks are skipped if not given.")
+
+
+def pytest_generate_tests(metafunc):
+    if "node_count" in metafunc.fixturenames:
+        sizes = [int(s) for s in metafunc.config.getoption("synthetic_nodes").split(",") if s.strip()]
+        metafunc.parametrize("node_count", sizes, scope="session", ids=["{}k".format(n // 1000) for n in sizes])
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    """Records the repository parameters and the commit, results of runs with different parameters must not be compared"""
+    output_json["synthetic_repository"] = dict(SYNTHETIC_REPOSITORY_PARAMS,
+                                               nodes=config.getoption("synthetic_nodes"))
+    try:
+        output_json["git_describe"] = subprocess.check_output(["git", "describe", "--always", "--dirty"]).strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+
+@yield_fixture(scope="session")
+def benchmark_database():
+    from core import db
+    from core.database.init import init_database_values
+    from core.init import init_fulltext_search, update_nodetypes_in_db
+    from utils.postgres import schema_exists
+
+    db.enable_session_for_test()
+    db.configure()
+    db.create_engine()
+    s = db.session
+    if not schema_exists(s, "mediatum"):
+        db.create_schema(set_alembic_version=False)
+        init_fulltext_search()
+        update_nodetypes_in_db()
+        init_database_values(s)
+        s.commit()
+    yield db
+    db.Session.remove()
+    db.disable_session_for_test()
+
+
+@fixture(scope="session")
+def synthetic_generator(benchmark_database, node_count):
+    generator = SyntheticRepositoryGenerator(node_count, **SYNTHETIC_REPOSITORY_PARAMS)
+    generator.get_or_generate()
+    benchmark_database.session.execute("ANALYZE")
+    benchmark_database.session.commit()
+    return generator
+
+
+@fixture
+def synthetic_collection(synthetic_generator):
+    return synthetic_generator.find_collection()
+
+
+@yield_fixture
+def bench_req():
+    """Request as seen by an anonymous user"""
+    from core.transition.app import AthanaFlaskStyleApp
+    app = AthanaFlaskStyleApp("benchmarks")
+    with app.test_request_context() as ctx:
+        yield ctx.request
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Benchmarks for the paths that dominate the response times of the web frontend, the export web service and OAI.
+    Benchmark names must stay stable, results are compared by name across commits.
+"""
+from itertools import count
+
+from pytest import fixture, yield_fixture
+from sqlalchemy.orm import undefer
+
+from core import db, Node
+from core.search.config import get_default_search_languages
+from core.users import get_guest_user
+
+
+q = db.query
+
+PAGE_SIZE = 50
+
+BATCH_EDIT_SIZE = 10000
+
+
+@fixture
+def guest():
+    return get_guest_user()
+
+
+@fixture
+def leaf_directory(synthetic_collection):
+    """First directory of the last level, all paths below the collection have the same length"""
+    node = synthetic_collection
+    while True:
+        child = node.container_children.order_by(Node.id).first()
+        if child is None:
+            return node
+        node = child
+
+
+@fixture
+def content_page(synthetic_collection, guest):
+    return (synthetic_collection.content_children_for_all_subcontainers.filter_read_access(user=guest)
+            .order_by(Node.id).limit(PAGE_SIZE).all())
+
+
+def test_search_fulltext_frequent_word(benchmark, synthetic_generator, synthetic_collection, guest):
+    word = synthetic_generator.frequent_words(1)[0]
+    languages = get_default_search_languages()
+
+    def search():
+        return (synthetic_collection.search(u"fulltext={}".format(word), languages).filter_read_access(user=guest)
+                .limit(PAGE_SIZE).all())
+
+    assert benchmark(search)
+
+
+def test_search_full_rare_word_count(benchmark, synthetic_generator, synthetic_collection, guest):
+    word = synthetic_generator.rare_words(1)[0]
+    languages = get_default_search_languages()
+
+    def search_count():
+        return synthetic_collection.search(u"full={}".format(word), languages).filter_read_access(user=guest).count()
+
+    benchmark(search_count)
+
+
+def test_search_attribute(benchmark, synthetic_generator, synthetic_collection, guest):
+    word = synthetic_generator.frequent_words(2)[1]
+    languages = get_default_search_languages()
+
+    def search():
+        return (synthetic_collection.search(u"title={}".format(word), languages).filter_read_access(user=guest)
+                .limit(PAGE_SIZE).all())
+
+    benchmark(search)
+
+
+def test_filter_read_access_count(benchmark, synthetic_collection, guest):
+
+    def count_readable():
+        return synthetic_collection.all_children.filter_read_access(user=guest).count()
+
+    assert benchmark(count_readable) > 0
+
+
+def test_content_list_paging(benchmark, bench_req, synthetic_collection):
+    from web.frontend.content import make_node_content, ContentList
+    bench_req.args["id"] = synthetic_collection.id
+    # start the second page after the first node of the first page
+    first_page = make_node_content(synthetic_collection, bench_req, [])
+    assert isinstance(first_page, ContentList)
+    bench_req.args["after"] = first_page.nodes.first().id
+
+    def second_page():
+        return make_node_content(synthetic_collection, bench_req, [])
+
+    benchmark(second_page)
+
+
+@yield_fixture
+def theme():
+    from core import webconfig
+    if webconfig.theme is None:
+        webconfig.init_theme()
+    yield webconfig.theme
+
+
+def test_render_navtree(benchmark, bench_req, theme, leaf_directory):
+    from web.frontend.frame import _render_navtree
+
+    def render():
+        return _render_navtree(u"en", leaf_directory.id)
+
+    assert benchmark(render)
+
+
+def test_show_node_text_deep(benchmark, bench_req, content_page):
+
+    def render_page():
+        # new request, the mask cache is request-bound
+        bench_req.app_cache = {}
+        return [n.show_node_text_deep(language=u"en") for n in content_page]
+
+    benchmark(render_page)
+
+
+def _export_struct(bench_req, collection):
+    from web.services.export.handlers import get_node_data_struct
+    params = {"limit": PAGE_SIZE, "start": 0}
+    return params, get_node_data_struct(bench_req, "/allchildren", params, None, collection.id, allchildren=True)
+
+
+def test_export_struct2xml(benchmark, bench_req, synthetic_collection):
+    from web.services.export.handlers import struct2xml
+
+    def export_xml():
+        params, d = _export_struct(bench_req, synthetic_collection)
+        return struct2xml(bench_req, "/allchildren", params, None, d)
+
+    benchmark(export_xml)
+
+
+def test_export_struct2json(benchmark, bench_req, synthetic_collection):
+    from web.services.export.handlers import struct2json
+
+    def export_json():
+        params, d = _export_struct(bench_req, synthetic_collection)
+        return struct2json(bench_req, "/allchildren", params, None, d)
+
+    benchmark(export_json)
+
+
+def test_oai_list_records(benchmark, bench_req, monkeypatch, synthetic_collection):
+    from core import config
+    from export import oai
+    monkeypatch.setitem(config.settings, "oai.formats", "mediatum")
+    bench_req.params = {"verb": "ListRecords", "metadataPrefix": "mediatum"}
+
+    def list_records():
+        bench_req.outgoing = []
+        oai.oaiRequest(bench_req)
+        return bench_req.outgoing
+
+    assert benchmark(list_records)
+
+
+def _benchmark_batch_edit(benchmark, collection, edit):
+    """Sets an attribute of BATCH_EDIT_SIZE content nodes. Nodes are loaded before each round, outside of the timing."""
+    values = count()
+
+    def load_nodes():
+        nodes = (collection.content_children_for_all_subcontainers.order_by(Node.id)
+                 .options(undefer(Node.attrs), undefer(Node.system_attrs)).limit(BATCH_EDIT_SIZE).all())
+        return (nodes, unicode(next(values))), {}
+
+    benchmark.pedantic(edit, setup=load_nodes, rounds=3)
+
+
+def test_batch_edit_orm(benchmark, synthetic_collection):
+
+    def edit(nodes, value):
+        for node in nodes:
+            node[u"benchmark_edit"] = value
+        db.session.commit()
+
+    _benchmark_batch_edit(benchmark, synthetic_collection, edit)
+
+
+def test_batch_edit_bulk_edit(benchmark, synthetic_collection):
+    from core.database.postgres.bulkedit import bulk_edit
+
+    def edit(nodes, value):
+        with bulk_edit(nodes):
+            for node in nodes:
+                node[u"benchmark_edit"] = value
+
+    _benchmark_batch_edit(benchmark, synthetic_collection, edit)
@@ -42,6 +42,7 @@ TraceLogger.trace_level = logging.ERROR
 
 from core.database.init import init_database_values
 from core import db, Node
+from core import config
 import utils.search
 import utils.iplist
 from utils.postgres import truncate_tables, run_single_sql, vacuum_tables, vacuum_full_tables, vacuum_analyze_tables
@@ -275,6 +276,202 @@ def sql(args):
         logg.info("finished, no results returned")
 
 
+def pdf(args):
+    """Re-processes all documents below a node with the PDF worker pool"""
+    init.full_init()
+    from contenttypes import Document
+    from core import File
+    from lib.pdf import pool as pdfpool
+    from lib.pdf.parsepdf import PDFException
+
+    parent = q(Node).get(args.nid)
+    if parent is None:
+        logg.warn("node # %s not found!", args.nid)
+        return
+
+    remove_versioning()
+    derived_filetypes = (u"thumb", u"presentation", u"fulltext", u"fileinfo")
+    filepath_to_node_id = {}
+
+    for node_id, filepath in (parent.all_children_by_query(q(Document.id, File.path))
+                              .join(Document.files)
+                              .filter(File.filetype == u"document")):
+        filepath_to_node_id[os.path.join(config.get("paths.datadir"), filepath)] = node_id
+
+    logg.info("re-processing %s documents below node # %s", len(filepath_to_node_id), args.nid)
+    failed = 0
+
+    for processed, (filepath, result) in enumerate(pdfpool.parse_pdfs(filepath_to_node_id), start=1):
+        if isinstance(result, Exception):
+            failed += 1
+            logg.warn("failed to process %s: %s", filepath, result)
+            continue
+
+        node = q(Document).get(filepath_to_node_id[filepath])
+        for f in node.files.filter(File.filetype.in_(derived_filetypes)):
+            node.files.remove(f)
+        node.apply_pdf_result(result, os.path.splitext(filepath)[0] + ".info", node.get_unwanted_exif_attributes())
+
+        if processed % args.commit_every == 0:
+            s.commit()
+            logg.info("processed %s documents", processed)
+
+    s.commit()
+    pdfpool.shutdown_pool()
+    logg.info("finished, %s documents failed", failed)
+
+
+def exif(args):
+    """Re-extracts Exif and IPTC metadata for all images below a node with the exiftool pool"""
+    init.full_init()
+    from contenttypes import Image
+    from core import File
+    from lib.Exif.compat import exif_tags_from_exiftool
+    from lib.iptc import pool as exiftoolpool
+    from lib.iptc.IPTC import iptc_tags_from_metadata
+
+    parent = q(Node).get(args.nid)
+    if parent is None:
+        logg.warn("node # %s not found!", args.nid)
+        return
+
+    remove_versioning()
+    filepath_to_node_id = {}
+
+    for node_id, filepath in (parent.all_children_by_query(q(Image.id, File.path))
+                              .join(Image.files)
+                              .filter(File.filetype == u"original")):
+        filepath_to_node_id[os.path.join(config.get("paths.datadir"), filepath).encode("utf8")] = node_id
+
+    logg.info("re-extracting metadata for %s images below node # %s", len(filepath_to_node_id), args.nid)
+    failed = 0
+
+    pool = exiftoolpool.get_pool()
+    results = pool.get_metadata_batch(filepath_to_node_id, batch_size=args.batch_size)
+    for processed, (filepath, metadata) in enumerate(results, start=1):
+        if isinstance(metadata, Exception):
+            failed += 1
+            logg.warn("failed to read metadata from %s: %s", filepath, metadata)
+            continue
+
+        node = q(Image).get(filepath_to_node_id[filepath])
+        node.set_exif_and_iptc_attributes(exif_tags_from_exiftool(metadata), iptc_tags_from_metadata(metadata.values))
+
+        if processed % args.commit_every == 0:
+            s.commit()
+            logg.info("processed %s images", processed)
+
+    s.commit()
+    exiftoolpool.shutdown_pool()
+    logg.info("finished, %s images failed", failed)
+
+
+def bibtex(args):
+    init.full_init()
+    from schema.bibteximport import BibTeXImporter, write_synthetic_bibtex_file
+
+    action = args.action.lower()
+    parent = None
+
+    if args.parent is not None:
+        parent = q(Node).get(args.parent)
+        if parent is None:
+            logg.warn("node # %s not found!", args.parent)
+            return
+    elif action == "import":
+        logg.warn("import needs a parent node, use --parent")
+        return
+
+    if action == "benchmark":
+        bibtex_filepath = os.path.join(tempfile.gettempdir(), "bibtex_benchmark_{}.bib".format(args.entries))
+        write_synthetic_bibtex_file(bibtex_filepath, args.entries)
+        logg.info("wrote %s synthetic entries to %s", args.entries, bibtex_filepath)
+    else:
+        bibtex_filepath = args.bibtex_file
+
+    remove_versioning()
+    importer = BibTeXImporter(parent, batch_size=args.batch_size, dry_run=(action == "dryrun" or parent is None))
+    report = importer.run(bibtex_filepath)
+
+    for key, msg in report.errors[:args.show_errors]:
+        logg.info("error%s: %s", " in entry " + key if key else "", msg)
+
+    print(report)
+
+    if action == "benchmark":
+        os.unlink(bibtex_filepath)
+
+
+def files(args):
+    """Stores SHA-256 and size for files imported before they were computed at import time"""
+    init.full_init()
+    from core import File, filestore
+
+    remove_versioning()
+    query = q(File).filter(File.sha256 == None)
+    logg.info("computing hashes for %s files%s", query.count(),
+              ", deduplicating content" if filestore.content_addressed_storage_enabled() else "")
+    processed = missing = last_id = 0
+
+    while True:
+        batch = query.filter(File.id > last_id).order_by(File.id).limit(args.commit_every).all()
+        if not batch:
+            break
+        for f in batch:
+            if not f.exists:
+                missing += 1
+                continue
+            f.sha256, f.filesize = filestore.ingest(f.abspath)
+        last_id = batch[-1].id
+        processed += len(batch)
+        s.commit()
+        logg.info("processed %s files", processed)
+
+    logg.info("finished, %s files are missing on disk", missing)
+
+
+def oauth(args):
+    """Measures the cost of OAuth signature verification for the export web service"""
+    init.full_init()
+    from core import oauth as core_oauth
+
+    if args.action == "benchmark":
+        result = core_oauth.benchmark_verification(args.oauth_user.decode("utf8"), args.requests)
+        print("verification per request: {uncached_us:.1f} us uncached, {cached_us:.1f} us with cached credentials".format(**result))
+
+
+def geoip(args):
+    """Measures the cost of country lookups for access statistics"""
+    from lib.geoip.resolver import benchmark
+    if args.action == "benchmark":
+        result = benchmark(args.lines)
+        print("country lookup per log line: {resolver:.2f} us with CountryResolver, {geoip:.2f} us with GeoIP, "
+              "/24 cache hit ratio {cache_hits:.3f}".format(**result))
+
+
+def stats(args):
+    """Manages the access statistics store"""
+    init.full_init()
+    from core import statsstore
+
+    if args.action == "migrate-xml":
+        statsstore.migrate_xml_statistics(remove_files=args.remove_files)
+
+
+def synthetic(args):
+    """Generates synthetic repositories for the benchmark suite"""
+    init.full_init()
+    from core.synthetic import SyntheticRepositoryGenerator
+
+    remove_versioning()
+    if args.action == "generate":
+        generator = SyntheticRepositoryGenerator(args.nodes, depth=args.depth, fanout=args.fanout,
+                                                 restricted_ratio=args.restricted_ratio,
+                                                 fulltext_words=args.fulltext_words, seed=args.seed)
+        collection = generator.run()
+        print("generated collection {} ({})".format(collection.id, collection.name))
+
+
 def iplist_import(args):
     f = open(args.file, "r") if args.file else sys.stdin
     try:
@@ -335,6 +532,58 @@ def main():
     iplist_subparser.add_argument("file", nargs="?", help="File to be parsed (will be stdin if none is given)")
     iplist_subparser.set_defaults(func=iplist_import)
 
+    pdf_subparser = subparsers.add_parser("pdf", help="re-process PDF documents (info, thumbnails, fulltext)")
+    pdf_subparser.add_argument("--commit-every", "-c", type=int, default=100, help="commit after processing n documents")
+    pdf_subparser.add_argument("nid", type=int, help="process all documents below this node ID")
+    pdf_subparser.set_defaults(func=pdf)
+
+    exif_subparser = subparsers.add_parser("exif", help="re-extract Exif and IPTC metadata of images")
+    exif_subparser.add_argument("--batch-size", "-b", type=int, default=50, help="read metadata of n files with one exiftool call")
+    exif_subparser.add_argument("--commit-every", "-c", type=int, default=500, help="commit after processing n images")
+    exif_subparser.add_argument("nid", type=int, help="process all images below this node ID")
+    exif_subparser.set_defaults(func=exif)
+
+    bibtex_subparser = subparsers.add_parser("bibtex", help="bulk import of bibtex files")
+    bibtex_subparser.add_argument("action", choices=["import", "dryrun", "benchmark"],
+                                  help="import file | only report mapping errors | import a synthetic file and measure throughput")
+    bibtex_subparser.add_argument("bibtex_file", nargs="?", help="bibtex file for 'import' and 'dryrun'")
+    bibtex_subparser.add_argument("--parent", "-p", type=int, help="ID of the node that gets the imported nodes as children")
+    bibtex_subparser.add_argument("--batch-size", "-b", type=int, default=1000, help="insert and commit n nodes at once")
+    bibtex_subparser.add_argument("--entries", "-n", type=int, default=100000, help="number of entries for 'benchmark'")
+    bibtex_subparser.add_argument("--show-errors", "-e", type=int, default=20, help="show the first n errors")
+    bibtex_subparser.set_defaults(func=bibtex)
+
+    files_subparser = subparsers.add_parser("files", help="compute and store SHA-256 and size of older files")
+    files_subparser.add_argument("--commit-every", "-c", type=int, default=1000, help="commit after processing n files")
+    files_subparser.set_defaults(func=files)
+
+    oauth_subparser = subparsers.add_parser("oauth", help="OAuth signature verification for the export web service")
+    oauth_subparser.add_argument("action", choices=["benchmark"], help="measure verification cost per request")
+    oauth_subparser.add_argument("oauth_user", help="existing oauth user whose key is used for signing")
+    oauth_subparser.add_argument("--requests", "-n", type=int, default=10000, help="number of verified requests")
+    oauth_subparser.set_defaults(func=oauth)
+
+    geoip_subparser = subparsers.add_parser("geoip", help="GeoIP country lookups")
+    geoip_subparser.add_argument("action", choices=["benchmark"], help="resolve the client addresses of a synthetic access log")
+    geoip_subparser.add_argument("--lines", "-n", type=int, default=10000000, help="number of log lines")
+    geoip_subparser.set_defaults(func=geoip)
+
+    stats_subparser = subparsers.add_parser("stats", help="access statistics store")
+    stats_subparser.add_argument("action", choices=["migrate-xml"], help="import statistic XML files into the database")
+    stats_subparser.add_argument("--remove-files", action="store_true", help="delete the statistic files after the import")
+    stats_subparser.set_defaults(func=stats)
+
+    synthetic_subparser = subparsers.add_parser("synthetic", help="synthetic repositories for benchmarks")
+    synthetic_subparser.add_argument("action", choices=["generate"], help="generate a collection with synthetic content")
+    synthetic_subparser.add_argument("--nodes", "-n", type=int, default=10000, help="total number of nodes")
+    synthetic_subparser.add_argument("--depth", "-d", type=int, default=3, help="directory levels below the collection")
+    synthetic_subparser.add_argument("--fanout", "-f", type=int, default=10, help="directory children per container")
+    synthetic_subparser.add_argument("--restricted-ratio", "-r", type=float, default=0.1,
+                                     help="fraction of leaf directories that guests cannot read")
+    synthetic_subparser.add_argument("--fulltext-words", "-w", type=int, default=300, help="average fulltext size in words")
+    synthetic_subparser.add_argument("--seed", "-s", type=int, default=0, help="random seed")
+    synthetic_subparser.set_defaults(func=synthetic)
+
     args = parser.parse_args()
     args.func(args)
 
@@ -81,22 +81,47 @@ def stackdump_setup():
         signal.signal(signal.SIGQUIT, dumpstacks)
 
 
-def run(host=None, http_port=None, redis_sessions=False, force_test_db=None, loglevel=None, automigrate=False):
-    """Serve mediaTUM from the Athana HTTP Server and start FTP and Z3950, if requested"""
-    # init.full_init() must be done as early as possible to init logging etc.
-    from core import init
-    init.full_init(force_test_db=force_test_db, root_loglevel=loglevel, automigrate=automigrate)
-
-    # init all web components
+def init_web():
+    """Initializes all web components and the request hooks, used by the Athana server and the WSGI application"""
     from core import webconfig
     from core import athana
     webconfig.initContexts()
 
+    @athana.request_started
+    def route_read_only_requests(req, *args):
+        from core import db
+        from core.database.postgres.replicas import use_replicas
+        if req.read_only and db.replicas is not None:
+            use_replicas(db.session)
+
     @athana.request_finished
     def request_finished_db_session(*args):
         from core import db
+        from core.database.postgres.replicas import reset_routing
+        reset_routing(db.session)
         db.session.close()
 
+    @athana.after_fork
+    def reset_db_connections():
+        # connections of the supervisor must not be used by the worker processes
+        from core import db
+        db.engine.dispose()
+        if db.replicas is not None:
+            db.replicas.dispose()
+
+
+def run(host=None, http_port=None, redis_sessions=False, force_test_db=None, loglevel=None, automigrate=False,
+        workers=None):
+    """Serve mediaTUM from the Athana HTTP Server and start FTP and Z3950, if requested.
+    With `workers` > 0, the server runs in prefork mode with that many worker processes.
+    """
+    # init.full_init() must be done as early as possible to init logging etc.
+    from core import init
+    init.full_init(force_test_db=force_test_db, root_loglevel=loglevel, automigrate=automigrate)
+
+    init_web()
+    from core import athana
+
     # start main web server, Z.39.50 and FTP, if configured
     if config.get('z3950.activate', '').lower() == 'true':
         z3950port = int(config.get("z3950.port", "2021"))
@@ -113,7 +138,18 @@ def run(host=None, http_port=None, redis_sessions=False, force_test_db=None, log
         wf.write(datetime.datetime.now().isoformat())
         wf.write("\n")
 
-    athana.run(host or config.get("host.host", "0.0.0.0"), int(http_port or config.get("host.port", "8081")), z3950port)
+    if workers is None:
+        workers = config.getint("host.workers", 0)
+
+    # restart limits only make sense for worker processes that are restarted by the supervisor
+    if workers:
+        worker_limits = dict(max_requests=config.getint("host.worker_max_requests", 0),
+                             max_memory_mb=config.getint("host.worker_max_memory_mb", 0))
+    else:
+        worker_limits = {}
+
+    athana.run(host or config.get("host.host", "0.0.0.0"), int(http_port or config.get("host.port", "8081")), z3950port,
+               workers=workers, graceful_timeout=config.getint("host.graceful_timeout", 30), **worker_limits)
 
 
 def main():
@@ -134,6 +170,8 @@ def main():
     parser.add_argument("-l", "--loglevel", help="root loglevel, sensible values: DEBUG, INFO, WARN")
     parser.add_argument("-m", "--automigrate", action="store_true", default=False,
                         help="run automatic database schema upgrades on startup")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (prefork mode), 0 runs a single process, default: see config file")
     parser.add_argument(
         "--redis-sessions",
         action="store_true",
@@ -143,6 +181,9 @@ def main():
     args = parser.parse_args()
     print("start.py args:", args)
 
+    if args.reload and args.workers:
+        parser.error("--reload cannot be used with worker processes")
+
     if args.stackdump:
         stackdump_setup()
 
@@ -152,11 +193,12 @@ def main():
         extra_files = [maybe_config_filepath] if maybe_config_filepath else []
 
         def main_wrapper():
-            run(args.bind, args.http_port, args.redis_sessions, args.force_test_db, args.loglevel, args.automigrate)
+            run(args.bind, args.http_port, args.redis_sessions, args.force_test_db, args.loglevel, args.automigrate, 0)
 
         run_with_reloader(main_wrapper, extra_files)
     else:
-        run(args.bind, args.http_port, args.redis_sessions, args.force_test_db, args.loglevel, args.automigrate)
+        run(args.bind, args.http_port, args.redis_sessions, args.force_test_db, args.loglevel, args.automigrate,
+            args.workers)
 
 
 # don't run mediaTUM server when this module is imported, unless FORCE_RUN is set
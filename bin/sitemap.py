@@ -24,271 +24,330 @@ import sys
 sys.path += ['../..', '../', '.']
 
 import core.config as config
-import logging
+import bisect
 import datetime
-import time
+import gzip
+import json
+import logging
 import urllib2
-import re
-from lxml import etree
-from math import ceil
+
+from sqlalchemy import func, sql
+from sqlalchemy_continuum import versioning_manager
+from sqlalchemy_continuum.utils import version_class
 
 from core.init import full_init
 full_init(prefer_config_filename="sitemap.log")
 
-from core import Node
+from core import Node, NodeType
 from core import db
 from contenttypes import Collections
 
 q = db.query
+logg = logging.getLogger(__name__)
 
 # XXX: alias handling must be fixed before switching this on
 USE_ALIASES = False
 PING_GOOGLE = True
 PING_URL_ENCODED = 'http://www.google.com/webmasters/tools/ping?sitemap=http%3A%2F%2Fmediatum.ub.tum.de%2Fsitemap-index.xml'
 
+# a sitemap file may contain at most 50k URLs
+URLS_PER_SITEMAP = 50000
+SITEMAP_INDEX_NAME = 'sitemap-index.xml'
+SITEMAP_NAME_TEMPLATE = 'sitemap-{:05d}.xml.gz'
+# rows fetched at once from the server-side cursor
+YIELD_PER = 10000
 
-class Sitemap:
+PRIORITIES = {
+    'dissertation': '1.0',
+    'document': '1.0',
+    'image': '1.0',
+    'video': '0.8',
+}
+DEFAULT_PRIORITY = '0.5'
 
-    """
-    A sitemap object which holds data relevant to the sitemap and creation of sitemap.xml's
-    """
+W3C_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S+00:00'
+
+
+def web_root_dir():
+    return os.path.join(config.basedir, 'web', 'root')
+
+
+def state_filepath():
+    """The state file remembers the sitemap files and the id ranges they cover for incremental updates"""
+    return config.resolve_datadir_path('sitemap_state.json')
 
-    def __init__(self, path, name, host):
-        self.name = name
-        self.path = '/'.join([path, 'web', 'root', name])
-        self.host = host
-        self.url_schema = "https" if config.getboolean("host.ssl", True) else "http"
-
-    def create_sitemap(self, nodes, p_num):
-        """
-        Creates a sitemap.xml from the nodes which were passed in
-        @param nodes: A list of nodes from the mediatum tree in the format '#*'
-        """
-        def check_date_format(date):
-            """
-            Checks to see whether dates are in proper datetime format and converts times in ##/##/#### format to
-            datetime or raises an error when it encounters a different format
-            """
-            # check if date is already in the proper format
-            datetime_pattern = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$')
-
-            # regex and its accompanying strptime format
-            misc_date_formats = ((re.compile(r'\d{2}/\d{2}/\d{4}\+\d{2}:\d{2}T\d{2}:\d{2}:\d{2}$'), '%m/%d/%Y+%H:%MT%H:%M:%S'),
-                                 (re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$'), '%Y-%m-%dT%H:%M:%S'),
-                                 (re.compile(r'\d{4}/\d{2}/\d{2}$'), '%d/%m/%YT%H:%M:%S'),
-                                 (re.compile(r'\d{4}/\d{2}/\d{2}$'), '%/%d/%YT%H:%M:%S'),
-                                 (re.compile(r'\d{2}/\d{2}/\d{4}\+\d{2}:\d{2}$'), '%m/%d/%Y+%H:%M'),
-                                 (re.compile(r'\d{4}-\d{2}-\d{2}$'), '%Y-%m-%d'),
-                                 (re.compile(r'\d{2}/\d{2}/\d{4}$'), '%d/%m/%Y'),
-                                 (re.compile(r'\d{2}/\d{2}/\d{4}$'), '%m/%d/%Y'))
-
-            matched = re.search(datetime_pattern, date)
-            if matched:
-                return date
-            else:
-                for date_format_tuple in misc_date_formats:
-                    matched = re.search(date_format_tuple[0], date)
-                    if matched:
-                        try:
-                            timestruct = time.strptime(date, date_format_tuple[1])
-                            timedatetime = datetime.datetime.fromtimestamp(time.mktime(timestruct))
-                            return timedatetime.strftime('%Y-%m-%dT%H:%M:%S')
-                        except ValueError:
-                            continue
-                else:
-                    raise TypeError('unknown date format given: %s' % date)
-
-        if os.path.isfile(self.path):
-            logging.getLogger('everything').info('Sitemap already exists at %s' % self.path)
-        else:
-            root = etree.Element('urlset', xmlns="http://www.sitemaps.org/schemas/sitemap/0.9")
-            # Doesn't create a sitemap if no nodes to place in it
-            if not nodes:
-                pass
-            else:
-                for id_lastmod_tuple in nodes:
-                    url = etree.SubElement(root, 'url')
-                    loc = etree.SubElement(url, 'loc')
-                    loc.text = "{}://{}/{}".format(self.url_schema, self.host, id_lastmod_tuple[0]) 
-                    lastmod = etree.SubElement(url, 'lastmod')
-
-                    #remove preexisting time zone indicator
-                    stripped_date = id_lastmod_tuple[1].replace('+02:00', '')
-
-                    if stripped_date == '':
-                        lastmod.text = ''.join([datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), '+02:00'])
-                    else:
-                        lastmod.text = ''.join([check_date_format(stripped_date), '+02:00'])
-
-                    changefreq = etree.SubElement(url, 'changefreq')
-                    changefreq.text = 'monthly'
-                    priority = etree.SubElement(url, 'priority')
-                    priority.text = p_num
-                try:
-                    with open(self.path, 'w') as f:
-                        f.write('''<?xml version="1.0" encoding="UTF-8"?>\n''')
-                        f.write(etree.tostring(root))
-                        f.close()
-                except IOError:
-                    logging.getLogger('error').error('Error creating %s' % self.path)
-
-    def delete_sitemap(self):
-        """
-        Removes the sitemap from the directory structure /web/root/
-        """
-        if os.path.isfile(self.path):
-            try:
-                os.remove(self.path)
-            except IOError:
-                logging.getLogger('error').error('Error removing %s' % self.path)
-
-
-class SitemapIndex:
 
+def url_schema():
+    return "https" if config.getboolean("host.ssl", True) else "http"
+
+
+def sitemap_nodes(start_id=None, end_id=None):
+    """Yields (id, type, lastmod) for all publicly readable content nodes below the collections node, ordered by id.
+    lastmod is the time of the latest version of the node (naive UTC datetime) or None.
+    Rows are streamed from a server-side cursor, `start_id` (inclusive) and `end_id` (exclusive) restrict the id range.
     """
-    A sitemap index object. It is responsible for serving as a reference for all sitemaps
+    from core.users import get_guest_user
+
+    NodeVersion = version_class(Node)
+    Transaction = versioning_manager.transaction_cls
+
+    lastmod = (sql.select([Transaction.issued_at])
+               .where(Transaction.id == NodeVersion.transaction_id)
+               .where(NodeVersion.id == Node.id)
+               .order_by(NodeVersion.transaction_id.desc())
+               .limit(1)
+               .as_scalar())
+
+    content_types = sql.select([NodeType.name]).where(NodeType.is_container == False)
+    collections = q(Collections).one()
+
+    query = (collections.all_children_by_query(q(Node.id, Node.type))
+             .filter(Node.type.in_(content_types))
+             .filter_read_access(user=get_guest_user()))
+
+    if start_id is not None:
+        query = query.filter(Node.id >= start_id)
+    if end_id is not None:
+        query = query.filter(Node.id < end_id)
+
+    query = query.add_columns(lastmod).order_by(Node.id)
+    return query.execution_options(stream_results=True).yield_per(YIELD_PER)
+
+
+class SitemapWriter(object):
+
+    """Writes a gzipped sitemap file URL by URL. The file is written to a temporary name and moved
+    to its final name on close(), so the webserver never sends incomplete files.
     """
 
-    def __init__(self, path, name, host):
+    def __init__(self, name, host):
         self.name = name
-        self.path = '/'.join([path, 'web', 'root', name])
         self.host = host
-
-    def create_sitemap_index(self, sitemaps, cur_time):
-        """
-        Creates a sitemap index file from the sitemaps passed in
-        @param sitemaps: a list of strings of sitemap names
-        """
-        if os.path.isfile(self.path):
-            logging.getLogger('everything').info('%s already exists' % self.path)
-        else:
-            root = etree.Element('sitemapindex', xmlns="http://www.sitemaps.org/schemas/sitemap/0.9")
-            if not sitemaps:
-                pass
-            else:
-                for i in sitemaps:
-                    sm = etree.SubElement(root, 'sitemap')
-                    loc = etree.SubElement(sm, 'loc')
-                    loc.text = '/'.join(['http:/', self.host, i])
-                    lastmod = etree.SubElement(sm, 'lastmod')
-                    lastmod.text = cur_time
-                try:
-                    with open(self.path, 'w') as f:
-                        f.write('''<?xml version="1.0" encoding="UTF-8"?>\n''')
-                        f.write(etree.tostring(root))
-                        f.close()
-                except IOError:
-                    logging.getLogger('error').error('Error creating %s' % self.path)
-
-    def delete_sitemap_index(self):
-        """
-        Removes the sitemapindex from the directory structure /web/root/
-        """
-        if os.path.isfile(self.path):
-            try:
-                os.remove(self.path)
-            except IOError:
-                logging.getLogger('error').error('Error removing %s' % self.path)
+        self.url_schema = url_schema()
+        self.count = 0
+        self.first_id = None
+        self.path = os.path.join(web_root_dir(), name)
+        self.tmp_path = self.path + '.tmp'
+        self._fileobj = open(self.tmp_path, 'wb')
+        self._gzipfile = gzip.GzipFile(filename=name[:-3], mode='wb', fileobj=self._fileobj)
+        self._gzipfile.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                             '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+
+    @property
+    def full(self):
+        return self.count >= URLS_PER_SITEMAP
+
+    def add(self, nid, node_type, lastmod):
+        if self.first_id is None:
+            self.first_id = nid
+        self.count += 1
+        lastmod_element = '<lastmod>{}</lastmod>'.format(lastmod.strftime(W3C_DATETIME_FORMAT)) if lastmod else ''
+        self._gzipfile.write('<url><loc>{}://{}/{}</loc>{}<changefreq>monthly</changefreq><priority>{}</priority></url>\n'
+                             .format(self.url_schema, self.host, nid, lastmod_element,
+                                     PRIORITIES.get(node_type, DEFAULT_PRIORITY)))
+
+    def close(self):
+        self._gzipfile.write('</urlset>\n')
+        self._gzipfile.close()
+        self._fileobj.close()
+        os.rename(self.tmp_path, self.path)
+
+    def abort(self):
+        self._gzipfile.close()
+        self._fileobj.close()
+        os.unlink(self.tmp_path)
+
+
+def write_sitemaps(rows, start_id, state, host):
+    """Writes the nodes from `rows` to as many sitemap files as needed.
+    The first file covers ids from `start_id`, the following files start at their first node id.
+    :returns: list of chunk dicts for the state file
+    """
+    chunks = []
+    writer = None
+    now = datetime.datetime.utcnow().strftime(W3C_DATETIME_FORMAT)
+
+    def finish(writer):
+        writer.close()
+        chunks.append({'file': writer.name,
+                       'start_id': start_id if not chunks else writer.first_id,
+                       'count': writer.count,
+                       'lastmod': now})
+        logg.info("wrote %s with %s URLs", writer.name, writer.count)
+
+    try:
+        for nid, node_type, lastmod in rows:
+            if writer is None or writer.full:
+                if writer is not None:
+                    finish(writer)
+                writer = SitemapWriter(SITEMAP_NAME_TEMPLATE.format(state['next_file_number']), host)
+                state['next_file_number'] += 1
+            writer.add(nid, node_type, lastmod)
+    except:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None:
+        finish(writer)
+
+    return chunks
+
+
+def write_sitemap_index(chunks, host):
+    path = os.path.join(web_root_dir(), SITEMAP_INDEX_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for chunk in chunks:
+            f.write('<sitemap><loc>{}://{}/{}</loc><lastmod>{}</lastmod></sitemap>\n'
+                    .format(url_schema(), host, chunk['file'], chunk['lastmod']))
+        f.write('</sitemapindex>\n')
+    os.rename(tmp_path, path)
+
+
+def load_state():
+    try:
+        with open(state_filepath()) as f:
+            return json.load(f)
+    except IOError:
+        return None
+
+
+def save_state(state):
+    path = state_filepath()
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.rename(path + '.tmp', path)
+
+
+def remove_sitemap_files(names):
+    for name in names:
+        path = os.path.join(web_root_dir(), name)
+        if os.path.isfile(path):
+            logg.info('Deleting file: %s', name)
+            os.remove(path)
+
+
+def current_transaction_id():
+    Transaction = versioning_manager.transaction_cls
+    return q(func.max(Transaction.id)).scalar() or 0
 
 
 def create():
     """
-    Creates the sitemap files and the sitemap index files which are located at /web/root/
+    Creates all sitemap files and the sitemap index at /web/root/ from scratch.
+    Old sitemap files are replaced after the new ones have been written.
     """
-    logging.getLogger('everything').info('Creating Sitemaps and Sitemap Index...')
-    from core.users import get_guest_user
-
-    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    logg.info('Creating Sitemaps and Sitemap Index...')
     hostname = config.get('host.name')
+    old_state = load_state() or {}
 
-    root = q(Collections).one()
-    guest_user = get_guest_user()
-    all_nodes = root.all_children_by_query(q(Node)).filter_read_access(user=guest_user)
-    sitemaps = []
-
-    node_dict = {'collection': [],
-                 'directory': [],
-                 'document': [],
-                 'dissertation': [],
-                 'image': [],
-                 'video': [],
-                 'audio': [],
+    state = {
+        'last_transaction_id': current_transaction_id(),
+        'next_file_number': old_state.get('next_file_number', 0),
     }
+    state['chunks'] = write_sitemaps(sitemap_nodes(), 0, state, hostname)
+    write_sitemap_index(state['chunks'], hostname)
+    save_state(state)
 
-    for node in all_nodes:
-        # Arkitekt had a guest field that is actually not visible
-        if node.has_read_access(user=guest_user):
-            for node_type in node_dict.keys():
-                if node_type in q(Node).get(node.id).type:
-                    node_dict[node_type].append((unicode(node.id), q(Node).get(node.id).updatetime))
-
-    # Reassign node_dict to a dict where empty values were removed
-    node_dict = dict((k, v) for k, v in node_dict.iteritems() if v)
-
-    # Sitemap can have at most 50k entries
-    for key in node_dict.keys():
-        if key in ('dissertation', 'document', 'image'):
-            priority_level = '1.0'
-        elif key == 'videos':
-            priority_level = '0.8'
-        else:
-            priority_level = '0.5'
-
-        # Create multiple sitemaps for node lists > 50k
-        if len(node_dict[key]) > 50000:
-            partitions = int(ceil((len(node_dict[key]) / 50000.)))
-            for partition_number in range(partitions):
-                sitemap = Sitemap(base_dir, ''.join(['sitemap-', str(key), str(partition_number), '.xml']), hostname)
-                sitemaps.append(sitemap.name)
-                sitemap.create_sitemap(node_dict[key][partition_number * 50000:(partition_number + 1) * 50000], priority_level)
-        else:
-            sitemap = Sitemap(base_dir, ''.join(['sitemap-', key, '.xml']), hostname)
-            sitemaps.append(sitemap.name)
-            sitemap.create_sitemap(node_dict[key], priority_level)
-
-    siteindex = SitemapIndex(base_dir, 'sitemap-index.xml', hostname)
-    now = '+'.join([datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), '02:00'])
-    siteindex.create_sitemap_index(sitemaps, now)
-
-    logging.getLogger('everything').info('Generation of Sitemaps and SitemapIndex Complete')
+    new_files = set(c['file'] for c in state['chunks'])
+    remove_sitemap_files(c['file'] for c in old_state.get('chunks', []) if c['file'] not in new_files)
 
+    logg.info('Generation of Sitemaps and SitemapIndex Complete, %s URLs in %s files',
+              sum(c['count'] for c in state['chunks']), len(state['chunks']))
 
-def clean():
+
+def update():
     """
-    Removes all .xml files from the /web/root/ directory
+    Rewrites only the sitemap files that contain nodes which have a new version since the last run.
+    Nodes that became non-public without a new version are not noticed, run create regularly to catch them.
+    Creates all sitemaps if there is no state from a previous run.
     """
-    logging.getLogger('everything').info('Cleaning /root of all Sitemaps and SitemapIndex')
+    state = load_state()
+    if not state or not state.get('chunks'):
+        logg.info('no state from a previous run found, creating all sitemaps')
+        return create()
+
+    hostname = config.get('host.name')
+    NodeVersion = version_class(Node)
+
+    transaction_id = current_transaction_id()
+    changed_ids = [nid for nid, in q(NodeVersion.id)
+                   .filter(NodeVersion.transaction_id > state['last_transaction_id'])
+                   .distinct()
+                   .execution_options(stream_results=True).yield_per(YIELD_PER)]
+
+    chunks = state['chunks']
+    start_ids = [c['start_id'] for c in chunks]
+    dirty = sorted(set(max(0, bisect.bisect_right(start_ids, nid) - 1) for nid in changed_ids))
+    logg.info('%s nodes changed since the last run, rewriting %s of %s sitemap files',
+              len(changed_ids), len(dirty), len(chunks))
+
+    new_chunks = []
+    replaced_files = []
+    for ix, chunk in enumerate(chunks):
+        if ix not in dirty:
+            new_chunks.append(chunk)
+            continue
+        end_id = chunks[ix + 1]['start_id'] if ix + 1 < len(chunks) else None
+        new_chunks.extend(write_sitemaps(sitemap_nodes(chunk['start_id'], end_id), chunk['start_id'], state, hostname))
+        replaced_files.append(chunk['file'])
+
+    if new_chunks:
+        # the first file always covers all ids from the start
+        new_chunks[0]['start_id'] = 0
+
+    state['chunks'] = new_chunks
+    state['last_transaction_id'] = transaction_id
+    write_sitemap_index(new_chunks, hostname)
+    save_state(state)
+    remove_sitemap_files(replaced_files)
+
+    logg.info('Update of Sitemaps and SitemapIndex Complete')
 
-    base_dir = os.path.abspath(os.curdir)
-    web_root_dir = '/'.join([base_dir, 'web', 'root'])
 
-    sitemaps = [f for f in os.listdir(web_root_dir) if '.xml' in f and f.startswith('sitemap')]
+def clean():
+    """
+    Removes all sitemap files, the sitemap index from the /web/root/ directory and the state file
+    """
+    logg.info('Cleaning /root of all Sitemaps and SitemapIndex')
+
+    sitemaps = [f for f in os.listdir(web_root_dir())
+                if f.startswith('sitemap') and (f.endswith('.xml') or f.endswith('.xml.gz'))]
 
     # If no .xml files exist
     if not sitemaps:
-        logging.getLogger('everything').info('Nothing to remove...')
+        logg.info('Nothing to remove...')
     else:
-        for sm in sitemaps:
-            logging.getLogger('everything').info('Deleting file: %s' % sm)
-            os.remove('/'.join([web_root_dir, sm]))
+        remove_sitemap_files(sitemaps)
+
+    if os.path.isfile(state_filepath()):
+        os.remove(state_filepath())
 
-    logging.getLogger('everything').info('Cleaning Complete...')
+    logg.info('Cleaning Complete...')
+
+
+def ping_google():
+    response = urllib2.urlopen(PING_URL_ENCODED)
+    if response.getcode() == 200:
+        logg.info('Successful ping of sitemap-index.xml to Google; Response Code: %i', response.getcode())
+    else:
+        logg.info('Unsuccessful ping of sitemap-index.xml to Google; Response Code: %i', response.getcode())
 
 
 def main():
-    if len(sys.argv) > 2 or 'create' not in sys.argv and 'clean' not in sys.argv:
-        raise TypeError('sitemap.py takes in only one of the following arguments: [create] [clean]')
+    if len(sys.argv) != 2 or sys.argv[1] not in ('create', 'update', 'clean'):
+        raise TypeError('sitemap.py takes in only one of the following arguments: [create] [update] [clean]')
     elif sys.argv[1] == 'create':
-        clean()
         create()
         if PING_GOOGLE:
-            response = urllib2.urlopen(PING_URL_ENCODED)
-            if response.getcode() == 200:
-                logging.getLogger('everything').info(
-                    'Successful ping of sitemap-index.xml to Google; Response Code: %i' % response.getcode())
-            else:
-                logging.getLogger('everything').info(
-                    'Unsuccessful ping of sitemap-index.xml to Google; Response Code: %i' % response.getcode())
+            ping_google()
+    elif sys.argv[1] == 'update':
+        update()
+        if PING_GOOGLE:
+            ping_google()
     elif sys.argv[1] == 'clean':
         clean()
 
@@ -32,6 +32,8 @@ import os
 """
 if parameter is given it will be used as period, format: %Y-%m
 if not given, current month will be used as period
+-nolog: don't update the logfile of the period from mediatum.log
+-full: read the whole logfile instead of the lines added since the last run
 """
 
 def create_logfile(period):
@@ -121,9 +123,13 @@ args = sys.argv
 period = time.strftime("%Y-%m")
 fname = None
 create_new_logfile = True
+incremental = True
 
-if len(args) >= 2 and args[1] == "-nolog":
-    create_new_logfile = False
+while len(args) >= 2 and args[1] in ("-nolog", "-full"):
+    if args[1] == "-nolog":
+        create_new_logfile = False
+    else:
+        incremental = False
     args = args[1:]
 
 if len(args) == 2:  # period given
@@ -136,4 +142,4 @@ if len(args) == 3:  # period and filename given
 if create_new_logfile:
     create_logfile(period)
 
-buildStatAll([], period, fname)
+buildStatAll([], period, fname, incremental=incremental)
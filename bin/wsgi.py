@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+WSGI entry point for running mediaTUM under a WSGI server instead of Athana, for example::
+
+    gunicorn --workers 4 --threads 8 --bind 0.0.0.0:8081 bin.wsgi:application
+
+Run from the mediaTUM base directory. The FTP and Z39.50 servers are not started by the WSGI application.
+"""
+from __future__ import absolute_import
+
+from core import init
+init.full_init()
+
+from bin.mediatum import init_web
+init_web()
+
+from core.athana_wsgi import WSGIApplication
+
+application = WSGIApplication()
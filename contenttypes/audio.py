@@ -199,12 +199,17 @@ class Audio(Content):
 
         if original:
 
+            # the old files are unlinked before they are written again, they may share their blobs with other files
             if audiothumb:
                 self.files.remove(audiothumb)
+                if audiothumb.path != original.path:
+                    audiothumb.unlink()
             if thumb:  # delete old thumb
                 self.files.remove(thumb)
+                thumb.unlink()
             if thumb2:  # delete old thumb2
                 self.files.remove(thumb2)
+                thumb2.unlink()
 
             athumb = makeAudioThumb(self, original)
             if athumb:
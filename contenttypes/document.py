@@ -28,6 +28,7 @@ from utils.search import import_node_fulltext
 from schema.schema import VIEW_HIDE_EMPTY
 from core.translation import lang, t
 from lib.pdf import parsepdf
+from lib.pdf import pool as pdfpool
 from core.attachment import filebrowser
 from contenttypes.data import Content, prepare_node_data
 from core.transition.postgres import check_type_arg_with_schema
@@ -137,14 +138,10 @@ class Document(Content):
                 doc = f
         if not doc:
             for f in self.files:
-                if f.type == "thumb":
-                    self.files.remove(f)
-                elif f.type.startswith("present"):
-                    self.files.remove(f)
-                elif f.type == "fileinfo":
-                    self.files.remove(f)
-                elif f.type == "fulltext":
+                if f.type == "thumb" or f.type.startswith("present") or f.type in ("fileinfo", "fulltext"):
                     self.files.remove(f)
+                    # a later document with the same name would write to this path, the blob may be shared
+                    f.unlink()
 
         #fetch unwanted tags to be omitted
         unwanted_attrs = self.get_unwanted_exif_attributes()
@@ -153,38 +150,39 @@ class Document(Content):
             path, ext = splitfilename(doc.abspath)
 
             if not (thumb and present and fulltext and fileinfo):
-                thumbname = path + ".thumb"
-                thumb2name = path + ".thumb2"
-                fulltextname = path + ".txt"
-                infoname = path + ".info"
-                tempdir = config.get("paths.tempdir")
-
                 try:
-                    pdfdata = parsepdf.parsePDFExternal(doc.abspath, tempdir)
+                    pdf_result = pdfpool.parse_pdf(doc.abspath)
                 except parsepdf.PDFException as ex:
                     if ex.value == 'error:document encrypted':
                         # allow upload of encrypted document
                         db.session.commit()
                         return
                     raise OperationException(ex.value)
-                with codecs.open(infoname, "rb", encoding='utf8') as fi:
-                    for line in fi.readlines():
-                        i = line.find(':')
-                        if i > 0:
-                            if any(tag in line[0:i].strip().lower() for tag in unwanted_attrs):
-                                continue
-                            self.set("pdf_" + line[0:i].strip().lower(), utf8_decode_escape(line[i + 1:].strip()))
-
-                self.files.append(File(thumbname, "thumb", "image/jpeg"))
-                self.files.append(File(thumb2name, "presentation", "image/jpeg"))
-                self.files.append(File(fulltextname, "fulltext", "text/plain"))
-                self.files.append(File(infoname, "fileinfo", "text/plain"))
+
+                self.apply_pdf_result(pdf_result, path + ".info", unwanted_attrs)
 
         db.session.commit()
 
         if doc:
             import_node_fulltext(self, overwrite=True)
 
+    def apply_pdf_result(self, pdf_result, infoname, unwanted_attrs):
+        """Sets pdf_* attributes and adds the derived files from a lib.pdf.pool.PDFResult"""
+        for key, value in pdf_result.info.items():
+            attrname = key.strip().lower()
+            if any(tag in attrname for tag in unwanted_attrs):
+                continue
+            self.set("pdf_" + attrname, utf8_decode_escape(value.decode("utf8")))
+
+        parsepdf.write_info_file(parsepdf.PDFInfo(pdf_result.info), infoname)
+
+        if pdf_result.thumb:
+            self.files.append(File(pdf_result.thumb, "thumb", "image/jpeg"))
+            self.files.append(File(pdf_result.thumb2, "presentation", "image/jpeg"))
+        if pdf_result.fulltext:
+            self.files.append(File(pdf_result.fulltext, "fulltext", "text/plain"))
+        self.files.append(File(infoname, "fileinfo", "text/plain"))
+
     def get_unwanted_exif_attributes(self):
             '''
             Returns a list of unwanted attributes which are not to be extracted from uploaded documents
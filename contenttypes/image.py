@@ -34,7 +34,9 @@ from utils.utils import isnewer, iso2utf8, utf8_decode_escape
 from utils.compat import iteritems
 
 import lib.iptc.IPTC
+import lib.iptc.pool
 from lib.Exif import EXIF
+from lib.Exif.compat import exif_tags_from_exiftool
 from utils.list import filter_scalar
 from utils.compat import iteritems
 import utils.process
@@ -488,23 +490,36 @@ class Image(Content):
         self.set("width", width)
         self.set("height", height)
 
-        # Exif
-        unwanted_attrs = Image.get_unwanted_exif_attributes()
+        # Exif and IPTC are read with one exiftool call
+        try:
+            metadata = lib.iptc.pool.get_pool().get_metadata(image_file.abspath)
+        except (OSError, lib.iptc.pool.ExifToolError) as e:
+            logg.warn("exiftool failed for %s, reading only Exif tags: %s", image_file.abspath, e)
+            with open(image_file.abspath, 'rb') as f:
+                exif_tags = EXIF.process_file(f)
+            iptc_tags = None
+        else:
+            exif_tags = exif_tags_from_exiftool(metadata)
+            iptc_tags = lib.iptc.IPTC.iptc_tags_from_metadata(metadata.values)
 
-        with open(image_file.abspath, 'rb') as f:
-            tags = EXIF.process_file(f)
+        self.set_exif_and_iptc_attributes(exif_tags, iptc_tags)
 
-        for k in tags.keys():
+    def set_exif_and_iptc_attributes(self, exif_tags, iptc_tags):
+        """Sets exif_* and iptc_* attributes.
+        :param exif_tags: dict of EXIF.process_file tag names to values
+        :param iptc_tags: dict of IPTC tag names to values, see lib.iptc.IPTC.iptc_tags_from_metadata
+        """
+        unwanted_attrs = Image.get_unwanted_exif_attributes()
+
+        for k in exif_tags.keys():
             # don't set unwanted exif attributes
             if any(tag in k for tag in unwanted_attrs):
                 continue
-            if tags[k]:
-                self.set("exif_" + k.replace(" ", "_"), utf8_decode_escape(str(tags[k])))
+            if exif_tags[k]:
+                self.set("exif_" + k.replace(" ", "_"), utf8_decode_escape(str(exif_tags[k])))
 
-        # IPTC
-        iptc_metadata = lib.iptc.IPTC.get_iptc_tags(image_file.abspath)
-        if iptc_metadata is not None:
-            for k, v in iteritems(iptc_metadata):
+        if iptc_tags is not None:
+            for k, v in iteritems(iptc_tags):
                 self.set('iptc_' + k, v)
 
     def event_files_changed(self):
@@ -757,7 +772,9 @@ class Image(Content):
             upload_path = '{}_upload{}'.format(os.path.splitext(original_path)[0], os.path.splitext(original_path)[-1])
             import shutil
             shutil.copy(original_path, upload_path)
-            self.files.append(File(upload_path, "upload", original_file.mimetype))
+            upload_file = File(upload_path, "upload", original_file.mimetype)
+            upload_file.content_changed()
+            self.files.append(upload_file)
             db.session.commit()
 
         tag_dict = {}
@@ -772,3 +789,6 @@ class Image(Content):
                     tag_dict[tag_name] = field_value
 
         lib.iptc.IPTC.write_iptc_tags(original_path, tag_dict)
+        # exiftool replaced the file, stored hash and size are outdated
+        original_file.content_changed()
+        db.session.commit()
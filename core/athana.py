@@ -77,6 +77,7 @@ def attrEscape(s):
 # python modules
 import os
 import select
+import signal
 import sys
 import time
 import stat
@@ -85,6 +86,9 @@ from cgi import escape
 from urllib import unquote, splitquery
 from collections import OrderedDict
 from core import config
+from core.athana_sessions import Session, MemorySessionStore, RedisSessionStore, make_session_store
+from core.athana_profiler import get_profiler, handler_name
+from core import metrics
 
 # async modules
 import asyncore
@@ -848,6 +852,12 @@ class http_request(object):
     # by default, this request object ignores user data.
     collector = None
 
+    # requests that must be handled by the thread that parsed them instead of a worker thread (see core.athana_wsgi)
+    synchronous = False
+
+    # set if the matched handler was registered as read-only, its database queries can be served by replicas
+    read_only = False
+
     def __init__(self, *args):
         # unpack information about the request
         (self.channel, self.request,
@@ -864,6 +874,7 @@ class http_request(object):
         self._split_uri = None
         self._header_cache = {}
         self.session = None
+        self.session_store = None
         
         # XXX: not really a good idea, but we need some place to store request-bound caching data...
         self.app_cache = {}
@@ -1006,6 +1017,17 @@ class http_request(object):
                 logg.debug("unlinked tempfile %s", f)
         return unlinked_tempfiles
 
+    def finish_session_and_headers(self):
+        "saves the session and adds the headers that are sent with every reply"
+        if self.session is not None and self.session_store is not None:
+            self.session_store.save(self.session)
+
+        if self.session and "PSESSION" not in self.Cookies:
+            self.setCookie('PSESSION', self.sessionid, path="/", secure=config.getboolean("host.ssl", True))
+
+        if "Cache-Control" not in self.reply_headers or not config.getboolean("athana.allow_cache_header", False):
+            self.reply_headers["Cache-Control"] = "no-cache"
+
     def done(self):
         "finalize this transaction - send output to the http channel"
 
@@ -1049,11 +1071,7 @@ class http_request(object):
             # when using telnet to debug a server.
             close_it = 1
 
-        if self.session and "PSESSION" not in self.Cookies:
-            self.setCookie('PSESSION', self.sessionid, path="/", secure=config.getboolean("host.ssl", True))
-            
-        if "Cache-Control" not in self.reply_headers or not config.getboolean("athana.allow_cache_header", False):
-            self.reply_headers["Cache-Control"] = "no-cache"
+        self.finish_session_and_headers()
 
         reply_header = self.build_reply_header()
 
@@ -1339,6 +1357,8 @@ class http_request(object):
         414: "Request-URI Too Large",
         415: "Unsupported Media Type",
         418: "I'm a Teapot",
+        # tus checksum extension, used by the chunked upload
+        460: "Checksum Mismatch",
         500: "Internal Server Error",
         501: "Not Implemented",
         502: "Bad Gateway",
@@ -1503,6 +1523,14 @@ class http_channel (async_chat):
         else:
             async_chat.handle_error(self)
 
+    def handle_close(self):
+        # the client went away while sending a request body, a streaming collector must release its target
+        if self.current_request is not None:
+            collector = getattr(self.current_request, "collector", None)
+            if collector is not None and hasattr(collector, "abort"):
+                collector.abort()
+        async_chat.handle_close(self)
+
     def log(self, *args):
         pass
 
@@ -1656,9 +1684,12 @@ class http_server (asyncore.dispatcher):
         pass
 
     def handle_accept(self):
-        self.total_clients.increment()
         try:
-            conn, addr = self.accept()
+            pair = self.accept()
+            if pair is None:
+                # EWOULDBLOCK, another process sharing the listening socket got the connection
+                return
+            conn, addr = pair
         except socket.error:
             # linux: on rare occasions we get a bogus socket back from
             # accept.  socketmodule.c:makesockaddr complains that the
@@ -1674,6 +1705,7 @@ class http_server (asyncore.dispatcher):
             logg.error('warning: server accept() threw EWOULDBLOCK', exc_info=1)
             return
 
+        self.total_clients.increment()
         self.channel_class(self, conn, addr)
 
     def install_handler(self, handler, back=0):
@@ -3382,10 +3414,12 @@ class WebContext:
 
         for pattern, call in self.pattern_to_function.items():
             if pattern.match(path):
-                function, desc = call
+                function, desc, read_only = call
                 if verbose:
                     logg.debug("Request %s matches (%s)", path, desc)
-                return lambda req: call_and_close(function, req)
+                handler = partial(call_and_close, function)
+                handler.read_only = read_only
+                return handler
 
         # no pattern matched, use catchall handler if present
         if self.catchall_handler:
@@ -3523,8 +3557,9 @@ class WebFile:
             global_modules[filename] = module
         self.handlers = []
 
-    def addHandler(self, function):
-        handler = WebHandler(self, function)
+    def addHandler(self, function, read_only=False):
+        """:param read_only: the handler doesn't write to the database, so its queries can be served by replicas"""
+        handler = WebHandler(self, function, read_only)
         self.handlers += [handler]
         return handler
 
@@ -3551,8 +3586,9 @@ class WebFile:
 
 class WebHandler:
 
-    def __init__(self, file, function):
+    def __init__(self, file, function, read_only=False):
         self.file = file
+        self.read_only = read_only
         if isinstance(function, str):
             self.function = function
             m = file.m
@@ -3569,7 +3605,7 @@ class WebHandler:
         p = WebPattern(self, pattern)
         desc = "pattern %s, file %s, function %s" % (pattern, self.file.filename, self.function)
         desc2 = "file %s, function %s" % (self.file.filename, self.function)
-        self.file.context.pattern_to_function[p.getPattern()] = (self.f, desc)
+        self.file.context.pattern_to_function[p.getPattern()] = (self.f, desc, self.read_only)
         return p
 
 
@@ -3661,6 +3697,25 @@ def read_ini_file(filename):
     return context
 
 
+def parse_cookies(headers):
+    """Returns a dict of the cookies sent in the request `headers`"""
+    cookies = {}
+    cookiestr = headers.get("cookie")
+    if not cookiestr:
+        return cookies
+    if cookiestr.rfind(";") == len(cookiestr) - 1:
+        cookiestr = cookiestr[:-1]
+    for a in cookiestr.split(';'):
+        a = a.strip()
+        i = a.find('=')
+        if i > 0:
+            key, value = a[:i], a[i + 1:]
+            cookies[key] = value
+        else:
+            logg.warn("corrupt cookie value: %s", a.encode("string-escape"))
+    return cookies
+
+
 def headers_to_map(mylist):
     headers = {}
     for h in mylist:
@@ -3758,6 +3813,46 @@ class simple_input_collector:
                     logg.warn("corrupt parameter: %s", e.encode("string-escape"))
         self.handler.continue_request(r, pairs)
 
+class stream_input_collector:
+
+    """Passes the request body to a writable object returned by a stream body opener instead of collecting it.
+    The writable is available as `request.stream_body` in the handler and is None if the opener refused the request.
+    The handler must check if the body was accepted, the request is dispatched as usual with an empty form.
+    """
+
+    def __init__(self, handler, request, length, opener):
+        self.request = request
+        self.length = length
+        self.handler = handler
+        request.channel.set_terminator(length)
+        try:
+            request.stream_session = handler.load_stored_session(request)
+            self.stream = opener(request)
+        except Exception:
+            logg.exception("stream body opener failed for %s", request.uri)
+            self.stream = None
+        request.stream_body = self.stream
+
+    def collect_incoming_data(self, data):
+        if self.stream is not None:
+            self.stream.write(data)
+
+    def abort(self):
+        if self.stream is not None:
+            self.stream.abort()
+            self.stream = None
+
+    def found_terminator(self):
+        self.request.channel.set_terminator('\r\n\r\n')
+        self.request.collector = None
+        if self.stream is not None:
+            self.stream.close()
+        r = self.request
+        del self.request
+        r._data = ""
+        self.handler.continue_request(r, [])
+
+
 class upload_input_collector:
 
 
@@ -3883,33 +3978,6 @@ class upload_input_collector:
 USE_PERSISTENT_SESSIONS = False
 
 
-try:
-    import redis_collections
-except ImportError:
-    pass
-else:
-    class RedisSession(redis_collections.Dict):
-
-        def __init__(self, key):
-            super(RedisSession, self).__init__(key=key)
-
-        @property
-        def id(self):
-            return self.key
-
-        def use(self):
-            pass
-
-
-class Session(dict):
-
-    def __init__(self, id):
-        self.id = id
-
-    def use(self):
-        self.lastuse = time.time()
-
-
 def exception_string():
     s = "Exception " + ustr(sys.exc_info()[0])
     info = sys.exc_info()[1]
@@ -3925,6 +3993,7 @@ BASENAME = re.compile("([^/]*/)*([^/.]*)(.py)?")
 MULTIPART = re.compile('multipart/form-data.*boundary=([^ ]*)', re.IGNORECASE)
 SESSION_PATTERN = re.compile("^;[a-z0-9]{6}-[a-z0-9]{6}-[a-z0-9]{6}$")
 SESSION_PATTERN2 = re.compile("[a-z0-9]{6}-[a-z0-9]{6}-[a-z0-9]{6}")
+_session_id_random = random.SystemRandom()
 
 SESSION_COOKIES_LIVE_SECS = 3600 * 2  # unused sessions may be valid for 2 hours
 
@@ -3952,6 +4021,28 @@ def make_param_dict_utf8_values(param_list):
     return ImmutableMultiDict([(decode(k), decode(v)) for k, v in param_list])
 # /COMPAT
 
+# request bodies that are passed to a writable object instead of being collected, see add_stream_body_opener()
+_stream_body_openers = []
+
+
+def add_stream_body_opener(pattern, opener, methods=("PATCH", )):
+    """Streams the body of requests with one of `methods` and a path matching the regex `pattern`
+    to the object returned by `opener(request)`. It must provide write(data), close() and abort().
+    The opener is called when the request headers have been read, before any data of the body.
+    `request.session` is not available yet, the stored session (or None) can be found in `request.stream_session`.
+    """
+    _stream_body_openers.append((re.compile(pattern), methods, opener))
+
+
+def _find_stream_body_opener(request):
+    if not _stream_body_openers:
+        return None
+    path = request.split_uri()[0]
+    for pattern, methods, opener in _stream_body_openers:
+        if request.command in methods and pattern.match(path):
+            return opener
+
+
 # COMPAT: before / after request handlers and request / app context handling
 _request_started_handlers = []
 _request_finished_handlers = []
@@ -3975,8 +4066,10 @@ def call_handler_func(handler, handler_func, request):
 
 class AthanaHandler:
 
-    def __init__(self):
-        self.sessions = {}
+    def __init__(self, session_store=None):
+        if session_store is None:
+            session_store = RedisSessionStore() if USE_PERSISTENT_SESSIONS else MemorySessionStore()
+        self.sessions = session_store
         self.queue = []
         self.queuelock = thread.allocate_lock()
 
@@ -3994,7 +4087,11 @@ class AthanaHandler:
             size = int(size)
             ctype = headers.get("content-type", None)
             b = MULTIPART.match(ctype) if ctype else None
-            if b is not None:
+            stream_body_opener = _find_stream_body_opener(request)
+            if stream_body_opener is not None:
+                request.type = "STREAM"
+                request.collector = stream_input_collector(self, request, size, stream_body_opener)
+            elif b is not None:
                 request.type = "MULTIPART"
                 boundary = b.group(1)
                 request.collector = upload_input_collector(self, request, size, boundary)
@@ -4005,24 +4102,18 @@ class AthanaHandler:
             request.type = "GET"
             self.continue_request(request, form=[])
 
+    def load_stored_session(self, request):
+        """Returns the stored session of `request` or None. Used before the request body is read."""
+        sessionid = parse_cookies(request.request_headers).get("PSESSION")
+        if sessionid is None:
+            return None
+        return self.sessions.load(sessionid)
+
     def create_session_id(self):
-        pid = abs((ustr(random.random())).__hash__())
-        now = abs((ustr(time.time())).__hash__())
-        rand = abs((ustr(random.random())).__hash__())
-        x = "abcdefghijklmnopqrstuvwxyz0123456789"
-        result = ""
-        for a in range(0, 6):
-            result += x[pid % 36]
-            pid = pid / 36
-        result += "-"
-        for a in range(0, 6):
-            result += x[now % 36]
-            now = now / 36
-        result += "-"
-        for a in range(0, 6):
-            result += x[rand % 36]
-            rand = rand / 36
-        return result
+        """Returns a new session id in the format of SESSION_PATTERN2. The characters are taken from os.urandom,
+        so ids are unpredictable and differ between forked worker processes."""
+        chars = "abcdefghijklmnopqrstuvwxyz0123456789"
+        return "-".join("".join(_session_id_random.choice(chars) for _ in range(6)) for _ in range(3))
 
     # COMPAT: new param style like flask
     @staticmethod
@@ -4065,21 +4156,7 @@ class AthanaHandler:
             args = []
         # /COMPAT
 
-        cookies = {}
-        if "cookie" in request.request_headers:
-            cookiestr = request.request_headers["cookie"]
-            if cookiestr.rfind(";") == len(cookiestr) - 1:
-                cookiestr = cookiestr[:-1]
-            items = cookiestr.split(';')
-            for a in items:
-                a = a.strip()
-                i = a.find('=')
-                if i > 0:
-                    key, value = a[:i], a[i + 1:]
-                    cookies[key] = value
-                else:
-                    logg.warn("corrupt cookie value: %s", a.encode("string-escape"))
-
+        cookies = parse_cookies(request.request_headers)
         request.Cookies = cookies
 
         sessionid = None
@@ -4087,25 +4164,15 @@ class AthanaHandler:
         if "PSESSION" in cookies:
             sessionid = cookies["PSESSION"]
 
-        if USE_PERSISTENT_SESSIONS:
-            if sessionid is None:
-                sessionid = self.create_session_id()
-                logg.debug("Creating new session %s", sessionid)
-
-            session = RedisSession(sessionid)
+        session = None
+        if sessionid is not None:
+            session = self.sessions.load(sessionid)
         else:
-            if sessionid is not None:
-                if sessionid in self.sessions:
-                    session = self.sessions[sessionid]
-                    session.use()
-                else:
-                    session = Session(sessionid)
-                    self.sessions[sessionid] = session
-            else:
-                sessionid = self.create_session_id()
-                logg.debug("Creating new session %s", sessionid)
-                session = Session(sessionid)
-                self.sessions[sessionid] = session
+            sessionid = self.create_session_id()
+
+        if session is None:
+            # new sessions are only stored if the request writes to them, see http_request.done()
+            session = Session(sessionid)
 
         request['Content-Type'] = 'text/html; encoding=utf-8; charset=utf-8'
 
@@ -4127,6 +4194,7 @@ class AthanaHandler:
             path = "/" + path
 
         request.session = session
+        request.session_store = self.sessions
         request.sessionid = sessionid
         request.context = context
         request.path = path
@@ -4159,14 +4227,20 @@ class AthanaHandler:
             return thread_status(request)
         if path == "/profilingstatus":
             return profiling_status(request)
+        if path == "/metrics":
+            return metrics_status(request)
 
         function = context.match(path)
 
         if function is not None:
-            if not multithreading_enabled:
+            request.read_only = getattr(function, "read_only", False)
+            if request.synchronous:
+                process_request(self, function, request)
+            elif not multithreading_enabled:
                 call_handler_func(self, function, request)
             else:
                 self.queuelock.acquire()
+                request.queued_at = time.time()
                 self.queue += [(function, request)]
                 self.queuelock.release()
             return
@@ -4396,6 +4470,7 @@ def flush():
     translators[:] = []
     ftphandlers[:] = []
     global_modules.clear()
+    _stream_body_openers[:] = []
     _purge_all_modules()
 
 
@@ -4441,6 +4516,10 @@ threadlist = None
 
 def thread_status(req):
     req.write("""<html><head><title>Athana Status</title></head><body>""")
+    if _ATHANA_HANDLER is not None:
+        session_stats = _ATHANA_HANDLER.sessions.stats()
+        req.write("<h3>Sessions [%s]</h3>" % session_stats["store"])
+        req.write("Stored: %(count)d<br />Created: %(created)d<br />Expired: %(expired)d<br />Evicted: %(evicted)d<br />" % session_stats)
     if threadlist:
         i = 1
         for thread in threadlist:
@@ -4474,39 +4553,50 @@ def thread_status(req):
     req.reply_code = 200
     return req.done()
 
-profiles = []
-
-
 def profiling_status(req):
+    profiler = get_profiler()
     req.write("""<html><head><title>Athana Profiling Status</title></head><body>""")
 
-    if not profiling:
+    if not profiler.enabled:
         req.write("(profiling disabled)")
+    else:
+        req.write("<p>Sample rate: %s, URL pattern: <tt>%s</tt>, interval: %.1fms</p>"
+                  % (profiler.sample_rate, attrEscape(profiler.url_pattern or ""), profiler.interval * 1000))
 
-    i = 1
-    for time, url, trace in profiles:
-        req.write("<h2>Most usage #%d</h2>" % i)
-        req.write("<h3>Time: %.2f seconds</h3>" % time)
-        req.write("<h3>URL: %s</h3>" % url)
-        i = i + 1
-        req.write('<pre>')
-        req.write(attrEscape(trace))
-        req.write('</pre>')
+    req.write("<table><tr><th>Handler</th><th>Requests</th><th>Total (s)</th><th>Mean (ms)</th><th>Max (ms)</th>"
+              "<th>Samples</th></tr>")
+    for handler, stats in profiler.handler_stats(limit=30):
+        req.write("<tr><td><tt>%s</tt></td><td>%d</td><td>%.2f</td><td>%.1f</td><td>%.1f</td><td>%d</td></tr>"
+                  % (attrEscape(handler), stats.count, stats.total, stats.mean * 1000, stats.max * 1000, stats.samples))
+    req.write("</table>")
 
     req.write("""</body></html>""")
     req.channel.current_request = None
     req.reply_code = 200
     return req.done()
 
-iolock = thread.allocate_lock()
-profiling = 0
-try:
-    import hotshot
-    import hotshot.stats
-except ValueError:
-    profiling = 0
-except ImportError:
-    profiling = 0
+
+def metrics_status(req):
+    req["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    req.write(metrics.REGISTRY.render())
+    req.channel.current_request = None
+    req.reply_code = 200
+    return req.done()
+
+
+def _collect_queue_depth():
+    if _ATHANA_HANDLER is not None:
+        yield (), len(_ATHANA_HANDLER.queue)
+
+
+def _collect_busy_workers():
+    if threadlist:
+        yield ("working", ), sum(1 for t in threadlist if t.status == "working")
+        yield ("idle", ), sum(1 for t in threadlist if t.status != "working")
+
+
+metrics.Gauge("athana_queue_depth", "Requests waiting for a worker thread", collect=_collect_queue_depth)
+metrics.Gauge("athana_workers", "Worker threads by status", ("status", ), collect=_collect_busy_workers)
 
 
 log_request_time = logg.isEnabledFor(logging.DEBUG)
@@ -4515,7 +4605,6 @@ log_request_time = logg.isEnabledFor(logging.DEBUG)
 class AthanaThread:
 
     def __init__(self, server, number):
-        global profiling
         self.server = server
         self.lastrequest = 0
         self.status = "idle"
@@ -4523,6 +4612,7 @@ class AthanaThread:
         self.uri = ""
         self.duration = 0
         self.identifier = ""
+        self.requests = 0
 
     def worker_thread(self):
         server = self.server
@@ -4537,57 +4627,34 @@ class AthanaThread:
                 self.status = "working"
                 self.uri = req.fullpath
                 server.queuelock.release()
-                if profiling:
-                    self.prof = hotshot.Profile("/tmp/athana%d.prof" % self.number)
-                    self.prof.start()
-                    
-                if log_request_time or profiling:  
-                    timenow = time.time()
-                try:
-                    call_handler_func(server, function, req)
-                except:
-                    try:
-                        logg.error("Error while processing request:", exc_info=1)
-                    except:
-                        print "FATAL ERROR: error in request, logging the exception failed!"
-
-                if log_request_time or profiling:
-                    duration = time.time() - timenow
-                    logg.debug("time for request %s: %.1fms", req.path, duration * 1000.)
-
-                if profiling:
-                    global profiles
-                    self.prof.stop()
-                    self.prof.close()
-                    st = hotshot.stats.load("/tmp/athana%d.prof" % self.number)
-                    st.sort_stats('cumulative', 'time')
-
-                    class myio:
-
-                        def __init__(self, old):
-                            self.txt = ""
-                            self.old = old
-                            self.id = thread.get_ident()
-
-                        def write(self, txt):
-                            if self.id == thread.get_ident():
-                                self.txt += txt
-                            else:
-                                self.old.write(txt)
-
-                    iolock.acquire()
-                    io = myio(sys.stdout)
-                    oldstdout, sys.stdout = sys.stdout, io
-                    st.print_stats(50)
-                    sys.stdout = oldstdout
-                    iolock.release()
-                    profiles += [(duration, self.uri, io.txt)]
-                    profiles.sort()
-                    profiles.reverse()
-                    profiles = profiles[0:30]
-
+                process_request(server, function, req, time.time() - req.queued_at)
                 self.status = "idle waiting"
                 self.duration = time.time() - self.lastrequest
+                self.requests += 1
+
+
+def process_request(server, function, req, queue_wait=None):
+    """Calls the handler `function` for `req` with profiling, statement tracking and metrics"""
+    from core.database.postgres import querytracking
+    profiler = get_profiler()
+    handler = handler_name(function)
+    profiling_token = profiler.begin_request(handler, req.path)
+    query_tracker = querytracking.start_request(u"{} {}".format(handler, req.path))
+    timenow = time.time()
+    try:
+        call_handler_func(server, function, req)
+    except:
+        try:
+            logg.error("Error while processing request:", exc_info=1)
+        except:
+            print "FATAL ERROR: error in request, logging the exception failed!"
+
+    profiler.end_request(profiling_token)
+    duration = time.time() - timenow
+    querytracking.finish_request()
+    metrics.request_finished(handler, duration, queue_wait, query_tracker)
+    if log_request_time:
+        logg.debug("time for request %s: %.1fms, %s", req.path, duration * 1000., query_tracker.summary())
 
 
 def runthread(athanathread):
@@ -4597,40 +4664,120 @@ ATHANA_STARTED = False
 _ATHANA_HANDLER = None
 
 
-def run(host="0.0.0.0", port=8081, z3950_port=None):
-    global ATHANA_STARTED, _ATHANA_HANDLER
-    check_date()
-    ph = _ATHANA_HANDLER = AthanaHandler()
-    hs = http_server(host, port)
-    hs.install_handler(ph)
+_after_fork_handlers = []
+_shutdown_requested = False
 
-    if len(ftphandlers) > 0:
-        ftp = ftp_server(ftp_authorizer(), port=ftphandlers[0].getPort())
 
-    if z3950_port is not None:
-        import athana_z3950
-        z3950_server = athana_z3950.z3950_server(port=z3950_port)
+def after_fork(handler):
+    """Decorator for functions which should be run in new worker processes in prefork mode"""
+    _after_fork_handlers.append(handler)
+    return handler
+
+
+def run_after_fork_handlers():
+    for handler in _after_fork_handlers:
+        handler()
+
+
+def request_shutdown(*args):
+    """Stops the server after the current requests have been processed, can be used as signal handler"""
+    global _shutdown_requested
+    _shutdown_requested = True
+
+
+def _pending_work(handler):
+    if handler.queue:
+        return True
+    if threadlist and any(t.status == "working" for t in threadlist):
+        return True
+    # responses that are still being sent
+    return any(d.writable() for d in asyncore.socket_map.values() if not d.accepting)
+
+
+def _serve(handler, servers, max_requests=0, max_memory_mb=0, graceful_timeout=30):
+    """Runs the worker threads and the asyncore loop until a shutdown is requested.
+    Then, the listening `servers` are closed and requests that are in progress are finished.
+    """
+    global ATHANA_STARTED, threadlist, _shutdown_requested
+    _shutdown_requested = False
 
     if multithreading_enabled:
-        global threadlist
         threadlist = []
         for i in range(number_of_threads):
-            athanathread = AthanaThread(ph, i)
+            athanathread = AthanaThread(handler, i)
             identifier = thread.start_new_thread(runthread, (athanathread,))
             athanathread.identifier = identifier
             threadlist += [athanathread]
 
     ATHANA_STARTED = True
 
-    while 1:
+    while not _shutdown_requested:
+        try:
+            asyncore.loop(timeout=0.01, count=100)
+        except select.error:
+            continue
+        if max_requests and threadlist and sum(t.requests for t in threadlist) >= max_requests:
+            logg.info("process %s served %s requests, restarting", os.getpid(), max_requests)
+            request_shutdown()
+        if max_memory_mb:
+            from core.athana_prefork import current_rss_mb
+            rss = current_rss_mb()
+            if rss is not None and rss > max_memory_mb:
+                logg.info("process %s uses %.0fMB memory, restarting", os.getpid(), rss)
+                request_shutdown()
+
+    for server in servers:
+        server.close()
+    deadline = time.time() + graceful_timeout
+    while _pending_work(handler) and time.time() < deadline:
         try:
-            asyncore.loop(timeout=0.01)
+            asyncore.loop(timeout=0.01, count=10)
         except select.error:
             continue
 
+
+def run(host="0.0.0.0", port=8081, z3950_port=None, workers=0, max_requests=0, max_memory_mb=0, graceful_timeout=30):
+    """Starts the server.
+    :param workers: number of worker processes (prefork mode), 0 runs the server in this process
+    :param max_requests: worker processes are restarted after this many requests, 0 means no limit
+    :param max_memory_mb: worker processes are restarted if they use more memory, 0 means no limit
+        The limits only apply to prefork mode, a single process would not be restarted by anyone.
+    """
+    global _ATHANA_HANDLER
+    check_date()
+    if not workers and (max_requests or max_memory_mb):
+        logg.info("worker_max_requests and worker_max_memory_mb are ignored without worker processes")
+        max_requests = max_memory_mb = 0
+
+    session_store = None if USE_PERSISTENT_SESSIONS else make_session_store(shared=workers > 0)
+    ph = _ATHANA_HANDLER = AthanaHandler(session_store)
+    hs = http_server(host, port)
+    hs.install_handler(ph)
+    servers = [hs]
+
+    if len(ftphandlers) > 0:
+        servers.append(ftp_server(ftp_authorizer(), port=ftphandlers[0].getPort()))
+
+    if z3950_port is not None:
+        import athana_z3950
+        servers.append(athana_z3950.z3950_server(port=z3950_port))
+
+    def serve(slot=None):
+        try:
+            signal.signal(signal.SIGTERM, request_shutdown)
+        except ValueError:
+            # not in the main thread, happens with the reloader
+            pass
+        _serve(ph, servers, max_requests, max_memory_mb, graceful_timeout)
+
+    if workers:
+        from core.athana_prefork import PreforkSupervisor
+        PreforkSupervisor(workers, serve, graceful_timeout, _after_fork_handlers).run()
+    else:
+        serve()
+
 """
 TODO:
-    * session clearup
     * temp directory in .cfg file
 """
 
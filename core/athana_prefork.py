@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Prefork mode for Athana: a supervisor process forks worker processes after the application has been initialized,
+    so the imported code and loaded data are shared copy-on-write. All workers accept connections on the listening
+    sockets that were bound by the supervisor before forking.
+
+    The supervisor restarts workers that die. Workers exit by themselves after `max_requests` requests or if they
+    use more than `max_memory_mb` MB, they are replaced by new ones. SIGTERM or SIGINT stop the supervisor, it sends
+    SIGTERM to all workers which finish their current requests and exit. Workers that don't exit within
+    `graceful_timeout` seconds are killed.
+
+    Each worker is connected to the supervisor by a socket pair which is used to relay invalidation messages
+    (see `core.invalidation`) to the other workers. The supervisor never blocks on a worker that doesn't read its
+    messages, they are buffered up to `MAX_PENDING_SIZE` bytes per worker.
+"""
+from __future__ import absolute_import
+
+import errno
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import time
+
+from core import invalidation
+
+
+logg = logging.getLogger(__name__)
+
+#: workers that die faster are restarted with a delay, to avoid a fork loop if workers fail at startup
+MIN_WORKER_LIFETIME = 1.
+MAX_MESSAGE_SIZE = 4096
+MAX_PENDING_SIZE = 1 << 20
+
+
+class WorkerProcess(object):
+
+    def __init__(self, slot, pid, channel):
+        self.slot = slot
+        self.pid = pid
+        self.channel = channel
+        self.channel.setblocking(False)
+        self.started = time.time()
+        self.buf = ""
+        # messages that couldn't be sent to the worker yet
+        self.pending = ""
+
+
+class PreforkSupervisor(object):
+
+    """Forks and supervises `workers` worker processes which run `serve(slot)`.
+
+    :param after_fork: functions that are called in each new worker process before `serve`, for example to
+        reset database connections inherited from the supervisor
+    """
+
+    def __init__(self, workers, serve, graceful_timeout=30, after_fork=()):
+        self.worker_count = workers
+        self.serve = serve
+        self.graceful_timeout = graceful_timeout
+        self.after_fork = after_fork
+        self.workers = {}
+        self.stopping = False
+
+    def _handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        logg.info("prefork supervisor %s starting %s workers", os.getpid(), self.worker_count)
+        for slot in xrange(self.worker_count):
+            self._spawn(slot)
+
+        while not self.stopping:
+            self._relay(timeout=1.)
+            self._reap()
+
+        self._shutdown()
+
+    def _spawn(self, slot):
+        channel, worker_channel = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            # worker process, never returns
+            exit_code = 1
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                channel.close()
+                for worker in self.workers.values():
+                    worker.channel.close()
+                # otherwise all workers continue the random sequence of the supervisor
+                random.seed()
+                for func in self.after_fork:
+                    func()
+                invalidation.listen(worker_channel)
+                self.serve(slot)
+                exit_code = 0
+            except:
+                logg.exception("worker %s failed", os.getpid())
+            finally:
+                os._exit(exit_code)
+
+        worker_channel.close()
+        self.workers[pid] = WorkerProcess(slot, pid, channel)
+        logg.info("started worker %s in slot %s", pid, slot)
+
+    def _relay(self, timeout):
+        """Forwards complete invalidation messages from one worker to all others"""
+        channels = {w.channel.fileno(): w for w in self.workers.values()}
+        waiting = [fd for fd, w in channels.iteritems() if w.pending]
+        try:
+            readable, writable, _ = select.select(channels.keys(), waiting, [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+
+        for fd in writable:
+            self._send_pending(channels[fd])
+
+        for fd in readable:
+            sender = channels[fd]
+            try:
+                data = sender.channel.recv(MAX_MESSAGE_SIZE)
+            except socket.error:
+                continue
+            if not data:
+                continue
+            sender.buf += data
+            if "\n" not in sender.buf:
+                continue
+            messages, sender.buf = sender.buf.rsplit("\n", 1)
+            messages += "\n"
+            for worker in self.workers.values():
+                if worker is not sender:
+                    if len(worker.pending) + len(messages) > MAX_PENDING_SIZE:
+                        logg.error("worker %s doesn't read invalidation messages, dropping %s bytes",
+                                   worker.pid, len(worker.pending))
+                        worker.pending = ""
+                    worker.pending += messages
+                    self._send_pending(worker)
+
+    def _send_pending(self, worker):
+        """Sends as much of the pending messages as the worker's socket buffer takes, without blocking"""
+        try:
+            sent = worker.channel.send(worker.pending)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            logg.warn("could not relay invalidation messages to worker %s", worker.pid)
+            worker.pending = ""
+            return
+        worker.pending = worker.pending[sent:]
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            worker.channel.close()
+            if self.stopping:
+                continue
+            lifetime = time.time() - worker.started
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                logg.info("worker %s exited after %.0f seconds, restarting", pid, lifetime)
+            else:
+                logg.error("worker %s died with status %s after %.0f seconds, restarting", pid, status, lifetime)
+            if lifetime < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            self._spawn(worker.slot)
+
+    def _shutdown(self):
+        logg.info("stopping %s workers", len(self.workers))
+        for pid in self.workers.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+        deadline = time.time() + self.graceful_timeout
+        while self.workers and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+
+        for pid in self.workers.keys():
+            logg.warn("worker %s did not stop in time, killing it", pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.workers.clear()
+        logg.info("prefork supervisor stopped")
+
+
+def current_rss_mb():
+    """Returns the resident set size of this process in MB, None if unknown"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024. * 1024.)
+    except (IOError, OSError, ValueError):
+        return None
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Statistical sampling profiler for Athana, replaces the hotshot profiling.
+
+    A sampler thread looks at the stacks of the worker threads every `interval` seconds (`sys._current_frames`),
+    the profiled requests themselves don't run any profiling code. Only requests selected by `sample_rate`
+    (fraction of all requests) or `url_pattern` (regular expression matched against the path) are sampled, so the
+    profiler can be enabled for production traffic.
+
+    Samples are aggregated as collapsed stacks per handler, the format used by flamegraph.pl and speedscope.
+    While the profiler is enabled, the wall time of all requests is recorded per handler.
+"""
+from __future__ import absolute_import
+
+from collections import defaultdict
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+from thread import get_ident
+import time
+
+from core import config
+
+
+logg = logging.getLogger(__name__)
+
+
+DEFAULT_INTERVAL = 0.005
+#: deeper stacks are truncated at the root side
+MAX_STACK_DEPTH = 200
+
+
+def handler_name(handler_func):
+    """Returns a readable name for a handler function or a callable handler object"""
+    name = getattr(handler_func, "__name__", None) or type(handler_func).__name__
+    module = getattr(handler_func, "__module__", None)
+    return "{}.{}".format(module, name) if module else name
+
+
+class HandlerStats(object):
+
+    """Wall time statistics of a handler"""
+
+    __slots__ = ("count", "total", "max", "max_path", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.max_path = None
+        self.samples = 0
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def add(self, duration, path):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+            self.max_path = path
+
+
+class SamplingProfiler(object):
+
+    """Samples the stacks of worker threads that are processing selected requests.
+
+    The worker threads call `begin_request` and `end_request`, everything else runs in the sampler thread or
+    in the admin view.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, sample_rate=0., url_pattern=None, output_dir=None):
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.url_pattern = url_pattern
+        self.output_dir = output_dir or tempfile.gettempdir()
+        self.started_at = None
+        self._lock = threading.Lock()
+        # thread ident -> handler name of the sampled requests that are currently processed
+        self._active = {}
+        self._stacks = defaultdict(lambda: defaultdict(int))
+        self._handler_stats = defaultdict(HandlerStats)
+        self._frame_names = {}
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def url_pattern(self):
+        return self._url_pattern.pattern if self._url_pattern is not None else None
+
+    @url_pattern.setter
+    def url_pattern(self, pattern):
+        self._url_pattern = re.compile(pattern) if pattern else None
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="athana-profiler")
+        self._thread.daemon = True
+        self.started_at = time.time()
+        self._thread.start()
+        logg.info("sampling profiler started, interval %.1fms, sample rate %s, url pattern %s",
+                  self.interval * 1000, self.sample_rate, self.url_pattern)
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join()
+        self._thread = None
+        with self._lock:
+            self._active.clear()
+        logg.info("sampling profiler stopped")
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._handler_stats.clear()
+        self.started_at = time.time() if self.enabled else None
+
+    def should_sample(self, path):
+        if self._url_pattern is not None and self._url_pattern.search(path):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def begin_request(self, handler, path):
+        """Called by a worker thread before running `handler`.
+        Returns a token that must be passed to `end_request`, None if the profiler is disabled.
+        """
+        if self._thread is None:
+            return None
+        sampled = self.should_sample(path)
+        if sampled:
+            with self._lock:
+                self._active[get_ident()] = handler
+        return (handler, path, sampled, time.time())
+
+    def end_request(self, token):
+        if token is None:
+            return
+        handler, path, sampled, started = token
+        duration = time.time() - started
+        with self._lock:
+            if sampled:
+                self._active.pop(get_ident(), None)
+            self._handler_stats[handler].add(duration, path)
+
+    def _frame_name(self, code):
+        name = self._frame_names.get(code)
+        if name is None:
+            filename = code.co_filename
+            if filename.startswith(config.basedir):
+                filename = filename[len(config.basedir):].lstrip(os.sep)
+            name = self._frame_names[code] = "{}:{} ({})".format(filename, code.co_firstlineno, code.co_name)
+        return name
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            names.append(self._frame_name(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        return ";".join(names)
+
+    def sample(self):
+        """Takes one sample of all threads that process a sampled request"""
+        with self._lock:
+            if not self._active:
+                return
+            active = self._active.copy()
+        frames = sys._current_frames()
+        collapsed = [(handler, self._collapse(frames[ident])) for ident, handler in active.iteritems() if ident in frames]
+        del frames
+        with self._lock:
+            for handler, stack in collapsed:
+                self._stacks[handler][stack] += 1
+                self._handler_stats[handler].samples += 1
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                logg.exception("sampling failed")
+
+    def handler_stats(self, sort_key="total", limit=None):
+        """Returns a list of (handler, HandlerStats), sorted by `sort_key` descending"""
+        with self._lock:
+            items = self._handler_stats.items()
+        items.sort(key=lambda t: getattr(t[1], sort_key), reverse=True)
+        return items[:limit] if limit else items
+
+    def top_stacks(self, handler, limit=20):
+        """Returns the most frequently sampled (stack, count) pairs of `handler`"""
+        with self._lock:
+            stacks = self._stacks.get(handler, {}).items()
+        stacks.sort(key=lambda t: t[1], reverse=True)
+        return stacks[:limit]
+
+    def collapsed_lines(self, handler=None):
+        """Yields the samples in collapsed stack format. The handler name is the root frame of all stacks."""
+        with self._lock:
+            if handler is None:
+                stacks = [(h, s.items()) for h, s in self._stacks.items()]
+            else:
+                stacks = [(handler, self._stacks.get(handler, {}).items())]
+        for handler, handler_stacks in stacks:
+            for stack, count in sorted(handler_stacks):
+                yield "{};{} {}\n".format(handler, stack, count)
+
+    def write_collapsed(self, handler=None):
+        """Writes the samples to a collapsed stack file in `output_dir` and returns its path"""
+        suffix = handler or "all"
+        filename = "athana_profile_{}_{}_{}.collapsed".format(os.getpid(), time.strftime("%Y%m%d-%H%M%S"), suffix)
+        path = os.path.join(self.output_dir, re.sub(r"[^\w.-]", "_", filename))
+        with open(path, "w") as wf:
+            wf.writelines(self.collapsed_lines(handler))
+        logg.info("wrote collapsed stacks to %s", path)
+        return path
+
+
+_profiler = None
+
+
+def get_profiler():
+    """Returns the profiler of this process, configured from the `athana.profiling_*` settings"""
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(interval=float(config.get("athana.profiling_interval", DEFAULT_INTERVAL)),
+                                     sample_rate=float(config.get("athana.profiling_sample_rate", 0)),
+                                     url_pattern=config.get("athana.profiling_url_pattern"),
+                                     output_dir=config.get("athana.profiling_dir"))
+        if config.getboolean("athana.profiling", False):
+            _profiler.start()
+    return _profiler
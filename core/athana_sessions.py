@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Session stores for Athana.
+
+    Sessions are created lazily: a request without a known session gets a new, empty `Session` that is only stored
+    when the request wrote something to it (see `http_request.done`). Crawlers that don't send the session cookie
+    therefore don't allocate anything.
+
+    `MemorySessionStore` keeps the sessions in the server process. `SqliteSessionStore` keeps them in a local SQLite
+    file which can be shared by multiple server processes on the same host. Session data is stored as JSON, and
+    the file must only be accessible by the server user because anyone who can write it can log in as any user.
+    Both drop sessions that were not used for `ttl` seconds and the least recently used ones if there are more than
+    `max_count` sessions. Expired sessions are removed every `sweep_interval` seconds.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from core import config
+
+
+logg = logging.getLogger(__name__)
+
+
+#: sessions that were not used for this time expire
+DEFAULT_TTL = 3600 * 2
+DEFAULT_MAX_COUNT = 100000
+DEFAULT_SWEEP_INTERVAL = 60
+#: last use of stored sessions is only updated after this time to avoid writes for every request
+SQLITE_TOUCH_INTERVAL = 60
+#: default location of the SQLite session file, relative to the datadir
+DEFAULT_SESSION_FILE = "sessions/sessions.sqlite"
+
+
+class Session(dict):
+
+    def __init__(self, id):
+        self.id = id
+        self.lastuse = time.time()
+        # JSON content when the session was loaded from a SqliteSessionStore
+        self.saved_state = None
+
+    def use(self):
+        self.lastuse = time.time()
+
+
+class SessionStore(object):
+
+    """Base class of session stores.
+    Subclasses implement `load`, `save`, `delete`, `sweep` and `__len__`.
+    """
+
+    name = None
+
+    def __init__(self, ttl=DEFAULT_TTL, max_count=DEFAULT_MAX_COUNT, sweep_interval=DEFAULT_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.max_count = max_count
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.time()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def load(self, sessionid):
+        """Returns the stored session with `sessionid` or None"""
+        raise NotImplementedError()
+
+    def save(self, session):
+        """Stores `session` at the end of a request. Empty sessions that were never stored are ignored."""
+        raise NotImplementedError()
+
+    def delete(self, sessionid):
+        raise NotImplementedError()
+
+    def sweep(self):
+        """Removes expired sessions and the least recently used ones exceeding `max_count`"""
+        raise NotImplementedError()
+
+    def maybe_sweep(self):
+        now = time.time()
+        if now - self.last_sweep >= self.sweep_interval:
+            self.last_sweep = now
+            self.sweep()
+
+    def stats(self):
+        """Returns a dict with the number of stored sessions and counters since server start"""
+        return {
+            "store": self.name,
+            "count": len(self),
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+class MemorySessionStore(SessionStore):
+
+    """Keeps sessions in the server process, in order of last use"""
+
+    name = "memory"
+
+    def __init__(self, *args, **kwargs):
+        super(MemorySessionStore, self).__init__(*args, **kwargs)
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sessionid):
+        self.maybe_sweep()
+        with self._lock:
+            session = self._sessions.pop(sessionid, None)
+            if session is None:
+                return None
+            if session.lastuse < time.time() - self.ttl:
+                self.expired += 1
+                return None
+            self._sessions[sessionid] = session
+        session.use()
+        return session
+
+    def save(self, session):
+        # stored sessions are modified in place
+        if not session:
+            return
+        with self._lock:
+            if session.id in self._sessions:
+                return
+            self._sessions[session.id] = session
+            self.created += 1
+            while len(self._sessions) > self.max_count:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+    def delete(self, sessionid):
+        with self._lock:
+            self._sessions.pop(sessionid, None)
+
+    def sweep(self):
+        limit = time.time() - self.ttl
+        with self._lock:
+            # least recently used sessions come first
+            for sessionid, session in self._sessions.items():
+                if session.lastuse >= limit:
+                    break
+                del self._sessions[sessionid]
+                self.expired += 1
+            while len(self._sessions) > self.max_count:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(self._sessions.values())
+
+
+def _check_private_file(filename):
+    """Creates `filename` and its directory if they don't exist, accessible only by the current user.
+    :raises: IOError if the file or its directory are owned or writable by other users
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, 0o700)
+    # don't follow a symlink placed by another user
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        file_stat = os.fstat(fd)
+    finally:
+        os.close(fd)
+    dir_stat = os.stat(dirname)
+
+    uid = os.getuid()
+    if file_stat.st_uid != uid or file_stat.st_mode & 0o077:
+        raise IOError("session file {} must be owned by uid {} and not be accessible by others (mode 0600)"
+                      .format(filename, uid))
+    if dir_stat.st_uid != uid or dir_stat.st_mode & 0o022:
+        raise IOError("directory {} of the session file must be owned by uid {} and not be writable by others"
+                      .format(dirname, uid))
+
+
+class SqliteSessionStore(SessionStore):
+
+    """Keeps sessions as JSON in a SQLite database file that can be shared by server processes on the same host.
+    Sessions are written back at the end of a request if their content changed.
+    Session values must be JSON serializable. Tuples are loaded as lists and strings as unicode.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, filename, *args, **kwargs):
+        super(SqliteSessionStore, self).__init__(*args, **kwargs)
+        # journal files created by SQLite get the permissions of the database file
+        _check_private_file(filename)
+        self.filename = filename
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS session (id TEXT PRIMARY KEY, data BLOB, lastuse REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS session_lastuse ON session (lastuse)")
+
+    def _connection(self):
+        # connections can't be shared between threads, processes open the file after forking
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.filename, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, sessionid):
+        self.maybe_sweep()
+        conn = self._connection()
+        row = conn.execute("SELECT data, lastuse FROM session WHERE id=?", (sessionid, )).fetchone()
+        if row is None:
+            return None
+        data, lastuse = row
+        now = time.time()
+        if lastuse < now - self.ttl:
+            self.expired += 1
+            return None
+        session = Session(sessionid)
+        state = str(data)
+        try:
+            session.update(json.loads(state))
+        except ValueError:
+            logg.warn("cannot decode session %s, using an empty session", sessionid)
+            return None
+        session.saved_state = state
+        if now - lastuse >= SQLITE_TOUCH_INTERVAL:
+            with conn:
+                conn.execute("UPDATE session SET lastuse=? WHERE id=?", (now, sessionid))
+        return session
+
+    def save(self, session):
+        if not session and session.saved_state is None:
+            return
+        try:
+            state = json.dumps(dict(session), sort_keys=True, separators=(",", ":"))
+        except (TypeError, ValueError):
+            logg.exception("cannot serialize session %s, changes are lost", session.id)
+            return
+        if state == session.saved_state:
+            return
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO session (id, data, lastuse) VALUES (?, ?, ?)",
+                         (session.id, state, time.time()))
+        if session.saved_state is None:
+            self.created += 1
+        session.saved_state = state
+
+    def delete(self, sessionid):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM session WHERE id=?", (sessionid, ))
+
+    def sweep(self):
+        with self._connection() as conn:
+            cursor = conn.execute("DELETE FROM session WHERE lastuse < ?", (time.time() - self.ttl, ))
+            self.expired += cursor.rowcount
+            cursor = conn.execute("DELETE FROM session WHERE id NOT IN "
+                                  "(SELECT id FROM session ORDER BY lastuse DESC LIMIT ?)", (self.max_count, ))
+            self.evicted += cursor.rowcount
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM session").fetchone()[0]
+
+
+try:
+    import redis_collections
+except ImportError:
+    pass
+else:
+    class RedisSession(redis_collections.Dict):
+
+        def __init__(self, key):
+            super(RedisSession, self).__init__(key=key)
+
+        @property
+        def id(self):
+            return self.key
+
+        def use(self):
+            pass
+
+
+class RedisSessionStore(SessionStore):
+
+    """Experimental persistent sessions in Redis, only for testing. Redis writes changes immediately."""
+
+    name = "redis"
+
+    def load(self, sessionid):
+        return RedisSession(sessionid)
+
+    def save(self, session):
+        pass
+
+    def delete(self, sessionid):
+        RedisSession(sessionid).clear()
+
+    def sweep(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+def make_session_store(shared=False):
+    """Creates the session store configured by athana.session_store (memory or sqlite)
+    :param shared: the store must be usable by multiple processes, sqlite is used instead of memory
+    """
+    store_type = config.get("athana.session_store", MemorySessionStore.name)
+    if shared and store_type == MemorySessionStore.name:
+        logg.warn("memory session store cannot be shared by server processes, using sqlite")
+        store_type = SqliteSessionStore.name
+    kwargs = dict(ttl=config.getint("athana.session_ttl", DEFAULT_TTL),
+                  max_count=config.getint("athana.session_max_count", DEFAULT_MAX_COUNT),
+                  sweep_interval=config.getint("athana.session_sweep_interval", DEFAULT_SWEEP_INTERVAL))
+
+    if store_type == MemorySessionStore.name:
+        return MemorySessionStore(**kwargs)
+    elif store_type == SqliteSessionStore.name:
+        filename = config.get("athana.session_file") or config.resolve_datadir_path(DEFAULT_SESSION_FILE)
+        return SqliteSessionStore(filename, **kwargs)
+    elif store_type == RedisSessionStore.name:
+        return RedisSessionStore(**kwargs)
+    else:
+        raise ValueError("unknown session store '{}', use memory or sqlite".format(store_type))
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    WSGI adapter for the Athana request handlers, so mediaTUM can run under a standard WSGI server like
+    gunicorn or uWSGI instead of the Athana HTTP server.
+
+    `WSGIApplication` builds a `WSGIRequest` from the WSGI environ and processes it like Athana does: the request
+    body is parsed by the Athana input collectors (form data, multipart uploads, stream bodies), `AthanaHandler`
+    loads the session, matches the context and calls the handler in the thread of the WSGI server.
+    Instead of being pushed to an HTTP channel, the reply is returned to the WSGI server. Files sent with
+    `req.sendFile` are delivered with `wsgi.file_wrapper` if the server provides it.
+
+    Multiple server processes need a shared session store, memory sessions are replaced by sqlite sessions.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+
+from core import athana
+from core.athana_sessions import make_session_store
+
+
+logg = logging.getLogger(__name__)
+
+BODY_CHUNK_SIZE = 1 << 16
+
+#: not allowed in WSGI responses, the server handles the connection
+_HOP_BY_HOP_HEADERS = frozenset(["connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+                                 "trailers", "transfer-encoding", "upgrade"])
+#: set by the WSGI server
+_SERVER_HEADERS = frozenset(["server", "date"])
+
+
+class WSGIServerInfo(object):
+
+    def __init__(self, port):
+        self.port = port
+
+
+class WSGIChannel(object):
+
+    """Stands in for the HTTP channel that is used by the request and the input collectors"""
+
+    def __init__(self, environ):
+        self.addr = (environ.get("REMOTE_ADDR", ""), int(environ.get("REMOTE_PORT") or 0))
+        self.server = WSGIServerInfo(int(environ.get("SERVER_PORT") or 0))
+        self.current_request = None
+
+    def set_terminator(self, terminator):
+        pass
+
+
+def environ_to_header_lines(environ):
+    """Returns the request headers from `environ` as header lines like Athana receives them"""
+    lines = []
+    for key, value in environ.iteritems():
+        if key.startswith("HTTP_"):
+            name = key[5:]
+        elif key in ("CONTENT_TYPE", "CONTENT_LENGTH") and value:
+            name = key
+        else:
+            continue
+        lines.append("{}: {}".format("-".join(p.capitalize() for p in name.split("_")), value))
+    return lines
+
+
+def environ_to_uri(environ):
+    uri = environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", "")
+    if not uri.startswith("/"):
+        uri = "/" + uri
+    query = environ.get("QUERY_STRING")
+    if query:
+        uri += "?" + query
+    return uri
+
+
+class WSGIRequest(athana.http_request):
+
+    """Request that collects the reply instead of sending it to a HTTP channel"""
+
+    synchronous = True
+
+    def __init__(self, environ):
+        command = environ["REQUEST_METHOD"]
+        uri = environ_to_uri(environ)
+        protocol = environ.get("SERVER_PROTOCOL", "HTTP/1.0")
+        version = protocol.split("/", 1)[1] if "/" in protocol else None
+        super(WSGIRequest, self).__init__(WSGIChannel(environ), "{} {} {}".format(command, uri, protocol),
+                                          command, uri, version, environ_to_header_lines(environ))
+        self.environ = environ
+        self.finished = False
+
+    def done(self):
+        if self.finished:
+            return
+        self.unlink_tempfiles()
+        self.finish_session_and_headers()
+        self.finished = True
+
+    def wsgi_status(self):
+        return "{} {}".format(self.reply_code, self.responses.get(self.reply_code, "Unknown"))
+
+    def wsgi_headers(self):
+        """Returns the reply headers as list of (name, value) str tuples"""
+        headers = []
+        for name, values in self.reply_headers.iteritems():
+            if name.lower() in _HOP_BY_HOP_HEADERS or name.lower() in _SERVER_HEADERS:
+                continue
+            if isinstance(name, unicode):
+                name = name.encode("utf8")
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                if isinstance(value, unicode):
+                    value = value.encode("utf8")
+                headers.append((name, str(value)))
+        return headers
+
+    def wsgi_body(self):
+        """Returns an iterable of the reply body, a single file is returned by `wsgi.file_wrapper` if possible"""
+        file_wrapper = self.environ.get("wsgi.file_wrapper")
+        if file_wrapper is not None and len(self.outgoing) == 1 and isinstance(self.outgoing[0], athana.file_producer):
+            producer = self.outgoing[0]
+            return file_wrapper(producer.file, producer.out_buffer_size)
+        return iter_producers(self.outgoing)
+
+
+def iter_producers(producers):
+    for producer in producers:
+        while True:
+            data = producer.more()
+            if not data:
+                break
+            yield data
+
+
+class WSGIApplication(object):
+
+    """WSGI application that runs the handlers registered in the Athana contexts.
+
+    :param handler: `AthanaHandler` that is used for all requests, one with a shared session store is created if None
+    """
+
+    def __init__(self, handler=None):
+        if handler is None:
+            handler = athana.AthanaHandler(make_session_store(shared=True))
+        self.handler = handler
+        self.pid = os.getpid()
+
+    def _check_fork(self):
+        # servers like gunicorn --preload import the application before forking the worker processes
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            athana.run_after_fork_handlers()
+
+    def read_body(self, request):
+        """Passes the request body to the input collector of `request`, returns False if the body was incomplete"""
+        collector = request.collector
+        if collector is None:
+            return True
+        stream = request.environ["wsgi.input"]
+        remaining = int(request.environ.get("CONTENT_LENGTH") or 0)
+        while remaining > 0:
+            data = stream.read(min(remaining, BODY_CHUNK_SIZE))
+            if not data:
+                break
+            collector.collect_incoming_data(data)
+            remaining -= len(data)
+
+        if remaining > 0:
+            logg.warn("incomplete request body for %s, %s bytes missing", request.uri, remaining)
+            if hasattr(collector, "abort"):
+                collector.abort()
+            request.collector = None
+            return False
+
+        collector.found_terminator()
+        return True
+
+    def handle(self, request):
+        try:
+            self.handler.handle_request(request)
+            if not self.read_body(request):
+                request.error(400)
+        except athana.AthanaException:
+            logg.warn("malformed request body for %s", request.uri, exc_info=True)
+            request.error(400)
+
+    def __call__(self, environ, start_response):
+        self._check_fork()
+        request = WSGIRequest(environ)
+        try:
+            self.handle(request)
+        except Exception:
+            logg.exception("error while processing WSGI request %s", request.uri)
+            request.error(500)
+        if not request.finished:
+            request.done()
+        start_response(request.wsgi_status(), request.wsgi_headers())
+        return request.wsgi_body()
@@ -22,9 +22,15 @@ import logging
 import socket
 import asyncore
 import random  # FIXME: drop dependency!
+import time
+from array import array
+from collections import OrderedDict
 
 from .athana import counter, async_chat
-from core import medmarc, db, Node, search
+from core import config, medmarc, db, Node
+from core.database.postgres.replicas import use_replicas, reset_routing
+from core.search.representation import And, Or, Not, AttributeMatch, AttributeCompare
+from core.search.oldtonewtree import old_to_new_field_mapping
 from schema import mapping
 
 from PyZ3950 import z3950, zdefs, asn1
@@ -48,6 +54,60 @@ class FormatError(Exception):
     """Communication format not supported.
     """
 
+
+#: Bib-1 diagnostic: specified result set does not exist
+DIAG_RESULT_SET_DOES_NOT_EXIST = 30
+
+
+class ResultSetStore(object):
+
+    """Named result sets of a Z39.50 association.
+
+    Result sets hold the IDs of the matching nodes in search order, so present requests can fetch
+    the requested records without running the search again. At most `max_count` result sets are kept,
+    the least recently used one is dropped first. Result sets that were not used for `ttl` seconds expire.
+    """
+
+    def __init__(self, max_count=10, ttl=600):
+        self.max_count = max_count
+        self.ttl = ttl
+        self._sets = OrderedDict()
+
+    def _expire(self):
+        limit = time.time() - self.ttl
+        for name, (_, last_used) in self._sets.items():
+            if last_used >= limit:
+                break
+            del self._sets[name]
+
+    def __setitem__(self, name, node_ids):
+        self._expire()
+        self._sets.pop(name, None)
+        self._sets[name] = (array("i", node_ids), time.time())
+        while len(self._sets) > self.max_count:
+            self._sets.popitem(last=False)
+
+    def __getitem__(self, name):
+        self._expire()
+        node_ids, _ = self._sets.pop(name)
+        self._sets[name] = (node_ids, time.time())
+        return node_ids
+
+    def __delitem__(self, name):
+        del self._sets[name]
+
+    def __contains__(self, name):
+        self._expire()
+        return name in self._sets
+
+    # used by z3950.Server.search
+    has_key = __contains__
+
+    def __len__(self):
+        self._expire()
+        return len(self._sets)
+
+
 def format_node(node, map_node):
     marc21_node = map_node(node)
 
@@ -76,6 +136,8 @@ class AsyncPyZ3950Server(z3950.Server):
         z3950.Server.__init__(self, conn)
         self.client_name = '[%s:%s]' % conn.getpeername()
         self._channel = channel
+        self.result_sets = ResultSetStore(config.getint("z3950.result_set_count", 10),
+                                          config.getint("z3950.result_set_ttl", 600))
 
     def handle_incoming_data(self, b):
         # see classes "z3950.Server" and "z3950.Conn", methods run(), read_PDU(), readproc()
@@ -91,10 +153,16 @@ class AsyncPyZ3950Server(z3950.Server):
                 raise self.ProtocolError("Bad typ", '%s %s' % (typ, val))
             if typ != 'initRequest' and self.expecting_init:
                 raise self.ProtocolError("Init expected", typ)
+            # Z39.50 only reads, queries are sent to the database replicas if configured
+            if db.replicas is not None:
+                use_replicas(db.session)
             try:
                 fn(self, val)
             except:
                 logg.exception("error while handling request")
+            finally:
+                reset_routing(db.session)
+                db.session.close()
 
     def send(self, val):
         b = self.encode_ctx.encode(z3950.APDU, val)
@@ -158,13 +226,46 @@ class AsyncPyZ3950Server(z3950.Server):
     def format_records(self, start, count, res_set, prefsyn):
         """
         Format a 'present' response for the requested query result subset.
+        Only the nodes of the subset are loaded, records are returned in result set order.
         """
         map_node = medmarc.MarcMapper()
 
-        node_ids = res_set[start-1:start+count-1]
-        nodes = q(Node).filter(Node.id.in_(node_ids)).prefetch_attrs()
-        formatted = [fo for fo in [format_node(n, map_node) for n in nodes] if fo is not None]
-        return formatted
+        node_ids = res_set[start-1:start+count-1].tolist()
+        if not node_ids:
+            return []
+        nodes = {n.id: n for n in q(Node).filter(Node.id.in_(node_ids)).prefetch_attrs()}
+        formatted = [format_node(nodes[nid], map_node) for nid in node_ids if nid in nodes]
+        return [fo for fo in formatted if fo is not None]
+
+    def present(self, preq):
+        """
+        Handle a 'present' request for records from a stored result set.
+        Replaces the base class implementation which fails without response for unknown result sets.
+        """
+        presp = z3950.PresentResponse()
+        try:
+            res_set = self.result_sets[preq.resultSetId]
+        except KeyError:
+            logg.info("%s present request for unknown or expired result set '%s'", self.client_name, preq.resultSetId)
+            diag = z3950.DefaultDiagFormat()
+            diag.diagnosticSetId = z3950.Z3950_DIAG_BIB1_ov
+            diag.condition = DIAG_RESULT_SET_DOES_NOT_EXIST
+            diag.addinfo = ('v3Addinfo', preq.resultSetId)
+            presp.numberOfRecordsReturned = 0
+            presp.nextResultSetPosition = 0
+            presp.presentStatus = 5  # failure
+            presp.records = ('nonSurrogateDiagnostic', diag)
+            self.send(('presentResponse', presp))
+            return
+
+        start = max(preq.resultSetStartPoint, 1)
+        count = max(min(preq.numberOfRecordsRequested, len(res_set) - start + 1), 0)
+        records = self.format_records(start, count, res_set, preq.preferredRecordSyntax)
+        presp.numberOfRecordsReturned = len(records)
+        presp.nextResultSetPosition = start + count
+        presp.presentStatus = 0
+        presp.records = ('responseRecords', records)
+        self.send(('presentResponse', presp))
 
     def delete(self, dreq):
         """
@@ -183,7 +284,7 @@ class AsyncPyZ3950Server(z3950.Server):
 
     fn_dict = {
         'searchRequest': z3950.Server.search,
-        'presentRequest': z3950.Server.present,
+        'presentRequest': present,
         'initRequest': init,
         'close': z3950.Server.close,
         #'sortRequest' : sort,
@@ -196,7 +297,7 @@ class AsyncPyZ3950Server(z3950.Server):
 
 def search_nodes(query, mapping_prefix='Z3950_search_'):
     """
-    Search nodes that match the query.
+    Search nodes that match the query and return their IDs.
 
     'query' is a tree of QueryBoolNode and QueryMatchNode objects.
 
@@ -223,6 +324,7 @@ def search_nodes(query, mapping_prefix='Z3950_search_'):
 
     # run one search per root node
     node_ids = []
+    seen = set()
     guest = get_guest_user()
     search_languages = get_service_search_languages()
 
@@ -233,18 +335,18 @@ def search_nodes(query, mapping_prefix='Z3950_search_'):
         # map query fields to node attributes
         field_mapping = {}
         for field in mapping_node.children:
-            field_mapping[field.name] = field.getDescription().split(';')
-        # XXX: this is redundant - why build an infix query string
-        # XXX: just to parse it afterwards?
-        # XXX: better: create search tree and apply it to a query instead of using node.search()
-        query_string = query.build_query_string(field_mapping)
-        searchtree = search.parse_searchquery_old_style(query_string)
-        if query_string is None:
+            field_mapping[field.name] = [f.strip() for f in field.getDescription().split(';')]
+        searchtree = query.build_search_tree(field_mapping)
+        if searchtree is None:
             logg.info('unable to map query: [%r] using mapping %s', query, field_mapping)
             continue
-        logg.info('executing query for node %s: %s', root_node.id, query_string)
-        for n in root_node.search(searchtree, search_languages).filter_read_access(user=guest):
-            node_ids.append(n.id)
+        logg.info('executing query for node %s: %r', root_node.id, searchtree)
+        # only the IDs are needed here, nodes are loaded by present requests
+        id_query = root_node.search(searchtree, search_languages).filter_read_access(user=guest).with_entities(Node.id)
+        for nid, in id_query:
+            if nid not in seen:
+                seen.add(nid)
+                node_ids.append(nid)
 
     # use a round-robin algorithm to merge the separate query results
     # in order to produce maximally diverse results in the first hits
@@ -282,12 +384,17 @@ def merge_ids_as_round_robin(id_sets):
     return ids
 
 
-def protect(s):
-    """
-    Wrap a string in double quotes, dropping contained double quotes
-    if available.
-    """
-    return '"%s"' % s.replace('"', '')
+def make_match(field, op, value):
+    """Returns the search tree element that compares node attribute or special search field `field` with `value`"""
+    special_cls = old_to_new_field_mapping.get(field)
+    if special_cls is not None:
+        return special_cls(value)
+    elif op == "=":
+        return AttributeMatch(field, value)
+    elif op == "!=":
+        return Not(AttributeMatch(field, value))
+    else:
+        return AttributeCompare(field, op, value)
 
 
 class QueryBoolNode(object):
@@ -297,11 +404,17 @@ class QueryBoolNode(object):
     def __init__(self, op, left, right):
         self.op, self.left, self.right = op, left, right
 
-    def build_query_string(self, field_mapping):
-        left = self.left.build_query_string(field_mapping)
-        right = self.right.build_query_string(field_mapping)
+    def build_search_tree(self, field_mapping):
+        left = self.left.build_search_tree(field_mapping)
+        right = self.right.build_search_tree(field_mapping)
         if left and right:
-            return '(%s) %s (%s)' % (left, self.op, right)
+            if self.op == "and":
+                return And(left, right)
+            elif self.op == "or":
+                return Or(left, right)
+            elif self.op == "and not":
+                return And(left, Not(right))
+            raise ValueError("unsupported boolean operator '%s'" % self.op)
         else:
             return left or right
 
@@ -314,14 +427,16 @@ class QueryMatchNode(object):
     "equality match"
 
     def __init__(self, op, name, value):
-        self.op, self.name, self.value = op, name, protect(value).decode('utf8')
+        # double quotes were removed from values by the old search query parser, keep it that way
+        self.op, self.name, self.value = op, name, value.replace('"', '').decode('utf8')
 
-    def build_query_string(self, field_mapping):
+    def build_search_tree(self, field_mapping):
         if self.name not in field_mapping:
             return None
-        op, value = self.op, self.value
-        return ' or '.join(['%s %s %s' % (field_type, op, value)
-                            for field_type in field_mapping[self.name]])
+        matches = [make_match(field, self.op, self.value) for field in field_mapping[self.name] if field]
+        if not matches:
+            return None
+        return reduce(Or, matches)
 
     def __repr__(self):
         return '%s = %s' % (self.name, self.value)
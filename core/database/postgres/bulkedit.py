@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Bulk edits of node attributes.
+
+    Changing the attributes of many nodes with the ORM sends the complete `attrs` and `system_attrs` objects of each
+    node to the database and editing them version by version creates a versioning transaction per node.
+    `bulk_edit` groups all changes into one versioning transaction. The caller changes the nodes as usual,
+    on exit only the changed and removed attribute keys are sent to the database in batched UPDATE statements
+    which are applied by the SQL function `jsonb_object_patch`. The versioning triggers create the node versions
+    in the same transaction.
+    Each node is written only once: nodes with changes to other columns are flushed by the ORM with their attributes.
+
+    Untagged versions can store their attributes as difference to the last version with complete attributes
+    (`store_attrs_diffs` or `database.version_attrs_diffs` in the config), see `NodeVersionAttrsDiff`.
+    The attributes of such versions are reconstructed when they are loaded. Tagged versions are always complete.
+"""
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import json
+import logging
+
+from sqlalchemy import func, inspect, text
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy_continuum import versioning_manager
+from sqlalchemy_continuum.utils import version_class
+
+from core import config
+
+
+logg = logging.getLogger(__name__)
+
+#: number of nodes that are updated by one statement
+BATCH_SIZE = 1000
+
+_PATCH_STATEMENT = text("""
+UPDATE node SET
+    attrs = CASE WHEN c.attrs IS NULL THEN node.attrs
+                 ELSE jsonb_object_patch(node.attrs, c.attrs, ARRAY(SELECT jsonb_array_elements_text(c.attrs_removed))) END,
+    system_attrs = CASE WHEN c.system_attrs IS NULL THEN node.system_attrs
+                        ELSE jsonb_object_patch(node.system_attrs, c.system_attrs,
+                                                ARRAY(SELECT jsonb_array_elements_text(c.system_attrs_removed))) END
+FROM jsonb_to_recordset(CAST(:changes AS jsonb))
+    AS c(id integer, attrs jsonb, attrs_removed jsonb, system_attrs jsonb, system_attrs_removed jsonb)
+WHERE node.id = c.id
+""")
+
+_STORE_ATTRS_DIFFS_STATEMENT = text("SELECT store_node_version_attrs_diffs(:transaction_id, CAST(:node_ids AS integer[]))")
+
+_PATCHED_ATTRIBUTES = ("attrs", "system_attrs")
+
+
+def _diff(old, new):
+    """Returns the changed and added items and the removed keys from `old` to `new`"""
+    changed = {k: v for k, v in new.iteritems() if k not in old or old[k] != v}
+    removed = [k for k in old if k not in new]
+    return changed, removed
+
+
+def _node_patch(node, snapshot):
+    """Returns the changes of `node` since `snapshot` was taken or None if nothing changed"""
+    patch = {"id": node.id}
+    modified = False
+    for attrname in _PATCHED_ATTRIBUTES:
+        changed, removed = _diff(snapshot[attrname], getattr(node, attrname) or {})
+        if changed or removed:
+            patch[attrname] = changed
+            patch[attrname + "_removed"] = removed
+            modified = True
+        else:
+            patch[attrname] = None
+            patch[attrname + "_removed"] = []
+
+    return patch if modified else None
+
+
+def _has_other_changes(node):
+    """Returns True if columns of `node` other than the patched attributes were changed"""
+    state = inspect(node)
+    return any(state.attrs[prop.key].history.has_changes()
+               for prop in state.mapper.column_attrs if prop.key not in _PATCHED_ATTRIBUTES)
+
+
+class BulkEdit(object):
+
+    """Context manager for changing many nodes in one versioning transaction, see `bulk_edit`"""
+
+    def __init__(self, nodes, tag=None, comment=None, user=None, tag_untagged_versions=False, store_attrs_diffs=None):
+        self.nodes = nodes
+        self.tag = tag
+        self.comment = comment
+        self.user = user
+        self.tag_untagged_versions = tag_untagged_versions
+        if store_attrs_diffs is None:
+            store_attrs_diffs = config.getboolean("database.version_attrs_diffs", False)
+        self.store_attrs_diffs = store_attrs_diffs and not tag
+        self.session = None
+        self.transaction = None
+        self.snapshots = None
+        self.autoflush = None
+
+    def __enter__(self):
+        if not self.nodes:
+            raise ValueError("no nodes to edit")
+
+        self.session = s = object_session(self.nodes[0])
+        if s.new or s.dirty:
+            if self.tag:
+                raise Exception("Refusing to create new tagged node versions. Session must be clean!")
+            # patches are computed from the snapshots, so they must match the database
+            s.flush()
+
+        self.snapshots = {node.id: {attrname: dict(getattr(node, attrname) or {}) for attrname in _PATCHED_ATTRIBUTES}
+                          for node in self.nodes}
+
+        tx = versioning_manager.unit_of_work(s).create_transaction(s)
+        if self.user is not None:
+            tx.user = self.user
+        if self.tag:
+            tx.meta[u"tag"] = self.tag
+        if self.comment:
+            tx.meta[u"comment"] = self.comment
+        self.transaction = tx
+
+        if self.tag_untagged_versions:
+            _tag_last_untagged_versions(s, self.nodes)
+
+        # changes must stay in the session until they are written by __exit__
+        self.autoflush = s.autoflush
+        s.autoflush = False
+        return tx
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        s = self.session
+        s.autoflush = self.autoflush
+        if exc_type:
+            s.rollback()
+            return
+
+        try:
+            patches = self.write_changes()
+        except:
+            s.rollback()
+            raise
+
+        s.commit()
+        logg.info("bulk edit changed attributes of %s of %s nodes", len(patches), len(self.nodes))
+
+    def write_changes(self):
+        """Flushes all changes, attribute changes are sent as patches. Returns the patches."""
+        from core.nodecache import remember_changed_nodes
+        s = self.session
+        patches = []
+        for node in self.nodes:
+            # nodes with other changes are written by the ORM, a patch would update them a second time
+            if _has_other_changes(node):
+                continue
+            patch = _node_patch(node, self.snapshots[node.id])
+            if patch is not None:
+                patches.append(patch)
+                # the ORM must not send the complete attribute objects
+                for attrname in _PATCHED_ATTRIBUTES:
+                    set_committed_value(node, attrname, getattr(node, attrname))
+
+        # writes other node changes and the versioning transaction which must exist before the node versions are created
+        s.flush()
+
+        for start in xrange(0, len(patches), BATCH_SIZE):
+            s.execute(_PATCH_STATEMENT, {"changes": json.dumps(patches[start:start + BATCH_SIZE])})
+
+        if self.store_attrs_diffs:
+            node_ids = [node.id for node in self.nodes]
+            for start in xrange(0, len(node_ids), BATCH_SIZE):
+                s.execute(_STORE_ATTRS_DIFFS_STATEMENT, {"transaction_id": self.transaction.id,
+                                                         "node_ids": node_ids[start:start + BATCH_SIZE]})
+
+        remember_changed_nodes(s, [p["id"] for p in patches])
+        return patches
+
+
+def bulk_edit(nodes, tag=None, comment=None, user=None, tag_untagged_versions=False, store_attrs_diffs=None):
+    """Returns a context manager that writes all changes to `nodes` in one versioning transaction.
+    Changes are committed on exit or rolled back if an exception was raised.
+
+    The session is not flushed automatically while the context manager is active.
+
+    :param nodes: nodes that will be changed. All nodes must be in the same session.
+        Pending changes are flushed before, the session must be clean if a tag is given.
+    :param tag: optional tag for the transaction, all nodes get a new version with that tag.
+    :param comment: optional comment for the transaction
+    :param user: user that will be associated with the transaction.
+    :param tag_untagged_versions: if true, the last version of each node without a tagged version is tagged as 1,
+        like `Node.new_tagged_version` does.
+    :param store_attrs_diffs: store the attributes of the new versions as diff if no tag is given.
+        Defaults to the config option `database.version_attrs_diffs`.
+    """
+    return BulkEdit(nodes, tag, comment, user, tag_untagged_versions, store_attrs_diffs)
+
+
+def _tag_last_untagged_versions(s, nodes):
+    from core import Node
+    from core.database.postgres.node import materialize_version_attrs
+    Transaction = versioning_manager.transaction_cls
+    NodeVersion = version_class(Node)
+    tagged_node_ids = set(_last_version_tags(s, nodes))
+    untagged_node_ids = [n.id for n in nodes if n.id not in tagged_node_ids]
+    if not untagged_node_ids:
+        return
+
+    last_versions = (s.query(NodeVersion.id, func.max(NodeVersion.transaction_id))
+                     .filter(NodeVersion.id.in_(untagged_node_ids))
+                     .group_by(NodeVersion.id)).all()
+
+    for tx in s.query(Transaction).filter(Transaction.id.in_(set(tx_id for _, tx_id in last_versions))):
+        tx.meta[u"tag"] = u"1"
+
+    materialize_version_attrs(s, last_versions)
+
+
+def _last_version_tags(s, nodes):
+    """Returns a dict of node id -> tag of the last tagged version, nodes without tagged versions are missing"""
+    from core import Node
+    Transaction = versioning_manager.transaction_cls
+    TransactionMeta = versioning_manager.transaction_meta_cls
+    NodeVersion = version_class(Node)
+    node_ids = [n.id for n in nodes]
+    tags = {}
+    for start in xrange(0, len(node_ids), BATCH_SIZE):
+        q = (s.query(NodeVersion.id, TransactionMeta.value)
+             .join(Transaction, NodeVersion.transaction_id == Transaction.id)
+             .join(Transaction.meta_relation)
+             .filter(TransactionMeta.key == u"tag")
+             .filter(NodeVersion.id.in_(node_ids[start:start + BATCH_SIZE]))
+             .distinct(NodeVersion.id)
+             .order_by(NodeVersion.id, NodeVersion.transaction_id.desc()))
+        tags.update(q)
+    return tags
+
+
+def group_by_next_version_tag(nodes):
+    """Groups `nodes` by the tag of the next numbered version, see `Node.new_tagged_version`.
+    Nodes without a tagged version get version 2. Use `bulk_edit` with `tag_untagged_versions` for each group.
+
+    :returns: OrderedDict of tag -> list of nodes, ordered by tag
+    """
+    s = object_session(nodes[0])
+    last_tags = _last_version_tags(s, nodes)
+    groups = {}
+    for node in nodes:
+        last_tag = last_tags.get(node.id)
+        next_version = int(last_tag) + 1 if last_tag is not None else 2
+        groups.setdefault(next_version, []).append(node)
+
+    return OrderedDict((unicode(version), groups[version]) for version in sorted(groups))
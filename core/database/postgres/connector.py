@@ -12,11 +12,15 @@ import time
 from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 from sqlalchemy_continuum.utils import version_class
 
-from core import config
+from core import config, metrics
 from . import db_metadata, DeclarativeBase
 from core.database.postgres import MtQuery
+from core.database.postgres import querytracking
+from core.database.postgres.slowqueries import make_slow_query_store
+from core.database.postgres.replicas import RoutingSession, ReplicaSet, DEFAULT_MAX_LAG, DEFAULT_CHECK_INTERVAL
 from core.database.postgres.psycopg2_debug import make_debug_connection_factory
 from core.database.init import init_database_values
 from utils.utils import find_free_port
@@ -65,14 +69,46 @@ class ConnectionException(Exception):
     pass
 
 
+POOL_CHECKOUT_WAIT = metrics.Histogram("mediatum_db_pool_checkout_seconds",
+                                       "Time waited for a connection from the pool, includes opening new connections")
+
+
+class TimedQueuePool(QueuePool):
+
+    """QueuePool that records the time needed to get a connection"""
+
+    def _do_get(self):
+        started = time.time()
+        try:
+            return QueuePool._do_get(self)
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.time() - started)
+
+
+def _register_pool_metrics(pool):
+    metrics.Gauge("mediatum_db_pool_size", "Configured size of the connection pool",
+                  collect=lambda: [((), pool.size())])
+    metrics.Gauge("mediatum_db_pool_checked_out", "Connections currently checked out from the pool",
+                  collect=lambda: [((), pool.checkedout())])
+    metrics.Gauge("mediatum_db_pool_overflow", "Connections opened beyond the pool size, negative if the pool is not full",
+                  collect=lambda: [((), pool.overflow())])
+
+
+def _register_replica_metrics(replica_set):
+    metrics.Gauge("mediatum_db_replica_lag_seconds", "Replication lag of the database replicas at the last check",
+                  labelnames=("replica",),
+                  collect=lambda: [((r.name,), r.lag) for r in replica_set.replicas if r.lag is not None])
+
+
 class PostgresSQLAConnector(object):
 
     """Basic db object used by the application
     """
 
     def __init__(self):
-        session_factory = sessionmaker(query_cls=MtQuery)
+        session_factory = sessionmaker(class_=RoutingSession, query_cls=MtQuery)
         self.Session = scoped_session(session_factory)
+        self.replicas = None
         self.metadata = db_metadata
         self.meta_plugin = TransactionMetaPlugin()
         self.athana_continuum_plugin = AthanaContinuumPlugin()
@@ -106,6 +142,7 @@ class PostgresSQLAConnector(object):
                 logg.warn("WARNING: database.test_db enabled in config, creating / using test database server", trace=False)
 
         self.test_db = test_db
+        self.replica_hosts = []
 
         if not test_db:
             self.host = config.get("database.host", "localhost")
@@ -115,6 +152,9 @@ class PostgresSQLAConnector(object):
             self.passwd = config.get("database.passwd", "mediatum")
             self.pool_size = config.getint("database.pool_size", 20)
             self.slow_query_seconds = config.getfloat("database.slow_query_seconds", 0.2)
+            self.replica_hosts = [h.strip() for h in config.get("database.replicas", "").split(",") if h.strip()]
+            self.replica_max_lag = config.getfloat("database.replica_max_lag_seconds", DEFAULT_MAX_LAG)
+            self.replica_check_interval = config.getfloat("database.replica_check_interval", DEFAULT_CHECK_INTERVAL)
             self.application_name = "{}({})".format(os.path.basename(sys.argv[0]), os.getpid())
             self.connectstr = CONNECTSTR_TEMPLATE.format(**self.__dict__)
             logg.info("using database connection string: %s", CONNECTSTR_TEMPLATE_WITHOUT_PW.format(**self.__dict__))
@@ -180,6 +220,7 @@ class PostgresSQLAConnector(object):
     def _setup_slow_query_logging(self):
         """Registers cursor execute event handlers that measure query time and 
             log warnings when `self.slow_query_seconds` is exceeded.
+            Slow statements are also recorded in `self.slow_query_store` if configured.
         """
         @event.listens_for(Engine, "before_cursor_execute")
         def before_cursor_execute(conn, cursor, statement,
@@ -191,13 +232,22 @@ class PostgresSQLAConnector(object):
         def after_cursor_execute(conn, cursor, statement,
                                  parameters, context, executemany):
             total = time.time() - conn.info['query_start_time'].pop(-1)
+            current_query = conn.info['current_query'].pop(-1)
+            metrics.query_executed(total)
+            querytracking.query_executed(statement, total)
             # total in seconds
             if total > self.slow_query_seconds:
                 if hasattr(conn.connection.connection, "history"):
-                    statement = conn.connection.connection.history.last_statement
+                    logged_statement = conn.connection.connection.history.last_statement
                 else:
-                    statement = conn.info['current_query'].pop(-1)
-                logg.warn("slow query %.1fms:\n%s", total * 1000, statement)
+                    logged_statement = current_query
+                logg.warn("slow query %.1fms:\n%s", total * 1000, logged_statement)
+                if self.slow_query_store is not None:
+                    try:
+                        self.slow_query_store.record(statement, total,
+                                                     None if executemany else cursor.connection, parameters)
+                    except Exception:
+                        logg.exception("could not record slow query")
 
     def create_engine(self):
         if self.debug:
@@ -213,7 +263,7 @@ class PostgresSQLAConnector(object):
             self.check_run_test_db_server()
             self.check_create_test_db()
 
-        engine = create_engine(self.connectstr, connect_args=connect_args, pool_size=self.pool_size)
+        engine = create_engine(self.connectstr, connect_args=connect_args, pool_size=self.pool_size, poolclass=TimedQueuePool)
         db_connection_exception = self.check_db_connection(engine)
 
         if db_connection_exception:
@@ -234,15 +284,37 @@ class PostgresSQLAConnector(object):
 
         DeclarativeBase.metadata.bind = engine
         self.engine = engine
-        self.Session.configure(bind=engine)
+        self.replicas = self.create_replicas(connect_args)
+        self.Session.configure(bind=engine, replicas=self.replicas)
         
+        self.slow_query_store = make_slow_query_store()
         self._setup_slow_query_logging()
+        _register_pool_metrics(engine.pool)
 
         if self.test_db:
             # create schema with default data in test_db mode if not present
             self.check_create_schema(set_alembic_version=False)
             self.check_load_initial_database_values(default_admin_password=u"insecure")
 
+    def create_replicas(self, connect_args):
+        """Creates the engines for `database.replicas`. Returns a `ReplicaSet` or None if no replicas are configured.
+        Replicas use the same database, user and password as the primary.
+        """
+        if not self.replica_hosts:
+            return None
+
+        engines = []
+        for replica_host in self.replica_hosts:
+            host, _, port = replica_host.partition(":")
+            params = dict(self.__dict__, host=host, port=int(port or 5432))
+            logg.info("using database replica: %s", CONNECTSTR_TEMPLATE_WITHOUT_PW.format(**params))
+            engines.append(create_engine(CONNECTSTR_TEMPLATE.format(**params), connect_args=connect_args,
+                                         pool_size=self.pool_size, poolclass=TimedQueuePool))
+
+        replica_set = ReplicaSet(engines, self.replica_max_lag, self.replica_check_interval)
+        _register_replica_metrics(replica_set)
+        return replica_set
+
     def check_db_connection(self, engine):
         try:
             conn = engine.connect()
@@ -270,11 +342,12 @@ class PostgresSQLAConnector(object):
 
     def get_model_classes(self):
         from core.database.postgres.file import File, NodeToFile
-        from core.database.postgres.node import NodeType, Node, NodeAlias
+        from core.database.postgres.node import NodeType, Node, NodeAlias, NodeVersionAttrsDiff
         from core.database.postgres.user import User, UserGroup, UserToUserGroup, AuthenticatorInfo, OAuthUserCredentials
         from core.database.postgres.permission import AccessRule, AccessRuleset, NodeToAccessRule, NodeToAccessRuleset, AccessRulesetToRule
         from core.database.postgres.setting import Setting
         from core.database.postgres.search import Fts
+        from core.database.postgres.stats import AccessStat
         return (
             File,
             NodeToFile,
@@ -292,7 +365,9 @@ class PostgresSQLAConnector(object):
             Setting,
             Fts,
             NodeType,
-            NodeAlias)
+            NodeAlias,
+            NodeVersionAttrsDiff,
+            AccessStat)
 
     def make_session(self):
         """Create a session.
@@ -409,6 +484,7 @@ class PostgresSQLAConnector(object):
     def create_functions(self, conn):
         conn.execute(read_and_prepare_sql("mediatum_utils.sql"))
         conn.execute(read_and_prepare_sql("node_funcs.sql"))
+        conn.execute(read_and_prepare_sql("node_version_funcs.sql"))
         conn.execute(read_and_prepare_sql("noderelation_funcs.sql"))
         conn.execute(read_and_prepare_sql("json.sql"))
         conn.execute(read_and_prepare_sql("nodesearch.sql"))
@@ -416,6 +492,7 @@ class PostgresSQLAConnector(object):
         conn.execute(read_and_prepare_sql("node_access_rules_and_triggers.sql"))
         conn.execute(read_and_prepare_sql("noderelation_rules_and_triggers.sql"))
         conn.execute(read_and_prepare_sql("speedups.sql"))
+        conn.execute(read_and_prepare_sql("node_change_notify.sql"))
 
     def drop_functions(self, conn):
         pass
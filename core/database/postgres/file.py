@@ -9,7 +9,7 @@ from warnings import warn
 
 from core.database.postgres import DeclarativeBase, C, FK, rel, bref, integer_pk
 from core.database.postgres.node import Node
-from sqlalchemy import Integer, Unicode, String, event, Table
+from sqlalchemy import BigInteger, Integer, Unicode, String, event, Table, func, select
 from core.database.postgres.alchemyext import AppenderQueryWithLen
 from core.file import FileMixin
 from core import config
@@ -60,18 +60,16 @@ class File(DeclarativeBase, FileMixin):
     path = C(Unicode(4096))
     filetype = C(Unicode(126))
     mimetype = C(String(255))
+    #: SHA-256 hex digest of the content, set when the file is imported
+    sha256 = C(String(64), index=True)
+    #: size in bytes, set when the file is imported
+    filesize = C(BigInteger)
 
     nodes = rel(Node, secondary=NodeToFile.__table__, 
                 backref=bref("files", lazy="dynamic", query_class=AppenderQueryWithLen), lazy="dynamic")
     
     _node_objects = rel(Node, secondary=NodeToFile.__table__, backref=bref("file_objects", viewonly=True), viewonly=True)
 
-    def unlink(self):
-        if self.exists:
-            os.unlink(self.abspath)
-        else:
-            logg.warn("tried to unlink missing physical file %s at %s, ignored", self.id, self.path)
-
     def __repr__(self):
         return "File #{} ({}:{}|{}) at {}".format(
             self.id, self.path, self.filetype, self.mimetype, hex(id(self)))
@@ -83,7 +81,13 @@ class File(DeclarativeBase, FileMixin):
 def unlink_physical_file_on_delete(mapper, connection, target):
     # XXX: convert this to a SQLAlchemy 1.1 session event
     if target.unlink_after_deletion:
-        if os.path.exists(target.abspath):
+        # the same physical file can be referenced by more than one File object, the last one removes it
+        file_table = File.__table__
+        references = connection.scalar(select([func.count()]).select_from(file_table)
+                                       .where(file_table.c.path == target.path))
+        if references:
+            logg.info("not unlinking physical file %s, still referenced by %s other file(s)", target.path, references)
+        elif os.path.exists(target.abspath):
                 target.unlink()
         else:
             logg.info("trying to unlink physical file for file with type %s for node %s, but it doesn't exist, ignoring.",
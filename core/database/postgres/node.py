@@ -9,10 +9,11 @@ from json import dumps
 from warnings import warn
 
 import pyaml
-from sqlalchemy import (Table, Sequence, Integer, Unicode, Boolean, sql, text, select, func)
+from sqlalchemy import (Table, Sequence, Integer, BigInteger, Unicode, UnicodeText, Boolean, sql, text, select, func, event)
 from sqlalchemy.orm import deferred, object_session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.dynamic import AppenderQuery, AppenderMixin
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from sqlalchemy.ext.declarative.api import DeclarativeMeta
 from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -450,7 +451,9 @@ class Node(DeclarativeBase, NodeMixin):
                     if last_tagged_version is not None:
                         next_version = int(last_tagged_version.tag) + 1
                     else:
-                        node.versions[-1].tag = u"1"
+                        last_version = node.versions[-1]
+                        last_version.tag = u"1"
+                        materialize_version_attrs(s, [(node.id, last_version.transaction_id)])
                         next_version = 2
 
                     tx.meta[u"tag"] = unicode(next_version)
@@ -600,3 +603,41 @@ class NodeAlias(DeclarativeBase):
     description = C(Unicode)
 
     node = rel(Node)
+
+
+class NodeVersionAttrsDiff(DeclarativeBase):
+
+    """Attributes of a node version, stored as difference to an older version of the node with complete attributes.
+    The `attrs` column of the version is NULL, the attributes are reconstructed when the version is loaded.
+    Diffs are only written by `core.database.postgres.bulkedit` for untagged versions."""
+
+    __tablename__ = "node_version_attrs_diff"
+
+    id = C(Integer, primary_key=True, autoincrement=False)
+    transaction_id = C(BigInteger, primary_key=True, autoincrement=False)
+    base_transaction_id = C(BigInteger, nullable=False)
+    attrs_changed = C(JSONB, nullable=False)
+    attrs_removed = C(ARRAY(UnicodeText), nullable=False)
+
+
+_VERSION_ATTRS_STATEMENT = text("SELECT node_version_attrs(:id, :transaction_id)")
+_MATERIALIZE_VERSION_ATTRS_STATEMENT = text("SELECT materialize_node_version_attrs(:id, :transaction_id)")
+
+
+@event.listens_for(NodeVersionMixin, "load", propagate=True)
+@event.listens_for(NodeVersionMixin, "refresh", propagate=True)
+def _reconstruct_version_attrs(version, *args):
+    # attrs is deferred, this runs again when it's loaded
+    if "attrs" in version.__dict__ and version.__dict__["attrs"] is None:
+        attrs = object_session(version).execute(_VERSION_ATTRS_STATEMENT,
+                                                {"id": version.id, "transaction_id": version.transaction_id}).scalar()
+        if attrs is not None:
+            set_committed_value(version, "attrs", attrs)
+
+
+def materialize_version_attrs(session, versions):
+    """Stores the complete attributes for node versions that are stored as diff. Tagged versions must be complete.
+    :param versions: iterable of (node id, transaction id) tuples
+    """
+    for node_id, transaction_id in versions:
+        session.execute(_MATERIALIZE_VERSION_ATTRS_STATEMENT, {"id": node_id, "transaction_id": transaction_id})
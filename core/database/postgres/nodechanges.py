@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Change feed for the node table.
+
+    The trigger node_change_notify (see sql/node_change_notify.sql) sends the id of each updated or deleted node on
+    the channel `node_changed`. Changes of access rules send `ALL_NODES_CHANGED` once per statement because they can
+    affect any number of nodes. Transactions changing more than 1000 nodes send it instead of the remaining node ids. Postgres delivers notifications when the transaction commits, to all server processes
+    that are listening. `NodeChangeListener` listens on the channel with its own connection in a background thread.
+"""
+from __future__ import absolute_import
+
+import logging
+import select
+import threading
+import time
+
+
+logg = logging.getLogger(__name__)
+
+NODE_CHANGED_CHANNEL = "node_changed"
+#: payload sent instead of a node id if all nodes may have changed
+ALL_NODES_CHANGED = "*"
+RECONNECT_DELAY = 5.
+
+
+class NodeChangeListener(object):
+
+    """Calls `on_change(node_id)` for each committed change of a node.
+
+    :param connect: function that returns a new psycopg2 connection
+    :param on_all_changed: called if all nodes may have changed, for example after a change of access rules
+    :param on_connect: called when listening started. Changes may have been missed before, so caches must be cleared.
+    :param on_disconnect: called when the connection was lost, changes are missed until `on_connect` is called again
+    """
+
+    def __init__(self, connect, on_change, on_all_changed, on_connect=None, on_disconnect=None, poll_timeout=5.):
+        self.connect = connect
+        self.on_change = on_change
+        self.on_all_changed = on_all_changed
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.poll_timeout = poll_timeout
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="node-change-listener")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+    def _run(self):
+        while not self.stopped:
+            try:
+                self._listen()
+            except Exception:
+                logg.warn("node change listener failed, reconnecting in %s seconds", RECONNECT_DELAY, exc_info=True)
+            if self.on_disconnect is not None:
+                self.on_disconnect()
+            if not self.stopped:
+                time.sleep(RECONNECT_DELAY)
+
+    def _listen(self):
+        conn = self.connect()
+        try:
+            # notifications are only received outside of transactions
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute("LISTEN " + NODE_CHANGED_CHANNEL)
+            cursor.close()
+            logg.info("listening for node changes")
+            if self.on_connect is not None:
+                self.on_connect()
+
+            while not self.stopped:
+                if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.dispatch(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def dispatch(self, payload):
+        if payload == ALL_NODES_CHANGED:
+            self.on_all_changed()
+            return
+        try:
+            node_id = int(payload)
+        except ValueError:
+            logg.warn("ignoring invalid node change notification '%s'", payload)
+            return
+        self.on_change(node_id)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Per-request accounting of database statements.
+
+    The slow query log only catches single slow statements. Many pages are slow because they run hundreds of fast
+    statements, typically the same statement for each node of a list (N+1). A `QueryTracker` counts the statements
+    of a request (or of a code block, see `track_queries`) and groups them by a normalized fingerprint. If a
+    fingerprint is repeated `n_plus_one_threshold` times, the origin of the statement in mediaTUM code is recorded
+    and a warning is logged when the request is finished.
+"""
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+import logging
+import os
+import re
+import threading
+import traceback
+
+from core import config
+
+
+logg = logging.getLogger(__name__)
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 20
+#: the fingerprint cache is cleared when it gets bigger, statements are mostly generated from few templates
+FINGERPRINT_CACHE_SIZE = 5000
+
+_IGNORED_ORIGIN_PATHS = (os.sep + "sqlalchemy" + os.sep, os.sep + "sqlalchemy_continuum" + os.sep,
+                         os.path.join("core", "database", "postgres", "querytracking.py"),
+                         os.path.join("core", "database", "postgres", "connector.py"),
+                         os.path.join("core", "database", "postgres", "psycopg2_debug.py"))
+
+_FINGERPRINT_SUBSTITUTIONS = [
+    # string literals
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    # bind parameters of psycopg2, their names are numbered by SQLAlchemy (id_1, id_2, ...)
+    (re.compile(r"%\(\w+\)s"), "?"),
+    # numbers not being part of an identifier
+    (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b"), "?"),
+    # lists of values, IN (?, ?, ?) and VALUES (?, ?), (?, ?)
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+_fingerprints = {}
+
+
+def fingerprint(statement):
+    """Returns `statement` with literals and bind parameters replaced, so statements that only differ in values
+    have the same fingerprint.
+    """
+    fp = _fingerprints.get(statement)
+    if fp is None:
+        fp = statement
+        for pattern, replacement in _FINGERPRINT_SUBSTITUTIONS:
+            fp = pattern.sub(replacement, fp)
+        fp = fp.strip()
+        if len(_fingerprints) > FINGERPRINT_CACHE_SIZE:
+            _fingerprints.clear()
+        _fingerprints[statement] = fp
+    return fp
+
+
+def statement_origin():
+    """Returns the innermost stack frame outside of SQLAlchemy and the database layer as 'file:line in function'"""
+    for filename, lineno, funcname, _ in reversed(traceback.extract_stack()):
+        if not any(p in filename for p in _IGNORED_ORIGIN_PATHS):
+            if filename.startswith(config.basedir):
+                filename = filename[len(config.basedir):].lstrip(os.sep)
+            return u"{}:{} in {}".format(filename, lineno, funcname)
+
+
+class FingerprintStats(object):
+
+    __slots__ = ("count", "time", "origin")
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.
+        self.origin = None
+
+
+class QueryTracker(object):
+
+    """Counts the statements executed by the thread the tracker is active for.
+
+    :param n_plus_one_threshold: repetitions of a fingerprint that are considered as N+1 problem, None disables
+        the origin recording
+    """
+
+    def __init__(self, name=None, n_plus_one_threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+        self.name = name
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.count = 0
+        self.time = 0.
+        self.fingerprints = {}
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.time += duration
+        fp = fingerprint(statement)
+        stats = self.fingerprints.get(fp)
+        if stats is None:
+            stats = self.fingerprints[fp] = FingerprintStats()
+        stats.count += 1
+        stats.time += duration
+        if stats.count == self.n_plus_one_threshold:
+            # the stack is only extracted once per repeated fingerprint, it's too expensive for every statement
+            stats.origin = statement_origin()
+
+    def repeated(self):
+        """Returns (fingerprint, FingerprintStats) for fingerprints that reached the N+1 threshold, most frequent first"""
+        if not self.n_plus_one_threshold:
+            return []
+        repeated = [(fp, stats) for fp, stats in self.fingerprints.items() if stats.count >= self.n_plus_one_threshold]
+        repeated.sort(key=lambda t: t[1].count, reverse=True)
+        return repeated
+
+    def log_repeated(self):
+        for fp, stats in self.repeated():
+            logg.warn("possible N+1 query in %s: %s executions (%.1fms) of statement from %s:\n%s",
+                      self.name, stats.count, stats.time * 1000, stats.origin, fp)
+
+    def summary(self):
+        return u"{} statements in {:.1f}ms, {} distinct".format(self.count, self.time * 1000, len(self.fingerprints))
+
+
+_local = threading.local()
+
+
+def current_tracker():
+    return getattr(_local, "tracker", None)
+
+
+def query_executed(statement, duration):
+    """Called by the connector after each statement"""
+    tracker = getattr(_local, "tracker", None)
+    if tracker is not None:
+        tracker.add(statement, duration)
+
+
+def start_request(name):
+    """Starts tracking the statements of the request processed by the current thread, returns the tracker"""
+    threshold = config.getint("database.n_plus_one_threshold", DEFAULT_N_PLUS_ONE_THRESHOLD)
+    tracker = _local.tracker = QueryTracker(name, threshold)
+    return tracker
+
+
+def finish_request():
+    """Stops tracking, logs repeated statements and returns the tracker of the current request"""
+    tracker = getattr(_local, "tracker", None)
+    _local.tracker = None
+    if tracker is not None:
+        tracker.log_repeated()
+    return tracker
+
+
+@contextmanager
+def track_queries(name=None, n_plus_one_threshold=None):
+    """Tracks the statements executed in the block. Trackers can be nested, the outer tracker gets all statements
+    executed in the inner block, too.
+    """
+    outer = getattr(_local, "tracker", None)
+    tracker = _local.tracker = QueryTracker(name, n_plus_one_threshold)
+    try:
+        yield tracker
+    finally:
+        _local.tracker = outer
+        if outer is not None:
+            for fp, stats in tracker.fingerprints.iteritems():
+                outer_stats = outer.fingerprints.get(fp)
+                if outer_stats is None:
+                    outer_stats = outer.fingerprints[fp] = FingerprintStats()
+                outer_stats.count += stats.count
+                outer_stats.time += stats.time
+                outer_stats.origin = outer_stats.origin or stats.origin
+            outer.count += tracker.count
+            outer.time += tracker.time
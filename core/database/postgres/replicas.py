@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Routing of read-only queries to database replicas.
+
+    Replicas are streaming replication standbys of the primary database, configured by `database.replicas`.
+    `RoutingSession` sends queries to a replica after `use_replicas` was called for the session, which is done for
+    requests to handlers that are registered as read-only. Flushes, INSERT / UPDATE / DELETE, SELECT ... FOR UPDATE
+    and textual SQL that is not a SELECT go to the primary. After the first write, the session stays on the primary
+    until `reset_routing` is called, so it sees its own changes.
+
+    Replicas lagging behind the primary by more than `max_lag` seconds are not used.
+    The primary is used if no replica is usable.
+
+    Process-wide caches must be filled inside `reads_from_primary`. Otherwise, an outdated result from a lagging
+    replica could be stored right after the cache entry was invalidated and would stay in the cache.
+"""
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+from itertools import count
+import logging
+import threading
+import time
+
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+
+
+logg = logging.getLogger(__name__)
+
+DEFAULT_MAX_LAG = 10.
+DEFAULT_CHECK_INTERVAL = 5.
+
+#: replay lag in seconds, a standby that replayed everything it received is up to date even if the primary is idle
+LAG_QUERY = """
+SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_xlog_receive_location() = pg_last_xlog_replay_location() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+# keys in Session.info
+_USE_REPLICAS = "replicas_use"
+_REPLICA_ENGINE = "replicas_engine"
+_WRITTEN = "replicas_written"
+_PRIMARY_ONLY = "replicas_primary_only"
+
+
+class Replica(object):
+
+    def __init__(self, engine):
+        self.engine = engine
+        #: None if the replica is not usable
+        self.lag = None
+        self.checked_at = 0
+        self.check_lock = threading.Lock()
+
+    @property
+    def name(self):
+        return "{}:{}".format(self.engine.url.host, self.engine.url.port)
+
+
+class ReplicaSet(object):
+
+    """Chooses replicas round robin from all replicas that are reachable and don't lag too much.
+    The replication lag is checked when a replica is chosen and the last check is older than `check_interval` seconds.
+    """
+
+    def __init__(self, engines, max_lag=DEFAULT_MAX_LAG, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._next = count()
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def check(self, replica):
+        try:
+            conn = replica.engine.connect()
+            try:
+                replica.lag = float(conn.execute(LAG_QUERY).scalar())
+            finally:
+                conn.close()
+        except Exception:
+            if replica.lag is not None or not replica.checked_at:
+                logg.warn("database replica %s is not available", replica.name, exc_info=True)
+            replica.lag = None
+        else:
+            if replica.lag > self.max_lag:
+                logg.warn("database replica %s lags %.1f seconds behind, not using it", replica.name, replica.lag)
+
+        replica.checked_at = time.time()
+
+    def _check_if_due(self, replica):
+        if time.time() - replica.checked_at < self.check_interval:
+            return
+        # only one thread checks, the others use the last result
+        if replica.check_lock.acquire(False):
+            try:
+                self.check(replica)
+            finally:
+                replica.check_lock.release()
+
+    def usable_replicas(self):
+        usable = []
+        for replica in self.replicas:
+            self._check_if_due(replica)
+            if replica.lag is not None and replica.lag <= self.max_lag:
+                usable.append(replica)
+        return usable
+
+    def choose_engine(self):
+        """Returns the engine of a usable replica or None if no replica is usable"""
+        usable = self.usable_replicas()
+        if not usable:
+            return None
+        return usable[next(self._next) % len(usable)].engine
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+            replica.checked_at = 0
+
+
+def is_write(clause):
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip()[:6].lower() == "select"
+    return getattr(clause, "_for_update_arg", None) is not None
+
+
+def use_replicas(session):
+    """Sends the following reads of `session` to a replica, until it writes or `reset_routing` is called"""
+    session.info[_USE_REPLICAS] = True
+
+
+def has_written(session):
+    """Returns True if `session` sent writes to the primary since the last `reset_routing`"""
+    return session.info.get(_WRITTEN, False)
+
+
+@contextmanager
+def reads_from_primary(session):
+    """Sends all queries of `session` to the primary inside the with block"""
+    previous = session.info.get(_PRIMARY_ONLY, False)
+    session.info[_PRIMARY_ONLY] = True
+    try:
+        yield
+    finally:
+        session.info[_PRIMARY_ONLY] = previous
+
+
+def reset_routing(session):
+    for key in (_USE_REPLICAS, _REPLICA_ENGINE, _WRITTEN):
+        session.info.pop(key, None)
+
+
+class RoutingSession(Session):
+
+    """Session that sends reads to replicas after `use_replicas` was called, see the module documentation.
+
+    :param replicas: `ReplicaSet`, all queries go to the primary (the configured bind) if None
+    """
+
+    def __init__(self, replicas=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replicas is not None:
+            info = self.info
+            if self._flushing or (clause is not None and is_write(clause)):
+                info[_WRITTEN] = True
+            # without a clause, a connection was requested directly, for example by sqlalchemy-continuum
+            elif (clause is not None and info.get(_USE_REPLICAS) and not info.get(_WRITTEN)
+                  and not info.get(_PRIMARY_ONLY)):
+                engine = info.get(_REPLICA_ENGINE)
+                if engine is None:
+                    # the request stays on the chosen replica, False means that the primary is used
+                    engine = info[_REPLICA_ENGINE] = self.replicas.choose_engine() or False
+                if engine:
+                    return engine
+
+        return super(RoutingSession, self).get_bind(mapper, clause)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Records slow statements and their query plans in a local SQLite file.
+
+    Statements are grouped by their fingerprint (see `querytracking.fingerprint`). For each fingerprint, the number
+    of slow executions and their time is counted. If plan capture is enabled, `EXPLAIN (FORMAT JSON)` is run with
+    the bound parameters of the slow statement, at most once per `explain_interval` seconds for a fingerprint.
+    A plan is identified by its structure (node types, relations, indexes, join types), so a changed plan is
+    detected even if only the estimates differ. The store keeps at most `max_fingerprints` fingerprints and
+    `max_plans` distinct plans per fingerprint. When the store is full, a new fingerprint replaces the one with the
+    lowest total time.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from core import config
+from core.database.postgres.querytracking import fingerprint
+
+
+logg = logging.getLogger(__name__)
+
+DEFAULT_EXPLAIN_INTERVAL = 600
+DEFAULT_MAX_FINGERPRINTS = 500
+DEFAULT_MAX_PLANS = 5
+
+#: plan node keys that define the structure of a plan, estimates and costs are ignored
+_PLAN_STRUCTURE_KEYS = ("Node Type", "Relation Name", "Index Name", "Join Type", "Strategy", "Parent Relationship",
+                        "Scan Direction", "Function Name", "CTE Name", "Subplan Name")
+
+_EXPLAINABLE_STATEMENT = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+
+def _hash(text):
+    return hashlib.md5(text.encode("utf8") if isinstance(text, unicode) else text).hexdigest()
+
+
+def plan_structure(plan):
+    """Returns the plan tree without costs and estimates"""
+    structure = {k: plan[k] for k in _PLAN_STRUCTURE_KEYS if k in plan}
+    if "Plans" in plan:
+        structure["Plans"] = [plan_structure(p) for p in plan["Plans"]]
+    return structure
+
+
+def explain(dbapi_connection, statement, parameters):
+    """Returns the JSON plan of `statement` as list or None if the statement cannot be explained.
+    Runs in a savepoint, so a failing EXPLAIN doesn't abort the transaction of the explained statement.
+    """
+    if not _EXPLAINABLE_STATEMENT.match(statement):
+        return None
+    cursor = dbapi_connection.cursor()
+    use_savepoint = not dbapi_connection.autocommit
+    try:
+        if use_savepoint:
+            cursor.execute("SAVEPOINT explain_slow_query")
+        try:
+            cursor.execute("EXPLAIN (ANALYZE off, FORMAT JSON) " + statement, parameters)
+            plan = cursor.fetchone()[0]
+        except Exception:
+            if use_savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT explain_slow_query")
+            logg.warn("could not explain slow query", exc_info=True)
+            return None
+        if use_savepoint:
+            cursor.execute("RELEASE SAVEPOINT explain_slow_query")
+    finally:
+        cursor.close()
+    # psycopg2 converts the json result, older versions return a string
+    return json.loads(plan) if isinstance(plan, basestring) else plan
+
+
+class SlowQueryStore(object):
+
+    def __init__(self, filename, explain_plans=True, explain_interval=DEFAULT_EXPLAIN_INTERVAL,
+                 max_fingerprints=DEFAULT_MAX_FINGERPRINTS, max_plans=DEFAULT_MAX_PLANS):
+        self.filename = filename
+        self.explain_plans = explain_plans
+        self.explain_interval = explain_interval
+        self.max_fingerprints = max_fingerprints
+        self.max_plans = max_plans
+        self._local = threading.local()
+        # fingerprint hash -> time of the last EXPLAIN in this process
+        self._explained = {}
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS fingerprint (hash TEXT PRIMARY KEY, fingerprint TEXT, "
+                         "count INTEGER, total_time REAL, max_time REAL, first_seen REAL, last_seen REAL, "
+                         "last_statement TEXT, plan_changes INTEGER DEFAULT 0, last_plan_hash TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS plan (fingerprint_hash TEXT, hash TEXT, plan TEXT, "
+                         "count INTEGER, first_seen REAL, last_seen REAL, PRIMARY KEY (fingerprint_hash, hash))")
+
+    def _connection(self):
+        # connections can't be shared between threads, processes open the file after forking
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.filename, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def needs_plan(self, fp_hash):
+        return self.explain_plans and time.time() - self._explained.get(fp_hash, 0) >= self.explain_interval
+
+    def record(self, statement, duration, dbapi_connection=None, parameters=None):
+        """Records a slow execution of `statement` and captures its plan if needed.
+        Returns the fingerprint hash.
+        """
+        fp = fingerprint(statement)
+        fp_hash = _hash(fp)
+        now = time.time()
+        with self._connection() as conn:
+            cursor = conn.execute("UPDATE fingerprint SET count=count+1, total_time=total_time+?, "
+                                  "max_time=max(max_time, ?), last_seen=?, last_statement=? WHERE hash=?",
+                                  (duration, duration, now, statement, fp_hash))
+            if not cursor.rowcount:
+                conn.execute("INSERT INTO fingerprint (hash, fingerprint, count, total_time, max_time, first_seen, "
+                             "last_seen, last_statement) VALUES (?, ?, 1, ?, ?, ?, ?, ?)",
+                             (fp_hash, fp, duration, duration, now, now, statement))
+                self._limit_fingerprints(conn, fp_hash)
+
+        if dbapi_connection is not None and self.needs_plan(fp_hash):
+            self._explained[fp_hash] = now
+            plan = explain(dbapi_connection, statement, parameters)
+            if plan is not None:
+                self.add_plan(fp_hash, plan)
+        return fp_hash
+
+    def add_plan(self, fp_hash, plan):
+        plan_hash = _hash(json.dumps(plan_structure(plan[0]["Plan"]), sort_keys=True))
+        now = time.time()
+        with self._connection() as conn:
+            last_plan_hash = conn.execute("SELECT last_plan_hash FROM fingerprint WHERE hash=?", (fp_hash, )).fetchone()
+            if last_plan_hash is None:
+                return
+            last_plan_hash = last_plan_hash[0]
+            cursor = conn.execute("UPDATE plan SET count=count+1, last_seen=?, plan=? WHERE fingerprint_hash=? AND hash=?",
+                                  (now, json.dumps(plan), fp_hash, plan_hash))
+            if not cursor.rowcount:
+                conn.execute("INSERT INTO plan (fingerprint_hash, hash, plan, count, first_seen, last_seen) "
+                             "VALUES (?, ?, ?, 1, ?, ?)", (fp_hash, plan_hash, json.dumps(plan), now, now))
+                conn.execute("DELETE FROM plan WHERE fingerprint_hash=? AND hash NOT IN "
+                             "(SELECT hash FROM plan WHERE fingerprint_hash=? ORDER BY last_seen DESC LIMIT ?)",
+                             (fp_hash, fp_hash, self.max_plans))
+            if last_plan_hash != plan_hash:
+                if last_plan_hash is not None:
+                    logg.warn("query plan changed for slow statement fingerprint %s", fp_hash)
+                    conn.execute("UPDATE fingerprint SET plan_changes=plan_changes+1 WHERE hash=?", (fp_hash, ))
+                conn.execute("UPDATE fingerprint SET last_plan_hash=? WHERE hash=?", (plan_hash, fp_hash))
+
+    def _limit_fingerprints(self, conn, new_fp_hash):
+        # the new fingerprint has the lowest total time in most cases, it must be kept to collect its executions
+        conn.execute("DELETE FROM fingerprint WHERE hash != ? AND hash NOT IN "
+                     "(SELECT hash FROM fingerprint WHERE hash != ? ORDER BY total_time DESC LIMIT ?)",
+                     (new_fp_hash, new_fp_hash, self.max_fingerprints - 1))
+        conn.execute("DELETE FROM plan WHERE fingerprint_hash NOT IN (SELECT hash FROM fingerprint)")
+
+    def top_fingerprints(self, limit=50):
+        """Returns the fingerprints with the highest total time as dicts, with their latest plan as `plan`"""
+        conn = self._connection()
+        rows = conn.execute("SELECT f.*, p.plan AS plan FROM fingerprint f "
+                            "LEFT JOIN plan p ON p.fingerprint_hash = f.hash AND p.hash = f.last_plan_hash "
+                            "ORDER BY f.total_time DESC LIMIT ?", (limit, )).fetchall()
+        return [dict(row, plan=json.loads(row["plan"]) if row["plan"] else None) for row in rows]
+
+    def plans(self, fp_hash):
+        """Returns all stored plans of a fingerprint, newest first"""
+        conn = self._connection()
+        rows = conn.execute("SELECT * FROM plan WHERE fingerprint_hash=? ORDER BY last_seen DESC", (fp_hash, )).fetchall()
+        return [dict(row, plan=json.loads(row["plan"])) for row in rows]
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM plan")
+            conn.execute("DELETE FROM fingerprint")
+        self._explained.clear()
+
+
+def make_slow_query_store():
+    """Returns a SlowQueryStore configured by the `database.slow_query_*` settings, None if not configured"""
+    filename = config.get("database.slow_query_store")
+    if not filename:
+        return None
+    return SlowQueryStore(filename,
+                          explain_plans=config.getboolean("database.slow_query_explain", True),
+                          explain_interval=config.getint("database.slow_query_explain_interval", DEFAULT_EXPLAIN_INTERVAL),
+                          max_fingerprints=config.getint("database.slow_query_max_fingerprints", DEFAULT_MAX_FINGERPRINTS))
@@ -96,3 +96,28 @@ BEGIN
     RETURN res;
 END;
 $f$;
+
+
+CREATE OR REPLACE FUNCTION jsonb_object_patch(obj jsonb, changed jsonb, keys_to_delete text[]) RETURNS jsonb
+    LANGUAGE plpgsql
+    SET search_path = :search_path
+    IMMUTABLE
+    AS $f$
+DECLARE
+    res jsonb;
+BEGIN
+    changed := COALESCE(changed, '{}');
+    keys_to_delete := COALESCE(keys_to_delete, '{}');
+
+    SELECT INTO res COALESCE(
+      (SELECT ('{' || string_agg(to_json(kv.key) || ':' || kv.value, ',') || '}')
+       FROM (SELECT key, value FROM jsonb_each(COALESCE(obj, '{}'))
+             WHERE "key" <> ALL (keys_to_delete) AND NOT changed ? "key"
+             UNION ALL
+             SELECT key, value FROM jsonb_each(changed)) kv),
+      '{}'
+    )::jsonb;
+
+    RETURN res;
+END;
+$f$;
@@ -0,0 +1,69 @@
+-- Sends the id of changed nodes on the channel node_changed, used to invalidate node caches in all server processes.
+-- Notifications are delivered when the transaction commits.
+-- Bulk changes would send a flood of notifications, so only the first 1000 changed nodes of a transaction are sent,
+-- followed by a single '*' which means that all nodes may have changed.
+-- The count is kept in the transaction-local setting mediatum.node_change_count (transition tables need Postgres 10,
+-- current_setting(name, missing_ok) needs 9.6).
+
+CREATE OR REPLACE FUNCTION notify_node_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO :search_path
+AS $f$
+DECLARE
+    changed integer;
+BEGIN
+    BEGIN
+        changed := coalesce(nullif(current_setting('mediatum.node_change_count'), ''), '0')::integer + 1;
+    EXCEPTION WHEN undefined_object THEN
+        changed := 1;
+    END;
+    PERFORM set_config('mediatum.node_change_count', changed::text, true);
+
+    IF changed <= 1000 THEN
+        PERFORM pg_notify('node_changed', OLD.id::text);
+    ELSIF changed = 1001 THEN
+        PERFORM pg_notify('node_changed', '*');
+    END IF;
+    RETURN NULL;
+END;
+$f$;
+
+
+DROP TRIGGER IF EXISTS node_change_notify ON :search_path.node;
+CREATE TRIGGER node_change_notify
+AFTER UPDATE OF name, type, schema, attrs, system_attrs OR DELETE ON :search_path.node
+FOR EACH ROW
+EXECUTE PROCEDURE :search_path.notify_node_change();
+
+
+-- Access rule changes can affect many nodes, including all nodes inheriting the rules.
+-- A single '*' is sent per statement instead of node ids, which means that all nodes may have changed.
+-- Identical notifications of a transaction are delivered only once.
+
+CREATE OR REPLACE FUNCTION notify_access_rule_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO :search_path
+AS $f$
+BEGIN
+    PERFORM pg_notify('node_changed', '*');
+    RETURN NULL;
+END;
+$f$;
+
+
+DROP TRIGGER IF EXISTS node_access_rule_change_notify ON :search_path.node_to_access_rule;
+CREATE TRIGGER node_access_rule_change_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON :search_path.node_to_access_rule
+FOR EACH STATEMENT
+EXECUTE PROCEDURE :search_path.notify_access_rule_change();
+
+DROP FUNCTION IF EXISTS notify_node_access_rule_change();
+
+
+DROP TRIGGER IF EXISTS access_rule_change_notify ON :search_path.access_rule;
+CREATE TRIGGER access_rule_change_notify
+AFTER UPDATE ON :search_path.access_rule
+FOR EACH STATEMENT
+EXECUTE PROCEDURE :search_path.notify_access_rule_change();
@@ -0,0 +1,84 @@
+-- Node versions written by bulk edits can store their attributes as difference to an older version with complete
+-- attributes, see core.database.postgres.bulkedit. The attrs column of such a version is NULL and the difference is
+-- stored in node_version_attrs_diff. Diffs always refer to a complete version, so reconstruction needs one step.
+
+CREATE OR REPLACE FUNCTION node_version_attrs(node_id integer, tx_id bigint)
+    RETURNS jsonb
+    LANGUAGE plpgsql
+    SET search_path = :search_path
+    STABLE
+    AS $f$
+DECLARE
+    res jsonb;
+    diff node_version_attrs_diff;
+BEGIN
+    SELECT attrs INTO res FROM node_version WHERE id = node_id AND transaction_id = tx_id;
+    IF res IS NOT NULL THEN
+        RETURN res;
+    END IF;
+
+    SELECT * INTO diff FROM node_version_attrs_diff WHERE id = node_id AND transaction_id = tx_id;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT jsonb_object_patch(attrs, diff.attrs_changed, diff.attrs_removed) INTO res
+    FROM node_version WHERE id = node_id AND transaction_id = diff.base_transaction_id;
+
+    RETURN res;
+END;
+$f$;
+
+
+CREATE OR REPLACE FUNCTION store_node_version_attrs_diffs(tx_id bigint, node_ids integer[])
+    RETURNS integer
+    LANGUAGE plpgsql
+    SET search_path = :search_path
+    AS $f$
+DECLARE
+    v record;
+    base record;
+    changed jsonb;
+    removed text[];
+    stored integer := 0;
+BEGIN
+    FOR v IN SELECT id, attrs FROM node_version
+             WHERE transaction_id = tx_id AND id = ANY(node_ids) AND attrs IS NOT NULL LOOP
+
+        SELECT transaction_id, attrs INTO base FROM node_version
+        WHERE id = v.id AND transaction_id < tx_id AND attrs IS NOT NULL
+        ORDER BY transaction_id DESC LIMIT 1;
+        CONTINUE WHEN NOT FOUND;
+
+        SELECT coalesce(jsonb_object_agg(key, value), '{}') INTO changed
+        FROM jsonb_each(v.attrs)
+        WHERE NOT base.attrs ? key OR base.attrs -> key <> value;
+
+        removed := ARRAY(SELECT key FROM jsonb_each(base.attrs) WHERE NOT v.attrs ? key);
+
+        -- keep the complete copy if the diff isn't smaller
+        CONTINUE WHEN length(changed::text) + length(removed::text) >= length(v.attrs::text);
+
+        INSERT INTO node_version_attrs_diff (id, transaction_id, base_transaction_id, attrs_changed, attrs_removed)
+        VALUES (v.id, tx_id, base.transaction_id, changed, removed);
+        UPDATE node_version SET attrs = NULL WHERE id = v.id AND transaction_id = tx_id;
+        stored := stored + 1;
+    END LOOP;
+
+    RETURN stored;
+END;
+$f$;
+
+
+CREATE OR REPLACE FUNCTION materialize_node_version_attrs(node_id integer, tx_id bigint)
+    RETURNS void
+    LANGUAGE plpgsql
+    SET search_path = :search_path
+    AS $f$
+BEGIN
+    UPDATE node_version SET attrs = node_version_attrs(node_id, tx_id)
+    WHERE id = node_id AND transaction_id = tx_id AND attrs IS NULL;
+
+    DELETE FROM node_version_attrs_diff WHERE id = node_id AND transaction_id = tx_id;
+END;
+$f$;
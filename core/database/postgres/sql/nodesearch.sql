@@ -28,6 +28,20 @@ END;
 $$;
 
 
+-- Bulk imports set mediatum.skip_tsvector with SET LOCAL and create the search index entries for many nodes at once.
+-- current_setting(name, missing_ok) needs Postgres 9.6, older versions raise an error if the setting was never set.
+CREATE OR REPLACE FUNCTION skip_tsvector() RETURNS boolean
+    LANGUAGE plpgsql
+    STABLE
+    AS $$
+BEGIN
+    RETURN current_setting('mediatum.skip_tsvector') = 'on';
+EXCEPTION WHEN undefined_object THEN
+    RETURN false;
+END;
+$$;
+
+
 CREATE OR REPLACE FUNCTION insert_node_tsvectors() RETURNS trigger
     LANGUAGE plpgsql
     SET search_path = :search_path
@@ -37,6 +51,10 @@ DECLARE
     fulltext_autoindex_languages text[];
     attribute_autoindex_languages text[];
 BEGIN
+    IF skip_tsvector() THEN
+        RETURN NEW;
+    END IF;
+
     fulltext_autoindex_languages = get_fulltext_autoindex_languages();
 
     IF fulltext_autoindex_languages IS NOT NULL THEN
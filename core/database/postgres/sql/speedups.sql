@@ -29,6 +29,47 @@ END;
 $f$;
 
 
+-- Like accessible_container_paths, but for many nodes at once. Returns one row (node_id, path) for each accessible path.
+-- Access to each container is checked only once, even if it's an ancestor of many of the given nodes.
+CREATE OR REPLACE FUNCTION accessible_container_paths_for_nodes(node_ids integer[], exclude_container_ids integer[]=ARRAY[]::integer[]
+                                                               ,group_ids integer[]=NULL, ipaddr inet=NULL, date date=NULL)
+    RETURNS TABLE (node_id integer, path integer[])
+    LANGUAGE plpgsql
+    SET search_path = :search_path
+    STABLE
+    AS $f$
+BEGIN
+RETURN QUERY 
+WITH parents AS (
+    SELECT nm.cid, nm.nid
+    FROM nodemapping nm
+    WHERE nm.cid = ANY(node_ids)
+    AND NOT ARRAY[nm.nid] <@ exclude_container_ids
+),
+readable AS (
+    SELECT a.nid
+    FROM (SELECT p.nid FROM parents p
+          UNION
+          SELECT nr.nid FROM noderelation nr WHERE nr.cid IN (SELECT p.nid FROM parents p)) a
+    WHERE NOT ARRAY[a.nid] <@ exclude_container_ids
+    AND has_read_access_to_node(a.nid, group_ids, ipaddr, date)
+)
+SELECT 
+    p.cid,
+    (SELECT array_append(array_agg(q.nid), p.nid)
+     FROM (SELECT nr.nid 
+           FROM noderelation nr 
+           JOIN readable r ON r.nid = nr.nid
+           WHERE nr.cid = p.nid
+           ORDER BY nr.distance DESC) q)
+
+FROM parents p
+JOIN readable r ON r.nid = p.nid
+ORDER BY p.cid, p.nid;
+END;
+$f$;
+
+
 CREATE MATERIALIZED VIEW IF NOT EXISTS :search_path.container_info AS 
 SELECT 
     id AS nid
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+from __future__ import absolute_import
+import datetime
+import logging
+import re
+
+from sqlalchemy import Date, Integer, MetaData, SmallInteger, String, Table, sql
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from core.database.postgres import DeclarativeBase, C, db_metadata
+
+
+logg = logging.getLogger(__name__)
+
+PARTITION_NAME_TEMPLATE = u"access_stat_{:04d}_{:02d}"
+PARTITION_NAME_PATTERN = re.compile(r"^access_stat_(\d{4})_(\d{2})$")
+
+# table objects for the month partitions, only used for inserts and deletes
+_partition_metadata = MetaData(schema=db_metadata.schema)
+
+
+class AccessStat(DeclarativeBase):
+
+    """Accesses to a node aggregated by day, access type and country of the client.
+    Hour arrays have 24 elements, index 1 counts the accesses between 0:00 and 0:59.
+    Visitors are counted per row, sums over many rows are upper bounds for the number of different visitors.
+
+    The table is partitioned by month. Rows are stored in child tables created by `create_month_partition`,
+    queries on this table only scan the partitions for the requested days.
+    """
+
+    __tablename__ = "access_stat"
+
+    nid = C(Integer, primary_key=True, autoincrement=False)
+    day = C(Date, primary_key=True)
+    type = C(SmallInteger, primary_key=True, autoincrement=False)
+    country = C(String(2), primary_key=True, server_default="")
+    hits = C(Integer, nullable=False)
+    visitors = C(Integer, nullable=False)
+    hour_hits = C(ARRAY(Integer))
+    hour_visitors = C(ARRAY(Integer))
+
+
+def month_bounds(year, month):
+    """Returns the first day of the month and the first day of the next month"""
+    start = datetime.date(year, month, 1)
+    end = datetime.date(year + 1, 1, 1) if month == 12 else datetime.date(year, month + 1, 1)
+    return start, end
+
+
+def create_month_partition(session, year, month):
+    """Creates the child table for a month if it doesn't exist.
+    :returns: Table object for the partition
+    """
+    name = PARTITION_NAME_TEMPLATE.format(year, month)
+    start, end = month_bounds(year, month)
+    schema = db_metadata.schema
+
+    session.execute(u"""CREATE TABLE IF NOT EXISTS {schema}.{name} (
+            CHECK (day >= DATE '{start}' AND day < DATE '{end}'),
+            PRIMARY KEY (nid, day, type, country)
+        ) INHERITS ({schema}.access_stat)""".format(schema=schema, name=name, start=start, end=end))
+
+    table = _partition_metadata.tables.get(schema + "." + name)
+    if table is None:
+        table = Table(name, _partition_metadata, *[c.copy() for c in AccessStat.__table__.columns])
+    return table
+
+
+def month_partitions(session):
+    """Returns a sorted list of (year, month) tuples for all existing partitions"""
+    stmt = sql.text(u"SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                    u"WHERE i.inhparent = '{}.access_stat'::regclass".format(db_metadata.schema))
+    months = []
+    for relname, in session.execute(stmt):
+        match = PARTITION_NAME_PATTERN.match(relname)
+        if match:
+            months.append((int(match.group(1)), int(match.group(2))))
+    return sorted(months)
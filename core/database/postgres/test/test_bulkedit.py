@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+from __future__ import absolute_import
+from pytest import raises
+
+from core.database.postgres.bulkedit import bulk_edit, group_by_next_version_tag, _diff, _has_other_changes
+from core.database.postgres.node import NodeVersionAttrsDiff
+from core.test.factories import DocumentFactory
+
+# versioning needs the unnested session, see core.test.test_version
+from core.test.test_version import teardown_module, session
+
+
+def test_diff():
+    changed, removed = _diff({u"a": u"1", u"b": u"2", u"c": u"3"}, {u"a": u"1", u"b": u"changed", u"d": u"new"})
+    assert changed == {u"b": u"changed", u"d": u"new"}
+    assert removed == [u"c"]
+
+
+def test_bulk_edit(session, content_node, other_content_node):
+    nodes = [content_node, other_content_node]
+    content_node.system_attrs[u"sys"] = u"old"
+    session.commit()
+
+    with bulk_edit(nodes, comment=u"bulk") as tx:
+        for node in nodes:
+            node[u"edited"] = unicode(node.id)
+            del node.attrs[u"sortattr"]
+        content_node.system_attrs[u"sys"] = u"new"
+        content_node.name = u"renamed"
+
+    # attributes are reloaded from the database after the commit
+    for node in nodes:
+        assert node[u"edited"] == unicode(node.id)
+        assert u"sortattr" not in node.attrs
+        assert node.versions[-1].transaction_id == tx.id
+
+    assert content_node.system_attrs[u"sys"] == u"new"
+    assert content_node.name == u"renamed"
+    assert content_node.versions.count() == 2
+    assert tx.meta[u"comment"] == u"bulk"
+
+
+def test_bulk_edit_rollback(session, content_node):
+    session.commit()
+    with raises(ValueError):
+        with bulk_edit([content_node]):
+            content_node[u"edited"] = u"1"
+            raise ValueError()
+
+    assert u"edited" not in content_node.attrs
+    assert content_node.versions.count() == 1
+
+
+def test_bulk_edit_tagged_dirty_session(session, content_node):
+    session.commit()
+    content_node[u"dirty"] = u"1"
+    with raises(Exception):
+        with bulk_edit([content_node], tag=u"2"):
+            pass
+    session.rollback()
+
+
+def test_group_by_next_version_tag(session, content_node_versioned_tagged):
+    untagged_node = DocumentFactory(name=u"untagged")
+    session.commit()
+    groups = group_by_next_version_tag([content_node_versioned_tagged, untagged_node])
+    assert groups.items() == [(u"2", [untagged_node]), (u"3", [content_node_versioned_tagged])]
+
+
+def test_bulk_edit_new_tagged_versions(session, content_node_versioned):
+    node = content_node_versioned
+    groups = group_by_next_version_tag([node])
+    assert groups.keys() == [u"2"]
+
+    with bulk_edit(groups[u"2"], tag=u"2", tag_untagged_versions=True):
+        node[u"edited"] = u"1"
+
+    # like Node.new_tagged_version, the previous version is tagged as 1
+    assert [v.tag for v in node.tagged_versions] == [u"1", u"2"]
+    assert node.get_tagged_version(u"2")[u"edited"] == u"1"
+
+
+def test_has_other_changes(session, content_node):
+    session.commit()
+    content_node[u"edited"] = u"1"
+    content_node.system_attrs[u"sys"] = u"1"
+    assert not _has_other_changes(content_node)
+    content_node.name = u"renamed"
+    assert _has_other_changes(content_node)
+    session.rollback()
+
+
+def test_bulk_edit_attrs_diff(session, content_node):
+    node = content_node
+    node[u"description"] = u"x" * 100
+    session.commit()
+
+    with bulk_edit([node], store_attrs_diffs=True) as tx:
+        node[u"edited"] = u"1"
+        del node.attrs[u"sortattr"]
+
+    diff = session.query(NodeVersionAttrsDiff).get((node.id, tx.id))
+    assert diff.attrs_changed == {u"edited": u"1"}
+    assert diff.attrs_removed == [u"sortattr"]
+    # attributes of the version are reconstructed from the diff
+    assert node.versions[-1].attrs == node.attrs
+
+
+def test_bulk_edit_attrs_diff_tagged_version_complete(session, content_node):
+    node = content_node
+    node[u"description"] = u"x" * 100
+    session.commit()
+
+    with bulk_edit([node], store_attrs_diffs=True) as tx:
+        node[u"edited"] = u"1"
+
+    with bulk_edit([node], tag=u"2", store_attrs_diffs=True, tag_untagged_versions=True):
+        node[u"edited"] = u"2"
+
+    # the version tagged as 1 doesn't use a diff anymore
+    assert session.query(NodeVersionAttrsDiff).get((node.id, tx.id)) is None
+    assert node.get_tagged_version(u"1")[u"edited"] == u"1"
+    assert node.get_tagged_version(u"2")[u"edited"] == u"2"
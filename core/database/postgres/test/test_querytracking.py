@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+from pytest import raises
+
+from core import db
+from core.database.postgres.querytracking import fingerprint, track_queries, QueryTracker
+from core.test.asserts import assert_max_queries
+
+q = db.query
+
+
+def test_fingerprint_literals():
+    assert fingerprint("SELECT * FROM node WHERE id = 42 AND name = 'it''s'") == "SELECT * FROM node WHERE id = ? AND name = ?"
+
+
+def test_fingerprint_bind_params_and_lists():
+    fp1 = fingerprint("SELECT node.id FROM node WHERE node.id IN (%(id_1)s, %(id_2)s)\n  AND node.type = %(type_1)s")
+    fp2 = fingerprint("SELECT node.id FROM node WHERE node.id IN (%(id_1)s) AND node.type = %(type_1)s")
+    assert fp1 == fp2 == "SELECT node.id FROM node WHERE node.id IN (...) AND node.type = ?"
+
+
+def test_fingerprint_keeps_identifiers():
+    assert fingerprint("SELECT node_1.id FROM node AS node_1") == "SELECT node_1.id FROM node AS node_1"
+
+
+def test_repeated_statements():
+    tracker = QueryTracker("test", n_plus_one_threshold=3)
+    for i in range(4):
+        tracker.add("SELECT * FROM node WHERE id = {}".format(i), 0.001)
+    tracker.add("SELECT 1", 0.001)
+    [(fp, stats)] = tracker.repeated()
+    assert fp == "SELECT * FROM node WHERE id = ?"
+    assert stats.count == 4
+    assert "test_querytracking.py" in stats.origin
+    assert tracker.count == 5
+
+
+def test_track_queries_nested(session, some_node):
+    with track_queries() as outer:
+        q(type(some_node)).get(some_node.id)
+        with track_queries() as inner:
+            session.execute("SELECT 1")
+    assert inner.count == 1
+    assert outer.count >= 2
+
+
+def test_assert_max_queries(session, some_node):
+    with assert_max_queries(1):
+        session.execute("SELECT 1")
+
+    with raises(AssertionError):
+        with assert_max_queries(1):
+            for _ in range(2):
+                session.execute("SELECT 1")
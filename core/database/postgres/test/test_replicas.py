@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    SQLite engines stand in for the primary and the replica, they record which engine executed a statement.
+"""
+from __future__ import absolute_import
+import time
+
+from pytest import fixture
+from sqlalchemy import create_engine, event, Column, Integer, Unicode, text
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql import select
+
+from core.database.postgres.replicas import RoutingSession, ReplicaSet, use_replicas, reset_routing, has_written, \
+    is_write, reads_from_primary
+
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "item"
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode)
+
+
+class FakeEngine(object):
+    pass
+
+
+def make_engine(name, executed):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append((name, statement.split()[0].upper()))
+
+    return engine
+
+
+def make_replica_set(engines, lags):
+    replica_set = ReplicaSet(engines, max_lag=10, check_interval=60)
+    for replica, lag in zip(replica_set.replicas, lags):
+        replica.lag = lag
+        replica.checked_at = time.time()
+    return replica_set
+
+
+@fixture
+def executed():
+    return []
+
+
+@fixture
+def session(executed):
+    primary = make_engine("primary", executed)
+    replica = make_engine("replica", executed)
+    return RoutingSession(bind=primary, replicas=make_replica_set([replica], [0.]))
+
+
+def test_is_write():
+    assert is_write(Item.__table__.insert())
+    assert is_write(Item.__table__.update())
+    assert is_write(text("DELETE FROM item"))
+    assert not is_write(text(" select 1"))
+    assert not is_write(select([Item.__table__]))
+    assert is_write(select([Item.__table__]).with_for_update())
+
+
+def test_primary_by_default(session, executed):
+    session.query(Item).all()
+    assert executed == [("primary", "SELECT")]
+
+
+def test_read_from_replica(session, executed):
+    use_replicas(session)
+    session.query(Item).all()
+    session.execute(text("SELECT 1"))
+    assert executed == [("replica", "SELECT"), ("replica", "SELECT")]
+    assert not has_written(session)
+
+
+def test_flush_sticks_to_primary(session, executed):
+    use_replicas(session)
+    session.query(Item).all()
+    session.add(Item(name=u"new"))
+    session.flush()
+    session.query(Item).all()
+    assert executed == [("replica", "SELECT"), ("primary", "INSERT"), ("primary", "SELECT")]
+    assert has_written(session)
+
+
+def test_write_statement_sticks_to_primary(session, executed):
+    use_replicas(session)
+    session.execute(Item.__table__.delete())
+    session.query(Item).all()
+    assert executed == [("primary", "DELETE"), ("primary", "SELECT")]
+
+
+def test_reads_from_primary(session, executed):
+    use_replicas(session)
+    with reads_from_primary(session):
+        session.query(Item).all()
+    session.query(Item).all()
+    assert executed == [("primary", "SELECT"), ("replica", "SELECT")]
+    assert not has_written(session)
+
+
+def test_reset_routing(session, executed):
+    use_replicas(session)
+    session.execute(Item.__table__.delete())
+    reset_routing(session)
+    session.close()
+    assert not has_written(session)
+    use_replicas(session)
+    session.query(Item).all()
+    assert executed == [("primary", "DELETE"), ("replica", "SELECT")]
+
+
+def test_no_usable_replica_uses_primary(executed):
+    primary = make_engine("primary", executed)
+    replica = make_engine("replica", executed)
+    session = RoutingSession(bind=primary, replicas=make_replica_set([replica], [None]))
+    use_replicas(session)
+    session.query(Item).all()
+    assert executed == [("primary", "SELECT")]
+
+
+def test_lagging_replicas_are_not_used():
+    up_to_date, lagging, unavailable = FakeEngine(), FakeEngine(), FakeEngine()
+    replica_set = make_replica_set([up_to_date, lagging, unavailable], [1., 60., None])
+    assert set(replica_set.choose_engine() for _ in range(4)) == {up_to_date}
+
+
+def test_replicas_are_chosen_round_robin():
+    first, second = FakeEngine(), FakeEngine()
+    replica_set = make_replica_set([first, second], [0., 0.])
+    assert set(replica_set.choose_engine() for _ in range(2)) == {first, second}
+
+
+def test_lag_is_checked_after_interval(monkeypatch):
+    engine = FakeEngine()
+    replica_set = make_replica_set([engine], [60.])
+    replica = replica_set.replicas[0]
+
+    def check(replica):
+        replica.lag = 0.
+        replica.checked_at = time.time()
+
+    monkeypatch.setattr(replica_set, "check", check)
+    assert replica_set.choose_engine() is None
+    replica.checked_at -= 61
+    assert replica_set.choose_engine() is engine
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+from pytest import fixture
+
+from core.database.postgres.slowqueries import SlowQueryStore, plan_structure
+
+
+def _plan(index_name, rows=10):
+    return [{"Plan": {"Node Type": "Index Scan", "Relation Name": "node", "Index Name": index_name,
+                      "Plan Rows": rows, "Total Cost": rows * 0.5}}]
+
+
+@fixture
+def store(tmpdir):
+    return SlowQueryStore(str(tmpdir.join("slow.sqlite")), max_fingerprints=2)
+
+
+def test_plan_structure_ignores_estimates():
+    assert plan_structure(_plan("node_pkey", 10)[0]["Plan"]) == plan_structure(_plan("node_pkey", 1000)[0]["Plan"])
+
+
+def test_record_groups_by_fingerprint(store):
+    store.record("SELECT * FROM node WHERE id = 1", 0.5)
+    fp_hash = store.record("SELECT * FROM node WHERE id = 2", 1.5)
+    [fp] = store.top_fingerprints()
+    assert fp["hash"] == fp_hash
+    assert fp["count"] == 2
+    assert fp["total_time"] == 2.
+    assert fp["max_time"] == 1.5
+    assert fp["last_statement"] == "SELECT * FROM node WHERE id = 2"
+
+
+def test_plan_change_detected(store):
+    fp_hash = store.record("SELECT * FROM node WHERE id = 1", 0.5)
+    store.add_plan(fp_hash, _plan("node_pkey"))
+    store.add_plan(fp_hash, _plan("node_pkey", 1000))
+    store.add_plan(fp_hash, _plan("node_name_idx"))
+    [fp] = store.top_fingerprints()
+    assert fp["plan_changes"] == 1
+    assert fp["plan"][0]["Plan"]["Index Name"] == "node_name_idx"
+    plans = store.plans(fp_hash)
+    assert len(plans) == 2
+    assert sum(p["count"] for p in plans) == 3
+
+
+def test_fingerprints_limited(store):
+    store.record("SELECT 1 FROM node", 3.)
+    store.record("SELECT 1 FROM nodefile", 1.)
+    store.record("SELECT 1 FROM noderelation", 2.)
+    assert [fp["fingerprint"] for fp in store.top_fingerprints()] == ["SELECT ? FROM node", "SELECT ? FROM noderelation"]
+
+
+def test_new_fingerprint_recorded_in_full_store(store):
+    store.record("SELECT 1 FROM node", 3.)
+    store.record("SELECT 1 FROM nodefile", 2.)
+    fp_hash = store.record("SELECT 1 FROM noderelation", 0.1)
+    store.add_plan(fp_hash, _plan("noderelation_pkey"))
+    fingerprints = {fp["fingerprint"]: fp for fp in store.top_fingerprints()}
+    assert sorted(fingerprints) == ["SELECT ? FROM node", "SELECT ? FROM noderelation"]
+    assert fingerprints["SELECT ? FROM noderelation"]["plan"] is not None
+    assert len(store.plans(fp_hash)) == 1
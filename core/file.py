@@ -9,6 +9,7 @@ import os.path
 from warnings import warn
 
 from core import config
+from core import filestore
 from utils.utils import get_filesize, get_hash
 
 
@@ -45,12 +46,41 @@ class FileMixin(object):
 
     @property
     def size(self):
+        if self.filesize is not None:
+            return self.filesize
         return get_filesize(self.path)
 
     @property
     def hash(self):
+        """MD5 hex digest of the file content, read from disk on every access.
+        Use `content_hash` if the hash algorithm doesn't matter.
+        """
         return get_hash(self.path)
 
+    @property
+    def content_hash(self):
+        """SHA-256 hex digest of the file content. Computed at import time for new files,
+        older files without a stored hash are read from disk on every access.
+        """
+        if self.sha256 is not None:
+            return self.sha256
+        if not self.exists:
+            return None
+        return filestore.hash_file(self.abspath)[0]
+
+    def update_hash(self):
+        """Computes and stores SHA-256 and size of the file content"""
+        self.sha256, self.filesize = filestore.hash_file(self.abspath)
+
+    def content_changed(self):
+        """Must be called after the physical file was replaced or changed.
+        Updates SHA-256 and size and moves the file to its new blob if content-addressed storage is enabled.
+        """
+        old_sha256 = self.sha256
+        self.sha256, self.filesize = filestore.ingest(self.abspath)
+        if old_sha256 is not None and old_sha256 != self.sha256:
+            filestore.release_blob(old_sha256)
+
     @property
     def exists(self):
         return os.path.exists(self.abspath)
@@ -66,6 +96,8 @@ class FileMixin(object):
     def unlink(self):
         if self.exists:
             os.unlink(self.abspath)
+            if self.sha256 is not None:
+                filestore.release_blob(self.sha256)
         else:
             logg.warn("tried to unlink missing physical file %s at %s, ignored", self.id, self.path)
 
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Hashing and optional content-addressed storage for files in the datadir.
+
+    Files are hashed with SHA-256 in blocks when they are imported, the digest and size are stored
+    in the `file` table (File.sha256, File.filesize) and don't have to be computed again.
+
+    If `paths.content_addressed_storage` is enabled, the content of each imported file is also stored
+    once as `<datadir>/cas/<ab>/<cd>/<sha256>`. The file at the import location (which keeps the
+    original file name) becomes a hard link to that blob, so identical uploads share their storage.
+    The link count of the blob is the reference count: when the last File referencing the content
+    is unlinked, only the blob itself is left and it's removed, too.
+
+    Existing files in the datadir must never be written in place because other files may share their blob.
+    New content is written to the path yielded by `replacement_path` instead, followed by File.content_changed().
+"""
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from core import config
+
+
+logg = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1 << 20
+CAS_DIRNAME = "cas"
+
+
+def content_addressed_storage_enabled():
+    return config.getboolean("paths.content_addressed_storage", False)
+
+
+def hash_fileobj(fileobj, dest_fileobj=None):
+    """Reads `fileobj` in blocks and returns the tuple (sha256 hex digest, size).
+    The content is copied to `dest_fileobj` on the way if given.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    while True:
+        block = fileobj.read(HASH_BLOCK_SIZE)
+        if not block:
+            break
+        sha256.update(block)
+        size += len(block)
+        if dest_fileobj is not None:
+            dest_fileobj.write(block)
+    return sha256.hexdigest(), size
+
+
+def hash_file(filepath):
+    """Returns the tuple (sha256 hex digest, size) for a file, reading it in blocks"""
+    with open(filepath, "rb") as f:
+        return hash_fileobj(f)
+
+
+def copy_and_hash(fileobj, dest_filepath):
+    """Writes the content of `fileobj` to `dest_filepath` and returns the tuple (sha256 hex digest, size)"""
+    with open(dest_filepath, "wb") as dest:
+        return hash_fileobj(fileobj, dest)
+
+
+def blob_path(sha256):
+    """Returns the absolute path of the content-addressed blob for a SHA-256 hex digest"""
+    return config.resolve_datadir_path(os.path.join(CAS_DIRNAME, sha256[:2], sha256[2:4], sha256))
+
+
+def deduplicate(filepath, sha256):
+    """Replaces `filepath` by a hard link to the blob with the same content.
+    If there is no blob for `sha256` yet, `filepath` becomes the blob.
+    Returns True if the content was already stored before.
+    """
+    blob = blob_path(sha256)
+    blob_dir = os.path.dirname(blob)
+    if not os.path.exists(blob_dir):
+        try:
+            os.makedirs(blob_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    try:
+        os.link(filepath, blob)
+        return False
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            logg.warn("content-addressed storage must be on the same file system as %s, not deduplicated", filepath)
+            return False
+        if e.errno != errno.EEXIST:
+            raise
+
+    if os.path.samefile(filepath, blob):
+        return True
+
+    # replace the file atomically, the path stays valid all the time
+    fd, link_tmp = tempfile.mkstemp(dir=os.path.dirname(filepath), prefix=".cas")
+    os.close(fd)
+    os.unlink(link_tmp)
+    os.link(blob, link_tmp)
+    os.rename(link_tmp, filepath)
+    return True
+
+
+@contextmanager
+def replacement_path(filepath):
+    """Yields a temporary path next to `filepath`. The file written there replaces `filepath` when the with block ends
+    without an exception. The rename breaks a hard link to a blob, so files sharing the old content are not changed.
+    """
+    dirname, basename = os.path.split(filepath)
+    fd, tmp_filepath = tempfile.mkstemp(dir=dirname, prefix=".new", suffix=os.path.splitext(basename)[1])
+    os.close(fd)
+    try:
+        yield tmp_filepath
+        if os.path.exists(filepath):
+            shutil.copymode(filepath, tmp_filepath)
+        else:
+            os.chmod(tmp_filepath, 0o644)
+        os.rename(tmp_filepath, filepath)
+    except:
+        if os.path.exists(tmp_filepath):
+            os.unlink(tmp_filepath)
+        raise
+
+
+def ingest(filepath, sha256=None, size=None):
+    """Called for new files in the datadir. Computes hash and size if not given and deduplicates the content
+    if content-addressed storage is enabled. Returns the tuple (sha256 hex digest, size).
+    """
+    if sha256 is None or size is None:
+        sha256, size = hash_file(filepath)
+    if content_addressed_storage_enabled():
+        if deduplicate(filepath, sha256):
+            logg.debug("content of %s already stored as %s", filepath, sha256)
+    return sha256, size
+
+
+def release_blob(sha256):
+    """Removes the blob for `sha256` if no file in the datadir links to it anymore"""
+    blob = blob_path(sha256)
+    try:
+        if os.stat(blob).st_nlink == 1:
+            os.unlink(blob)
+            logg.debug("removed unreferenced blob %s", sha256)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
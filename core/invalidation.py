@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Invalidation of per-process caches in all server processes.
+
+    Code that clears a process-local cache calls `broadcast` after doing so. In prefork mode (see `core.athana_prefork`),
+    the message is sent to the supervisor which relays it to all other worker processes. There, the handlers registered
+    for the message name with `register_handler` are called with the argument of the message.
+    In single process mode, `broadcast` does nothing.
+    Messages are sent by a background thread, callers don't wait for the supervisor. Messages queued in the meantime
+    are sent together.
+"""
+from __future__ import absolute_import
+
+from collections import defaultdict
+import logging
+import threading
+
+
+logg = logging.getLogger(__name__)
+
+
+_handlers = defaultdict(list)
+#: encoded messages waiting for the sender thread
+_pending = []
+_pending_cond = threading.Condition()
+#: socket connected to the supervisor, set in worker processes
+_channel = None
+
+
+def register_handler(name, handler):
+    """Registers `handler(arg)` for invalidation messages called `name`. Returns the handler."""
+    _handlers[name].append(handler)
+    return handler
+
+
+def encode(name, arg=None):
+    if "\n" in name or " " in name or (arg is not None and "\n" in arg):
+        raise ValueError("invalidation message name and argument must not contain newlines, the name no spaces")
+    return u"{} {}\n".format(name, arg if arg is not None else u"").encode("utf8")
+
+
+def decode(line):
+    name, _, arg = line.decode("utf8").rstrip("\n").partition(" ")
+    return name, arg or None
+
+
+def dispatch(name, arg=None):
+    """Calls the local handlers for an invalidation message"""
+    for handler in _handlers.get(name, []):
+        try:
+            handler(arg)
+        except Exception:
+            logg.exception("invalidation handler for %s failed", name)
+
+
+def broadcast(name, arg=None):
+    """Tells the other server processes to run the handlers for `name`. The caller must invalidate its own cache."""
+    if _channel is None:
+        return
+    message = encode(name, arg)
+    with _pending_cond:
+        _pending.append(message)
+        _pending_cond.notify()
+
+
+def _send_pending(channel):
+    while True:
+        with _pending_cond:
+            while not _pending:
+                _pending_cond.wait()
+            messages = "".join(_pending)
+            del _pending[:]
+        try:
+            channel.sendall(messages)
+        except Exception:
+            logg.exception("could not broadcast invalidation messages")
+
+
+def listen(channel):
+    """Starts a thread that dispatches messages received from `channel` and a thread that sends broadcast messages
+    via `channel`. Returns the receiving thread."""
+    global _channel
+    _channel = channel
+
+    def receive():
+        buf = ""
+        while True:
+            try:
+                data = channel.recv(4096)
+            except Exception:
+                logg.exception("invalidation channel failed")
+                return
+            if not data:
+                return
+            buf += data
+            while "\n" in buf:
+                line, buf = buf.split("\n", 1)
+                dispatch(*decode(line + "\n"))
+
+    sender = threading.Thread(target=_send_pending, args=(channel, ), name="invalidation-sender")
+    sender.daemon = True
+    sender.start()
+
+    thread = threading.Thread(target=receive, name="invalidation-listener")
+    thread.daemon = True
+    thread.start()
+    return thread
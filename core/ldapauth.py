@@ -18,7 +18,14 @@
  You should have received a copy of the GNU General Public License
  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+from contextlib import contextmanager
+import hashlib
+import hmac
 import logging
+import os
+import Queue
+import threading
+import time
 import ldap
 
 from core import db, Node, User, UserGroup, UserToUserGroup
@@ -35,11 +42,145 @@ ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
 ldap.set_option(ldap.OPT_X_TLS, ldap.OPT_X_TLS_DEMAND)
 ldap.set_option(ldap.OPT_REFERRALS, 0)
 
+#: errors that are worth another try with a new connection
+RETRY_ERRORS = (ldap.TIMEOUT, ldap.SERVER_DOWN)
+
 
 class LDAPConfigError(Exception):
     pass
 
 
+class LDAPConnectionPool(object):
+
+    """Thread-safe pool of connections that are bound as the proxy user.
+    At most `size` connections are opened, requests wait up to `timeout` seconds for a free connection.
+    Connections that failed are closed and replaced by new ones.
+    """
+
+    def __init__(self, server, bind_user, password, size=4, timeout=5):
+        self.server = server
+        self.bind_user = bind_user
+        self.password = password
+        self.size = size
+        self.timeout = timeout
+        self._idle = Queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = ldap.initialize(self.server)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+        conn.set_option(ldap.OPT_TIMEOUT, self.timeout)
+        conn.simple_bind_s(self.bind_user, self.password)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            pass
+
+        with self._lock:
+            open_new = self._opened < self.size
+            if open_new:
+                self._opened += 1
+
+        if not open_new:
+            try:
+                return self._idle.get(timeout=self.timeout)
+            except Queue.Empty:
+                raise ldap.TIMEOUT("no free LDAP connection for {} after {} seconds".format(self.server, self.timeout))
+
+        try:
+            return self._connect()
+        except:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _discard(self, conn):
+        with self._lock:
+            self._opened -= 1
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Yields a bound connection which is returned to the pool afterwards"""
+        conn = self._acquire()
+        try:
+            yield conn
+        except ldap.LDAPError:
+            self._discard(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Queue.Empty:
+                break
+            self._discard(conn)
+
+
+class CredentialCache(object):
+
+    """Remembers successful password verifications for `ttl` seconds.
+    Passwords are not stored, only a HMAC-SHA256 of login and password with a random key that is created on startup.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._key = os.urandom(32)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _digest(self, login, password):
+        return hmac.new(self._key, u"{}\0{}".format(login, password).encode("utf8"), hashlib.sha256).digest()
+
+    def get(self, login, password):
+        """Returns the user id for `login` if `password` has been verified recently, else None."""
+        entry = self._entries.get(login)
+        if entry is None:
+            return
+        digest, user_id, expires = entry
+        if expires < time.time():
+            self.discard(login)
+            return
+        if hmac.compare_digest(digest, self._digest(login, password)):
+            return user_id
+
+    def add(self, login, password, user_id):
+        now = time.time()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: v for k, v in iteritems(self._entries) if v[2] >= now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[login] = (self._digest(login, password), user_id, now + self.ttl)
+
+    def discard(self, login):
+        with self._lock:
+            self._entries.pop(login, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _first_entry(result_type, result_data):
+    """Returns (dn, attributes) of the first entry from a search result or None"""
+    if result_type in (ldap.RES_SEARCH_ENTRY, ldap.RES_SEARCH_RESULT) and result_data:
+        return result_data[0]
+
+
 class LDAPAuthenticator(Authenticator):
     
     """Provide LDAP authentication. Multiple LDAPAuthenticators can be configured in mediatum.cfg like:
@@ -57,6 +198,11 @@ class LDAPAuthenticator(Authenticator):
 
         This prefers internal authentication. If that fails, the ldap authenticator with 'name' is tried and so on.
 
+        Searches for users are done with a pool of connections bound as proxy user (option pool_size).
+        LDAP requests time out after `timeout` seconds and are tried `retries` times.
+        If `credential_cache_ttl` is set, successful logins are remembered for that many seconds and repeated logins
+        with the same password don't need a LDAP request in that time.
+
     TODO: Logging should include the name of the authenticator!
     """
 
@@ -69,44 +215,61 @@ class LDAPAuthenticator(Authenticator):
         """
         Authenticator.__init__(self, name)
         self._configure(config_dict)
+        self.pool = LDAPConnectionPool(self.server, self.bind_user, self.proxyuser_password, self.pool_size, self.timeout)
+        self.credential_cache = CredentialCache(self.credential_cache_ttl) if self.credential_cache_ttl > 0 else None
+        # user id -> digest of the directory data that was used for the last update of the user
+        self._directory_digests = {}
 
-    def try_auth(self, searchfilter):
-        count = 5
-        # if proxyuser given as full DN, take that
-        # otherwise assume cn as given and append configured basedn
-        while True:
-            l = ldap.initialize(self.server)
-            l.simple_bind_s(self.bind_user, self.proxyuser_password)
-
-            ldap_result_id = l.search(self.base_dn, ldap.SCOPE_SUBTREE, searchfilter, [])
+    def _with_retries(self, func, *args):
+        for attempt in range(1, self.retries + 1):
             try:
-                return l.result(ldap_result_id, 0, timeout=5)
-
-            except ldap.TIMEOUT:
-                count += 1
-                if count > 5:
+                return func(*args)
+            except RETRY_ERRORS as e:
+                if attempt == self.retries:
                     raise
-                logg.warn("timeout while trying to connect to user database, retry %s", count)
-                continue
-            else:
-                return None, None
-
-    def try_login(self, user_dn, password, searchfilter):
-        while True:
-            l2 = ldap.initialize(self.server)
+                logg.warn("%s: LDAP request failed (%s), retry %s of %s", self.name, e.__class__.__name__,
+                          attempt, self.retries - 1)
+
+    def _search(self, conn, searchfilter, attributes):
+        ldap_result_id = conn.search(self.base_dn, ldap.SCOPE_SUBTREE, searchfilter, attributes)
+        try:
+            return conn.result(ldap_result_id, 0, timeout=self.timeout)
+        finally:
+            # we only want the first entry, drop the rest of the result
+            conn.abandon(ldap_result_id)
+
+    def _search_as_proxyuser(self, searchfilter):
+        with self.pool.connection() as conn:
+            return self._search(conn, searchfilter, [])
+
+    def _login_and_search(self, user_dn, password, searchfilter):
+        conn = ldap.initialize(self.server)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+        conn.set_option(ldap.OPT_TIMEOUT, self.timeout)
+        try:
+            conn.simple_bind_s(user_dn, password.encode("utf8"))
+            return self._search(conn, searchfilter, self.attributes)
+        finally:
             try:
-                l2.simple_bind_s(user_dn, password.encode("utf8"))
-            except ldap.INVALID_CREDENTIALS:
-                return None, None
+                conn.unbind_s()
+            except ldap.LDAPError:
+                pass
 
-            ldap_result_id = l2.search(self.base_dn, ldap.SCOPE_SUBTREE, searchfilter, self.attributes)
-            try:
-                return l2.result(ldap_result_id, 0, timeout=5)
-            except ldap.TIMEOUT:
-                logg.info("timeout while authenticating user,  retrying...")
-                continue
-            else:
-                return None, None
+    def try_auth(self, searchfilter):
+        """Searches the directory as proxy user.
+        :raises ldap.TIMEOUT, ldap.SERVER_DOWN: if LDAP didn't answer in time after all retries
+        """
+        return self._with_retries(self._search_as_proxyuser, searchfilter)
+
+    def try_login(self, user_dn, password, searchfilter):
+        """Binds as `user_dn` with `password` and searches the directory with that user.
+        Returns (None, None) if the credentials are wrong.
+        :raises ldap.TIMEOUT, ldap.SERVER_DOWN: if LDAP didn't answer in time after all retries
+        """
+        try:
+            return self._with_retries(self._login_and_search, user_dn, password, searchfilter)
+        except ldap.INVALID_CREDENTIALS:
+            return None, None
 
     def get_user_data(self, data):
         return {attribute_name: data.get(ldap_fieldname)[0].decode("utf8") if data.get(ldap_fieldname) else None
@@ -170,6 +333,23 @@ class LDAPAuthenticator(Authenticator):
         user.update(**user_data)
         self.update_groups_from_ldap(user, data)
 
+    def directory_data_digest(self, data):
+        """Returns a digest of the user data and group names that are used from the LDAP entry `data`"""
+        user_data = sorted(iteritems(self.get_user_data(data)))
+        group_names = sorted(self.get_ldap_group_names(data))
+        return hashlib.sha1(repr((user_data, group_names))).hexdigest()
+
+    def _cached_user(self, login, password):
+        if self.credential_cache is None:
+            return
+        user_id = self.credential_cache.get(login, password)
+        if user_id is not None:
+            return q(User).get(user_id)
+
+    def _remember_credentials(self, login, password, user):
+        if self.credential_cache is not None:
+            self.credential_cache.add(login, password, user.id)
+
     def authenticate_user_credentials(self, login, password, request=None):
 
         # empty passwords not allowed, don't even try to authenticate with that...
@@ -180,53 +360,56 @@ class LDAPAuthenticator(Authenticator):
         if "@" not in login and self.user_url:
             login += self.user_url
 
-        searchfilter = self.searchfilter_template.replace("[username]", login)
+        user = self._cached_user(login, password)
+        if user is not None:
+            logg.info("LDAP auth succeeded for known login name %s (cached)", login)
+            return user
 
-        result_type, auth_result_data = self.try_auth(searchfilter)
+        searchfilter = self.searchfilter_template.replace("[username]", login)
 
-        if result_type == ldap.RES_SEARCH_RESULT:
-            if len(auth_result_data) > 0:
-                result_type = ldap.RES_SEARCH_ENTRY
-                auth_result_data = auth_result_data[0]
-            else:
+        try:
+            auth_entry = _first_entry(*self.try_auth(searchfilter))
+            if auth_entry is None:
                 logg.info("LDAP auth failed for login name %s", login)
                 return
 
-        if result_type != ldap.RES_SEARCH_ENTRY:
-            logg.info("LDAP auth failed for login name %s", login)
-            return
-
-        user_dn = auth_result_data[0][0]
-        auth_result_dict = auth_result_data[0][1]
-        dir_id = auth_result_dict[self.user_login][0]
+            user_dn, auth_result_dict = auth_entry
+            dir_id = auth_result_dict[self.user_login][0]
 
-        result_type, login_result_data = self.try_login(user_dn, password, searchfilter)
+            login_entry = _first_entry(*self.try_login(user_dn, password, searchfilter))
+        except RETRY_ERRORS:
+            logg.exception("LDAP server %s not available, auth failed for login name %s", self.server, login)
+            return
 
-        if (result_type == ldap.RES_SEARCH_RESULT and len(login_result_data) > 0):
-            result_type = ldap.RES_SEARCH_ENTRY
-            login_result_data = login_result_data[0]
-        if (result_type != ldap.RES_SEARCH_ENTRY):
+        if login_entry is None:
+            if self.credential_cache is not None:
+                self.credential_cache.discard(login)
             logg.info("LDAP auth failed for login name %s", login)
             return
 
-        if login_result_data[0][0] == user_dn:
+        if login_entry[0] == user_dn:
+            data = login_entry[1]
             user = q(User).filter_by(
                 login_name=dir_id.decode("utf8")).join(AuthenticatorInfo).filter_by(
                 name=self.name,
                 auth_type=LDAPAuthenticator.auth_type).scalar()
 
             if user is not None:
-                # we already have an user object, update data
-                if config.getboolean("config.readonly"):
+                # we already have an user object, update data if something changed in the directory
+                digest = self.directory_data_digest(data)
+                if self._directory_digests.get(user.id) == digest:
+                    logg.debug("LDAP data unchanged for login name %s, not updating user", login)
+                elif config.getboolean("config.readonly"):
                     logg.warn("cannot update existing user data for login name %s in read-only mode", login, trace=False)
                 else:
-                    self.update_ldap_user(login_result_data[0][1], user)
+                    self.update_ldap_user(data, user)
                     db.session.commit()
+                    self._directory_digests[user.id] = digest
 
+                self._remember_credentials(login, password, user)
                 logg.info("LDAP auth succeeded for known login name %s", login)
                 return user
             else:
-                data = login_result_data[0][1]
                 authenticator_info = q(AuthenticatorInfo).filter_by(name=self.name, auth_type=LDAPAuthenticator.auth_type).scalar()
                 user = self.add_ldap_user(data, login, authenticator_info)
 
@@ -238,6 +421,8 @@ class LDAPAuthenticator(Authenticator):
                 # refuse login if no user was created (if no matching group was found)
                 if user is not None:
                     db.session.commit()
+                    self._directory_digests[user.id] = self.directory_data_digest(data)
+                    self._remember_credentials(login, password, user)
                     logg.info("LDAP auth succeeded for login name %s, created new user", login)
                     return user
                 else:
@@ -280,6 +465,10 @@ class LDAPAuthenticator(Authenticator):
         self.attributes = get_config("attributes", "").encode("utf8").split(",") + [self.user_login.encode("utf8")]
         self.group_attributes = [a.strip() for a in get_config("group_attributes", "").split(",")]
         self.searchfilter_template = get_config("searchfilter")
+        self.pool_size = int(get_config("pool_size", optional=True) or 4)
+        self.timeout = int(get_config("timeout", optional=True) or 5)
+        self.retries = max(1, int(get_config("retries", optional=True) or 3))
+        self.credential_cache_ttl = int(get_config("credential_cache_ttl", optional=True) or 0)
 
         self.user_attributes = {
             "login_name": self.user_login,
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Minimal metrics registry that renders the Prometheus text exposition format, served by Athana at `/metrics`.
+
+    Counters and histograms are updated in the request path, so updating must be cheap: a dict lookup, a bisect
+    and some additions under a lock. Values that are already available somewhere else (pool status, cache sizes)
+    are read at scrape time by gauges with a `collect` function.
+"""
+from __future__ import absolute_import
+
+from bisect import bisect_left
+import logging
+import threading
+
+
+logg = logging.getLogger(__name__)
+
+
+#: in seconds, from 5ms to 1min
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = zip(labelnames, labelvalues) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(u'{}="{}"'.format(k, unicode(v).replace("\\", r"\\").replace('"', r'\"').replace("\n", r"\n"))
+                          for k, v in pairs) + "}"
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Registers `metric`, replaces a registered metric with the same name"""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format (version 0.0.4)"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                logg.exception("collecting metric %s failed", metric.name)
+                continue
+            lines.append(u"# HELP {} {}".format(metric.name, metric.documentation))
+            lines.append(u"# TYPE {} {}".format(metric.name, metric.type))
+            for suffix, labels, value in samples:
+                lines.append(u"{}{}{} {}".format(metric.name, suffix, labels, _format_value(value)))
+        lines.append(u"")
+        return u"\n".join(lines).encode("utf8")
+
+
+REGISTRY = Registry()
+
+
+class _Metric(object):
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def value(self, labels=()):
+        return self._values.get(tuple(labels))
+
+
+class Counter(_Metric):
+
+    type = "counter"
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield "", _format_labels(self.labelnames, labels), value
+
+
+class Gauge(_Metric):
+
+    """A gauge is either set by the application or read by `collect` at scrape time.
+    `collect` must return an iterable of (label values, value).
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, collect=None):
+        self.collect = collect
+        super(Gauge, self).__init__(name, documentation, labelnames, registry)
+
+    def set(self, value, labels=()):
+        self._values[labels] = value
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def samples(self):
+        values = self.collect() if self.collect is not None else self._values.items()
+        for labels, value in sorted(values):
+            yield "", _format_labels(self.labelnames, labels), value
+
+
+class Histogram(_Metric):
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super(Histogram, self).__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, labels=()):
+        # the last bucket is +Inf
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", _format_labels(self.labelnames, labels, [("le", _format_value(float(bound)))]), cumulative
+            yield "_sum", _format_labels(self.labelnames, labels), total
+            yield "_count", _format_labels(self.labelnames, labels), cumulative
+
+
+def query_executed(duration):
+    """Called after each database statement"""
+    DB_QUERIES.inc()
+    DB_QUERY_SECONDS.inc(duration)
+
+
+def request_finished(handler, duration, queue_wait=None, queries=None):
+    """:param queries: `QueryTracker` of the request"""
+    REQUEST_LATENCY.observe(duration, (handler, ))
+    WORKER_BUSY_SECONDS.inc(duration)
+    if queue_wait is not None:
+        REQUEST_QUEUE_WAIT.observe(queue_wait)
+    if queries is not None:
+        DB_QUERIES_PER_REQUEST.observe(queries.count, (handler, ))
+        DB_QUERY_SECONDS_PER_REQUEST.observe(queries.time, (handler, ))
+
+
+def cache_lookup(cache, hit):
+    """Counts a lookup in one of the application caches"""
+    CACHE_LOOKUPS.inc(labels=(cache, "hit" if hit else "miss"))
+
+
+def register_cache_size(cache, size_func):
+    """Registers a function that returns the current number of entries of `cache`"""
+    _cache_size_funcs[cache] = size_func
+
+
+def _collect_cache_sizes():
+    for cache, size_func in _cache_size_funcs.items():
+        try:
+            yield (cache, ), size_func()
+        except Exception:
+            logg.warn("could not determine size of cache %s", cache, exc_info=True)
+
+
+_cache_size_funcs = {}
+
+CACHE_LOOKUPS = Counter("mediatum_cache_lookups_total", "Lookups in application caches", ("cache", "result"))
+CACHE_SIZE = Gauge("mediatum_cache_entries", "Number of entries in application caches", ("cache", ),
+                   collect=_collect_cache_sizes)
+
+REQUEST_LATENCY = Histogram("athana_request_duration_seconds", "Time spent in request handlers", ("handler", ))
+REQUEST_QUEUE_WAIT = Histogram("athana_request_queue_wait_seconds", "Time requests waited for a worker thread")
+WORKER_BUSY_SECONDS = Counter("athana_worker_busy_seconds_total", "Time spent by all worker threads in handlers")
+
+DB_QUERIES = Counter("mediatum_db_queries_total", "Database statements executed")
+DB_QUERY_SECONDS = Counter("mediatum_db_query_seconds_total", "Time spent executing database statements")
+DB_QUERIES_PER_REQUEST = Histogram("mediatum_db_queries_per_request", "Database statements executed per request",
+                                   ("handler", ), buckets=QUERY_COUNT_BUCKETS)
+DB_QUERY_SECONDS_PER_REQUEST = Histogram("mediatum_db_query_seconds_per_request",
+                                         "Time spent executing database statements per request", ("handler", ))
@@ -4,15 +4,39 @@
     :license: GPL3, see COPYING for details
 """
 from __future__ import absolute_import
-from sqlalchemy.orm import undefer, joinedload
+from collections import OrderedDict
+from itertools import chain
+import logging
+import os
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import undefer, joinedload, Session
 from dogpile.cache.region import make_region
 from sqlalchemy.orm.exc import NoResultFound
+from werkzeug.datastructures import ImmutableDict
+from core import config, metrics
+
+
+logg = logging.getLogger(__name__)
 
 
 class Cache(object):
     pass
 
 memory_nodecache = make_region().configure('dogpile.cache.memory')
+metrics.register_cache_size("node", lambda: len(memory_nodecache.backend._cache))
+
+
+def _get_or_create_counted(key, creator):
+    created = []
+
+    def count_creation():
+        created.append(True)
+        return creator()
+
+    value = memory_nodecache.get_or_create(key, count_creation)
+    metrics.cache_lookup("node", not created)
+    return value
 
 
 def get_typed_node_from_cache(nodeclass, nid):    
@@ -30,7 +54,7 @@ def get_typed_node_from_cache(nodeclass, nid):
                                            joinedload(nodeclass.file_objects)).filter_by(id=nid).one()
         
 
-    node_from_cache = memory_nodecache.get_or_create(nodeclass, fetch_typed_node_from_db)
+    node_from_cache = _get_or_create_counted(nodeclass, fetch_typed_node_from_db)
     return s.merge(node_from_cache, load=False)
 
 
@@ -46,7 +70,7 @@ def get_singleton_node_from_cache(nodeclass):
                                            undefer(nodeclass.system_attrs), 
                                            joinedload(nodeclass.file_objects)).one()
 
-    node_from_cache = memory_nodecache.get_or_create(nodeclass, fetch_singleton_node_from_db)
+    node_from_cache = _get_or_create_counted(nodeclass, fetch_singleton_node_from_db)
     return s.merge(node_from_cache, load=False)
         
     
@@ -66,3 +90,282 @@ def get_home_root_node():
     """Home object may not change during runtime, so we can cache it indefinitely"""
     from contenttypes import Home
     return get_singleton_node_from_cache(Home)
+
+
+DEFAULT_SNAPSHOT_CACHE_SIZE = 10000
+#: key in Session.info, ids of nodes changed in the current transaction
+_CHANGED_NODE_IDS = "nodecache_changed_node_ids"
+#: key in Session.info, set if nodes were changed by bulk statements in the current transaction
+_BULK_NODE_CHANGES = "nodecache_bulk_node_changes"
+
+
+class NodeSnapshot(object):
+
+    """Read-only copy of the node columns that are needed for rendering.
+    Use a Node instance for everything else (children, files, permissions, changes).
+    """
+
+    __slots__ = ("id", "name", "type", "schema", "attrs", "system_attrs")
+
+    def __init__(self, id, name, type, schema, attrs, system_attrs):
+        self.id = id
+        self.name = name
+        self.type = type
+        self.schema = schema
+        self.attrs = ImmutableDict(attrs or {})
+        self.system_attrs = ImmutableDict(system_attrs or {})
+
+    def get(self, key, default=u""):
+        """Same as Node.get"""
+        return self.attrs.get(key, default)
+
+    def __repr__(self):
+        return u"NodeSnapshot<{} '{}' ({}/{})>".format(self.id, self.name, self.type, self.schema).encode("utf8")
+
+
+class NodeSnapshotCache(object):
+
+    """Process-local LRU cache of node snapshots, keyed by node id.
+
+    The cache is only filled while it's active, that is while the node change listener is connected.
+    Each invalidation increments the generation. Snapshots that were loaded from the database before an
+    invalidation are not stored because they may already be outdated.
+    """
+
+    def __init__(self, max_size=DEFAULT_SNAPSHOT_CACHE_SIZE):
+        self.max_size = max_size
+        self.active = False
+        self.generation = 0
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def lookup(self, nid):
+        with self._lock:
+            snapshot = self._snapshots.pop(nid, None)
+            if snapshot is not None:
+                self._snapshots[nid] = snapshot
+        return snapshot
+
+    def store(self, snapshot, generation):
+        """Stores `snapshot` if nothing was invalidated since `generation`"""
+        with self._lock:
+            if not self.active or generation != self.generation:
+                return
+            self._snapshots[snapshot.id] = snapshot
+            if len(self._snapshots) > self.max_size:
+                self._snapshots.popitem(last=False)
+
+    def invalidate(self, nid):
+        with self._lock:
+            self.generation += 1
+            self._snapshots.pop(nid, None)
+
+    def invalidate_many(self, nids):
+        with self._lock:
+            self.generation += 1
+            for nid in nids:
+                self._snapshots.pop(nid, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._snapshots.clear()
+
+    def activate(self):
+        self.clear()
+        self.active = True
+
+    def deactivate(self):
+        self.active = False
+        self.clear()
+
+
+_snapshot_cache = None
+_snapshot_cache_pid = None
+_snapshot_cache_lock = threading.Lock()
+
+#: name -> (on_change, on_connect, on_disconnect), see add_node_change_handler
+_node_change_handlers = {}
+_node_change_listener_pid = None
+_node_change_listener_connected = False
+_node_change_lock = threading.Lock()
+
+
+def add_node_change_handler(name, on_change, on_connect=None, on_disconnect=None):
+    """Calls `on_change(node_id)` for each committed change of a node in any server process.
+    Changes are only reported while the node change listener is connected, so caches must be cleared
+    by `on_connect` and `on_disconnect`. `on_connect` is called immediately if the listener is connected already.
+    It's also called if all nodes may have changed, for example after a change of access rules.
+    A handler replaces the one registered before with the same name, for example by the parent process.
+    Use `start_node_change_listener` to start the listener.
+    """
+    with _node_change_lock:
+        _node_change_handlers[name] = (on_change, on_connect, on_disconnect)
+        connected = _node_change_listener_connected and _node_change_listener_pid == os.getpid()
+    if connected and on_connect is not None:
+        on_connect()
+
+
+def _call_node_change_handlers(index, *args):
+    with _node_change_lock:
+        handlers = [h[index] for h in _node_change_handlers.itervalues() if h[index] is not None]
+    for handler in handlers:
+        handler(*args)
+
+
+def _on_node_change(node_id):
+    _call_node_change_handlers(0, node_id)
+
+
+def _on_all_nodes_changed():
+    _call_node_change_handlers(1)
+
+
+def _on_node_change_listener_connect():
+    global _node_change_listener_connected
+    with _node_change_lock:
+        _node_change_listener_connected = True
+    _call_node_change_handlers(1)
+
+
+def _on_node_change_listener_disconnect():
+    global _node_change_listener_connected
+    with _node_change_lock:
+        _node_change_listener_connected = False
+    _call_node_change_handlers(2)
+
+
+def _connect_node_change_listener():
+    from core import db
+    connection = db.engine.raw_connection()
+    # the listener keeps the connection, it must not be returned to the pool
+    connection.detach()
+    return connection.connection
+
+
+def start_node_change_listener():
+    """Starts the node change listener thread if it's not running in this process (also after forking)"""
+    global _node_change_listener_pid, _node_change_listener_connected
+    if _node_change_listener_pid == os.getpid():
+        return
+    with _node_change_lock:
+        if _node_change_listener_pid == os.getpid():
+            return
+        _node_change_listener_pid = os.getpid()
+        _node_change_listener_connected = False
+
+    from core.database.postgres.nodechanges import NodeChangeListener
+    NodeChangeListener(_connect_node_change_listener, _on_node_change, _on_all_nodes_changed,
+                       on_connect=_on_node_change_listener_connect,
+                       on_disconnect=_on_node_change_listener_disconnect).start()
+
+
+def get_node_snapshot_cache():
+    """Returns the node snapshot cache of this process.
+    The node change listener is started when this is called first in a process (also after forking).
+    """
+    global _snapshot_cache, _snapshot_cache_pid
+    if _snapshot_cache_pid != os.getpid():
+        with _snapshot_cache_lock:
+            if _snapshot_cache_pid != os.getpid():
+                cache = NodeSnapshotCache(config.getint("database.node_snapshot_cache_size", DEFAULT_SNAPSHOT_CACHE_SIZE))
+                if cache.max_size > 0:
+                    add_node_change_handler("node_snapshot", cache.invalidate, cache.activate, cache.deactivate)
+                    start_node_change_listener()
+                metrics.register_cache_size("node_snapshot", lambda: len(cache))
+                _snapshot_cache = cache
+                _snapshot_cache_pid = os.getpid()
+    return _snapshot_cache
+
+
+def get_node_snapshot(nid):
+    """Returns a read-only NodeSnapshot of the node with the id `nid` or None if there's no such node.
+    For read-only rendering code that needs name, type, schema or attributes of nodes referenced by id,
+    for example metadata fields or mappings. The snapshot reflects the last committed state of the node.
+    Like `q(Node).get`, `nid` can also be the alias id of a node version. Snapshots of versions are not cached.
+    """
+    try:
+        nid = int(nid)
+    except (TypeError, ValueError):
+        return None
+
+    cache = get_node_snapshot_cache()
+    snapshot = cache.lookup(nid)
+    metrics.cache_lookup("node_snapshot", snapshot is not None)
+    if snapshot is not None:
+        return snapshot
+
+    from core import db, Node
+    from core.database.postgres.replicas import reads_from_primary
+    s = db.session
+    generation = cache.generation
+    # don't flush pending changes, the snapshot may be stored for other requests
+    with s.no_autoflush, reads_from_primary(s):
+        row = s.query(Node.id, Node.name, Node.type, Node.schema, Node.attrs, Node.system_attrs).filter_by(id=nid).first()
+
+    if row is None:
+        # MtQuery.get also finds node versions by alias id
+        version = s.query(Node).get(nid)
+        if version is None:
+            return None
+        return NodeSnapshot(version.id, version.name, version.type, version.schema, version.attrs,
+                            version.system_attrs)
+
+    snapshot = NodeSnapshot(*row)
+    # changes flushed by this session are visible, but not committed yet
+    if not s.info.get(_CHANGED_NODE_IDS) and not s.info.get(_BULK_NODE_CHANGES):
+        cache.store(snapshot, generation)
+    return snapshot
+
+
+# Write-through invalidation: nodes changed by this process are removed from the snapshot cache on commit.
+# Other processes are notified by the node change trigger.
+
+@event.listens_for(Session, "after_flush")
+def _remember_changed_nodes(session, flush_context):
+    from core import Node
+    # the session still shows the pre-flush state here, new nodes have their ids already
+    changed = [obj.id for obj in chain(session.new, session.dirty, session.deleted) if isinstance(obj, Node)]
+    remember_changed_nodes(session, changed)
+
+
+def remember_changed_nodes(session, node_ids):
+    """Invalidates the snapshots of `node_ids` when `session` commits. Must be called for changes to nodes that
+    bypass the ORM, like UPDATE statements executed by `session.execute`.
+    """
+    if node_ids:
+        session.info.setdefault(_CHANGED_NODE_IDS, set()).update(node_ids)
+
+
+def _remember_bulk_node_changes(update_context):
+    from core import Node
+    mapper = update_context.mapper
+    if mapper is not None and issubclass(mapper.class_, Node):
+        update_context.session.info[_BULK_NODE_CHANGES] = True
+
+
+event.listen(Session, "after_bulk_update", _remember_bulk_node_changes)
+event.listen(Session, "after_bulk_delete", _remember_bulk_node_changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_nodes(session):
+    changed = session.info.pop(_CHANGED_NODE_IDS, None)
+    bulk_changes = session.info.pop(_BULK_NODE_CHANGES, None)
+    cache = _snapshot_cache
+    if cache is None:
+        return
+    if bulk_changes:
+        cache.clear()
+    elif changed:
+        cache.invalidate_many(changed)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_uncommitted_nodes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_CHANGED_NODE_IDS, None)
+        session.info.pop(_BULK_NODE_CHANGES, None)
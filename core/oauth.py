@@ -4,10 +4,16 @@
     :license: GPL3, see COPYING for details
 """
 import logging
+from collections import OrderedDict
 import hashlib
+import hmac
+import itertools
 import random
+import threading
 import time
-from core import db
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from core import db, config, invalidation
 from core.database.postgres.user import OAuthUserCredentials
 
 q = db.query
@@ -16,56 +22,197 @@ logg = logging.getLogger(__name__)
 
 logg.info("imported core.oauth")
 
+#: credentials are read from the database again after this number of seconds,
+#: changes made by other processes are visible after that time
+CREDENTIALS_CACHE_TTL = 300
+CREDENTIALS_CACHE_SIZE = 10000
 
-def verify_request_signature(req_path, params):
-    # we generate the signature from the shared secret, the request path and all sorted parameters
-    # as described in the upload api documentation
-    _p = params.copy()
+# oauth_user -> (oauth_key, expiry time)
+_credentials_cache = {}
+
+#: session info key for the oauth users whose credentials are changed by the current transaction
+_CHANGED_OAUTH_USERS = "oauth_changed_users"
+
+# (oauth_user, signature) -> expiry time, in order of insertion
+_seen_signatures = OrderedDict()
+_seen_signatures_lock = threading.Lock()
+
+
+def invalidate_credentials_cache(oauth_user=None):
+    """Removes the cached key for `oauth_user` or all cached keys if no user is given"""
+    if oauth_user is None:
+        _credentials_cache.clear()
+    else:
+        _credentials_cache.pop(oauth_user, None)
+
+
+invalidation.register_handler("oauth_credentials", invalidate_credentials_cache)
+
+
+# Cached keys are invalidated after commit. Before, other threads and processes would read the old key again.
+
+def remember_changed_credentials(session, oauth_user):
+    """Invalidates the cached key of `oauth_user` in all processes when `session` commits.
+    Must be called for changes that bypass the ORM, like bulk updates.
+    """
+    session.info.setdefault(_CHANGED_OAUTH_USERS, set()).add(oauth_user)
+
+
+@event.listens_for(Session, "after_flush")
+def _remember_changed_credentials(session, flush_context):
+    # the session still shows the pre-flush state here
+    for obj in session.deleted:
+        if isinstance(obj, OAuthUserCredentials):
+            remember_changed_credentials(session, obj.oauth_user)
+
+    for obj in session.dirty:
+        if isinstance(obj, OAuthUserCredentials):
+            attrs = inspect(obj).attrs
+            if attrs.oauth_key.history.has_changes() or attrs.oauth_user.history.has_changes():
+                for oauth_user in attrs.oauth_user.history.sum():
+                    remember_changed_credentials(session, oauth_user)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_credentials(session):
+    for oauth_user in session.info.pop(_CHANGED_OAUTH_USERS, ()):
+        invalidate_credentials_cache(oauth_user)
+        invalidation.broadcast("oauth_credentials", oauth_user)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_uncommitted_credentials(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_CHANGED_OAUTH_USERS, None)
+
+
+def get_oauth_key(oauth_user):
+    """Returns the shared secret for `oauth_user` or None if the user is unknown.
+    Keys are cached, unknown users are not.
+    """
+    cached = _credentials_cache.get(oauth_user)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+
+    # oauth_user is the primary key, so there can be only one
+    oauth_key = q(OAuthUserCredentials.oauth_key).filter_by(oauth_user=oauth_user).scalar()
+    if oauth_key is not None:
+        if len(_credentials_cache) >= CREDENTIALS_CACHE_SIZE:
+            _credentials_cache.clear()
+        _credentials_cache[oauth_user] = (oauth_key, time.time() + CREDENTIALS_CACHE_TTL)
+    return oauth_key
 
+
+def _check_and_remember_signature(oauth_user, signature, timestamp):
+    """Replay protection: returns False if `timestamp` is outside of the allowed window or the
+    signature has been seen before in that window.
+    """
+    max_age = config.getint("oauth.max_request_age", 0)
+    if not max_age:
+        return True
+
+    now = time.time()
+    try:
+        timestamp = float(timestamp)
+    except (TypeError, ValueError):
+        logg.info("verify_request_signature going to return False: missing or invalid timestamp %r", timestamp)
+        return False
+
+    if abs(now - timestamp) > max_age:
+        logg.info("verify_request_signature going to return False: timestamp %r outside of allowed window", timestamp)
+        return False
+
+    key = (oauth_user, signature)
+    max_size = config.getint("oauth.replay_cache_size", 100000)
+
+    with _seen_signatures_lock:
+        # entries expire in insertion order, remove them from the front
+        while _seen_signatures:
+            oldest_key, expiry = next(iter(_seen_signatures.iteritems()))
+            if expiry > now and len(_seen_signatures) < max_size:
+                break
+            del _seen_signatures[oldest_key]
+
+        if key in _seen_signatures:
+            logg.info("verify_request_signature going to return False: replayed request for oauth_user %r", oauth_user)
+            return False
+
+        _seen_signatures[key] = now + 2 * max_age
+
+    # other server processes must reject the signature, too
+    invalidation.broadcast("oauth_signature", u"{} {} {}".format(now + 2 * max_age, signature, oauth_user))
+    return True
+
+
+@invalidation.register_handler("oauth_signature")
+def _remember_signature_from_other_process(arg):
+    expiry, signature, oauth_user = arg.split(" ", 2)
+    with _seen_signatures_lock:
+        _seen_signatures[(oauth_user, signature)] = float(expiry)
+
+
+def calculate_signature(oauth_key, req_path, params):
+    """Calculates the signature from the shared secret, the request path and all sorted parameters (without 'sign')
+    as described in the upload api documentation.
+    """
+    param_string = '&'.join('{}={}'.format(k, params[k]) for k in sorted(params) if k != 'sign')
+    return hashlib.md5(oauth_key + req_path + param_string).hexdigest()
+
+
+def verify_request_signature(req_path, params):
     fmsg = "verify_request_signature going to return False: "
-    if 'user' not in _p or 'sign' not in _p:
+    if 'user' not in params or 'sign' not in params:
         logg.info(fmsg + "'user' or 'sign' parameter missing in request")
         return False
 
-    oauth_user = _p.get('user')
-    oauth_user_credentials_count = q(OAuthUserCredentials).filter(OAuthUserCredentials.oauth_user == oauth_user).count()
-    if oauth_user_credentials_count < 1:
+    oauth_user = params['user']
+    oauth_key = get_oauth_key(oauth_user)
+    if oauth_key is None:
         logg.info(fmsg + "no oauth user credentials known for oauth_user %r", oauth_user)
         return False
-    if oauth_user_credentials_count > 1:
-        logg.info(fmsg + "multiple oauth user credentials stored for oauth_user %r", oauth_user)
+
+    signature = params['sign']
+    if isinstance(signature, unicode):
+        signature = signature.encode("utf8")
+
+    if not hmac.compare_digest(calculate_signature(oauth_key, req_path, params), signature):
         return False
-    oauth_user_credentials = q(OAuthUserCredentials).filter(OAuthUserCredentials.oauth_user == oauth_user).one()
-    workingString = oauth_user_credentials.oauth_key
 
-    #try:
-    #    workingString = ""
-    #    for n in [h for h in tree.getRoot('home').getChildren() if h.get('system.oauthuser') == params.get('user')]:
-    #        workingString = n.get('system.oauthkey')
-    #        break
-    #except:
-    #    return False
+    return _check_and_remember_signature(oauth_user, signature, params.get('timestamp'))
 
-    workingString += req_path
 
-    # remove signature form parameters before we calculate the test signature
-    signature = _p['sign']
-    del _p['sign']
+def benchmark_verification(oauth_user, requests=10000):
+    """Measures the cost of verify_request_signature with and without cached credentials.
+    Returns a dict with the average time per request in microseconds.
+    """
+    oauth_key = get_oauth_key(oauth_user)
+    if oauth_key is None:
+        raise ValueError("no oauth user credentials known for oauth_user {!r}".format(oauth_user))
 
-    keylist = sorted(_p.keys())
+    params = {"user": oauth_user, "format": "json", "limit": "100", "attrspec": "all"}
+    path = "/services/export/node/1/allchildren"
+    nonces = itertools.count()
 
-    isFirst = True
+    def run(n, before_request=None):
+        signed_params = []
+        for _ in range(n):
+            req_params = dict(params, timestamp=str(int(time.time())), nonce=str(next(nonces)))
+            req_params["sign"] = calculate_signature(oauth_key, path, req_params)
+            signed_params.append(req_params)
 
-    for oneKey in keylist:
-        oneValue = _p[oneKey]
-        if not isFirst:
-            workingString += '&'
-        else:
-            isFirst = False
-        workingString += '{}={}'.format(oneKey,
-                                        oneValue)
-    testSignature = hashlib.md5(workingString).hexdigest()
-    return (testSignature == signature)
+        start = time.time()
+        for req_params in signed_params:
+            if before_request is not None:
+                before_request()
+            if not verify_request_signature(path, req_params):
+                raise AssertionError("signature verification failed in benchmark")
+        return (time.time() - start) / n * 1e6
+
+    uncached_requests = max(1, requests // 10)
+    return {
+        "uncached_us": run(uncached_requests, lambda: invalidate_credentials_cache(oauth_user)),
+        "cached_us": run(requests),
+    }
 
 
 def get_oauth_key_for_user(user):
@@ -98,6 +245,7 @@ def generate_new_oauth_key_for_user(user):
     elif oauth_user_credentials_count == 1:
         oauth_user_credentials = s.query(OAuthUserCredentials).filter(OAuthUserCredentials.oauth_user == unicode(user_login_name)).filter(OAuthUserCredentials.user_id == user.id)
         oauth_user_credentials.update({'oauth_key': generated_key})
+        remember_changed_credentials(s, user_login_name)
         s.commit()
     else:
         pass  #raise exception? should not happen: unique constraint on column oauth_user
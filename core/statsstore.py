@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Storage for access statistics.
+
+    Accesses are aggregated by node, day, access type and country and stored in the month partitions of the
+    `access_stat` table (see core.database.postgres.stats). The statistics pages compute their numbers with
+    aggregation queries on that table instead of parsing a statistic file for each view.
+
+    Visitors are counted per node and day. Numbers of visitors for a collection are sums over its nodes,
+    so a visitor who accessed many nodes of a collection on the same day is counted for each node.
+"""
+from __future__ import absolute_import
+
+from collections import defaultdict
+import datetime
+import logging
+import os
+import xml.parsers.expat
+
+from sqlalchemy import sql
+
+from core import db, Node
+from core.database.postgres.node import t_noderelation
+from core.database.postgres.setting import Setting
+from core.database.postgres.stats import AccessStat, create_month_partition, month_bounds, month_partitions
+from lib.geoip.geoip import getFullCountyName
+from utils.date import format_date, make_date, now, parse_date
+
+
+logg = logging.getLogger(__name__)
+
+q = db.query
+
+EDIT = 1
+DOWNLOAD = 2
+FRONTEND = 3
+
+#: access type names used in statistic periods and file names
+ACCESS_TYPES = {
+    "edit": EDIT,
+    "download": DOWNLOAD,
+    "frontend": FRONTEND,
+}
+
+#: rows inserted with one statement
+INSERT_BATCH_SIZE = 5000
+
+CREATED_SETTING_KEY_TEMPLATE = u"stats.created.{:04d}-{:02d}"
+
+# schema-qualified table names for the textual statistics queries
+_ACCESS_STAT_TABLE = AccessStat.__table__.fullname
+_NODE_TABLE = Node.__table__.fullname
+_NODERELATION_TABLE = t_noderelation.fullname
+
+
+class _Counter(object):
+
+    __slots__ = ("hits", "hour_hits", "visitors", "hour_visitors")
+
+    def __init__(self):
+        self.hits = 0
+        self.hour_hits = [0] * 24
+        self.visitors = set()
+        self.hour_visitors = set()
+
+    def __getstate__(self):
+        return self.hits, self.hour_hits, self.visitors, self.hour_visitors
+
+    def __setstate__(self, state):
+        self.hits, self.hour_hits, self.visitors, self.hour_visitors = state
+
+
+class StatsAggregator(object):
+
+    """Counts accesses by (node, day, access type, country) in memory.
+    Aggregators filled by different processes can be combined with `merge`.
+    The result is written to the database with `replace_month_stats`.
+    """
+
+    def __init__(self):
+        self._counters = defaultdict(_Counter)
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, nid, day, hour, access_type, country, visitor):
+        """Counts one access.
+        :param day: datetime.date
+        :param hour: 0 - 23
+        :param access_type: EDIT, DOWNLOAD or FRONTEND
+        :param visitor: hashable that identifies the client, an IP address, for example
+        """
+        counter = self._counters[(nid, day, access_type, country or "")]
+        counter.hits += 1
+        counter.hour_hits[hour] += 1
+        counter.visitors.add(visitor)
+        counter.hour_visitors.add((hour, visitor))
+
+    def merge(self, other):
+        """Adds the counts of another StatsAggregator to this one"""
+        for key, other_counter in other._counters.iteritems():
+            counter = self._counters[key]
+            counter.hits += other_counter.hits
+            counter.hour_hits = [a + b for a, b in zip(counter.hour_hits, other_counter.hour_hits)]
+            counter.visitors.update(other_counter.visitors)
+            counter.hour_visitors.update(other_counter.hour_visitors)
+
+    def rows(self):
+        """Yields the aggregated values as dicts with the columns of the access_stat table"""
+        for (nid, day, access_type, country), counter in self._counters.iteritems():
+            hour_visitors = [0] * 24
+            for hour, _ in counter.hour_visitors:
+                hour_visitors[hour] += 1
+
+            yield {
+                "nid": nid,
+                "day": day,
+                "type": access_type,
+                "country": country,
+                "hits": counter.hits,
+                "visitors": len(counter.visitors),
+                "hour_hits": counter.hour_hits,
+                "hour_visitors": hour_visitors,
+            }
+
+
+def replace_month_stats(year, month, rows, nids=None, access_type=None, created=None, from_day=None):
+    """Replaces the statistics of a month with `rows`.
+    :param rows: iterable of dicts as returned by `StatsAggregator.rows`. Rows for other months are ignored.
+    :param nids: only replace statistics for these node ids, all nodes if None
+    :param access_type: only replace statistics for this access type, all types if None
+    :param from_day: only replace statistics for this day and the following days of the month, used by incremental
+        builds. Rows for earlier days are ignored.
+    :param created: datetime of the build shown on the statistics page, default: now
+    The caller must commit the session.
+    """
+    s = db.session
+    table = create_month_partition(s, year, month)
+    start, end = month_bounds(year, month)
+    if from_day is not None:
+        start = max(start, from_day)
+
+    delete = table.delete().where(table.c.day >= start)
+    if nids is not None:
+        delete = delete.where(sql.text("nid = ANY(:nids)").bindparams(nids=list(nids)))
+    if access_type is not None:
+        delete = delete.where(table.c.type == access_type)
+    s.execute(delete)
+
+    insert = table.insert()
+    batch = []
+    row_count = 0
+    for row in rows:
+        if not start <= row["day"] < end:
+            continue
+        batch.append(row)
+        if len(batch) == INSERT_BATCH_SIZE:
+            s.execute(insert, batch)
+            row_count += len(batch)
+            batch = []
+    if batch:
+        s.execute(insert, batch)
+        row_count += len(batch)
+
+    setting_key = CREATED_SETTING_KEY_TEMPLATE.format(year, month)
+    s.merge(Setting(key=setting_key, value=format_date(created or now(), "yyyy-mm-dd HH:MM:SS")))
+    logg.info("stored %s statistic rows for %04d-%02d", row_count, year, month)
+    return row_count
+
+
+def stats_periods():
+    """Returns the periods with statistics as list of "yyyy-mm" strings, newest first"""
+    return [u"{:04d}-{:02d}".format(year, month) for year, month in reversed(month_partitions(db.session))]
+
+
+def _parse_period(period):
+    year, month = period.split("-")
+    return int(year), int(month)
+
+
+class AccessStatistics(object):
+
+    """Statistics of a node and its children for one month and access type.
+    Used by the statistics views of the edit area, the values of `getProgress` are numbers.
+    """
+
+    def __init__(self, node, period, access_type):
+        """
+        :param period: "yyyy-mm" or None for empty statistics
+        :param access_type: "frontend", "download" or "edit"
+        """
+        self.node = node
+        self.period = period
+        self.type = access_type
+        self._names = {}
+        if period:
+            self.period_year, self.period_month = _parse_period(period)
+        else:
+            self.period_year = self.period_month = None
+
+    def _query(self, select_clause, group_by, from_clause=_ACCESS_STAT_TABLE + u" a", order_by=None):
+        if self.period is None:
+            return []
+        start, end = month_bounds(self.period_year, self.period_month)
+        # the day range is inlined as constants, so the planner can skip the partitions of other months
+        stmt = (u"SELECT " + select_clause + u" FROM " + from_clause +
+                u" WHERE a.day >= DATE '{}' AND a.day < DATE '{}' AND a.type = :type".format(start, end) +
+                u" AND a.nid IN (SELECT cid FROM " + _NODERELATION_TABLE + u" WHERE nid = :nid UNION SELECT :nid)")
+        stmt += u" GROUP BY " + group_by
+        if order_by:
+            stmt += u" ORDER BY " + order_by
+        return db.session.execute(sql.text(stmt), {"nid": self.node.id, "type": ACCESS_TYPES[self.type]}).fetchall()
+
+    def getPeriodYear(self):
+        return self.period_year
+
+    def getPeriodMonth(self):
+        return self.period_month
+
+    def getCreationDate(self):
+        if self.period is None:
+            return None
+        setting = q(Setting).get(CREATED_SETTING_KEY_TEMPLATE.format(self.period_year, self.period_month))
+        if setting is None:
+            return None
+        return parse_date(setting.value, "yyyy-mm-dd HH:MM:SS")
+
+    def getName(self, id):
+        if id not in self._names:
+            node = q(Node).get(id)
+            self._names[id] = node.name if node is not None else id
+        return self._names[id]
+
+    def getIDs(self):
+        """Returns a list of (node id, accesses) tuples, most accessed first"""
+        rows = self._query(u"a.nid, sum(a.hits)::integer, n.name",
+                           group_by=u"a.nid, n.name",
+                           from_clause=u"{} a LEFT JOIN {} n ON n.id = a.nid".format(_ACCESS_STAT_TABLE, _NODE_TABLE),
+                           order_by=u"2 DESC, a.nid")
+        if not rows:
+            return [(0, 0)]
+
+        for nid, _, name in rows:
+            self._names[nid] = name if name is not None else nid
+        return [(nid, hits) for nid, hits, _ in rows]
+
+    def getProgress(self, type=""):
+        """Returns a dict that maps days of the month (type ""), weekdays 1-7 ("day"), hours 1-24 ("time")
+        or country codes ("country") to dicts with the number of accesses ("items"), accessed nodes ("different")
+        and visitors ("visitors"). Key 0 holds the maximum of each value ("max", "max_p", "max_u").
+        """
+        if type == "time":
+            rows = self._query(u"h, sum(a.hour_hits[h])::integer, count(DISTINCT CASE WHEN a.hour_hits[h] > 0 THEN a.nid END), "
+                               u"sum(a.hour_visitors[h])::integer",
+                               group_by=u"h",
+                               from_clause=_ACCESS_STAT_TABLE + u" a, generate_series(1, 24) h")
+        else:
+            if type == "":
+                key_expr = u"extract(day FROM a.day)::integer"
+            elif type == "day":
+                key_expr = u"extract(isodow FROM a.day)::integer"
+            elif type == "country":
+                key_expr = u"a.country"
+            else:
+                raise ValueError("unknown progress type " + type)
+
+            rows = self._query(key_expr + u", sum(a.hits)::integer, count(DISTINCT a.nid), sum(a.visitors)::integer",
+                               group_by=u"1")
+
+        items = {}
+        if rows:
+            if type == "":
+                keys = range(1, make_date(self.period_year, self.period_month, 1).maxMonthDay() + 1)
+            elif type == "day":
+                keys = range(1, 8)
+            elif type == "time":
+                keys = range(1, 25)
+            else:
+                keys = []
+
+            for key in keys:
+                items[key] = {"items": 0, "different": 0, "visitors": 0}
+
+            for key, hits, different, visitors in rows:
+                if type == "country" and not key:
+                    key = "n.a."
+                items[key] = {"items": hits or 0, "different": different, "visitors": visitors or 0}
+
+        values = items.values()
+        items[0] = {"items": 0,
+                    "max": max([v["items"] for v in values] or [0]),
+                    "max_p": max([v["different"] for v in values] or [0]),
+                    "max_u": max([v["visitors"] for v in values] or [0])}
+        return items
+
+    def getCountryName(self, id):
+        return getFullCountyName(id)
+
+    def getWeekDay(self, day):
+        dt = make_date(self.period_year, self.period_month, day)
+        return dt.weekday()
+
+
+def _statistic_file_info(filename):
+    """Returns (period, access type) for a file name stat_<id>_<yyyy-mm>_<type>.xml"""
+    parts = os.path.splitext(os.path.basename(filename))[0].split("_")
+    return parts[2], parts[3]
+
+
+def _read_statistic_file(path, access_type, aggregator, skip_nids):
+    """Adds the accesses from a statistic XML file to `aggregator`, ignoring nodes in `skip_nids`.
+    :returns: (set of node ids in the file, creation date of the file)
+    """
+    state = {"nid": None, "created": None}
+    nids = set()
+
+    def start_element(name, attrs):
+        if name == "access":
+            nid = state["nid"]
+            if nid is None or nid in skip_nids:
+                return
+            date = attrs.get("date", "")
+            time = attrs.get("time", "")
+            day = datetime.date(int(date[0:4]), int(date[5:7]), int(date[8:10]))
+            aggregator.add(nid, day, int(time[0:2] or 0), access_type, attrs.get("country", ""), attrs.get("visitor_number"))
+        elif name == "node":
+            state["nid"] = int(attrs["id"]) if "id" in attrs else None
+            if state["nid"] is not None:
+                nids.add(state["nid"])
+        elif name == "nodelist" and "created" in attrs:
+            state["created"] = parse_date(attrs["created"], "yyyy-mm-dd HH:MM:SS")
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    with open(path, "rb") as f:
+        parser.ParseFile(f)
+    return nids, state["created"]
+
+
+def migrate_xml_statistics(remove_files=False):
+    """Imports all statistic files (stat_<id>_<yyyy-mm>_<type>.xml) of all nodes into the access_stat table.
+    Statistics of a collection include those of its subcollections, so the accesses of a node are only taken from the
+    first file of a period that contains them.
+    :param remove_files: delete the statistic files after the import
+    """
+    from core.database.postgres.file import File
+    files_by_period = defaultdict(list)
+    statistic_files = q(File).filter_by(filetype=u"statistic").all()
+    for statfile in statistic_files:
+        try:
+            period, access_type = _statistic_file_info(statfile.path)
+        except IndexError:
+            logg.warn("ignoring statistic file with unexpected name %s", statfile.path)
+            continue
+        if access_type not in ACCESS_TYPES:
+            logg.warn("ignoring statistic file with unknown type %s", statfile.path)
+            continue
+        files_by_period[(period, access_type)].append(statfile)
+
+    for (period, access_type), statfiles in sorted(files_by_period.iteritems()):
+        year, month = _parse_period(period)
+        aggregator = StatsAggregator()
+        seen_nids = set()
+        created = None
+        for statfile in statfiles:
+            if not statfile.exists:
+                logg.warn("statistic file %s is missing, ignored", statfile.path)
+                continue
+            nids, file_created = _read_statistic_file(statfile.abspath, ACCESS_TYPES[access_type], aggregator, seen_nids)
+            seen_nids.update(nids)
+            if file_created is not None and (created is None or created < file_created):
+                created = file_created
+
+        replace_month_stats(year, month, aggregator.rows(), access_type=ACCESS_TYPES[access_type], created=created)
+        db.session.commit()
+        logg.info("migrated %s statistic files for %s %s", len(statfiles), period, access_type)
+
+    if remove_files:
+        for statfile in statistic_files:
+            statfile.unlink_after_deletion = True
+            db.session.delete(statfile)
+        db.session.commit()
+        logg.info("removed %s statistic files", len(statistic_files))
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Deterministic generator for synthetic repositories, used by the benchmark suite in `benchmarks/`.
+
+    A generated repository is a collection below the collections root with `depth` levels of directories,
+    each container has `fanout` directory children. The content nodes are distributed over the directories of the
+    last level. Types and schemas of the content nodes are chosen from a weighted `schema_mix`, attribute values
+    are generated according to the metafield types of the schema. Words follow a Zipf distribution, so there are
+    frequent and rare search terms like in a real repository.
+
+    The collection is readable by everybody, a fraction of the leaf directories (`restricted_ratio`) is only readable
+    by members of the group `synthetic-restricted`. The same parameters always generate the same repository.
+"""
+from __future__ import absolute_import
+
+from bisect import bisect_left
+import datetime
+import logging
+import random
+import time
+
+from sqlalchemy import text
+
+from core import db, Node, UserGroup, AccessRulesetToRule
+from core.database.postgres.node import t_nodemapping
+from core.permission import get_or_add_everybody_rule, get_or_add_access_rule
+
+
+logg = logging.getLogger(__name__)
+q = db.query
+
+#: (node type, schema, weight), the schemas are loaded by `init_database_values`
+DEFAULT_SCHEMA_MIX = ((u"document", u"document", 9), (u"image", u"image", 1))
+RESTRICTED_GROUP_NAME = u"synthetic-restricted"
+
+_SYLLABLES = [u"ka", u"lo", u"mi", u"ne", u"ru", u"ta", u"shi", u"ven", u"dor", u"pel", u"gra", u"fu", u"zen", u"bau",
+              u"qui", u"sto", u"ar", u"en", u"il", u"um"]
+_NAMES = [u"Müller", u"Schmidt", u"Schneider", u"Fischer", u"Weber", u"Meyer", u"Wagner", u"Becker", u"Smith",
+          u"Johnson", u"Brown", u"García", u"Nowak", u"Rossi", u"Dubois", u"Tanaka"]
+_FIRST_NAMES = [u"Anna", u"Hans", u"Jürgen", u"Maria", u"John", u"Jane", u"Paul", u"Eva", u"Luca", u"Yuki"]
+
+
+class SyntheticRepositoryGenerator(object):
+
+    """Generates a synthetic repository with (approximately) `nodes` nodes.
+
+    :param depth: number of directory levels below the collection
+    :param fanout: number of directory children of each container
+    :param schema_mix: sequence of (node type, schema, weight) for content nodes
+    :param restricted_ratio: fraction of leaf directories that are not readable by guests
+    :param fulltext_words: average number of fulltext words of documents, fulltext sizes are exponentially distributed
+    :param vocabulary_size: number of distinct words in titles, abstracts and fulltexts
+    """
+
+    def __init__(self, nodes=10000, depth=3, fanout=10, schema_mix=DEFAULT_SCHEMA_MIX, restricted_ratio=0.1,
+                 fulltext_words=300, vocabulary_size=5000, seed=0, batch_size=2000):
+        self.nodes = nodes
+        self.depth = depth
+        self.fanout = fanout
+        self.schema_mix = schema_mix
+        self.restricted_ratio = restricted_ratio
+        self.fulltext_words = fulltext_words
+        self.seed = seed
+        self.batch_size = batch_size
+        self.rand = random.Random(seed)
+        self.vocabulary = self._make_vocabulary(vocabulary_size)
+        self._cumulative_word_weights = []
+        total = 0.
+        for rank in xrange(1, len(self.vocabulary) + 1):
+            total += 1. / rank
+            self._cumulative_word_weights.append(total)
+        # fulltexts are composed of pregenerated sentences, sampling every word would be too slow for big repositories
+        self._sentences = [self.words(self.rand.randint(5, 25)) for _ in xrange(2000)]
+
+    @property
+    def collection_name(self):
+        return u"synthetic-{}-{}-{}-{}".format(self.nodes, self.depth, self.fanout, self.seed)
+
+    def _make_vocabulary(self, size):
+        words = set()
+        while len(words) < size:
+            words.add(u"".join(self.rand.choice(_SYLLABLES) for _ in xrange(self.rand.randint(2, 4))))
+        # sort before shuffling, set order is not deterministic
+        words = sorted(words)
+        self.rand.shuffle(words)
+        return words
+
+    def word(self):
+        """Returns a random word, the word with rank n has the probability 1/n (Zipf)"""
+        r = self.rand.random() * self._cumulative_word_weights[-1]
+        return self.vocabulary[bisect_left(self._cumulative_word_weights, r)]
+
+    def words(self, count):
+        return u" ".join(self.word() for _ in xrange(count))
+
+    def frequent_words(self, count=3):
+        """Returns the most frequent words, these appear in many nodes"""
+        return self.vocabulary[:count]
+
+    def rare_words(self, count=3):
+        return self.vocabulary[-count:]
+
+    def _person(self):
+        return u"{}, {}".format(self.rand.choice(_NAMES), self.rand.choice(_FIRST_NAMES))
+
+    def _fulltext(self):
+        word_count = int(self.rand.expovariate(1. / self.fulltext_words)) if self.fulltext_words else 0
+        parts = []
+        while word_count > 0:
+            sentence = self.rand.choice(self._sentences)
+            parts.append(sentence)
+            word_count -= sentence.count(u" ") + 1
+        return u". ".join(parts)
+
+    def _attribute_value(self, name, fieldtype):
+        if fieldtype == u"date" or name.endswith(u"year") or name.endswith(u"time"):
+            year = self.rand.randint(1950, 2016)
+            return u"{}-{:02d}-{:02d}T00:00:00".format(year, self.rand.randint(1, 12), self.rand.randint(1, 28))
+        if fieldtype in (u"ilist", u"list", u"mlist") or name in (u"author", u"editor", u"source"):
+            return u";".join(self._person() for _ in xrange(self.rand.randint(1, 3)))
+        if fieldtype in (u"memo", u"htmlmemo") or name in (u"abstract", u"description"):
+            return self.words(self.rand.randint(30, 120))
+        return self.words(self.rand.randint(2, 10)).capitalize()
+
+    def _schema_fields(self):
+        """Returns {schema: [(attribute name, field type)]} for the schemas of the schema mix"""
+        from schema.schema import Metadatatype
+        fields = {}
+        for _, schema, _ in self.schema_mix:
+            mdt = q(Metadatatype).filter_by(name=schema).scalar()
+            if mdt is None:
+                raise ValueError(u"metadatatype '{}' from the schema mix is missing".format(schema))
+            fields[schema] = sorted((f.name, f.get(u"type")) for f in mdt.metafields if f.name != u"nodename")
+        return fields
+
+    def _choose_schema(self):
+        total = sum(w for _, _, w in self.schema_mix)
+        r = self.rand.random() * total
+        for nodetype, schema, weight in self.schema_mix:
+            r -= weight
+            if r < 0:
+                break
+        return nodetype, schema
+
+    def find_collection(self):
+        from contenttypes import Collection
+        return q(Collection).filter_by(name=self.collection_name).scalar()
+
+    def _restricted_group(self):
+        group = q(UserGroup).filter_by(name=RESTRICTED_GROUP_NAME).scalar()
+        if group is None:
+            group = UserGroup(name=RESTRICTED_GROUP_NAME, description=u"members can read restricted synthetic nodes")
+            db.session.add(group)
+            db.session.flush()
+        return group
+
+    def _make_containers(self):
+        """Creates the collection and the directory levels, returns the collection and the IDs of the leaf directories"""
+        from contenttypes import Collection, Collections, Directory
+        s = db.session
+        collection = Collection(self.collection_name, attrs={u"label": self.collection_name})
+        q(Collections).one().container_children.append(collection)
+        s.flush()
+        everybody_rule = get_or_add_everybody_rule()
+        for ruletype in (u"read", u"data"):
+            collection.get_or_add_special_access_ruleset(ruletype).rule_assocs.append(AccessRulesetToRule(rule=everybody_rule))
+
+        level = [collection]
+        for depth in xrange(self.depth):
+            next_level = []
+            for parent in level:
+                for i in xrange(self.fanout):
+                    directory = Directory(u"{} {}".format(self.words(2), i), attrs={u"label": self.words(2)})
+                    parent.container_children.append(directory)
+                    next_level.append(directory)
+            s.flush()
+            level = next_level
+
+        restricted_rule = get_or_add_access_rule(group_ids=[self._restricted_group().id])
+        restricted_count = 0
+        for directory in level:
+            if self.depth and self.rand.random() < self.restricted_ratio:
+                ruleset = directory.get_or_add_special_access_ruleset(u"read")
+                ruleset.rule_assocs.append(AccessRulesetToRule(rule=restricted_rule))
+                restricted_count += 1
+
+        s.commit()
+        logg.info("created collection %s with %s directories, %s of %s leaf directories are restricted",
+                  collection.id, sum(self.fanout ** d for d in xrange(1, self.depth + 1)), restricted_count, len(level))
+        return collection, [d.id for d in level]
+
+    def _allocate_ids(self, count):
+        stmt = text("SELECT nextval('node_id_seq') FROM generate_series(1, :count)")
+        return [row[0] for row in db.session.execute(stmt, {"count": count})]
+
+    def _insert_content_batch(self, rows, mappings):
+        s = db.session
+        s.execute(Node.__table__.insert(), rows)
+        # the insert trigger of the nodemapping view maintains noderelation and the inherited access rules
+        s.execute(t_nodemapping.insert(), mappings)
+        s.commit()
+
+    def run(self):
+        """Generates the repository and returns its collection"""
+        if self.find_collection() is not None:
+            raise ValueError(u"collection '{}' already exists".format(self.collection_name))
+
+        started = time.time()
+        schema_fields = self._schema_fields()
+        collection, leaf_ids = self._make_containers()
+        content_count = max(self.nodes - sum(self.fanout ** d for d in xrange(0, self.depth + 1)), 0)
+        updatetime = datetime.datetime(2016, 1, 1)
+
+        created = 0
+        while created < content_count:
+            batch_size = min(self.batch_size, content_count - created)
+            rows = []
+            mappings = []
+            for node_id in self._allocate_ids(batch_size):
+                nodetype, schema = self._choose_schema()
+                attrs = {name: self._attribute_value(name, fieldtype) for name, fieldtype in schema_fields[schema]}
+                attrs[u"updatetime"] = (updatetime + datetime.timedelta(minutes=created)).isoformat()
+                rows.append({
+                    "id": node_id,
+                    "type": nodetype,
+                    "schema": schema,
+                    "name": attrs.get(u"title") or self.words(3),
+                    "orderpos": created,
+                    "attrs": attrs,
+                    "system_attrs": {},
+                    "fulltext": self._fulltext() if nodetype == u"document" else None,
+                })
+                mappings.append({"nid": leaf_ids[created % len(leaf_ids)], "cid": node_id})
+                created += 1
+
+            self._insert_content_batch(rows, mappings)
+            logg.info("synthetic repository: %s of %s content nodes created", created, content_count)
+
+        logg.info("generated synthetic repository %s in %.1fs", self.collection_name, time.time() - started)
+        return self.find_collection()
+
+    def get_or_generate(self):
+        collection = self.find_collection()
+        if collection is None:
+            collection = self.run()
+        return collection
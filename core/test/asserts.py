@@ -3,6 +3,7 @@
     :copyright: (c) 2014 by the mediaTUM authors
     :license: GPL3, see COPYING for details
 """
+from contextlib import contextmanager
 import warnings
 
 
@@ -39,3 +40,17 @@ def assert_sorted(seq, cmp=None, key=None, reverse=False):
         assert seq == sorted_seq, "got key seq {}, expected {}".format([key(e) for e in seq], [key(e) for e in sorted_seq])
     else:
         assert seq == sorted_seq
+
+
+@contextmanager
+def assert_max_queries(max_count):
+    """Fails if the block executes more than `max_count` database statements.
+    Usage: `with assert_max_queries(3): ...`
+    """
+    from core.database.postgres.querytracking import track_queries
+    with track_queries("assert_max_queries") as tracker:
+        yield tracker
+    if tracker.count > max_count:
+        most_frequent = sorted(tracker.fingerprints.items(), key=lambda t: t[1].count, reverse=True)[:5]
+        raise AssertionError("{} statements executed, expected at most {}. Most frequent:\n{}".format(
+            tracker.count, max_count, "\n".join("{} x {}".format(stats.count, fp) for fp, stats in most_frequent)))
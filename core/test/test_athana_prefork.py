@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import os
+
+from pytest import fixture
+
+from core import athana
+import core.athana_prefork
+
+
+class FakeServer(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def install_handler(self, handler):
+        pass
+
+
+@fixture
+def served(monkeypatch):
+    """Records the arguments of _serve and the supervisor instead of starting a server"""
+    calls = {}
+
+    def serve(handler, servers, max_requests=0, max_memory_mb=0, graceful_timeout=30):
+        calls["limits"] = (max_requests, max_memory_mb)
+
+    class FakeSupervisor(object):
+
+        def __init__(self, workers, serve, graceful_timeout, after_fork_handlers):
+            self.serve = serve
+
+        def run(self):
+            self.serve(0)
+
+    monkeypatch.setattr(athana, "http_server", FakeServer)
+    monkeypatch.setattr(athana, "_serve", serve)
+    monkeypatch.setattr(athana, "ftphandlers", [])
+    monkeypatch.setattr(athana, "make_session_store", lambda shared: None)
+    monkeypatch.setattr(athana.signal, "signal", lambda *args: None)
+    monkeypatch.setattr(core.athana_prefork, "PreforkSupervisor", FakeSupervisor)
+    return calls
+
+
+def test_single_process_ignores_worker_limits(served):
+    athana.run(workers=0, max_requests=10, max_memory_mb=100)
+    assert served["limits"] == (0, 0)
+
+
+def test_prefork_uses_worker_limits(served):
+    athana.run(workers=2, max_requests=10, max_memory_mb=100)
+    assert served["limits"] == (10, 100)
+
+
+def test_session_ids_differ_after_fork():
+    handler = athana.AthanaHandler(athana.MemorySessionStore())
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_fd, handler.create_session_id())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    os.close(write_fd)
+    child_session_id = os.read(read_fd, 100)
+    os.close(read_fd)
+    session_id = handler.create_session_id()
+    assert athana.SESSION_PATTERN2.match(session_id)
+    assert session_id != child_session_id
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import threading
+
+from pytest import yield_fixture
+
+from core.athana_profiler import SamplingProfiler, handler_name
+
+
+@yield_fixture
+def profiler(tmpdir):
+    # samples are taken explicitly by the tests
+    profiler = SamplingProfiler(interval=3600, output_dir=str(tmpdir))
+    profiler.start()
+    yield profiler
+    profiler.stop()
+
+
+def _busy_handler(started, stop):
+    started.set()
+    while not stop.is_set():
+        sum(xrange(100))
+
+
+def test_handler_name():
+    assert handler_name(test_handler_name) == "core.test.test_athana_profiler.test_handler_name"
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = SamplingProfiler()
+    token = profiler.begin_request("handler", "/")
+    profiler.end_request(token)
+    assert token is None
+    assert profiler.handler_stats() == []
+
+
+def test_unsampled_request_timed(profiler):
+    profiler.end_request(profiler.begin_request("handler", "/node"))
+    [(handler, stats)] = profiler.handler_stats()
+    assert handler == "handler"
+    assert stats.count == 1
+    assert stats.samples == 0
+
+
+def test_sampled_request(profiler):
+    profiler.url_pattern = "^/export"
+    started = threading.Event()
+    stop = threading.Event()
+
+    def worker():
+        token = profiler.begin_request("export", "/export/node/1")
+        _busy_handler(started, stop)
+        profiler.end_request(token)
+
+    t = threading.Thread(target=worker)
+    t.start()
+    started.wait()
+    for _ in xrange(5):
+        profiler.sample()
+    stop.set()
+    t.join()
+
+    [(handler, stats)] = profiler.handler_stats()
+    assert stats.samples == 5
+    stack, count = profiler.top_stacks("export")[0]
+    assert "_busy_handler" in stack
+    lines = open(profiler.write_collapsed()).readlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == 5
+    assert all(line.startswith("export;") for line in lines)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import os
+
+from pytest import fixture, raises
+
+from core.athana_sessions import Session, MemorySessionStore, SqliteSessionStore
+
+
+@fixture(params=["memory", "sqlite"])
+def make_store(request, tmpdir):
+    def _make_store(**kwargs):
+        if request.param == "memory":
+            return MemorySessionStore(**kwargs)
+        return SqliteSessionStore(str(tmpdir.join("sessions.sqlite")), **kwargs)
+    return _make_store
+
+
+def test_empty_session_not_stored(make_store):
+    store = make_store()
+    store.save(Session("a"))
+    assert store.load("a") is None
+    assert len(store) == 0
+
+
+def test_session_stored(make_store):
+    store = make_store()
+    session = Session("a")
+    session["user_id"] = 1
+    store.save(session)
+    loaded = store.load("a")
+    assert loaded["user_id"] == 1
+    loaded["unfolded"] = {"1": 1}
+    store.save(loaded)
+    loaded = store.load("a")
+    loaded["unfolded"]["2"] = 1
+    store.save(loaded)
+    assert store.load("a")["unfolded"] == {"1": 1, "2": 1}
+    assert store.stats()["created"] == 1
+
+
+def test_expired_sessions(make_store):
+    store = make_store(ttl=-1)
+    session = Session("a")
+    session["user_id"] = 1
+    store.save(session)
+    assert store.load("a") is None
+    store.sweep()
+    assert len(store) == 0
+
+
+def test_least_recently_used_dropped(make_store):
+    store = make_store(max_count=2)
+    for sessionid in "abc":
+        session = Session(sessionid)
+        session["x"] = sessionid
+        store.save(session)
+    store.sweep()
+    assert len(store) == 2
+    assert store.load("a") is None
+    assert store.load("c")["x"] == "c"
+
+
+def test_sqlite_session_file_is_private(tmpdir):
+    filename = str(tmpdir.join("sessions", "sessions.sqlite"))
+    SqliteSessionStore(filename)
+    assert os.stat(filename).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.dirname(filename)).st_mode & 0o777 == 0o700
+
+
+def test_sqlite_session_file_accessible_by_others(tmpdir):
+    filename = str(tmpdir.join("sessions.sqlite"))
+    SqliteSessionStore(filename)
+    os.chmod(filename, 0o666)
+    with raises(IOError):
+        SqliteSessionStore(filename)
+
+
+def test_sqlite_session_stored_as_json(tmpdir):
+    store = SqliteSessionStore(str(tmpdir.join("sessions.sqlite")))
+    session = Session("a")
+    session["nodelist"] = [1, 2]
+    store.save(session)
+    data = store._connection().execute("SELECT data FROM session WHERE id='a'").fetchone()[0]
+    assert data == '{"nodelist":[1,2]}'
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+from StringIO import StringIO
+import os
+import sys
+import urllib
+from wsgiref.util import FileWrapper, setup_testing_defaults
+
+from pytest import fixture
+
+from core import athana, config
+from core.athana_sessions import MemorySessionStore
+from core.athana_wsgi import WSGIApplication
+
+
+uploaded_tempfiles = []
+
+
+def echo_params(req):
+    req.write(u"{}|{}".format(req.params.get("a", ""), req.form.get("b", "")))
+
+
+def store_in_session(req):
+    req.session["value"] = req.args["value"]
+
+
+def read_from_session(req):
+    req.write(req.session.get("value", "missing"))
+
+
+def upload(req):
+    uploaded = req.files["file"]
+    uploaded_tempfiles.append(uploaded.tempname)
+    with open(uploaded.tempname) as f:
+        req.write(u"{}:{}".format(uploaded.filename, f.read()))
+
+
+def send_this_file(req):
+    req.sendFile(__file__.replace(".pyc", ".py"), "text/plain")
+
+
+def fail(req):
+    raise Exception("handler failed")
+
+
+@fixture
+def wsgi_app(monkeypatch):
+    context = athana.WebContext("/wsgitest")
+    webfile = context.addFile("test_athana_wsgi", sys.modules[__name__])
+    for func in (echo_params, store_in_session, read_from_session, upload, send_this_file, fail):
+        webfile.addHandler(func).addPattern("/" + func.__name__)
+    monkeypatch.setattr(athana, "contexts", [context])
+    return WSGIApplication(athana.AthanaHandler(MemorySessionStore()))
+
+
+def call(app, path, query="", method="GET", body="", content_type="", cookie=None, file_wrapper=None,
+         content_length=None):
+    environ = {"REQUEST_METHOD": method, "PATH_INFO": path, "QUERY_STRING": query, "wsgi.input": StringIO(body)}
+    if body:
+        environ["CONTENT_LENGTH"] = str(content_length or len(body))
+        environ["CONTENT_TYPE"] = content_type
+    if cookie:
+        environ["HTTP_COOKIE"] = cookie
+    setup_testing_defaults(environ)
+    environ.pop("wsgi.file_wrapper", None)
+    if file_wrapper is not None:
+        environ["wsgi.file_wrapper"] = file_wrapper
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = status
+        response["headers"] = headers
+
+    body = app(environ, start_response)
+    response["body"] = "".join(body)
+    response["app_iter"] = body
+    return response
+
+
+def test_get_params(wsgi_app):
+    response = call(wsgi_app, "/wsgitest/echo_params", "a=%C3%A4")
+    assert response["status"] == "200 OK"
+    assert response["body"] == u"ä|".encode("utf8")
+
+
+def test_post_form(wsgi_app):
+    response = call(wsgi_app, "/wsgitest/echo_params", "a=1", "POST", urllib.urlencode({"b": "2"}),
+                    "application/x-www-form-urlencoded")
+    assert response["body"] == "1|2"
+
+
+def test_multipart_upload(wsgi_app):
+    body = ("--xyz\r\n"
+            'Content-Disposition: form-data; name="file"; filename="test.txt"\r\n'
+            "Content-Type: text/plain\r\n\r\n"
+            "uploaded content\r\n"
+            "--xyz--\r\n")
+    response = call(wsgi_app, "/wsgitest/upload", method="POST", body=body, content_type="multipart/form-data; boundary=xyz")
+    assert response["body"] == "test.txt:uploaded content"
+    # tempfiles are removed when the request is done
+    assert not os.path.exists(uploaded_tempfiles[-1])
+
+
+def test_incomplete_body(wsgi_app):
+    body = urllib.urlencode({"b": "2"})
+    response = call(wsgi_app, "/wsgitest/echo_params", method="POST", body=body,
+                    content_type="application/x-www-form-urlencoded", content_length=len(body) + 10)
+    assert response["status"].startswith("400")
+
+
+def test_session(wsgi_app):
+    response = call(wsgi_app, "/wsgitest/store_in_session", "value=stored")
+    cookies = [v for k, v in response["headers"] if k == "Set-Cookie"]
+    assert len(cookies) == 1
+    session_cookie = cookies[0].split(";")[0]
+    assert session_cookie.startswith("PSESSION=")
+    response = call(wsgi_app, "/wsgitest/read_from_session", cookie=session_cookie)
+    assert response["body"] == "stored"
+    response = call(wsgi_app, "/wsgitest/read_from_session")
+    assert response["body"] == "missing"
+
+
+def test_send_file_with_file_wrapper(wsgi_app):
+    response = call(wsgi_app, "/wsgitest/send_this_file", file_wrapper=FileWrapper)
+    assert isinstance(response["app_iter"], FileWrapper)
+    assert "def send_this_file" in response["body"]
+    headers = dict(response["headers"])
+    assert headers["Content-Type"] == "text/plain"
+    assert int(headers["Content-Length"]) == len(response["body"])
+
+
+def test_send_file_without_file_wrapper(wsgi_app):
+    response = call(wsgi_app, "/wsgitest/send_this_file")
+    assert "def send_this_file" in response["body"]
+
+
+def test_no_hop_by_hop_headers(wsgi_app):
+    response = call(wsgi_app, "/wsgitest/echo_params")
+    names = [k.lower() for k, v in response["headers"]]
+    assert "connection" not in names
+    assert "transfer-encoding" not in names
+    assert all(isinstance(v, str) for k, v in response["headers"])
+
+
+def test_not_found(wsgi_app):
+    assert call(wsgi_app, "/other/echo_params")["status"].startswith("404")
+    assert call(wsgi_app, "/wsgitest/unknown")["status"].startswith("404")
+
+
+def test_handler_error(wsgi_app, monkeypatch):
+    # don't use the error page which needs the database
+    monkeypatch.setitem(config.settings, "host.type", "testing")
+    assert call(wsgi_app, "/wsgitest/fail")["status"].startswith("500")
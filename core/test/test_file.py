@@ -3,6 +3,7 @@
     :copyright: (c) 2014 by the mediaTUM authors
     :license: GPL3, see COPYING for details
 """
+import hashlib
 import os
 
 from pytest import raises, fixture
@@ -40,6 +41,20 @@ def test_size(some_file_real):
     assert some_file_real.size == 4
 
 
+def test_hash(some_file_real):
+    assert some_file_real.hash == hashlib.md5("test").hexdigest()
+    assert some_file_real.content_hash == hashlib.sha256("test").hexdigest()
+
+
+def test_content_changed(some_file_real):
+    some_file_real.content_changed()
+    with some_file_real.open("w") as wf:
+        wf.write("changed")
+    some_file_real.content_changed()
+    assert some_file_real.sha256 == hashlib.sha256("changed").hexdigest()
+    assert some_file_real.size == 7
+
+
 def test_base_name(some_file_in_subdir):
     assert some_file_in_subdir.base_name == "filename"
 
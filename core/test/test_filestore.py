@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import hashlib
+import os
+from StringIO import StringIO
+
+from pytest import fixture
+
+import core.config
+from core import filestore
+
+
+CONTENT = "mediaTUM" * 1000
+CONTENT_SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+@fixture
+def datadir(tmpdir, monkeypatch):
+    monkeypatch.setattr(core.config, "settings", {"paths.datadir": str(tmpdir),
+                                                  "paths.content_addressed_storage": "true"})
+    return tmpdir
+
+
+def _write(datadir, name, content=CONTENT):
+    filepath = datadir.join(name)
+    filepath.write(content)
+    return str(filepath)
+
+
+def test_copy_and_hash(tmpdir, monkeypatch):
+    monkeypatch.setattr(filestore, "HASH_BLOCK_SIZE", 100)
+    dest = str(tmpdir.join("copy"))
+    assert filestore.copy_and_hash(StringIO(CONTENT), dest) == (CONTENT_SHA256, len(CONTENT))
+    with open(dest) as f:
+        assert f.read() == CONTENT
+
+
+def test_ingest_deduplicates(datadir):
+    first = _write(datadir, "first.txt")
+    second = _write(datadir, "second.txt")
+
+    assert filestore.ingest(first) == (CONTENT_SHA256, len(CONTENT))
+    assert filestore.ingest(second) == (CONTENT_SHA256, len(CONTENT))
+
+    blob = filestore.blob_path(CONTENT_SHA256)
+    assert os.path.samefile(first, blob)
+    assert os.path.samefile(second, blob)
+    assert os.stat(blob).st_nlink == 3
+
+
+def test_ingest_disabled(datadir, monkeypatch):
+    monkeypatch.setitem(core.config.settings, "paths.content_addressed_storage", "false")
+    filepath = _write(datadir, "file.txt")
+    filestore.ingest(filepath)
+    assert not os.path.exists(filestore.blob_path(CONTENT_SHA256))
+
+
+def test_release_blob(datadir):
+    first = _write(datadir, "first.txt")
+    second = _write(datadir, "second.txt")
+    filestore.ingest(first)
+    filestore.ingest(second)
+    blob = filestore.blob_path(CONTENT_SHA256)
+
+    os.unlink(first)
+    filestore.release_blob(CONTENT_SHA256)
+    assert os.path.exists(blob)
+
+    os.unlink(second)
+    filestore.release_blob(CONTENT_SHA256)
+    assert not os.path.exists(blob)
+
+
+def test_replacement_path_keeps_shared_blob(datadir):
+    first = _write(datadir, "first.txt")
+    second = _write(datadir, "second.txt")
+    filestore.ingest(first)
+    filestore.ingest(second)
+
+    with filestore.replacement_path(first) as tmp_filepath:
+        with open(tmp_filepath, "w") as f:
+            f.write("changed")
+
+    assert datadir.join("first.txt").read() == "changed"
+    assert datadir.join("second.txt").read() == CONTENT
+    assert os.stat(filestore.blob_path(CONTENT_SHA256)).st_nlink == 2
+
+
+def test_replacement_path_error_keeps_file(datadir):
+    filepath = _write(datadir, "file.txt")
+    try:
+        with filestore.replacement_path(filepath) as tmp_filepath:
+            with open(tmp_filepath, "w") as f:
+                f.write("changed")
+            raise ValueError()
+    except ValueError:
+        pass
+
+    assert datadir.join("file.txt").read() == CONTENT
+    assert datadir.listdir() == [datadir.join("file.txt")]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import socket
+
+from pytest import raises
+
+import core.athana_prefork
+from core import invalidation
+from core.athana_prefork import PreforkSupervisor, WorkerProcess
+
+
+def test_encode_decode():
+    assert invalidation.decode(invalidation.encode("child_count")) == ("child_count", None)
+    assert invalidation.decode(invalidation.encode("oauth_signature", u"1.5 sig üser")) == ("oauth_signature", u"1.5 sig üser")
+
+
+def test_encode_invalid_name():
+    with raises(ValueError):
+        invalidation.encode("child count")
+
+
+def test_dispatch():
+    received = []
+    invalidation.register_handler("test_dispatch", received.append)
+    invalidation.dispatch("test_dispatch", "1")
+    invalidation.dispatch("unknown")
+    assert received == ["1"]
+
+
+def test_supervisor_relays_complete_messages():
+    supervisor = PreforkSupervisor(2, serve=None)
+    worker_ends = []
+    for pid in (1, 2, 3):
+        channel, worker_channel = socket.socketpair()
+        supervisor.workers[pid] = WorkerProcess(pid - 1, pid, channel)
+        worker_ends.append(worker_channel)
+
+    worker_ends[0].sendall(invalidation.encode("a") + "b 1")
+    supervisor._relay(timeout=1)
+    worker_ends[0].sendall("2\n")
+    supervisor._relay(timeout=1)
+
+    expected = "a \nb 12\n"
+    for worker_channel in worker_ends[1:]:
+        worker_channel.settimeout(1)
+        received = ""
+        while len(received) < len(expected):
+            received += worker_channel.recv(100)
+        assert received == expected
+    worker_ends[0].setblocking(0)
+    with raises(socket.error):
+        worker_ends[0].recv(100)
+
+
+def test_supervisor_does_not_block_on_full_worker(monkeypatch):
+    monkeypatch.setattr(core.athana_prefork, "MAX_PENDING_SIZE", 1 << 22)
+    supervisor = PreforkSupervisor(2, serve=None)
+    worker_ends = []
+    for pid in (1, 2):
+        channel, worker_channel = socket.socketpair()
+        supervisor.workers[pid] = WorkerProcess(pid - 1, pid, channel)
+        worker_ends.append(worker_channel)
+
+    # the second worker doesn't read, messages are kept when its socket buffer is full
+    message = invalidation.encode("a", u"x" * 1000)
+    for _ in range(2000):
+        worker_ends[0].sendall(message)
+        supervisor._relay(timeout=0)
+    receiver = supervisor.workers[2]
+    assert receiver.pending
+
+    worker_ends[1].setblocking(0)
+    received = ""
+    while receiver.pending or len(received) < 2000 * len(message):
+        try:
+            received += worker_ends[1].recv(1 << 16)
+        except socket.error:
+            supervisor._relay(timeout=0.1)
+    assert received == 2000 * message
+
+
+def test_broadcast_is_sent_by_sender_thread(monkeypatch):
+    channel, supervisor_end = socket.socketpair()
+    monkeypatch.setattr(invalidation, "_channel", None)
+    invalidation.listen(channel)
+    invalidation.broadcast("a", u"1")
+    invalidation.broadcast("b")
+    supervisor_end.settimeout(1)
+    expected = invalidation.encode("a", u"1") + invalidation.encode("b")
+    received = ""
+    while len(received) < len(expected):
+        received += supervisor_end.recv(100)
+    assert received == expected
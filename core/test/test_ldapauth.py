@@ -4,7 +4,7 @@
     :license: GPL3, see COPYING for details
 """
 from pytest import fixture, raises
-from core.ldapauth import LDAPAuthenticator, LDAPConfigError
+from core.ldapauth import LDAPAuthenticator, LDAPConfigError, CredentialCache
 from core.test.factories import UserFactory, AuthenticatorInfoFactory, UserGroupFactory
 import ldap
 
@@ -42,7 +42,26 @@ LDAP_CONFIG = {
 
 class FakeLDAP(object):
 
+    """In-process LDAP backend that counts connections and requests"""
+
+    connections = 0
+    searches = 0
+    timeouts = 0
+
+    def __init__(self, server=None):
+        FakeLDAP.connections += 1
+
+    def set_option(self, option, value):
+        pass
+
+    def unbind_s(self):
+        pass
+
+    def abandon(self, msgid):
+        pass
+
     def search(self, base_dn, scope, searchfilter, attributes):
+        FakeLDAP.searches += 1
         if "unknown" in searchfilter:
             return 0
         return 1
@@ -52,6 +71,9 @@ class FakeLDAP(object):
             raise ldap.INVALID_CREDENTIALS
 
     def result(self, result_id, _, timeout):
+        if FakeLDAP.timeouts:
+            FakeLDAP.timeouts -= 1
+            raise ldap.TIMEOUT
         if result_id == 1:
             return ldap.RES_SEARCH_ENTRY, FAKE_RECORD
 
@@ -60,7 +82,10 @@ class FakeLDAP(object):
 
 @fixture
 def fake_ldap_record(monkeypatch):
-    monkeypatch.setattr("core.ldapauth.ldap.initialize", lambda x: FakeLDAP())
+    monkeypatch.setattr(FakeLDAP, "connections", 0)
+    monkeypatch.setattr(FakeLDAP, "searches", 0)
+    monkeypatch.setattr(FakeLDAP, "timeouts", 0)
+    monkeypatch.setattr("core.ldapauth.ldap.initialize", FakeLDAP)
     return FAKE_RECORD
 
 
@@ -141,3 +166,54 @@ def test_update_groups_from_ldap_remove_managed_group(session, ldap_authenticato
     ldap_authenticator.update_groups_from_ldap(ldap_user, USER_DATA)
     assert ldap_user.groups == [resource]
 
+
+
+def test_authenticate_credentials_reuses_proxyuser_connection(fake_ldap_record, ldap_authenticator, ldap_user):
+    ldap_authenticator.authenticate_user_credentials(u"testuser", u"password")
+    ldap_authenticator.authenticate_user_credentials(u"testuser", u"password")
+    # one pooled proxy user connection + one connection per user bind
+    assert FakeLDAP.connections == 3
+
+
+def test_authenticate_credentials_bounded_retries(fake_ldap_record, ldap_authenticator, ldap_user):
+    FakeLDAP.timeouts = 100
+    ret = ldap_authenticator.authenticate_user_credentials(u"testuser", u"password")
+    assert ret is None
+    assert FakeLDAP.searches == ldap_authenticator.retries
+
+
+def test_authenticate_credentials_retry_after_timeout(fake_ldap_record, ldap_authenticator, ldap_user):
+    FakeLDAP.timeouts = 1
+    ret = ldap_authenticator.authenticate_user_credentials(u"testuser", u"password")
+    assert ret == ldap_user
+
+
+def test_authenticate_credentials_cached(fake_ldap_record, ldap_user):
+    authenticator = LDAPAuthenticator(u"ldap", dict(LDAP_CONFIG, credential_cache_ttl="60"))
+    assert authenticator.authenticate_user_credentials(u"testuser", u"password") == ldap_user
+    searches = FakeLDAP.searches
+    assert authenticator.authenticate_user_credentials(u"testuser", u"password") == ldap_user
+    assert FakeLDAP.searches == searches
+    # another password must be checked by LDAP
+    assert authenticator.authenticate_user_credentials(u"testuser", u"wrong") is None
+    assert FakeLDAP.searches > searches
+
+
+def test_authenticate_credentials_unchanged_data_skips_update(fake_ldap_record, ldap_authenticator, ldap_user, monkeypatch):
+    ldap_authenticator.authenticate_user_credentials(u"testuser", u"password")
+    updates = []
+    monkeypatch.setattr(ldap_authenticator, "update_ldap_user", lambda data, user: updates.append(user))
+    assert ldap_authenticator.authenticate_user_credentials(u"testuser", u"password") == ldap_user
+    assert updates == []
+
+
+def test_credential_cache(monkeypatch):
+    cache = CredentialCache(ttl=60)
+    cache.add(u"testuser", u"password", 42)
+    assert cache.get(u"testuser", u"password") == 42
+    assert cache.get(u"testuser", u"wrong") is None
+    assert cache.get(u"other", u"password") is None
+    assert u"password" not in repr(cache._entries)
+
+    monkeypatch.setattr("core.ldapauth.time.time", lambda: 1e12)
+    assert cache.get(u"testuser", u"password") is None
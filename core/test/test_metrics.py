@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+from pytest import fixture
+
+from core.metrics import Registry, Counter, Gauge, Histogram
+
+
+@fixture
+def registry():
+    return Registry()
+
+
+def test_counter(registry):
+    counter = Counter("requests_total", "Requests", ("handler", ), registry=registry)
+    counter.inc(labels=("a", ))
+    counter.inc(2, labels=("a", ))
+    counter.inc(labels=('b"', ))
+    lines = registry.render().splitlines()
+    assert lines == ['# HELP requests_total Requests',
+                     '# TYPE requests_total counter',
+                     'requests_total{handler="a"} 3',
+                     'requests_total{handler="b\\""} 1']
+
+
+def test_gauge_collect(registry):
+    Gauge("queue_depth", "Queue", collect=lambda: [((), 5)], registry=registry)
+    assert "queue_depth 5" in registry.render().splitlines()
+
+
+def test_histogram(registry):
+    histogram = Histogram("duration_seconds", "Duration", buckets=(0.1, 1.), registry=registry)
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(5.)
+    lines = registry.render().splitlines()
+    assert 'duration_seconds_bucket{le="0.1"} 2' in lines
+    assert 'duration_seconds_bucket{le="1.0"} 2' in lines
+    assert 'duration_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'duration_seconds_sum 5.15' in lines
+    assert 'duration_seconds_count 3' in lines
+
+
+def test_failing_collector_skipped(registry):
+    Gauge("broken", "Broken", collect=lambda: 1 / 0, registry=registry)
+    Counter("working_total", "Working", registry=registry).inc()
+    text = registry.render()
+    assert "broken" not in text
+    assert "working_total 1" in text
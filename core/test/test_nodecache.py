@@ -4,9 +4,115 @@
     :license: GPL3, see COPYING for details
 """
 from __future__ import absolute_import
-from core.nodecache import get_collections_node
+import os
+from pytest import fixture, raises
+from core import nodecache
+from core.nodecache import get_collections_node, get_node_snapshot, NodeSnapshot, NodeSnapshotCache
+from core.database.postgres.nodechanges import NodeChangeListener, ALL_NODES_CHANGED
 
 
 def test_get_collections_node(req, collections):
     cached_collections = get_collections_node()
-    assert cached_collections == collections
\ No newline at end of file
+    assert cached_collections == collections
+
+
+@fixture
+def snapshot_cache(monkeypatch):
+    """Snapshot cache without node change listener"""
+    cache = NodeSnapshotCache(max_size=2)
+    cache.activate()
+    monkeypatch.setattr(nodecache, "_snapshot_cache", cache)
+    monkeypatch.setattr(nodecache, "_snapshot_cache_pid", os.getpid())
+    return cache
+
+
+def make_snapshot(nid):
+    return NodeSnapshot(nid, u"node{}".format(nid), u"directory", u"directory", {u"a": u"1"}, None)
+
+
+def test_snapshot_is_read_only():
+    snapshot = make_snapshot(1)
+    assert snapshot.get(u"a") == u"1"
+    assert snapshot.get(u"missing") == u""
+    assert snapshot.system_attrs.get(u"b") is None
+    with raises(TypeError):
+        snapshot.attrs[u"a"] = u"2"
+
+
+def test_snapshot_cache_lru():
+    cache = NodeSnapshotCache(max_size=2)
+    cache.activate()
+    for nid in (1, 2):
+        cache.store(make_snapshot(nid), cache.generation)
+    cache.lookup(1)
+    cache.store(make_snapshot(3), cache.generation)
+    assert cache.lookup(2) is None
+    assert cache.lookup(1).id == 1
+    assert len(cache) == 2
+
+
+def test_snapshot_cache_invalidation_during_load():
+    cache = NodeSnapshotCache()
+    cache.activate()
+    generation = cache.generation
+    cache.invalidate(1)
+    cache.store(make_snapshot(1), generation)
+    assert cache.lookup(1) is None
+
+
+def test_snapshot_cache_inactive():
+    cache = NodeSnapshotCache()
+    cache.store(make_snapshot(1), cache.generation)
+    assert cache.lookup(1) is None
+    cache.activate()
+    cache.store(make_snapshot(1), cache.generation)
+    cache.deactivate()
+    assert cache.lookup(1) is None
+
+
+def test_get_node_snapshot(session, snapshot_cache, some_node):
+    session.flush()
+    snapshot = get_node_snapshot(some_node.id)
+    assert snapshot.name == some_node.name
+    assert snapshot.type == some_node.type
+    assert snapshot.attrs == some_node.attrs
+    # not stored, some_node is not committed yet
+    assert snapshot_cache.lookup(some_node.id) is None
+    assert get_node_snapshot(u"not an id") is None
+
+
+def test_committed_nodes_invalidated(session, snapshot_cache):
+    snapshot_cache.store(make_snapshot(1), snapshot_cache.generation)
+    snapshot_cache.store(make_snapshot(2), snapshot_cache.generation)
+    session.info[nodecache._CHANGED_NODE_IDS] = {1}
+    nodecache._invalidate_committed_nodes(session)
+    assert snapshot_cache.lookup(1) is None
+    assert snapshot_cache.lookup(2) is not None
+
+
+def test_node_change_handlers(monkeypatch):
+    monkeypatch.setattr(nodecache, "_node_change_handlers", {})
+    monkeypatch.setattr(nodecache, "_node_change_listener_pid", os.getpid())
+    monkeypatch.setattr(nodecache, "_node_change_listener_connected", False)
+    calls = []
+    nodecache.add_node_change_handler("test", calls.append, lambda: calls.append("connect"))
+    nodecache._on_node_change_listener_connect()
+    nodecache._on_node_change(1)
+    nodecache._on_node_change_listener_disconnect()
+    assert calls == ["connect", 1]
+
+    # the listener is connected already
+    nodecache._on_node_change_listener_connect()
+    nodecache.add_node_change_handler("test", calls.append, lambda: calls.append("connect again"))
+    assert calls == ["connect", 1, "connect", "connect again"]
+
+
+def test_all_nodes_changed_clears(monkeypatch):
+    monkeypatch.setattr(nodecache, "_node_change_handlers", {})
+    calls = []
+    nodecache.add_node_change_handler("test", calls.append, lambda: calls.append("clear"))
+    listener = NodeChangeListener(None, nodecache._on_node_change, nodecache._on_all_nodes_changed)
+    listener.dispatch("1")
+    listener.dispatch(ALL_NODES_CHANGED)
+    listener.dispatch("invalid")
+    assert calls == [1, "clear"]
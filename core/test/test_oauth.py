@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import time
+
+from pytest import fixture
+
+import core.config
+from core import oauth
+from core.database.postgres.user import OAuthUserCredentials
+from core.test.factories import UserFactory
+
+
+PATH = "/services/export/node/1"
+
+
+@fixture
+def oauth_user(session, monkeypatch):
+    monkeypatch.setattr(core.config, "settings", {})
+    oauth.invalidate_credentials_cache()
+    oauth._seen_signatures.clear()
+    user = UserFactory(login_name=u"apiuser")
+    session.add(OAuthUserCredentials(oauth_user=u"apiuser", oauth_key=u"secret", user=user))
+    session.flush()
+    return user
+
+
+def signed_params(key=u"secret", **params):
+    params.setdefault("user", u"apiuser")
+    params["sign"] = oauth.calculate_signature(key, PATH, params)
+    return params
+
+
+def test_calculate_signature():
+    import hashlib
+    params = {"user": "apiuser", "format": "json", "sign": "ignored"}
+    assert oauth.calculate_signature(u"secret", PATH, params) == hashlib.md5(u"secret" + PATH + "format=json&user=apiuser").hexdigest()
+
+
+def test_verify_request_signature(oauth_user):
+    assert oauth.verify_request_signature(PATH, signed_params(format="json"))
+    assert not oauth.verify_request_signature(PATH, signed_params(key=u"wrong", format="json"))
+    assert not oauth.verify_request_signature(PATH, signed_params(user=u"unknown"))
+    assert not oauth.verify_request_signature(PATH, {"user": u"apiuser"})
+
+
+def test_verify_request_signature_uses_cache(oauth_user, session):
+    assert oauth.verify_request_signature(PATH, signed_params())
+    # a key changed directly in the database is not seen until the cache is invalidated
+    session.query(OAuthUserCredentials).update({"oauth_key": u"newsecret"})
+    assert oauth.verify_request_signature(PATH, signed_params())
+    oauth.invalidate_credentials_cache(u"apiuser")
+    assert oauth.verify_request_signature(PATH, signed_params(key=u"newsecret"))
+
+
+def test_generate_new_oauth_key_invalidates_cache(oauth_user):
+    assert oauth.verify_request_signature(PATH, signed_params())
+    new_key = oauth.generate_new_oauth_key_for_user(oauth_user)
+    assert not oauth.verify_request_signature(PATH, signed_params())
+    assert oauth.verify_request_signature(PATH, signed_params(key=new_key))
+
+
+def test_changed_credentials_invalidated_after_commit(oauth_user, session, monkeypatch):
+    broadcasts = []
+    monkeypatch.setattr(oauth.invalidation, "broadcast", lambda name, arg=None: broadcasts.append((name, arg)))
+    assert oauth.get_oauth_key(u"apiuser") == u"secret"
+    credentials = session.query(OAuthUserCredentials).get(u"apiuser")
+    credentials.oauth_key = u"newsecret"
+    session.flush()
+    # other processes would load the old key again before the commit
+    assert broadcasts == []
+    assert oauth.get_oauth_key(u"apiuser") == u"secret"
+    oauth._invalidate_committed_credentials(session)
+    assert broadcasts == [("oauth_credentials", u"apiuser")]
+    assert oauth.get_oauth_key(u"apiuser") == u"newsecret"
+
+
+def test_unchanged_credentials_not_broadcast(oauth_user, session, monkeypatch):
+    broadcasts = []
+    monkeypatch.setattr(oauth.invalidation, "broadcast", lambda name, arg=None: broadcasts.append((name, arg)))
+    credentials = session.query(OAuthUserCredentials).get(u"apiuser")
+    credentials.oauth_key = u"secret"
+    session.flush()
+    oauth._invalidate_committed_credentials(session)
+    assert broadcasts == []
+
+
+def test_replay_protection(oauth_user, monkeypatch):
+    monkeypatch.setattr(core.config, "settings", {"oauth.max_request_age": "60"})
+    # timestamp is required
+    assert not oauth.verify_request_signature(PATH, signed_params())
+
+    params = signed_params(timestamp=str(int(time.time())), nonce="1")
+    assert oauth.verify_request_signature(PATH, params)
+    assert not oauth.verify_request_signature(PATH, params)
+    assert oauth.verify_request_signature(PATH, signed_params(timestamp=str(int(time.time())), nonce="2"))
+    assert not oauth.verify_request_signature(PATH, signed_params(timestamp=str(int(time.time()) - 120)))
+
+
+def test_replay_cache_is_bounded(oauth_user, monkeypatch):
+    monkeypatch.setattr(core.config, "settings", {"oauth.max_request_age": "60", "oauth.replay_cache_size": "10"})
+    for nonce in range(20):
+        assert oauth.verify_request_signature(PATH, signed_params(timestamp=str(int(time.time())), nonce=str(nonce)))
+    assert len(oauth._seen_signatures) <= 10
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+from pytest import mark
+
+from core.stats import parse_log_line, client_ip, aggregate_log_file, buildStatAll
+from core.statsstore import AccessStatistics, EDIT, DOWNLOAD, FRONTEND
+
+
+LOG_LINE = '2016-05-{:02d} 10:11:12,123 INFO 1.2.3.4:5555 - - [{:02d}/May/2016:10:11:12 ] "GET {} HTTP/1.1"\n'
+
+
+def log_line(url, day=2):
+    return LOG_LINE.format(day, day, url)
+
+
+@mark.parametrize("url, expected", [
+    ("/doc/123/file.pdf", (123, DOWNLOAD)),
+    ("/fullsize?id=5", (5, DOWNLOAD)),
+    ("/edit/edit_content?id=7&tab=meta", (7, EDIT)),
+    ("/123", (123, FRONTEND)),
+    ("/node?show_id=9&id=3", (9, FRONTEND)),
+    ("/node?id=3", (3, FRONTEND)),
+    ("/doc/abc", None),
+    ("/node?change_language=en&id=3", None),
+    ("/", None),
+])
+def test_parse_log_line(url, expected):
+    access = parse_log_line(log_line(url))
+    if expected is None:
+        assert access is None
+    else:
+        nid, date, hour, access_type, address = access
+        assert (nid, access_type) == expected
+        assert date == "2016-05-02"
+        assert hour == 10
+        assert address == "1.2.3.4:5555"
+
+
+def test_client_ip():
+    assert client_ip("1.2.3.4:5555") == "1.2.3.4"
+    assert client_ip("10.0.0.1, 1.2.3.4:5555") == "1.2.3.4"
+    assert client_ip("unknown:0") == "127.0.0.1"
+
+
+def test_aggregate_log_file(tmpdir):
+    logfile = tmpdir.join("2016-05.log")
+    logfile.write("".join(log_line("/{}".format(nid), day) for day in (2, 3) for nid in (1, 2, 3)))
+    aggregator, checkpoint = aggregate_log_file(str(logfile), nids={1, 2})
+    assert sorted((r["nid"], r["day"].day, r["hits"]) for r in aggregator.rows()) == [(1, 2, 1), (1, 3, 1), (2, 2, 1), (2, 3, 1)]
+    assert checkpoint == {"day": "2016-05-03", "offset": len(log_line("/1")) * 3}
+
+
+def test_build_stat_all_incremental(session, collections, tmpdir):
+    collection = collections
+    session.flush()
+    logfile = tmpdir.join("2016-05.log")
+    logfile.write(log_line("/{}".format(collection.id), 2) + log_line("/{}".format(collection.id), 3))
+    buildStatAll([], "2016-05", str(logfile), processes=1)
+    stats = AccessStatistics(collection, u"2016-05", "frontend")
+    assert stats.getIDs() == [(collection.id, 2)]
+
+    # only the last day is read again
+    logfile.write(log_line("/{}".format(collection.id), 3) + log_line("/{}".format(collection.id), 4), mode="a")
+    buildStatAll([], "2016-05", str(logfile), processes=1)
+    progress = stats.getProgress()
+    assert [progress[day]["items"] for day in (2, 3, 4)] == [1, 2, 1]
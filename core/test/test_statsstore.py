@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import datetime
+
+from core.statsstore import StatsAggregator, AccessStatistics, replace_month_stats, stats_periods, FRONTEND, DOWNLOAD
+
+
+DAY = datetime.date(2016, 5, 2)
+
+
+def test_aggregator():
+    aggregator = StatsAggregator()
+    aggregator.add(1, DAY, 10, FRONTEND, "de", "1.2.3.4")
+    aggregator.add(1, DAY, 10, FRONTEND, "de", "1.2.3.4")
+    aggregator.add(1, DAY, 11, FRONTEND, "de", "1.2.3.5")
+    aggregator.add(1, DAY, 11, DOWNLOAD, "", "1.2.3.5")
+    rows = sorted(aggregator.rows(), key=lambda r: r["type"])
+    assert len(rows) == 2
+    download, frontend = rows
+    assert download["country"] == ""
+    assert frontend["hits"] == 3
+    assert frontend["visitors"] == 2
+    assert frontend["hour_hits"][10] == 2
+    assert frontend["hour_visitors"][10] == 1
+    assert frontend["hour_visitors"][11] == 1
+
+
+def test_access_statistics(session, some_node):
+    content_node = some_node.content_children[0]
+    session.flush()
+    aggregator = StatsAggregator()
+    aggregator.add(content_node.id, DAY, 10, FRONTEND, "de", "1.2.3.4")
+    aggregator.add(content_node.id, DAY, 10, FRONTEND, "de", "1.2.3.5")
+    aggregator.add(some_node.id, datetime.date(2016, 5, 3), 23, FRONTEND, "", "1.2.3.4")
+    # outside of the month, ignored
+    aggregator.add(some_node.id, datetime.date(2016, 6, 1), 0, FRONTEND, "", "1.2.3.4")
+    replace_month_stats(2016, 5, aggregator.rows())
+
+    assert stats_periods() == [u"2016-05"]
+    stats = AccessStatistics(some_node, u"2016-05", "frontend")
+    assert stats.getIDs() == [(content_node.id, 2), (some_node.id, 1)]
+    assert stats.getName(content_node.id) == content_node.name
+    assert stats.getCreationDate() is not None
+
+    days = stats.getProgress()
+    assert len(days) == 32
+    assert days[2] == {"items": 2, "different": 1, "visitors": 2}
+    assert days[3] == {"items": 1, "different": 1, "visitors": 1}
+    assert days[0]["max"] == 2
+
+    # 2016-05-02 is a monday
+    weekdays = stats.getProgress("day")
+    assert weekdays[1]["items"] == 2
+    assert weekdays[7]["items"] == 0
+
+    hours = stats.getProgress("time")
+    assert hours[11] == {"items": 2, "different": 1, "visitors": 2}
+    assert hours[24]["items"] == 1
+
+    countries = stats.getProgress("country")
+    assert countries["de"]["items"] == 2
+    assert countries["n.a."]["items"] == 1
+
+    # statistics of the content node don't include its parent
+    assert AccessStatistics(content_node, u"2016-05", "frontend").getIDs() == [(content_node.id, 2)]
+    assert AccessStatistics(some_node, u"2016-05", "download").getIDs() == [(0, 0)]
+
+
+def test_replace_month_stats_for_nodes(session, some_node):
+    content_node = some_node.content_children[0]
+    session.flush()
+    aggregator = StatsAggregator()
+    aggregator.add(content_node.id, DAY, 10, FRONTEND, "de", "1.2.3.4")
+    aggregator.add(some_node.id, DAY, 10, FRONTEND, "de", "1.2.3.4")
+    replace_month_stats(2016, 5, aggregator.rows())
+
+    aggregator = StatsAggregator()
+    aggregator.add(content_node.id, DAY, 10, FRONTEND, "de", "1.2.3.4")
+    aggregator.add(content_node.id, DAY, 11, FRONTEND, "de", "1.2.3.4")
+    replace_month_stats(2016, 5, aggregator.rows(), nids=[content_node.id])
+
+    stats = AccessStatistics(some_node, u"2016-05", "frontend")
+    assert sorted(stats.getIDs()) == sorted([(content_node.id, 2), (some_node.id, 1)])
+
+
+def test_empty_access_statistics(some_node):
+    stats = AccessStatistics(some_node, None, "frontend")
+    assert stats.getIDs() == [(0, 0)]
+    assert stats.getProgress() == {0: {"items": 0, "max": 0, "max_p": 0, "max_u": 0}}
@@ -3,10 +3,11 @@
     :copyright: (c) 2015 by the mediaTUM authors
     :license: GPL3, see COPYING for details
 """
+import os
 from pytest import yield_fixture, raises
 from sqlalchemy_continuum.utils import version_class
 
-from core import db, Node, File
+from core import db, Node, File, nodecache
 from core.database.postgres.alchemyext import truncate_tables
 from contenttypes import Directory
 from core.test.factories import DirectoryFactory
@@ -214,6 +215,16 @@ def test_old_node_version_support(content_node_versioned_with_alias_id):
     assert version.orderpos == 23
 
 
+def test_old_node_version_snapshot(content_node_versioned_with_alias_id, monkeypatch):
+    # don't start the node change listener
+    monkeypatch.setattr(nodecache, "_snapshot_cache", nodecache.NodeSnapshotCache())
+    monkeypatch.setattr(nodecache, "_snapshot_cache_pid", os.getpid())
+    node = content_node_versioned_with_alias_id
+    snapshot = nodecache.get_node_snapshot(23)
+    assert snapshot.id == node.id
+    assert snapshot.name == node.name
+
+
 def test_tag(content_node_versioned):
     node = content_node_versioned
     node.tag = u"5"
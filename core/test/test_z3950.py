@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+from pytest import raises
+
+from core.athana_z3950 import ResultSetStore, QueryBoolNode, QueryMatchNode
+from core.search.representation import And, Or, Not, AttributeMatch, AttributeCompare, FullMatch
+
+
+def test_result_set_store_drops_least_recently_used():
+    store = ResultSetStore(max_count=2)
+    store["a"] = [1, 2, 3]
+    store["b"] = [4]
+    assert list(store["a"]) == [1, 2, 3]
+    store["c"] = [5]
+    assert "a" in store
+    assert "b" not in store
+    assert store.has_key("c")
+    assert len(store) == 2
+
+
+def test_result_set_store_expires():
+    store = ResultSetStore(ttl=-1)
+    store["a"] = [1]
+    with raises(KeyError):
+        store["a"]
+    assert len(store) == 0
+
+
+def test_build_search_tree():
+    field_mapping = {"title": ["title", "subtitle"], "any": ["full"], "year": ["year"]}
+    query = QueryBoolNode("and not",
+                          QueryBoolNode("or", QueryMatchNode("=", "title", '"foo"'), QueryMatchNode("=", "any", "bar")),
+                          QueryBoolNode("and", QueryMatchNode(">", "year", "2000"), QueryMatchNode("=", "unmapped", "x")))
+    expected = And(Or(Or(AttributeMatch("title", u"foo"), AttributeMatch("subtitle", u"foo")), FullMatch(u"bar")),
+                   Not(AttributeCompare("year", ">", u"2000")))
+    assert query.build_search_tree(field_mapping) == expected
+
+
+def test_build_search_tree_unmapped():
+    assert QueryMatchNode("=", "unmapped", "x").build_search_tree({}) is None
@@ -80,7 +80,7 @@ def loadServices():
         file = context.addFile(servicedir + "services/" + servicename)
 
         if hasattr(file.m, "request_handler"):
-            file.addHandler("request_handler").addPattern("/.*")
+            file.addHandler("request_handler", read_only=getattr(file.m, "READ_ONLY", False)).addPattern("/.*")
 
             if not os.path.exists(servicedata):
                 try:
@@ -178,29 +178,30 @@ def initContexts():
     oai_enabled = config.getboolean("oai.activate", False)
 
     # === public area ===
+    # read_only handlers don't write to the database, their queries are sent to the replicas if configured
     file = context.addFile("web/frontend/filehandlers.py")
-    file.addHandler("send_thumbnail").addPattern("/thumbs/.*")
-    file.addHandler("send_thumbnail2").addPattern("/thumb2/.*")
-    file.addHandler("send_doc").addPattern("/doc/.*")
-    file.addHandler("send_image").addPattern("/image/.*")
-    file.addHandler("redirect_images").addPattern("/images/.*")
-    handler = file.addHandler("send_file")
+    file.addHandler("send_thumbnail", read_only=True).addPattern("/thumbs/.*")
+    file.addHandler("send_thumbnail2", read_only=True).addPattern("/thumb2/.*")
+    file.addHandler("send_doc", read_only=True).addPattern("/doc/.*")
+    file.addHandler("send_image", read_only=True).addPattern("/image/.*")
+    file.addHandler("redirect_images", read_only=True).addPattern("/images/.*")
+    handler = file.addHandler("send_file", read_only=True)
     handler.addPattern("/file/.*")
     handler.addPattern("/download/.*")
-    file.addHandler("send_attachment").addPattern("/attachment/.*")
-    file.addHandler("send_attfile").addPattern("/attfile/.*")
+    file.addHandler("send_attachment", read_only=True).addPattern("/attachment/.*")
+    file.addHandler("send_attfile", read_only=True).addPattern("/attfile/.*")
     file.addHandler("fetch_archived").addPattern("/archive/.*")
-    file.addHandler("send_from_webroot").addPattern("/[a-z,0-9,-]*\.[a-z]*")  # root directory added /web/root (only files with extensions)
+    file.addHandler("send_from_webroot", read_only=True).addPattern("/[a-z,0-9,-]*\.[a-z]*")  # root directory added /web/root (only files with extensions)
 
     file = context.addFile("web/frontend/zoom.py")
-    file.addHandler("send_imageproperties_xml").addPattern("/tile/[0-9]*/ImageProperties.xml")
-    file.addHandler("send_tile").addPattern("/tile/[0-9]*/[^I].*")
+    file.addHandler("send_imageproperties_xml", read_only=True).addPattern("/tile/[0-9]*/ImageProperties.xml")
+    file.addHandler("send_tile", read_only=True).addPattern("/tile/[0-9]*/[^I].*")
 
     main_file = file = context.addFile("web/frontend/main.py")
-    handler = file.addHandler("display")
+    handler = file.addHandler("display", read_only=True)
     handler.addPattern("/")
     handler.addPattern("/node")
-    handler = file.addHandler("display_newstyle")
+    handler = file.addHandler("display_newstyle", read_only=True)
     handler.addPattern("/nodes/\d+")
     # /\d+ could also be a node, the handler must check this
     handler.addPattern("/\d+")
@@ -208,19 +209,19 @@ def initContexts():
     if workflows_enabled:
         file.addHandler("workflow").addPattern("/mask")
 
-    file.addHandler("show_parent_node").addPattern("/pnode")
+    file.addHandler("show_parent_node", read_only=True).addPattern("/pnode")
     file.addHandler("publish").addPattern("/publish/.*")
     file = context.addFile("web/frontend/popups.py")
-    file.addHandler("popup_metatype").addPattern("/metatype/.*")
-    file.addHandler("popup_fullsize").addPattern("/fullsize")
-    file.addHandler("popup_thumbbig").addPattern("/thumbbig")
+    file.addHandler("popup_metatype", read_only=True).addPattern("/metatype/.*")
+    file.addHandler("popup_fullsize", read_only=True).addPattern("/fullsize")
+    file.addHandler("popup_thumbbig", read_only=True).addPattern("/thumbbig")
     # file.addHandler("show_index").addPattern("/popup_index")
-    file.addHandler("show_help").addPattern("/popup_help")
-    file.addHandler("show_attachmentbrowser").addPattern("/attachmentbrowser")
+    file.addHandler("show_help", read_only=True).addPattern("/popup_help")
+    file.addHandler("show_attachmentbrowser", read_only=True).addPattern("/attachmentbrowser")
     
     if config.getboolean("config.enable_printing"):
-        file.addHandler("show_printview").addPattern("/print/\d+\.pdf")
-        file.addHandler("redirect_old_printview").addPattern("/print/.*")
+        file.addHandler("show_printview", read_only=True).addPattern("/print/\d+\.pdf")
+        file.addHandler("redirect_old_printview", read_only=True).addPattern("/print/.*")
 
     file = context.addFile("web/frontend/login.py")
     file.addHandler("login").addPattern("/login")
@@ -255,6 +256,10 @@ def initContexts():
         file.addHandler("content").addPattern("/edit_content")
         file.addHandler("content").addPattern("/edit_content/.*")
         file.addHandler("action").addPattern("/edit_action")
+        # resumable uploads, chunks are written directly to the target file
+        file = context.addFile("web/edit/chunkedupload.py")
+        file.addHandler("chunked_upload").addPattern("/upload/chunked(/[0-9a-f]{32})?$")
+        athana.add_stream_body_opener(file.m.CHUNK_PATH_PATTERN, file.m.open_chunk_stream)
 
         # === ajax tree ===
         context = athana.addContext("/ftree", ".")
@@ -269,12 +274,12 @@ def initContexts():
     if oai_enabled:
         context = athana.addContext("/oai/", ".")
         file = context.addFile("export/oai.py")
-        file.addHandler("oaiRequest").addPattern(".*")
+        file.addHandler("oaiRequest", read_only=True).addPattern(".*")
 
     # === Export ===
     context = athana.addContext("/export", ".")
     file = context.addFile("web/frontend/export.py")
-    file.addHandler("export").addPattern("/.*")
+    file.addHandler("export", read_only=True).addPattern("/.*")
 
     # === static files ===
     athana.addFileStore("/ckeditor/", "lib/CKeditor/files.zip")
@@ -284,11 +289,11 @@ def initContexts():
     athana.addFileStore("/js/", ["web/js/", "js", "lib/CKeditor/js/"])
 
     # === last: path aliasing for collections ===
-    handler = main_file.addHandler("display_alias")
+    handler = main_file.addHandler("display_alias", read_only=True)
     handler.addPattern("/([_a-zA-Z][_/a-zA-Z0-9]+)$")
 
     # 404
-    handler = main_file.addHandler("display_404")
+    handler = main_file.addHandler("display_404", read_only=True)
     handler.addPattern("/(.)+$")
 
     init_theme()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Converts EXIF metadata read by exiftool (see lib.iptc.pool) to the tag names and printable values of
+    `EXIF.process_file`, which were used for the exif_* node attributes before.
+    The IFD and tag names are taken from the EXIF tag tables by tag ID. Rational values are reconstructed from the
+    decimal values of exiftool, GPS coordinates are decimal degrees. MakerNote tags are not converted.
+"""
+from __future__ import absolute_import
+
+from fractions import Fraction
+import re
+
+from lib.Exif.EXIF import EXIF_TAGS, GPS_TAGS, INTR_TAGS, Ratio
+
+
+#: exiftool family 1 group -> (IFD name used by EXIF.process_file, tag table)
+EXIFTOOL_GROUPS = {
+    "IFD0": ("Image", EXIF_TAGS),
+    "IFD1": ("Thumbnail", EXIF_TAGS),
+    "ExifIFD": ("EXIF", EXIF_TAGS),
+    "GPS": ("GPS", GPS_TAGS),
+    "InteropIFD": ("EXIF Interoperability", INTR_TAGS),
+}
+
+NUMBER = re.compile(r"^-?\d+(\.\d+)?(e-?\d+)?$")
+
+
+def _convert_number(value):
+    if isinstance(value, float) or not isinstance(value, (int, long)):
+        value = float(value)
+        if not value.is_integer():
+            fraction = Fraction(value).limit_denominator(1000000)
+            return Ratio(fraction.numerator, fraction.denominator)
+    return int(value)
+
+
+def _values(value):
+    """Returns the value list (numbers) or string like EXIF.process_file"""
+    if isinstance(value, (int, long, float)):
+        return [_convert_number(value)]
+    if isinstance(value, basestring):
+        parts = value.split()
+        if parts and all(NUMBER.match(p) for p in parts):
+            return [_convert_number(p) for p in parts]
+    return value
+
+
+def _printable(value, tag_entry):
+    mapping = tag_entry[1] if tag_entry and len(tag_entry) != 1 else None
+    if callable(mapping) and isinstance(value, basestring):
+        # the mapping functions of EXIF.py decode byte values to strings, exiftool already did that
+        return value.encode("utf8") if isinstance(value, unicode) else value
+
+    values = _values(value)
+    if not isinstance(values, list):
+        return values.encode("utf8") if isinstance(values, unicode) else str(values)
+    if isinstance(mapping, dict):
+        return "".join(mapping.get(i, repr(i)) for i in values)
+    return str(values[0]) if len(values) == 1 else str(values)
+
+
+def exif_tags_from_exiftool(metadata):
+    """Returns a dict that maps EXIF.process_file tag names like "EXIF DateTimeOriginal" to printable values.
+    :param metadata: lib.iptc.pool.ExifToolMetadata
+    """
+    tags = {}
+    for key, value in metadata.values.iteritems():
+        group, _, exiftool_name = key.partition(":")
+        if group not in EXIFTOOL_GROUPS or key not in metadata.tag_ids:
+            continue
+        ifd_name, tag_table = EXIFTOOL_GROUPS[group]
+        tag_id = metadata.tag_ids[key]
+        tag_entry = tag_table.get(tag_id)
+        tag_name = tag_entry[0] if tag_entry else 'Tag 0x%04X' % tag_id
+        tags[ifd_name + " " + tag_name] = _printable(value, tag_entry)
+    return tags
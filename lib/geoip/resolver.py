@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Fast country lookups for many IP addresses.
+
+    `GeoIP._seek_country` decodes the tree records of the database byte by byte for each of up to 32 steps.
+    `CountryResolver` decodes all records once into a flat integer array, so a step is one index operation.
+    The first 24 steps only depend on the /24 network of an address. Their result is cached, so addresses from known
+    networks need at most 8 more steps. The cache approximates LRU with two generations of plain dicts: networks that
+    were not used while the current generation filled up are dropped. Results are the same as
+    `GeoIP.country_code_by_addr`.
+
+    Only country databases are supported.
+"""
+from __future__ import absolute_import
+
+from array import array
+from itertools import izip
+import random
+import time
+
+from lib.geoip.const import COUNTRY_BEGIN, COUNTRY_CODES, COUNTRY_EDITION, MEMORY_CACHE
+from lib.geoip.geoip import GeoIP, GeoIPError
+from lib.geoip.util import ip2long
+
+
+#: number of /24 networks kept in the cache
+DEFAULT_CACHE_SIZE = 65536
+
+
+class CountryResolver(object):
+
+    def __init__(self, filename="", cache_size=DEFAULT_CACHE_SIZE):
+        geoip = GeoIP(filename, MEMORY_CACHE)
+        if geoip._databaseType != COUNTRY_EDITION:
+            raise GeoIPError("CountryResolver only supports country databases")
+
+        self._segments = geoip._databaseSegments
+        record_length = geoip._recordLength
+        data = array("B", geoip._memoryBuffer)
+        data = data[:len(data) - len(data) % record_length]
+        # little endian values of record_length bytes, tree[2 * offset] is the left, tree[2 * offset + 1] the right child
+        byte_columns = [data[j::record_length] for j in range(record_length)]
+        self._tree = array("i", [sum(b << (8 * j) for j, b in enumerate(values)) for values in izip(*byte_columns)])
+
+        self._generation_size = max(cache_size / 2, 1)
+        self._recent = {}
+        self._older = {}
+        self.lookups = 0
+        self.misses = 0
+
+    def _walk(self, ipnum, offset, first_bit, last_bit):
+        """Follows the tree from `offset` for the bits first_bit..last_bit (descending) of `ipnum`.
+        :returns: a record >= segments (country) or the offset reached after last_bit
+        """
+        tree = self._tree
+        segments = self._segments
+        for bit in xrange(first_bit, last_bit - 1, -1):
+            offset = tree[2 * offset + ((ipnum >> bit) & 1)]
+            if offset >= segments:
+                break
+        return offset
+
+    def _network_record(self, network):
+        """Returns the record reached after the 24 bits of a /24 network, see `_walk`"""
+        self.lookups += 1
+        record = self._recent.get(network)
+        if record is None:
+            record = self._older.get(network)
+            if record is None:
+                self.misses += 1
+                record = self._walk(network << 8, 0, 31, 8)
+            self._recent[network] = record
+            if len(self._recent) >= self._generation_size:
+                self._older = self._recent
+                self._recent = {}
+        return record
+
+    def _country_id(self, ipnum):
+        record = self._network_record(ipnum >> 8)
+        if record < self._segments:
+            record = self._walk(ipnum, record, 7, 0)
+            if record < self._segments:
+                raise GeoIPError("Error traversing database - perhaps it is corrupt?")
+        return record - COUNTRY_BEGIN
+
+    def country_code_by_addr(self, addr):
+        """Returns the 2-letter country code for an IPv4 address like `GeoIP.country_code_by_addr`.
+        :raises GeoIPError: if `addr` is not an IP address
+        """
+        try:
+            ipnum = ip2long(addr)
+        except (ValueError, IndexError):
+            ipnum = 0
+        if not ipnum:
+            raise GeoIPError("*_by_addr methods only accept IP addresses. Use *_by_name for hostnames.")
+        return COUNTRY_CODES[self._country_id(ipnum)]
+
+    def lookup_many(self, addrs):
+        """Returns a list with the country codes of many IPv4 addresses, None for invalid addresses"""
+        country_id = self._country_id
+        codes = []
+        for addr in addrs:
+            try:
+                ipnum = ip2long(addr)
+            except (ValueError, IndexError):
+                ipnum = 0
+            codes.append(COUNTRY_CODES[country_id(ipnum)] if ipnum else None)
+        return codes
+
+    @property
+    def cache_hit_ratio(self):
+        return 1 - float(self.misses) / (self.lookups or 1)
+
+
+def synthetic_log_addresses(lines, networks=5000, seed=0):
+    """Yields `lines` IP addresses like the clients of an access log: few networks with many requests.
+    Network popularity follows a Pareto distribution.
+    """
+    rnd = random.Random(seed)
+    prefixes = ["{}.{}.{}.".format(rnd.randint(1, 223), rnd.randint(0, 255), rnd.randint(0, 255)) for _ in xrange(networks)]
+    for _ in xrange(lines):
+        index = min(int(rnd.paretovariate(1.2)) - 1, networks - 1)
+        yield prefixes[index] + str(rnd.randint(1, 254))
+
+
+def benchmark(lines=10000000, networks=5000, batch_size=10000, compare_lines=100000):
+    """Resolves the client addresses of a synthetic log with `lines` lines with CountryResolver.lookup_many.
+    The first `compare_lines` addresses are also resolved with GeoIP in MEMORY_CACHE mode, results must be identical.
+    :returns: dict with microseconds per address for "resolver" and "geoip" and the cache hit ratio "cache_hits"
+    """
+    resolver = CountryResolver()
+    geoip = GeoIP(flags=MEMORY_CACHE)
+
+    addrs = list(synthetic_log_addresses(compare_lines, networks))
+    start = time.time()
+    expected = [geoip.country_code_by_addr(a) for a in addrs]
+    geoip_time = time.time() - start
+    if resolver.lookup_many(addrs) != expected:
+        raise AssertionError("CountryResolver results differ from GeoIP")
+
+    resolver = CountryResolver()
+    resolver_time = 0
+    batch = []
+    for addr in synthetic_log_addresses(lines, networks, seed=1):
+        batch.append(addr)
+        if len(batch) == batch_size:
+            start = time.time()
+            resolver.lookup_many(batch)
+            resolver_time += time.time() - start
+            batch = []
+    if batch:
+        start = time.time()
+        resolver.lookup_many(batch)
+        resolver_time += time.time() - start
+
+    return {
+        "resolver": resolver_time * 1e6 / lines,
+        "geoip": geoip_time * 1e6 / compare_lines,
+        "cache_hits": resolver.cache_hit_ratio,
+    }
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import random
+
+from pytest import fixture, mark, raises
+
+from lib.geoip.geoip import GeoIP, GeoIPError, STANDARD, MEMORY_CACHE, MMAP_CACHE
+from lib.geoip.resolver import CountryResolver, synthetic_log_addresses
+
+
+@fixture(scope="module")
+def resolver():
+    return CountryResolver()
+
+
+def random_addresses(count):
+    rnd = random.Random(42)
+    return ["{}.{}.{}.{}".format(rnd.randint(1, 255), rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255))
+            for _ in xrange(count)]
+
+
+@mark.parametrize("flags", [STANDARD, MEMORY_CACHE, MMAP_CACHE])
+def test_same_results_as_geoip(resolver, flags):
+    geoip = GeoIP(flags=flags)
+    addrs = random_addresses(5000) + list(synthetic_log_addresses(5000))
+    assert resolver.lookup_many(addrs) == [geoip.country_code_by_addr(a) for a in addrs]
+
+
+def test_small_cache_same_results():
+    resolver = CountryResolver(cache_size=4)
+    geoip = GeoIP(flags=MEMORY_CACHE)
+    addrs = list(synthetic_log_addresses(2000, networks=50))
+    assert resolver.lookup_many(addrs) == [geoip.country_code_by_addr(a) for a in addrs]
+    assert resolver.misses > 50
+
+
+def test_network_cache(resolver):
+    resolver.lookup_many(["8.8.8.{}".format(i) for i in range(1, 100)])
+    misses = resolver.misses
+    resolver.lookup_many(["8.8.8.{}".format(i) for i in range(100, 200)])
+    assert resolver.misses == misses
+
+
+def test_invalid_addresses(resolver):
+    assert resolver.lookup_many(["example.com", "0.0.0.0", "1.2.3"]) == [None, None, None]
+    with raises(GeoIPError):
+        resolver.country_code_by_addr("example.com")
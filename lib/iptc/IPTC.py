@@ -23,14 +23,11 @@ import sys
 sys.path.append('.')
 import logging
 import os
-import subprocess
-import exiftool
 from utils.date import parse_date
 from utils.date import validateDate
 from utils.date import format_date
 from utils.strings import ensure_unicode
-from core import config
-import utils.process
+import lib.iptc.pool
 import collections
 
 
@@ -147,16 +144,32 @@ def get_iptc_tags(image_path, tags=None):
         return
 
     # fetch metadata dict from exiftool
-    exiftool_exe = config.get("external.exiftool", "exiftool")
-    with exiftool.ExifTool(exiftool_exe) as et:
-        iptc_metadata = et.get_metadata(image_path)
+    iptc_metadata = lib.iptc.pool.get_pool().get_metadata(image_path).values
+    ret = iptc_tags_from_metadata(iptc_metadata, tags)
+
+    logg.info('{} read from file.'.format(ret))
+
+    return ret
+
+
+def iptc_tags_from_metadata(metadata, tags=None):
+    """
+        get the IPTC tag/values from metadata
+        read by the exiftool pool
+
+        :param metadata: dictionary with "Group:Tag" keys, see lib.iptc.pool.ExifToolMetadata.values
+        :param tags: dictionary with wanted iptc tags
+        :return: dictionary with tag/value
+    """
+    if tags is None:
+        tags = get_wanted_iptc_tags()
 
     ret = {}
 
     for iptc_tag in tags.keys():
         key = "IPTC:" + iptc_tag
-        if key in iptc_metadata:
-            value = iptc_metadata[key]
+        if key in metadata:
+            value = metadata[key]
 
             # format dates for date fields
             if iptc_tag == 'DateCreated':
@@ -171,8 +184,6 @@ def get_iptc_tags(image_path, tags=None):
 
             ret[iptc_tag] = ensure_unicode(value, silent=True)
 
-    logg.info('{} read from file.'.format(ret))
-
     return ret
 
 
@@ -187,12 +198,6 @@ def write_iptc_tags(image_path, tag_dict):
 
         :return  status
     '''
-    try:
-        utils.process.call(['exiftool'])
-    except OSError:
-        logg.error('No exiftool installed.')
-        return
-
     image_path = os.path.abspath(image_path)
 
     if not os.path.exists(image_path):
@@ -203,19 +208,17 @@ def write_iptc_tags(image_path, tag_dict):
         logg.error(u'No dictionary of tags.')
         return
 
-    command_list = [u'exiftool']
-    command_list.append(u'-overwrite_original')
+    command_list = [u'-overwrite_original']
 
     command_list.append(u'-charset')
     command_list.append(u'iptc=UTF8')
 
-    command_list.append(image_path)
-
     for tag_name in tag_dict.keys():
         tag_value = tag_dict[tag_name]
 
         if tag_dict[tag_name] == '':
             command_list.append(u'-{}='.format(tag_name))
+            continue
 
         elif tag_name == u'DateCreated':
             if validateDate(parse_date(tag_value.split('T')[0], format='%Y-%m-%d')):
@@ -223,13 +226,18 @@ def write_iptc_tags(image_path, tag_dict):
             else:
                 logg.error(u'Could not validate {}.'.format(tag_value))
 
-        command_list.append(u'-charset iptc=UTF8')
         command_list.append(u'-{}={}'.format(tag_name, tag_value))
 
+    command_list.append(image_path)
+
     logg.info(u'Command: {} will be executed.'.format(command_list))
-    process = utils.process.Popen(command_list, stdout=subprocess.PIPE)
-    output, error = process.communicate()
+    try:
+        output = lib.iptc.pool.get_pool().execute(command_list)
+    except OSError:
+        logg.error('No exiftool installed.')
+        return
+    except (lib.iptc.pool.ExifToolError, ValueError) as e:
+        logg.error('Exiftool error: {}'.format(e))
+        return
 
-    if error is not None:
-        logg.info('Exiftool output: {}'.format(output))
-        logg.error('Exiftool error: {}'.format(error))
+    logg.info('Exiftool output: {}'.format(output))
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Pool of long-lived exiftool processes.
+
+    Starting exiftool means starting a Perl interpreter and loading the exiftool modules which takes much longer than
+    reading the metadata of a typical image. The processes in this pool are started with `-stay_open True` and read
+    their arguments from stdin, so they can be reused for many files. A process is replaced if it died, didn't answer
+    in time or handled `max_jobs_per_worker` requests.
+
+    Metadata is read with `-G1 -D -n`: all EXIF, IPTC and XMP tags of a file in one pass, with the specific group name
+    (IFD0, ExifIFD, IPTC, XMP-dc...), the numeric tag ID and unconverted values.
+
+    Config options (section [exiftool]):
+
+    * workers: maximum number of exiftool processes (default: 2)
+    * timeout: seconds to wait for an answer from exiftool (default: 60)
+    * max_jobs_per_worker: restart a process after this number of requests (default: 1000)
+"""
+from __future__ import absolute_import
+
+from collections import namedtuple
+from contextlib import contextmanager
+import json
+import logging
+import os
+import Queue
+import select
+from subprocess import PIPE
+import threading
+import time
+
+from core import config
+import utils.process
+
+
+logg = logging.getLogger(__name__)
+
+READY_MARKER = "{ready}\n"
+#: idle processes are checked with `-ver` before they are used again
+HEALTH_CHECK_INTERVAL = 300
+#: default number of files read with one request by get_metadata_batch()
+BATCH_SIZE = 50
+
+
+#: Metadata of a file. `values` maps "Group:TagName" to the tag value, `tag_ids` maps "Group:TagName" to the numeric tag ID
+#: (only for tags that have one).
+ExifToolMetadata = namedtuple("ExifToolMetadata", ["filepath", "values", "tag_ids"])
+
+
+class ExifToolError(Exception):
+    pass
+
+
+class ExifToolTimeout(ExifToolError):
+    pass
+
+
+class ExifToolPoolExhausted(ExifToolError):
+    """All processes of the pool were busy for longer than the timeout"""
+
+
+class ExifToolProcess(object):
+
+    """A single exiftool process in -stay_open mode"""
+
+    def __init__(self):
+        with open(os.devnull, "w") as devnull:
+            self.proc = utils.process.Popen(["exiftool", "-stay_open", "True", "-@", "-"],
+                                            stdin=PIPE, stdout=PIPE, stderr=devnull, close_fds=True)
+        self.jobs = 0
+        self.last_used = time.time()
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def _read_until_ready(self, timeout):
+        fd = self.proc.stdout.fileno()
+        deadline = time.time() + timeout
+        chunks = []
+        tail = ""
+        while not tail.endswith(READY_MARKER):
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise ExifToolTimeout("exiftool didn't answer in {} seconds".format(timeout))
+            data = os.read(fd, 65536)
+            if not data:
+                raise ExifToolError("exiftool process exited")
+            chunks.append(data)
+            tail = (tail + data)[-len(READY_MARKER):]
+        return "".join(chunks)[:-len(READY_MARKER)]
+
+    def execute(self, args, timeout):
+        """Runs exiftool with `args` and returns its output"""
+        for arg in args:
+            if "\n" in arg:
+                raise ValueError("exiftool arguments cannot contain newlines")
+        encoded_args = [a.encode("utf8") if isinstance(a, unicode) else a for a in args]
+        self.jobs += 1
+        self.last_used = time.time()
+        self.proc.stdin.write("\n".join(encoded_args + ["-execute", ""]))
+        self.proc.stdin.flush()
+        return self._read_until_ready(timeout)
+
+    def check(self, timeout):
+        """Returns True if the process answers"""
+        try:
+            return bool(self.execute(["-ver"], timeout).strip())
+        except (ExifToolError, IOError, OSError):
+            return False
+
+    def terminate(self):
+        if self.alive:
+            try:
+                self.proc.stdin.write("-stay_open\nFalse\n")
+                self.proc.stdin.flush()
+            except IOError:
+                pass
+            # give exiftool a moment to exit cleanly
+            for _ in range(10):
+                if not self.alive:
+                    break
+                time.sleep(0.05)
+            else:
+                self.proc.kill()
+        self.proc.wait()
+
+
+def _split_tag_ids(entry):
+    values = {}
+    tag_ids = {}
+    for key, value in entry.iteritems():
+        if isinstance(value, dict) and "val" in value:
+            if "id" in value:
+                tag_ids[key] = value["id"]
+            value = value["val"]
+        values[key] = value
+    return values, tag_ids
+
+
+class ExifToolPool(object):
+
+    def __init__(self, size, timeout=60, max_jobs=1000):
+        self.size = size
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self._idle = Queue.LifoQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _start_process(self):
+        proc = ExifToolProcess()
+        logg.debug("started exiftool process %s", proc.proc.pid)
+        return proc
+
+    def _acquire(self):
+        try:
+            proc = self._idle.get_nowait()
+        except Queue.Empty:
+            with self._lock:
+                start_new = self._started < self.size
+                if start_new:
+                    self._started += 1
+            if start_new:
+                try:
+                    return self._start_process()
+                except:
+                    with self._lock:
+                        self._started -= 1
+                    raise
+            try:
+                proc = self._idle.get(timeout=self.timeout)
+            except Queue.Empty:
+                logg.warn("all %s exiftool processes are busy, no process became available in %s seconds",
+                          self.size, self.timeout)
+                raise ExifToolPoolExhausted("no exiftool process available after {} seconds".format(self.timeout))
+
+        healthy = proc.alive and proc.jobs < self.max_jobs
+        if healthy and time.time() - proc.last_used > HEALTH_CHECK_INTERVAL:
+            healthy = proc.check(self.timeout)
+        if not healthy:
+            logg.info("replacing exiftool process %s after %s jobs", proc.proc.pid, proc.jobs)
+            proc.terminate()
+            try:
+                proc = self._start_process()
+            except:
+                with self._lock:
+                    self._started -= 1
+                raise
+        return proc
+
+    @contextmanager
+    def process(self):
+        """Yields an ExifToolProcess which is returned to the pool afterwards.
+        A process that failed is terminated and replaced by a new one on the next request.
+        """
+        proc = self._acquire()
+        try:
+            yield proc
+        except (ExifToolError, IOError, OSError):
+            logg.warn("exiftool process %s failed, terminating it", proc.proc.pid)
+            proc.terminate()
+            with self._lock:
+                self._started -= 1
+            proc = None
+            raise
+        finally:
+            if proc is not None:
+                self._idle.put(proc)
+
+    def execute(self, args, retries=1):
+        """Runs exiftool with `args` in a pool process and returns its output.
+        Failed requests are repeated `retries` times with a fresh process.
+        :raises ExifToolPoolExhausted: if no process became available in time, this is not retried
+        """
+        while True:
+            try:
+                with self.process() as proc:
+                    return proc.execute(args, self.timeout)
+            except ExifToolPoolExhausted:
+                raise
+            except ExifToolError:
+                if retries <= 0:
+                    raise
+                retries -= 1
+
+    def get_metadata_batch(self, filepaths, batch_size=BATCH_SIZE):
+        """Reads metadata for many files, `batch_size` files with one request.
+        Yields (filepath, ExifToolMetadata or exception) tuples. Unreadable files get an empty ExifToolMetadata.
+        """
+        filepaths = list(filepaths)
+        for start in range(0, len(filepaths), batch_size):
+            batch = [os.path.abspath(fp.encode("utf8") if isinstance(fp, unicode) else fp)
+                     for fp in filepaths[start:start + batch_size]]
+            try:
+                output = self.execute(["-j", "-G1", "-D", "-n"] + batch)
+                entries = json.loads(output.decode("utf8")) if output.strip() else []
+            except ExifToolPoolExhausted as e:
+                # reading the files one by one would wait for a process again for each file
+                for filepath in batch:
+                    yield filepath, e
+                continue
+            except (ExifToolError, ValueError) as e:
+                if len(batch) == 1:
+                    yield batch[0], e
+                    continue
+                # find out which file caused the problem
+                for filepath in batch:
+                    for result in self.get_metadata_batch([filepath]):
+                        yield result
+                continue
+
+            by_filepath = {entry.pop("SourceFile", u"").encode("utf8"): entry for entry in entries}
+            for filepath in batch:
+                values, tag_ids = _split_tag_ids(by_filepath.get(filepath, {}))
+                yield filepath, ExifToolMetadata(filepath, values, tag_ids)
+
+    def get_metadata(self, filepath):
+        """Reads EXIF, IPTC and XMP metadata for a file in one pass.
+        :rtype: ExifToolMetadata
+        :raises ExifToolError: if exiftool failed
+        """
+        _, result = next(self.get_metadata_batch([filepath]))
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def shutdown(self):
+        while True:
+            try:
+                proc = self._idle.get_nowait()
+            except Queue.Empty:
+                break
+            proc.terminate()
+            with self._lock:
+                self._started -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the exiftool pool, processes are started when they are needed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExifToolPool(config.getint("exiftool.workers", 2),
+                                 config.getint("exiftool.timeout", 60),
+                                 config.getint("exiftool.max_jobs_per_worker", 1000))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
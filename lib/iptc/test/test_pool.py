@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import os
+
+from pytest import yield_fixture, raises
+
+from lib.Exif.compat import exif_tags_from_exiftool
+from lib.iptc.pool import ExifToolPool, ExifToolMetadata, ExifToolPoolExhausted
+from lib.iptc.IPTC import iptc_tags_from_metadata
+
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data/')
+KEYWORDS_TIF = os.path.join(TEST_DATA_DIR, 'keywords_list.tif')
+EMPTY_JPG = os.path.join(TEST_DATA_DIR, 'empty.jpg')
+
+
+@yield_fixture
+def pool():
+    pool = ExifToolPool(1, timeout=30, max_jobs=3)
+    yield pool
+    pool.shutdown()
+
+
+def test_get_metadata(pool):
+    metadata = pool.get_metadata(KEYWORDS_TIF)
+    assert metadata.filepath == KEYWORDS_TIF
+    assert iptc_tags_from_metadata(metadata.values) == {'ApplicationRecordVersion': "4", 'Keywords': '1;2;3'}
+    assert metadata.tag_ids["IFD0:ImageWidth"] == 0x100
+
+
+def test_get_metadata_batch(pool):
+    filepaths = [KEYWORDS_TIF, EMPTY_JPG, os.path.join(TEST_DATA_DIR, "missing.jpg")]
+    results = list(pool.get_metadata_batch(filepaths, batch_size=2))
+    assert [filepath for filepath, _ in results] == filepaths
+    assert "IPTC:Keywords" in results[0][1].values
+    assert "IPTC:Keywords" not in results[1][1].values
+    assert results[2][1].values == {}
+
+
+def test_process_reused_and_replaced(pool):
+    with pool.process() as proc:
+        first_pid = proc.proc.pid
+    for _ in range(3):
+        pool.get_metadata(EMPTY_JPG)
+    with pool.process() as proc:
+        # max_jobs reached, the process must have been replaced
+        assert proc.proc.pid != first_pid
+
+
+def test_dead_process_replaced(pool):
+    with pool.process() as proc:
+        proc.proc.kill()
+        proc.proc.wait()
+    assert pool.get_metadata(EMPTY_JPG).filepath == EMPTY_JPG
+
+
+def test_pool_exhausted():
+    pool = ExifToolPool(1, timeout=0.1)
+    try:
+        with pool.process():
+            with raises(ExifToolPoolExhausted):
+                pool.execute(["-ver"])
+            results = list(pool.get_metadata_batch([KEYWORDS_TIF, EMPTY_JPG]))
+            assert [filepath for filepath, _ in results] == [KEYWORDS_TIF, EMPTY_JPG]
+            assert all(isinstance(result, ExifToolPoolExhausted) for _, result in results)
+        # the process is available again
+        assert pool.get_metadata(EMPTY_JPG).filepath == EMPTY_JPG
+    finally:
+        pool.shutdown()
+
+
+def test_exif_tags_from_exiftool():
+    metadata = ExifToolMetadata("test.jpg",
+                                {"IFD0:Make": u"Canon", "IFD0:Orientation": 6, "ExifIFD:ExposureTime": 0.0166666666666667,
+                                 "ExifIFD:ExifVersion": u"0230", "ExifIFD:ComponentsConfiguration": u"1 2 3 0",
+                                 "IPTC:Keywords": u"ignored"},
+                                {"IFD0:Make": 0x010F, "IFD0:Orientation": 0x0112, "ExifIFD:ExposureTime": 0x829A,
+                                 "ExifIFD:ExifVersion": 0x9000, "ExifIFD:ComponentsConfiguration": 0x9101,
+                                 "IPTC:Keywords": 25})
+    assert exif_tags_from_exiftool(metadata) == {
+        "Image Make": "Canon",
+        "Image Orientation": "Rotated 90 CW",
+        "EXIF ExposureTime": "1/60",
+        "EXIF ExifVersion": "0230",
+        "EXIF ComponentsConfiguration": "YCbCr",
+    }
@@ -67,31 +67,66 @@ class PDFInfo(object):
         return self.data
 
 
-def parsePDF(filename, tempdir):
-    # process info file
-    def parseInfo(lines):
-        attrs = ["Title", "Subject", "Keywords", "Author", "Creator", "Producer", "CreationDate", "ModDate",
-                 "Tagged", "Pages", "Encrypted", "Page size", "File size", "Optimized", "PDF Version", "Metadata"]
-        data = {}
-        for line in lines:
-            for attr in attrs:
-                parts = line.replace("\n", "").replace("\r", "").split(attr + ":")
-                if len(parts) == 2:
-                    # pdfinfo cannot handle strings in utf-16, they are clipped after BOM_UTF16_BE:
-                    if parts[1].strip() == codecs.BOM_UTF16_BE:
+INFO_ATTRIBUTES = ["Title", "Subject", "Keywords", "Author", "Creator", "Producer", "CreationDate", "ModDate",
+                   "Tagged", "Pages", "Encrypted", "Page size", "File size", "Optimized", "PDF Version", "Metadata"]
+
+
+def parse_info(lines):
+    """Parses the output lines of `pdfinfo` and returns a PDFInfo object"""
+    data = {}
+    for line in lines:
+        line = line.replace("\n", "").replace("\r", "")
+        for attr in INFO_ATTRIBUTES:
+            if not line.startswith(attr + ":"):
+                continue
+            value = line[len(attr) + 1:].strip()
+            # pdfinfo cannot handle strings in utf-16, they are clipped after BOM_UTF16_BE:
+            if value == codecs.BOM_UTF16_BE:
+                break
+            data[attr] = value
+
+            if attr == "Encrypted" and value.startswith("yes"):
+                for s_option in value[5:-1].split(" "):
+                    option = s_option.split(":")
+                    if option[1] == "":
                         break
-                    data[attr] = parts[1].strip()
-
-                    if attr == "Encrypted" and parts[1].strip().startswith("yes"):
-                        for s_option in parts[1].strip()[5:-1].split(" "):
-                            option = s_option.split(":")
-                            if option[1] == "":
-                                break
-                            data[option[0]] = option[1]
-                        data[attr] = "yes"
-                    break
-        return PDFInfo(data)
+                    data[option[0]] = option[1]
+                data[attr] = "yes"
+            # pdfinfo prints one attribute per line, values may contain the names of other attributes
+            break
+    return PDFInfo(data)
+
+
+def write_info_file(info, infoname):
+    """Writes PDF info data in the format of the .info files stored as 'fileinfo' files"""
+    with open(infoname, "w") as finfo:
+        for item in info.items():
+            finfo.write(item + ":" + (" " * (15 - len(item)) + info[item] + "\n"))
+
+
+def get_convert_cmd(filename, imgfile):
+    """Returns the command that converts the first page of `filename` to `imgfile`.
+    The convert command from the config is used if defined.
+    """
+    convert_cmd = config.get("external.convert_cmd", "")
+    if convert_cmd and convert_cmd.find("pdf_file") >= 0 and convert_cmd.find("image_file") >= 0:
+        convert_cmd = convert_cmd.replace("pdf_file", filename + "[0]")
+        convert_cmd = convert_cmd.replace("image_file", imgfile)
+        return convert_cmd.split(' ')
+
+    return ["gm", "convert", "-colorspace", "RGB", "-density", "300",
+            filename + "[0]", "-background", "white", "-thumbnail", "x300", imgfile]
+
 
+def get_fulltext_cmd(filename, fulltext_from_pdftotext):
+    return ["pdftotext", "-enc", "UTF-8", filename, fulltext_from_pdftotext]
+
+
+def get_fulltext_normalization_cmd(fulltext_from_pdftotext, fulltext):
+    return ["uconv", "-x", "any-nfc", "-f", "UTF-8", "-t", "UTF-8", "--output", fulltext, fulltext_from_pdftotext]
+
+
+def parsePDF(filename, tempdir):
     name = ".".join(filename.split(".")[:-1])
     imgfile = os.path.join(tempdir, "tmp" + str(random.random()) + ".png")
     thumb128 = name + ".thumb"
@@ -107,27 +142,16 @@ def parsePDF(filename, tempdir):
         logg.exception("failed to extract metadata from file %s")
         info = PDFInfo()
     else:
-        info = parseInfo(out.splitlines())
+        info = parse_info(out.splitlines())
 
     # test for correct rights
     if info.isEncrypted():
         raise PDFException("error:document encrypted")
 
-    finfo = open(infoname, "w")
-    for item in info.items():  # infokeys:
-        finfo.write(item + ":" + (" " * (15 - len(item)) + info[item] + "\n"))
-    finfo.close()
+    write_info_file(info, infoname)
 
     # convert first page to image (graphicsmagick + ghostview)
-    # use convert command from config if defined
-    convert_cmd = config.get("external.convert_cmd", "")
-    if convert_cmd and convert_cmd.find("pdf_file") >= 0 and convert_cmd.find("image_file") >= 0:
-       convert_cmd = convert_cmd.replace("pdf_file", filename + "[0]")
-       convert_cmd = convert_cmd.replace("image_file", imgfile)
-       convert_cmd = convert_cmd.split(' ')
-    else:
-        convert_cmd = ["gm", "convert", "-colorspace", "RGB", "-density", "300",
-                       filename + "[0]", "-background", "white", "-thumbnail", "x300", imgfile]
+    convert_cmd = get_convert_cmd(filename, imgfile)
     try:
         utils.process.check_call(convert_cmd)
     except CalledProcessError:
@@ -136,14 +160,14 @@ def parsePDF(filename, tempdir):
         makeThumbs(imgfile, thumb128, thumb300)
 
     # extract fulltext (xpdf)
-    fulltext_cmd = ["pdftotext", "-enc", "UTF-8", filename, fulltext_from_pdftotext]
+    fulltext_cmd = get_fulltext_cmd(filename, fulltext_from_pdftotext)
     try:
         utils.process.check_call(fulltext_cmd)
     except CalledProcessError:
         logg.exception("failed to extract fulltext from file %s", filename)
 
     # normalization of fulltext (uconv)
-    fulltext_normalization_cmd = ["uconv", "-x", "any-nfc", "-f", "UTF-8", "-t", "UTF-8", "--output", fulltext, fulltext_from_pdftotext]
+    fulltext_normalization_cmd = get_fulltext_normalization_cmd(fulltext_from_pdftotext, fulltext)
     try:
         utils.process.check_call(fulltext_normalization_cmd)
     except CalledProcessError:
@@ -154,7 +178,9 @@ def parsePDF(filename, tempdir):
 
 
 def parsePDFExternal(filepath, tempdir):
-    """Call parsePDF as external process"""
+    """Call parsePDF as external process.
+    Prefer lib.pdf.pool.parse_pdf() which reuses long-lived worker processes.
+    """
     from core.config import basedir
     retcode = call([sys.executable, os.path.join(basedir, "lib/pdf/parsepdf.py"), filepath, tempdir])
     if retcode == 111:
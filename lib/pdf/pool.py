@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Long-lived pool of worker processes for PDF processing.
+
+    parsePDFExternal() starts a new Python interpreter for every document which then runs
+    pdfinfo, convert, pdftotext and uconv one after another. The pool defined here keeps
+    a configurable number of worker processes alive. Each job starts the external tools
+    concurrently and returns a PDFResult instead of writing an .info file.
+
+    Config options (section [pdf]):
+
+    * workers: number of worker processes (default: number of CPUs)
+    * timeout: seconds a single document may take before it's aborted (default: 600)
+    * memory_limit: address space limit for a worker and its subprocesses in MiB (default: unlimited)
+    * max_jobs_per_worker: restart a worker after it processed this number of documents (default: 100)
+"""
+from __future__ import absolute_import
+
+from collections import namedtuple
+import logging
+import multiprocessing
+import os
+import random
+import signal
+from subprocess import PIPE
+import threading
+
+from core import config
+from lib.pdf.parsepdf import PDFException, parse_info, get_convert_cmd, get_fulltext_cmd, \
+    get_fulltext_normalization_cmd, makeThumbs
+import utils.process
+
+
+logg = logging.getLogger(__name__)
+
+
+#: Result of a processed PDF file. `info` is a dict of pdfinfo values.
+#: `thumb`, `thumb2` and `fulltext` are file paths or None if the step failed, `errors` is a list of messages.
+PDFResult = namedtuple("PDFResult", ["filepath", "info", "thumb", "thumb2", "fulltext", "errors"])
+
+
+class PDFTimeout(PDFException):
+    pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _handle_alarm(signum, frame):
+    raise PDFTimeout("error:timeout")
+
+
+def _init_worker(memory_limit):
+    # the parent handles SIGINT and shuts down the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, _handle_alarm)
+    if memory_limit:
+        import resource
+        limit = memory_limit * 1024 * 1024
+        # also applies to the external tools started by the worker
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _kill(proc):
+    if proc.poll() is None:
+        try:
+            proc.kill()
+        except OSError:
+            pass
+        proc.wait()
+
+
+def _remove_if_exists(filepath):
+    if os.path.exists(filepath):
+        os.remove(filepath)
+
+
+def _process_pdf(filepath, tempdir, timeout):
+    """Runs in a worker process. pdfinfo, convert and pdftotext are started at the same time,
+    uconv and the thumbnail creation wait for the step they depend on.
+    """
+    signal.alarm(timeout)
+    name = ".".join(filepath.split(".")[:-1])
+    imgfile = os.path.join(tempdir, "tmp" + str(random.random()) + ".png")
+    thumb = name + ".thumb"
+    thumb2 = name + ".thumb2"
+    fulltext_from_pdftotext = name + ".pdftotext"
+    fulltext = name + ".txt"
+    errors = []
+    procs = []
+
+    try:
+        info_proc = utils.process.Popen(["pdfinfo", filepath], stdout=PIPE)
+        procs.append(info_proc)
+        convert_proc = utils.process.Popen(get_convert_cmd(filepath, imgfile))
+        procs.append(convert_proc)
+        fulltext_proc = utils.process.Popen(get_fulltext_cmd(filepath, fulltext_from_pdftotext))
+        procs.append(fulltext_proc)
+
+        out, _ = info_proc.communicate()
+        if info_proc.returncode:
+            errors.append("failed to extract metadata")
+            info = {}
+        else:
+            info = parse_info(out.splitlines()).data
+
+        if info.get("Encrypted") == "yes":
+            raise PDFException("error:document encrypted")
+
+        if fulltext_proc.wait():
+            errors.append("failed to extract fulltext")
+            fulltext = None
+        else:
+            normalization_proc = utils.process.Popen(get_fulltext_normalization_cmd(fulltext_from_pdftotext, fulltext))
+            procs.append(normalization_proc)
+
+        if convert_proc.wait():
+            errors.append("failed to create thumbnail")
+            thumb = thumb2 = None
+        else:
+            makeThumbs(imgfile, thumb, thumb2)
+
+        if fulltext is not None and normalization_proc.wait():
+            errors.append("failed to normalize fulltext")
+            fulltext = None
+
+        return PDFResult(filepath, info, thumb, thumb2, fulltext, errors)
+
+    finally:
+        signal.alarm(0)
+        for proc in procs:
+            _kill(proc)
+        _remove_if_exists(fulltext_from_pdftotext)
+        _remove_if_exists(imgfile)
+
+
+def _process_pdf_catch(filepath, tempdir, timeout):
+    """Bulk variant of _process_pdf(): exceptions are returned instead of raised, one failure must not stop the rest."""
+    try:
+        return filepath, _process_pdf(filepath, tempdir, timeout)
+    except Exception as e:
+        return filepath, e
+
+
+def _process_pdf_star(args):
+    return _process_pdf_catch(*args)
+
+
+def _get_timeout():
+    return config.getint("pdf.timeout", 600)
+
+
+def get_pool():
+    """Returns the process pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = config.getint("pdf.workers", multiprocessing.cpu_count())
+            memory_limit = config.getint("pdf.memory_limit", 0)
+            max_jobs = config.getint("pdf.max_jobs_per_worker", 100)
+            _pool = multiprocessing.Pool(workers, _init_worker, (memory_limit, ), max_jobs)
+            logg.info("started PDF worker pool with %s processes, memory limit %s MiB", workers, memory_limit or "-")
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool.join()
+            _pool = None
+
+
+def parse_pdf(filepath, tempdir=None):
+    """Extracts info, thumbnails and fulltext for a PDF file in a pool worker.
+    Thumbnail and fulltext files are written next to `filepath`.
+    :returns: PDFResult
+    :raises PDFException: if the document is encrypted or the job timed out
+    """
+    if tempdir is None:
+        tempdir = config.get("paths.tempdir")
+    timeout = _get_timeout()
+    async_result = get_pool().apply_async(_process_pdf, (filepath, tempdir, timeout))
+    try:
+        # the worker aborts itself after `timeout`, this only protects us from a hanging worker
+        return async_result.get(timeout + 30)
+    except multiprocessing.TimeoutError:
+        raise PDFTimeout("error:timeout")
+
+
+def parse_pdfs(filepaths, tempdir=None):
+    """Bulk mode: processes many PDF files using all pool workers.
+    Yields (filepath, PDFResult or exception) tuples in completion order.
+    """
+    if tempdir is None:
+        tempdir = config.get("paths.tempdir")
+    timeout = _get_timeout()
+    jobs = ((filepath, tempdir, timeout) for filepath in filepaths)
+    for filepath, result in get_pool().imap_unordered(_process_pdf_star, jobs):
+        yield filepath, result
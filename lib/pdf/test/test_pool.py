@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import os
+
+import pytest
+
+import core.config
+from lib.pdf import pool
+from lib.pdf.parsepdf import PDFException, parse_info
+
+
+settings_external = {
+    "external.pdfinfo": os.path.join(os.path.dirname(__file__), "test_pool_pdfinfo_encrypted.sh"),
+    "external.gm": "true",
+    "external.pdftotext": "true",
+    "external.uconv": "true",
+}
+
+
+def test_parse_info_encrypted():
+    lines = ["Title:          test",
+             "Page size:      595 x 842 pts (A4)",
+             "Encrypted:      yes (print:no copy:yes)"]
+    info = parse_info(lines)
+    assert info.isEncrypted()
+    assert info["Title"] == "test"
+    assert info["Page size"] == "595 x 842 pts (A4)"
+    assert info["print"] == "no"
+    assert info["copy"] == "yes"
+
+
+def test_parse_info_value_contains_attribute_name():
+    lines = ["Title:          Keywords: a review",
+             "Producer:       Creator: pdfTeX",
+             "Pages:          3"]
+    info = parse_info(lines)
+    assert info["Title"] == "Keywords: a review"
+    assert info["Producer"] == "Creator: pdfTeX"
+    assert info["Pages"] == "3"
+    assert "Keywords" not in info.data
+    assert "Creator" not in info.data
+
+
+def test_process_pdf_encrypted(monkeypatch, tmpdir):
+    monkeypatch.setattr(core.config, "settings", settings_external)
+    pdf_filepath = str(tmpdir.join("test.pdf"))
+    with pytest.raises(PDFException) as excinfo:
+        pool._process_pdf(pdf_filepath, str(tmpdir), 10)
+    assert excinfo.value.value == "error:document encrypted"
+    # temporary files must be removed
+    assert tmpdir.listdir() == []
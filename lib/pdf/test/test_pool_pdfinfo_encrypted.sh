@@ -0,0 +1,5 @@
+#!/usr/bin/env sh
+# stands in for pdfinfo, prints the output for an encrypted document
+echo "Title:          test"
+echo "Pages:          1"
+echo "Encrypted:      yes (print:no copy:no change:no addNotes:no)"
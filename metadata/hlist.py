@@ -6,6 +6,7 @@ from core.metatype import Metatype
 from core.transition import httpstatus
 from core import Node
 from core import db
+from core.nodecache import get_node_snapshot
 
 q = db.query
 
@@ -39,9 +40,9 @@ class m_hlist(Metatype):
         ids = node.get(metafield.getName())
         if ids:
             for n in ids.split(';'):
-                vn = q(Node).get(n)
+                vn = get_node_snapshot(n)
                 if vn is not None:
-                    value.append(vn.getName())
+                    value.append(vn.name)
         values = metafield.get("valuelist").split(';')
         while len(values) < 3:
             values.append(u'')
@@ -0,0 +1,125 @@
+"""add node_version_attrs_diff table for attribute diffs of node versions
+
+Revision ID: 0d3f5b7a9c1e
+Revises: 9c2e4a6b8d0f
+Create Date: 2016-12-15 11:23:40.571206
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0d3f5b7a9c1e'
+down_revision = '9c2e4a6b8d0f'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table('node_version_attrs_diff',
+                    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+                    sa.Column('transaction_id', sa.BigInteger(), autoincrement=False, nullable=False),
+                    sa.Column('base_transaction_id', sa.BigInteger(), nullable=False),
+                    sa.Column('attrs_changed', postgresql.JSONB(), nullable=False),
+                    sa.Column('attrs_removed', postgresql.ARRAY(sa.UnicodeText()), nullable=False),
+                    sa.PrimaryKeyConstraint('id', 'transaction_id'),
+                    schema='mediatum'
+                    )
+
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION node_version_attrs(node_id integer, tx_id bigint)
+    RETURNS jsonb
+    LANGUAGE plpgsql
+    SET search_path = mediatum
+    STABLE
+    AS $f$
+DECLARE
+    res jsonb;
+    diff node_version_attrs_diff;
+BEGIN
+    SELECT attrs INTO res FROM node_version WHERE id = node_id AND transaction_id = tx_id;
+    IF res IS NOT NULL THEN
+        RETURN res;
+    END IF;
+
+    SELECT * INTO diff FROM node_version_attrs_diff WHERE id = node_id AND transaction_id = tx_id;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT jsonb_object_patch(attrs, diff.attrs_changed, diff.attrs_removed) INTO res
+    FROM node_version WHERE id = node_id AND transaction_id = diff.base_transaction_id;
+
+    RETURN res;
+END;
+$f$;
+
+
+CREATE OR REPLACE FUNCTION store_node_version_attrs_diffs(tx_id bigint, node_ids integer[])
+    RETURNS integer
+    LANGUAGE plpgsql
+    SET search_path = mediatum
+    AS $f$
+DECLARE
+    v record;
+    base record;
+    changed jsonb;
+    removed text[];
+    stored integer := 0;
+BEGIN
+    FOR v IN SELECT id, attrs FROM node_version
+             WHERE transaction_id = tx_id AND id = ANY(node_ids) AND attrs IS NOT NULL LOOP
+
+        SELECT transaction_id, attrs INTO base FROM node_version
+        WHERE id = v.id AND transaction_id < tx_id AND attrs IS NOT NULL
+        ORDER BY transaction_id DESC LIMIT 1;
+        CONTINUE WHEN NOT FOUND;
+
+        SELECT coalesce(jsonb_object_agg(key, value), '{}') INTO changed
+        FROM jsonb_each(v.attrs)
+        WHERE NOT base.attrs ? key OR base.attrs -> key <> value;
+
+        removed := ARRAY(SELECT key FROM jsonb_each(base.attrs) WHERE NOT v.attrs ? key);
+
+        -- keep the complete copy if the diff isn't smaller
+        CONTINUE WHEN length(changed::text) + length(removed::text) >= length(v.attrs::text);
+
+        INSERT INTO node_version_attrs_diff (id, transaction_id, base_transaction_id, attrs_changed, attrs_removed)
+        VALUES (v.id, tx_id, base.transaction_id, changed, removed);
+        UPDATE node_version SET attrs = NULL WHERE id = v.id AND transaction_id = tx_id;
+        stored := stored + 1;
+    END LOOP;
+
+    RETURN stored;
+END;
+$f$;
+
+
+CREATE OR REPLACE FUNCTION materialize_node_version_attrs(node_id integer, tx_id bigint)
+    RETURNS void
+    LANGUAGE plpgsql
+    SET search_path = mediatum
+    AS $f$
+BEGIN
+    UPDATE node_version SET attrs = node_version_attrs(node_id, tx_id)
+    WHERE id = node_id AND transaction_id = tx_id AND attrs IS NULL;
+
+    DELETE FROM node_version_attrs_diff WHERE id = node_id AND transaction_id = tx_id;
+END;
+$f$;
+""")
+
+
+def downgrade():
+    op.execute(u"""
+UPDATE mediatum.node_version nv SET attrs = mediatum.node_version_attrs(d.id, d.transaction_id)
+FROM mediatum.node_version_attrs_diff d
+WHERE nv.id = d.id AND nv.transaction_id = d.transaction_id;
+
+DROP FUNCTION mediatum.materialize_node_version_attrs(integer, bigint);
+DROP FUNCTION mediatum.store_node_version_attrs_diffs(bigint, integer[]);
+DROP FUNCTION mediatum.node_version_attrs(integer, bigint);
+""")
+    op.drop_table('node_version_attrs_diff', schema='mediatum')
@@ -0,0 +1,32 @@
+"""add sha256 and filesize columns to File model
+
+Revision ID: 1a0b3c5d7e9f
+Revises: 3296a17debd3
+Create Date: 2016-10-24 11:02:31.487213
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1a0b3c5d7e9f'
+down_revision = '3296a17debd3'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('file', sa.Column('sha256', sa.String(length=64), nullable=True))
+    op.add_column('file', sa.Column('filesize', sa.BigInteger(), nullable=True))
+    op.create_index(op.f('ix_mediatum_file_sha256'), 'file', ['sha256'], unique=False, schema='mediatum')
+    op.add_column('file_version', sa.Column('sha256', sa.String(length=64), autoincrement=False, nullable=True))
+    op.add_column('file_version', sa.Column('filesize', sa.BigInteger(), autoincrement=False, nullable=True))
+
+
+def downgrade():
+    op.drop_column('file_version', 'filesize')
+    op.drop_column('file_version', 'sha256')
+    op.drop_index(op.f('ix_mediatum_file_sha256'), table_name='file', schema='mediatum')
+    op.drop_column('file', 'filesize')
+    op.drop_column('file', 'sha256')
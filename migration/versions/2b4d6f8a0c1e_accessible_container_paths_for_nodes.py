@@ -0,0 +1,62 @@
+"""add accessible_container_paths_for_nodes SQL function
+
+Revision ID: 2b4d6f8a0c1e
+Revises: 1a0b3c5d7e9f
+Create Date: 2016-10-27 14:21:09.114620
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b4d6f8a0c1e'
+down_revision = '1a0b3c5d7e9f'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION mediatum.accessible_container_paths_for_nodes(node_ids integer[], exclude_container_ids integer[]=ARRAY[]::integer[]
+                                                               ,group_ids integer[]=NULL, ipaddr inet=NULL, date date=NULL)
+    RETURNS TABLE (node_id integer, path integer[])
+    LANGUAGE plpgsql
+    SET search_path = mediatum
+    STABLE
+    AS $f$
+BEGIN
+RETURN QUERY 
+WITH parents AS (
+    SELECT nm.cid, nm.nid
+    FROM nodemapping nm
+    WHERE nm.cid = ANY(node_ids)
+    AND NOT ARRAY[nm.nid] <@ exclude_container_ids
+),
+readable AS (
+    SELECT a.nid
+    FROM (SELECT p.nid FROM parents p
+          UNION
+          SELECT nr.nid FROM noderelation nr WHERE nr.cid IN (SELECT p.nid FROM parents p)) a
+    WHERE NOT ARRAY[a.nid] <@ exclude_container_ids
+    AND has_read_access_to_node(a.nid, group_ids, ipaddr, date)
+)
+SELECT 
+    p.cid,
+    (SELECT array_append(array_agg(q.nid), p.nid)
+     FROM (SELECT nr.nid 
+           FROM noderelation nr 
+           JOIN readable r ON r.nid = nr.nid
+           WHERE nr.cid = p.nid
+           ORDER BY nr.distance DESC) q)
+
+FROM parents p
+JOIN readable r ON r.nid = p.nid
+ORDER BY p.cid, p.nid;
+END;
+$f$;
+""")
+
+
+def downgrade():
+    op.execute("DROP FUNCTION mediatum.accessible_container_paths_for_nodes(integer[], integer[], integer[], inet, date)")
@@ -0,0 +1,37 @@
+"""add access_stat table for aggregated access statistics
+
+Revision ID: 3c5e7a9b1d2f
+Revises: 2b4d6f8a0c1e
+Create Date: 2016-11-02 10:12:44.305117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c5e7a9b1d2f'
+down_revision = '2b4d6f8a0c1e'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table('access_stat',
+                    sa.Column('nid', sa.Integer(), autoincrement=False, nullable=False),
+                    sa.Column('day', sa.Date(), nullable=False),
+                    sa.Column('type', sa.SmallInteger(), autoincrement=False, nullable=False),
+                    sa.Column('country', sa.String(length=2), server_default='', nullable=False),
+                    sa.Column('hits', sa.Integer(), nullable=False),
+                    sa.Column('visitors', sa.Integer(), nullable=False),
+                    sa.Column('hour_hits', postgresql.ARRAY(sa.Integer()), nullable=True),
+                    sa.Column('hour_visitors', postgresql.ARRAY(sa.Integer()), nullable=True),
+                    sa.PrimaryKeyConstraint('nid', 'day', 'type', 'country'),
+                    schema='mediatum'
+                    )
+
+
+def downgrade():
+    # removes the month partitions, too
+    op.execute("DROP TABLE mediatum.access_stat CASCADE")
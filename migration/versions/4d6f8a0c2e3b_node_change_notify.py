@@ -0,0 +1,42 @@
+"""add node_change_notify trigger
+
+Revision ID: 4d6f8a0c2e3b
+Revises: 3c5e7a9b1d2f
+Create Date: 2016-11-21 10:12:44.402151
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d6f8a0c2e3b'
+down_revision = '3c5e7a9b1d2f'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION mediatum.notify_node_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO mediatum
+AS $f$
+BEGIN
+    PERFORM pg_notify('node_changed', OLD.id::text);
+    RETURN NULL;
+END;
+$f$;
+
+DROP TRIGGER IF EXISTS node_change_notify ON mediatum.node;
+CREATE TRIGGER node_change_notify
+AFTER UPDATE OF name, type, schema, attrs, system_attrs OR DELETE ON mediatum.node
+FOR EACH ROW
+EXECUTE PROCEDURE mediatum.notify_node_change();
+""")
+
+
+def downgrade():
+    op.execute(u"DROP TRIGGER IF EXISTS node_change_notify ON mediatum.node")
+    op.execute(u"DROP FUNCTION IF EXISTS mediatum.notify_node_change()")
@@ -0,0 +1,48 @@
+"""add jsonb_object_patch function for bulk edits
+
+Revision ID: 5e7a9b1c3d4f
+Revises: 4d6f8a0c2e3b
+Create Date: 2016-11-28 14:37:02.118394
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e7a9b1c3d4f'
+down_revision = '4d6f8a0c2e3b'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION mediatum.jsonb_object_patch(obj jsonb, changed jsonb, keys_to_delete text[]) RETURNS jsonb
+    LANGUAGE plpgsql
+    SET search_path TO mediatum
+    IMMUTABLE
+    AS $f$
+DECLARE
+    res jsonb;
+BEGIN
+    changed := COALESCE(changed, '{}');
+    keys_to_delete := COALESCE(keys_to_delete, '{}');
+
+    SELECT INTO res COALESCE(
+      (SELECT ('{' || string_agg(to_json(kv.key) || ':' || kv.value, ',') || '}')
+       FROM (SELECT key, value FROM jsonb_each(COALESCE(obj, '{}'))
+             WHERE "key" <> ALL (keys_to_delete) AND NOT changed ? "key"
+             UNION ALL
+             SELECT key, value FROM jsonb_each(changed)) kv),
+      '{}'
+    )::jsonb;
+
+    RETURN res;
+END;
+$f$;
+""")
+
+
+def downgrade():
+    op.execute(u"DROP FUNCTION IF EXISTS mediatum.jsonb_object_patch(jsonb, jsonb, text[])")
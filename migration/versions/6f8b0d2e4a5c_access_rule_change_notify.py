@@ -0,0 +1,66 @@
+"""add access rule change notification triggers
+
+Revision ID: 6f8b0d2e4a5c
+Revises: 5e7a9b1c3d4f
+Create Date: 2016-12-05 11:02:37.513208
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6f8b0d2e4a5c'
+down_revision = '5e7a9b1c3d4f'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION mediatum.notify_node_access_rule_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO mediatum
+AS $f$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM pg_notify('node_changed', OLD.nid::text);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM pg_notify('node_changed', NEW.nid::text);
+    END IF;
+    RETURN NULL;
+END;
+$f$;
+
+DROP TRIGGER IF EXISTS node_access_rule_change_notify ON mediatum.node_to_access_rule;
+CREATE TRIGGER node_access_rule_change_notify
+AFTER INSERT OR UPDATE OR DELETE ON mediatum.node_to_access_rule
+FOR EACH ROW
+EXECUTE PROCEDURE mediatum.notify_node_access_rule_change();
+
+CREATE OR REPLACE FUNCTION mediatum.notify_access_rule_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO mediatum
+AS $f$
+BEGIN
+    PERFORM pg_notify('node_changed', nid::text) FROM node_to_access_rule WHERE rule_id = NEW.id;
+    RETURN NULL;
+END;
+$f$;
+
+DROP TRIGGER IF EXISTS access_rule_change_notify ON mediatum.access_rule;
+CREATE TRIGGER access_rule_change_notify
+AFTER UPDATE ON mediatum.access_rule
+FOR EACH ROW
+EXECUTE PROCEDURE mediatum.notify_access_rule_change();
+""")
+
+
+def downgrade():
+    op.execute(u"DROP TRIGGER IF EXISTS access_rule_change_notify ON mediatum.access_rule")
+    op.execute(u"DROP FUNCTION IF EXISTS mediatum.notify_access_rule_change()")
+    op.execute(u"DROP TRIGGER IF EXISTS node_access_rule_change_notify ON mediatum.node_to_access_rule")
+    op.execute(u"DROP FUNCTION IF EXISTS mediatum.notify_node_access_rule_change()")
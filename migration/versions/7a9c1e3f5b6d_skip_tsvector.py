@@ -0,0 +1,71 @@
+"""skip insert_node_tsvectors if mediatum.skip_tsvector is set
+
+Revision ID: 7a9c1e3f5b6d
+Revises: 6f8b0d2e4a5c
+Create Date: 2016-12-07 09:48:15.230871
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a9c1e3f5b6d'
+down_revision = '6f8b0d2e4a5c'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+INSERT_NODE_TSVECTORS = u"""
+CREATE OR REPLACE FUNCTION mediatum.insert_node_tsvectors() RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path = mediatum
+    AS $$
+DECLARE
+    searchconfig regconfig;
+    fulltext_autoindex_languages text[];
+    attribute_autoindex_languages text[];
+BEGIN
+    {skip}
+    fulltext_autoindex_languages = get_fulltext_autoindex_languages();
+
+    IF fulltext_autoindex_languages IS NOT NULL THEN
+        FOREACH searchconfig IN ARRAY fulltext_autoindex_languages LOOP
+            INSERT INTO fts (nid, config, searchtype, tsvec)
+            SELECT NEW.id, searchconfig, 'fulltext', to_tsvector_safe(searchconfig, NEW.fulltext);
+        END LOOP;
+    END IF;
+
+    attribute_autoindex_languages = get_attribute_autoindex_languages();
+
+    IF attribute_autoindex_languages IS NOT NULL THEN
+        FOREACH searchconfig IN ARRAY attribute_autoindex_languages LOOP
+            INSERT INTO fts (nid, config, searchtype, tsvec)
+            SELECT NEW.id, searchconfig, 'attrs', jsonb_object_values_to_tsvector(searchconfig, NEW.attrs);
+        END LOOP;
+    END IF;
+RETURN NEW;
+END;
+$$;
+"""
+
+
+def upgrade():
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION mediatum.skip_tsvector() RETURNS boolean
+    LANGUAGE plpgsql
+    STABLE
+    AS $$
+BEGIN
+    RETURN current_setting('mediatum.skip_tsvector') = 'on';
+EXCEPTION WHEN undefined_object THEN
+    RETURN false;
+END;
+$$;
+""")
+    op.execute(INSERT_NODE_TSVECTORS.format(skip=u"IF skip_tsvector() THEN\n        RETURN NEW;\n    END IF;\n"))
+
+
+def downgrade():
+    op.execute(INSERT_NODE_TSVECTORS.format(skip=u""))
+    op.execute(u"DROP FUNCTION IF EXISTS mediatum.skip_tsvector()")
@@ -0,0 +1,88 @@
+"""send one notification per statement for access rule changes
+
+Revision ID: 8b1d3f5a7c9e
+Revises: 7a9c1e3f5b6d
+Create Date: 2016-12-12 14:21:08.310457
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8b1d3f5a7c9e'
+down_revision = '7a9c1e3f5b6d'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION mediatum.notify_access_rule_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO mediatum
+AS $f$
+BEGIN
+    PERFORM pg_notify('node_changed', '*');
+    RETURN NULL;
+END;
+$f$;
+
+DROP TRIGGER IF EXISTS node_access_rule_change_notify ON mediatum.node_to_access_rule;
+CREATE TRIGGER node_access_rule_change_notify
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON mediatum.node_to_access_rule
+FOR EACH STATEMENT
+EXECUTE PROCEDURE mediatum.notify_access_rule_change();
+
+DROP FUNCTION IF EXISTS mediatum.notify_node_access_rule_change();
+
+DROP TRIGGER IF EXISTS access_rule_change_notify ON mediatum.access_rule;
+CREATE TRIGGER access_rule_change_notify
+AFTER UPDATE ON mediatum.access_rule
+FOR EACH STATEMENT
+EXECUTE PROCEDURE mediatum.notify_access_rule_change();
+""")
+
+
+def downgrade():
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION mediatum.notify_node_access_rule_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO mediatum
+AS $f$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM pg_notify('node_changed', OLD.nid::text);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM pg_notify('node_changed', NEW.nid::text);
+    END IF;
+    RETURN NULL;
+END;
+$f$;
+
+DROP TRIGGER IF EXISTS node_access_rule_change_notify ON mediatum.node_to_access_rule;
+CREATE TRIGGER node_access_rule_change_notify
+AFTER INSERT OR UPDATE OR DELETE ON mediatum.node_to_access_rule
+FOR EACH ROW
+EXECUTE PROCEDURE mediatum.notify_node_access_rule_change();
+
+CREATE OR REPLACE FUNCTION mediatum.notify_access_rule_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO mediatum
+AS $f$
+BEGIN
+    PERFORM pg_notify('node_changed', nid::text) FROM node_to_access_rule WHERE rule_id = NEW.id;
+    RETURN NULL;
+END;
+$f$;
+
+DROP TRIGGER IF EXISTS access_rule_change_notify ON mediatum.access_rule;
+CREATE TRIGGER access_rule_change_notify
+AFTER UPDATE ON mediatum.access_rule
+FOR EACH ROW
+EXECUTE PROCEDURE mediatum.notify_access_rule_change();
+""")
@@ -0,0 +1,59 @@
+"""limit node change notifications per transaction
+
+Revision ID: 9c2e4a6b8d0f
+Revises: 8b1d3f5a7c9e
+Create Date: 2016-12-13 09:47:52.118630
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9c2e4a6b8d0f'
+down_revision = '8b1d3f5a7c9e'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION mediatum.notify_node_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO mediatum
+AS $f$
+DECLARE
+    changed integer;
+BEGIN
+    BEGIN
+        changed := coalesce(nullif(current_setting('mediatum.node_change_count'), ''), '0')::integer + 1;
+    EXCEPTION WHEN undefined_object THEN
+        changed := 1;
+    END;
+    PERFORM set_config('mediatum.node_change_count', changed::text, true);
+
+    IF changed <= 1000 THEN
+        PERFORM pg_notify('node_changed', OLD.id::text);
+    ELSIF changed = 1001 THEN
+        PERFORM pg_notify('node_changed', '*');
+    END IF;
+    RETURN NULL;
+END;
+$f$;
+""")
+
+
+def downgrade():
+    op.execute(u"""
+CREATE OR REPLACE FUNCTION mediatum.notify_node_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    SET search_path TO mediatum
+AS $f$
+BEGIN
+    PERFORM pg_notify('node_changed', OLD.id::text);
+    RETURN NULL;
+END;
+$f$;
+""")
@@ -28,6 +28,7 @@
     not dealing with curly braces at all)
 """
 
+from collections import namedtuple
 import re
 import os
 import shutil
@@ -237,6 +238,59 @@ def detecttype(doctype, fields):
         return None
 
 
+#: result of get_bibtex_field_mapping().
+#: `fieldnames` maps bibtex field names to attribute names, `datefields` maps attribute names of date fields to their format.
+#: `errors` is a list of messages for mask items that could not be resolved.
+BibTeXFieldMapping = namedtuple("BibTeXFieldMapping", ["fieldnames", "datefields", "errors"])
+
+
+def get_bibtex_field_mapping(metatype_name):
+    """Resolves the bibtex import mask of a metadatatype.
+    Mapping fields and metafields referenced by the mask items are fetched with a single query.
+    """
+    metadatatype = q(Metadatatype).filter_by(name=metatype_name).one()
+    mask = metadatatype.get_mask(u"bibtex_import") or metadatatype.get_mask(u"bibtex")
+    fieldnames = {}
+    datefields = {}
+    errors = []
+
+    if not mask:
+        return BibTeXFieldMapping(fieldnames, datefields, errors)
+
+    maskitems = mask.all_maskitems.all()
+    referenced_ids = set()
+    for f in maskitems:
+        for attrname in (u"mappingfield", u"attribute"):
+            value = f.get(attrname)
+            if value and value.isdigit():
+                referenced_ids.add(int(value))
+
+    referenced_nodes = {n.id: n for n in q(Node).filter(Node.id.in_(referenced_ids))} if referenced_ids else {}
+
+    def get_referenced(maskitem, attrname):
+        value = maskitem.get(attrname)
+        node = referenced_nodes.get(int(value)) if value and value.isdigit() else None
+        if node is None:
+            raise AttributeError("maskitem {} references missing node '{}' as {}".format(maskitem.id, value, attrname))
+        return node
+
+    for f in maskitems:
+        try:
+            _bib_name = get_referenced(f, u"mappingfield").name
+            _mfield = get_referenced(f, u"attribute")
+            _med_name = _mfield.name
+            if _mfield.get(u"type") == u"date":
+                datefields[_med_name] = _mfield.get(u"valuelist")
+        except AttributeError as e:
+            msg = "field error for bibtex mask for type {}: {}".format(metatype_name, e)
+            logg.error("bibtex import: %s", msg)
+            errors.append(msg)
+        else:
+            fieldnames[_bib_name] = _med_name
+
+    return BibTeXFieldMapping(fieldnames, datefields, errors)
+
+
 def _bibteximport_customize(record):
     """
     Sanitize bibtex records (unicode, name lists).
@@ -320,6 +374,8 @@ def importBibTeX(infile, node=None, req=None):
 
     logg.info("bibtex import: %d entries", len(entries))
 
+    field_mappings = {}
+
     for count, fields in enumerate(entries):
         docid_utf8 = fields["ID"]
         fields["key"] = fields.pop("ID")
@@ -327,8 +383,6 @@ def importBibTeX(infile, node=None, req=None):
         mytype = detecttype(doctype, fields)
 
         if mytype:
-            fieldnames = {}
-            datefields = {}
             if mytype not in bibtextypes:
                 logg.error("bibtex mapping of bibtex type '%s' not defined - import stopped", mytype)
                 msg = "bibtex mapping of bibtex type '%s' not defined - import stopped" % mytype
@@ -337,23 +391,10 @@ def importBibTeX(infile, node=None, req=None):
 
             metatype = bibtextypes[mytype]
 
-            # check for mask configuration
-            metadatatype = q(Metadatatype).filter_by(name=metatype).one()
-            mask = metadatatype.get_mask(u"bibtex_import") or metadatatype.get_mask(u"bibtex")
-            if mask:
-                for f in mask.all_maskitems:
-                    try:
-                        _bib_name = q(Node).get(f.get(u"mappingfield")).name
-                        _mfield = q(Node).get(f.get(u"attribute"))
-                        _med_name = _mfield.name
-                        if _mfield.get(u"type") == u"date":
-                            datefields[_med_name] = _mfield.get(u"valuelist")
-                    except AttributeError as e:
-                        msg = "bibtex import docid='{}': field error for bibtex mask for type {} and bibtex-type '{}': {}"
-                        msg = msg.format(docid_utf8, metatype, mytype, e)
-                        logg.error(msg)
-                    else:
-                        fieldnames[_bib_name] = _med_name
+            # check for mask configuration, resolved only once per metatype
+            if metatype not in field_mappings:
+                field_mappings[metatype] = get_bibtex_field_mapping(metatype)
+            fieldnames, datefields, _ = field_mappings[metatype]
 
             doc = Document(docid_utf8,schema=metatype)
             for k, v in fields.items():
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Bulk BibTeX import for large files.
+
+    In contrast to `schema.bibtex.importBibTeX`, the BibTeXImporter
+
+    * parses the file in chunks of records instead of loading all entries at once,
+    * resolves the bibtex mask mapping once per metadatatype,
+    * inserts the new nodes in batches with pre-allocated ids so that SQLAlchemy can use executemany,
+    * creates the search index entries for a whole batch with one statement instead of the per-row insert trigger,
+    * records errors per entry instead of stopping the import.
+
+    The insert trigger is skipped with the transaction-local setting `mediatum.skip_tsvector`, so no table lock
+    is needed and inserts of other sessions are indexed as usual.
+
+    A dry run parses the whole file and reports mapping errors without touching the database.
+"""
+from __future__ import absolute_import
+
+import codecs
+import logging
+import random
+import re
+import time
+
+from bibtexparser import loads as bibtex_loads
+from bibtexparser.bparser import BibTexParser
+from sqlalchemy import text
+
+from core import db, Node
+from contenttypes.document import Document
+from schema.bibtex import _bibteximport_customize, detecttype, getbibtexmappings, get_bibtex_field_mapping, article_types
+from utils.date import parse_date
+
+
+logg = logging.getLogger(__name__)
+q = db.query
+
+RECORD_START = re.compile(r"\s*@")
+MACRO_RECORD_START = re.compile(r"\s*@(string|preamble)\b", re.IGNORECASE)
+
+INSERT_FTS_ATTRS = text("""
+INSERT INTO fts (nid, config, searchtype, tsvec)
+SELECT n.id, c.config::regconfig, 'attrs', jsonb_object_values_to_tsvector(c.config::regconfig, n.attrs)
+FROM node n, unnest(get_attribute_autoindex_languages()) AS c(config)
+WHERE n.id = ANY(:node_ids)
+""")
+
+INSERT_FTS_FULLTEXT = text("""
+INSERT INTO fts (nid, config, searchtype, tsvec)
+SELECT n.id, c.config::regconfig, 'fulltext', to_tsvector_safe(c.config::regconfig, n.fulltext)
+FROM node n, unnest(get_fulltext_autoindex_languages()) AS c(config)
+WHERE n.id = ANY(:node_ids)
+""")
+
+
+def _detect_encoding(filename):
+    with open(filename, "rb") as f:
+        start = f.read(2)
+    if start in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return "utf-16"
+    # utf-8-sig instead of utf-8 gets rid of BOM_UTF8, which confuses the bibtex parser
+    return "utf-8-sig"
+
+
+def _parse_chunk(macro_records, records):
+    parser = BibTexParser()
+    # accept also non standard records like @SCIENCEREPORT
+    parser.ignore_nonstandard_types = False
+    parser.customization = _bibteximport_customize
+    return bibtex_loads(u"".join(macro_records + records), parser=parser).entries
+
+
+def iter_bibtex_entries(filename, chunk_size=500, errors=None):
+    """Yields parsed bibtex entries from `filename`, parsing `chunk_size` records at once.
+    @string and @preamble records are passed to every following chunk.
+    If `errors` is a list, unparseable chunks are recorded there and skipped, else the exception is raised.
+    """
+    macro_records = []
+    records = []
+    current = []
+    chunk_start_line = 1
+    lineno = 0
+
+    def finish_record():
+        if current:
+            record = u"".join(current)
+            if MACRO_RECORD_START.match(record):
+                macro_records.append(record)
+            else:
+                records.append(record)
+            del current[:]
+
+    def parse_records(end_line):
+        try:
+            entries = _parse_chunk(macro_records, records)
+        except Exception as e:
+            if errors is None:
+                raise
+            msg = u"lines {}-{}: bibtexparser failed: {}".format(chunk_start_line, end_line, e)
+            logg.error("bibtex import: %s", msg)
+            errors.append((None, msg))
+            entries = []
+        del records[:]
+        return entries
+
+    with codecs.open(filename, "r", encoding=_detect_encoding(filename)) as f:
+        for lineno, line in enumerate(f, start=1):
+            if RECORD_START.match(line):
+                finish_record()
+                if len(records) >= chunk_size:
+                    for entry in parse_records(lineno - 1):
+                        yield entry
+                    chunk_start_line = lineno
+            current.append(line)
+
+        finish_record()
+        for entry in parse_records(lineno):
+            yield entry
+
+
+class BibTeXImportReport(object):
+
+    def __init__(self):
+        self.entries = 0
+        #: entries that passed all checks (and were imported if this is not a dry run)
+        self.valid = 0
+        self.imported = 0
+        self.skipped = 0
+        #: list of (bibtex key, message) tuples
+        self.errors = []
+        #: bibtex types without a metadatatype mapping and their count
+        self.unmapped_types = {}
+        self.elapsed = 0.
+
+    @property
+    def entries_per_second(self):
+        return self.entries / self.elapsed if self.elapsed else 0.
+
+    def __str__(self):
+        return ("{} entries, {} valid, {} imported, {} skipped (unknown type), {} errors, unmapped types: {}, "
+                "{:.1f}s ({:.0f} entries/s)").format(self.entries, self.valid, self.imported, self.skipped, len(self.errors),
+                                                     self.unmapped_types or "-", self.elapsed, self.entries_per_second)
+
+
+class BibTeXImporter(object):
+
+    """Imports bibtex files as Document nodes below `parent`.
+    :param batch_size: number of nodes inserted and committed together
+    :param dry_run: only parse and check the mapping, don't create nodes
+    """
+
+    def __init__(self, parent, batch_size=1000, dry_run=False):
+        self.parent = parent
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.bibtextypes = getbibtexmappings()
+        self.field_mappings = {}
+        self.report = BibTeXImportReport()
+        self._batch = []
+
+    def _get_field_mapping(self, metatype):
+        mapping = self.field_mappings.get(metatype)
+        if mapping is None:
+            mapping = self.field_mappings[metatype] = get_bibtex_field_mapping(metatype)
+            for msg in mapping.errors:
+                self.report.errors.append((None, msg))
+        return mapping
+
+    def _make_document(self, fields):
+        """Returns a new Document for a parsed entry or None if the entry was skipped.
+        :raises ValueError: if the entry cannot be imported
+        """
+        key = fields.pop("ID")
+        fields["key"] = key
+        doctype = fields.pop("ENTRYTYPE")
+        mytype = detecttype(doctype, fields)
+
+        if not mytype:
+            self.report.skipped += 1
+            return None
+
+        metatype = self.bibtextypes.get(mytype)
+        if metatype is None:
+            self.report.unmapped_types[mytype] = self.report.unmapped_types.get(mytype, 0) + 1
+            raise ValueError(u"bibtex mapping of bibtex type '{}' not defined".format(mytype))
+
+        fieldnames, datefields, _ = self._get_field_mapping(metatype)
+        attrs = {}
+        for k, v in fields.iteritems():
+            k = fieldnames.get(k, k)
+            if k in datefields:
+                try:
+                    v = str(parse_date(v, datefields[k]))
+                except ValueError:
+                    raise ValueError(u"invalid date for {}: {}".format(k, v))
+            attrs[k] = v
+
+        self.report.valid += 1
+        if self.dry_run:
+            return None
+
+        return Document(key, schema=metatype, attrs=attrs)
+
+    def _allocate_ids(self, count):
+        stmt = text("SELECT nextval('node_id_seq') FROM generate_series(1, :count)")
+        return [row[0] for row in db.session.execute(stmt, {"count": count})]
+
+    def _flush_batch(self):
+        batch = self._batch
+        if not batch:
+            return
+
+        s = db.session
+        # with known primary keys, SQLAlchemy inserts all nodes of the batch with one executemany
+        for doc, node_id in zip(batch, self._allocate_ids(len(batch))):
+            doc.id = node_id
+
+        node_ids = [doc.id for doc in batch]
+        # only valid until the end of the transaction, the insert trigger checks it
+        s.execute("SET LOCAL mediatum.skip_tsvector = on")
+        self.parent.children.extend(batch)
+        s.flush()
+        s.execute(INSERT_FTS_ATTRS, {"node_ids": node_ids})
+        s.execute(INSERT_FTS_FULLTEXT, {"node_ids": node_ids})
+        s.commit()
+        # free the memory held by the session
+        s.expunge_all()
+        self.parent = q(Node).get(self.parent.id)
+
+        self.report.imported += len(batch)
+        self._batch = []
+        logg.info("bibtex import: %s entries imported", self.report.imported)
+
+    def run(self, filename):
+        """Imports all entries from `filename` and returns a BibTeXImportReport"""
+        report = self.report
+        started = time.time()
+
+        try:
+            for fields in iter_bibtex_entries(filename, errors=report.errors):
+                report.entries += 1
+                key = fields.get("ID")
+                try:
+                    doc = self._make_document(fields)
+                except ValueError as e:
+                    report.errors.append((key, unicode(e)))
+                    continue
+
+                if doc is not None:
+                    self._batch.append(doc)
+                    if len(self._batch) >= self.batch_size:
+                        self._flush_batch()
+
+            self._flush_batch()
+        except:
+            db.session.rollback()
+            raise
+
+        report.elapsed = time.time() - started
+        logg.info("bibtex import of %s finished%s: %s", filename, " (dry run)" if self.dry_run else "", report)
+        return report
+
+
+def write_synthetic_bibtex_file(filepath, count, seed=0):
+    """Writes a bibtex file with `count` generated entries for benchmarks.
+    All standard entry types are used, the output is deterministic for a given `seed`.
+    """
+    rand = random.Random(seed)
+    words = ["data", "analysis", "system", "network", "learning", "model", "theory", "method", "graph", "process"]
+    names = [u"Müller, Hans", u"Smith, John", u"Schmidt, Anna", u"Doe, Jane", u"Meier, Jürgen"]
+
+    def field_value(fieldname, i):
+        if fieldname in ("author", "editor"):
+            return u" and ".join(rand.sample(names, rand.randint(1, 3)))
+        if fieldname == "year":
+            return unicode(rand.randint(1950, 2016))
+        if fieldname in ("volume", "number", "edition"):
+            return unicode(rand.randint(1, 50))
+        if fieldname == "pages":
+            start = rand.randint(1, 500)
+            return u"{}--{}".format(start, start + rand.randint(1, 30))
+        return u" ".join(rand.choice(words) for _ in range(rand.randint(2, 8))).capitalize()
+
+    with codecs.open(filepath, "w", encoding="utf8") as f:
+        for i in xrange(count):
+            bibname, _, required, optional = article_types[i % len(article_types)]
+            if isinstance(required, basestring):
+                required = (required, )
+            fieldnames = [fn.split(" ")[0] for fn in required] + list(optional[:rand.randint(0, len(optional))])
+            f.write(u"@{}{{key{},\n".format(bibname, i))
+            f.write(u",\n".join(u"  {} = {{{}}}".format(fn, field_value(fn, i)) for fn in fieldnames if fn != "key"))
+            f.write(u"\n}\n\n")
@@ -34,6 +34,7 @@ import requests
 
 from core import Node
 from core import db
+from core.nodecache import get_node_snapshot
 from contenttypes import Document
 from .schema import Metadatatype
 from . import importbase
@@ -314,8 +315,8 @@ def import_csl(record, target=None, name=None, testing=False):
             csl_name = "not defined"
             mfield = "not defined"
             med_name = "not defined"
-            csl_name = q(Node).get(int(maskitem[u"mappingfield"])).name
-            mfield = q(Node).get(int(maskitem[u"attribute"]))
+            csl_name = get_node_snapshot(maskitem[u"mappingfield"]).name
+            mfield = get_node_snapshot(maskitem[u"attribute"])
             med_name = mfield.name
         except:
             logg.exception("citeproc import name='%s': field error for citeproc mask for type '%s and " +
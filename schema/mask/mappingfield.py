@@ -29,6 +29,7 @@ from schema.schema import getMetadataType
 import export.exportutils as exportutils
 from core import Node
 from core import db
+from core.nodecache import get_node_snapshot
 
 logg = logging.getLogger(__name__)
 q = db.query
@@ -163,7 +164,7 @@ class m_mappingfield(Metatype):
 
             elif var.startswith("value|nodename"):
                 try:
-                    s2 = q(Node).get(node.get(attrnode.getName())).getName()
+                    s2 = get_node_snapshot(node.get(attrnode.getName())).name
                 except:
                     s2 = node.getName()
                 s = s.replace("[" + var + "]", s2)
@@ -181,9 +182,9 @@ class m_mappingfield(Metatype):
             elif var == "ns":
                 ns = ""
                 for mapping in attrnode.get("exportmapping").split(";"):
-                    n = q(Node).get(mapping)
-                    if n.getNamespace() != "" and n.getNamespaceUrl() != "":
-                        ns += 'xmlns:' + n.getNamespace() + '="' + n.getNamespaceUrl() + '" '
+                    n = get_node_snapshot(mapping)
+                    if n.get("namespace") != "" and n.get("namespaceurl") != "":
+                        ns += 'xmlns:' + n.get("namespace") + '="' + n.get("namespaceurl") + '" '
                 s = s.replace("[" + var + "]", ns)
 
             for ext in self.extensions:
@@ -235,13 +236,13 @@ class m_mappingfield(Metatype):
 
             if field.get("fieldtype") == "mapping":  # mapping to mapping definition
                 exportmapping_id = mask.get("exportmapping").split(";")[0]
-                mapping = q(Node).get(exportmapping_id)
+                mapping = get_node_snapshot(exportmapping_id)
                 if mapping is None:
                     logg.warn("exportmapping %s for mask %s not found", exportmapping_id, mask.id)
                     return u""
                 separator = mapping.get("separator")
 
-                ns = mapping.getNamespace()
+                ns = mapping.get("namespace")
                 if ns != "":
                     ns += ":"
                 fld = q(Node).get(field.get("mappingfield"))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import codecs
+import logging
+import time
+
+from pytest import mark
+
+from schema.bibteximport import iter_bibtex_entries, write_synthetic_bibtex_file
+
+
+logg = logging.getLogger(__name__)
+
+BIBTEX_WITH_MACRO = u"""
+@string{tum = "Technische Universität München"}
+
+@article{first,
+  author = {Müller, Hans},
+  title = {First},
+  journal = tum,
+  year = {2015}
+}
+
+@book{second,
+  author = {Doe, Jane},
+  title = {Second},
+  publisher = tum,
+  year = {2016}
+}
+
+@misc{third,
+  title = {Third}
+}
+"""
+
+
+def test_iter_bibtex_entries_chunks_and_macros(tmpdir):
+    bibtex_filepath = str(tmpdir.join("test.bib"))
+    with codecs.open(bibtex_filepath, "w", encoding="utf8") as f:
+        f.write(BIBTEX_WITH_MACRO)
+
+    entries = list(iter_bibtex_entries(bibtex_filepath, chunk_size=1))
+    assert [e["ID"] for e in entries] == ["first", "second", "third"]
+    # macro defined in the first chunk must be available in later chunks
+    assert entries[0]["journal"] == u"Technische Universität München"
+    assert entries[1]["publisher"] == u"Technische Universität München"
+
+
+def test_write_synthetic_bibtex_file(tmpdir):
+    bibtex_filepath = str(tmpdir.join("synthetic.bib"))
+    write_synthetic_bibtex_file(bibtex_filepath, 100)
+    entries = list(iter_bibtex_entries(bibtex_filepath, chunk_size=30))
+    assert len(entries) == 100
+    assert entries[0]["ID"] == "key0"
+
+
+@mark.slow
+def test_iter_bibtex_entries_throughput(tmpdir):
+    count = 100000
+    bibtex_filepath = str(tmpdir.join("synthetic.bib"))
+    write_synthetic_bibtex_file(bibtex_filepath, count)
+    started = time.time()
+    parsed = sum(1 for _ in iter_bibtex_entries(bibtex_filepath))
+    elapsed = time.time() - started
+    logg.info("parsed %s entries in %.1fs (%.0f entries/s)", parsed, elapsed, parsed / elapsed)
+    assert parsed == count
@@ -21,9 +21,8 @@ import codecs
 import logging
 import os
 import random
-import shutil
 import time
-from core import db, File, config
+from core import db, File, config, filestore
 from .utils import getMimeType
 from core.config import resolve_datadir_path
 
@@ -54,6 +53,23 @@ def _find_unique_destname(filename, prefix=""):
     return destname
 
 
+def _copy_and_ingest(source, destname):
+    """Copies `source` (a file path or a readable file object) to `destname` in one pass, hashing the content on the way.
+    Returns the tuple (sha256 hex digest, size)."""
+    if isinstance(source, basestring):
+        with open(source, "rb") as f:
+            sha256, size = filestore.copy_and_hash(f, destname)
+    else:
+        sha256, size = filestore.copy_and_hash(source, destname)
+    return filestore.ingest(destname, sha256, size)
+
+
+def _make_file(destname, filetype, mimetype, sha256_and_size):
+    f = File(destname, filetype, mimetype)
+    f.sha256, f.filesize = sha256_and_size
+    return f
+
+
 def importFile(realname, tempname, prefix=""):
     if not os.path.exists(tempname):
         raise IOError("temporary file " + tempname + "does not exist")
@@ -61,23 +77,44 @@ def importFile(realname, tempname, prefix=""):
     filename = os.path.basename(tempname)
     destname = _find_unique_destname(filename, prefix)
 
-    shutil.copyfile(tempname, destname)
+    sha256_and_size = _copy_and_ingest(tempname, destname)
     r = realname.lower()
     mimetype, filetype = getMimeType(r)
 
-    return File(destname, filetype, mimetype)
+    return _make_file(destname, filetype, mimetype, sha256_and_size)
 
 
 def importFileToRealname(realname, tempname, prefix="", typeprefix=""):
     filename = os.path.basename(realname)
     destname = _find_unique_destname(filename, prefix)
 
-    shutil.copyfile(tempname, destname)
+    sha256_and_size = _copy_and_ingest(tempname, destname)
     r = realname.lower()
 
     mimetype, filetype = getMimeType(r)
 
-    return File(destname, typeprefix + filetype, mimetype)
+    return _make_file(destname, typeprefix + filetype, mimetype, sha256_and_size)
+
+
+def importFileFromStream(realname, fileobj, prefix=""):
+    """Like importFileToRealname(), but reads the content from a file-like object (a zip archive member, for example)
+    and writes it directly to the import dir."""
+    filename = os.path.basename(realname)
+    destname = _find_unique_destname(filename, prefix)
+
+    sha256_and_size = _copy_and_ingest(fileobj, destname)
+    mimetype, filetype = getMimeType(realname.lower())
+
+    return _make_file(destname, filetype, mimetype, sha256_and_size)
+
+
+def createImportFile(realname, prefix=""):
+    """Creates an empty file with a unique name in the import dir and returns its path.
+    Used for uploads that are written in several steps."""
+    filename = os.path.basename(realname)
+    destname = _find_unique_destname(filename, prefix)
+    open(destname, "wb").close()
+    return destname
 
 
 def importFileIntoDir(destdir, tempname):
@@ -89,12 +126,12 @@ def importFileIntoDir(destdir, tempname):
     if not os.path.exists(dest_dirpath):
         os.mkdir(dest_dirpath)
 
-    shutil.copyfile(tempname, dest_filepath)
+    sha256_and_size = _copy_and_ingest(tempname, dest_filepath)
 
     r = tempname.lower()
     mimetype, filetype = getMimeType(r)
 
-    return File(os.path.join(dest_filepath), filetype, mimetype)
+    return _make_file(os.path.join(dest_filepath), filetype, mimetype, sha256_and_size)
 
 
 def importFileRandom(tempname):
@@ -103,8 +140,8 @@ def importFileRandom(tempname):
 
     destfile = unicode(random.random())[2:] + os.path.splitext(filename)[1]
     destname = os.path.join(uploaddir, destfile)
-    shutil.copyfile(tempname, destname)
+    sha256_and_size = _copy_and_ingest(tempname, destname)
 
     r = tempname.lower()
     mimetype, filetype = getMimeType(r)
-    return File(destname, filetype, mimetype)
+    return _make_file(destname, filetype, mimetype, sha256_and_size)
@@ -18,20 +18,36 @@
  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import datetime
 import os
 import string
+import time
 from warnings import warn
+from sqlalchemy import event, sql
 from core import db
 from core import Node
 from contenttypes import Collections
 from core.systemtypes import Root
 from core.database.postgres.alchemyext import exec_sqlfunc
 from core.database.postgres import mediatumfunc, build_accessfunc_arguments
+from core.database.postgres.replicas import reads_from_primary
 from itertools import chain
-from core.nodecache import get_home_root_node
+from core.nodecache import get_home_root_node, add_node_change_handler, start_node_change_listener
+from utils.compat import iteritems
 
 q = db.query
 
+#: cached paths are fetched again after this number of seconds, changes made by other processes are visible after that time
+PATH_CACHE_TTL = 300
+PATH_CACHE_SIZE = 100000
+
+# (node id, access signature) -> (expiry time, list of id paths)
+_id_paths_cache = {}
+# ids of all containers in cached paths
+_cached_path_node_ids = set()
+_path_cache_invalidation_registered = False
+_node_mapping_changed_in_transaction = False
+
 # scaled down version of web.frontend.contend.getPaths() to get all paths
 
 
@@ -112,25 +128,139 @@ def getPaths(node):
         return []
 
 
-def get_accessible_paths(node, node_query=None):
-    from core.nodecache import get_collections_node, get_root_node
+def _access_signature(group_ids, ip, date):
+    """Returns a hashable cache key for the arguments of the DB access functions"""
+    if not isinstance(date, datetime.date):
+        # sqlfunc.current_date()
+        date = datetime.date.today()
+    return (tuple(sorted(group_ids)) if group_ids is not None else None, str(ip), date)
+
+
+def invalidate_path_cache():
+    """Clears all cached paths. Called when node relations or access rules change."""
+    _id_paths_cache.clear()
+    _cached_path_node_ids.clear()
+
+
+def _node_mapping_changed(*args, **kwargs):
+    global _node_mapping_changed_in_transaction
+    _node_mapping_changed_in_transaction = True
+    invalidate_path_cache()
+
+
+def _access_rules_changed(session, flush_context):
+    from core.database.postgres.permission import AccessRule, AccessRulesetToRule, NodeToAccessRule, NodeToAccessRuleset
+    access_classes = (AccessRule, AccessRulesetToRule, NodeToAccessRule, NodeToAccessRuleset)
+    if any(isinstance(obj, access_classes) for obj in chain(session.new, session.dirty, session.deleted)):
+        _node_mapping_changed()
+
+
+def _node_changed(node_id):
+    """Called for node changes in all processes. Access rule changes clear the whole cache instead."""
+    if node_id in _cached_path_node_ids:
+        invalidate_path_cache()
+
+
+def _register_path_cache_invalidation():
+    """Listens for changes of all relationships that move or link nodes and for changes of access rules.
+    Paths are invalidated immediately and again at the end of the transaction (other threads may have cached old paths
+    in the meantime, paths cached in a transaction that is rolled back may be wrong).
+    Access rule changes made by other processes are received by the node change listener.
+    Other processes see moved nodes after PATH_CACHE_TTL.
+    """
+    global _path_cache_invalidation_registered
+    if _path_cache_invalidation_registered:
+        return
+
+    from sqlalchemy.orm import configure_mappers
+    from core.database.postgres.node import t_nodemapping
+    configure_mappers()
+
+    for mapper in Node.__mapper__.self_and_descendants:
+        for prop in mapper.relationships:
+            if prop.secondary is t_nodemapping and not prop.viewonly and prop.parent is mapper:
+                event.listen(prop.class_attribute, "append", _node_mapping_changed, propagate=True)
+                event.listen(prop.class_attribute, "remove", _node_mapping_changed, propagate=True)
+
+    event.listen(db.Session, "after_flush", _access_rules_changed)
+    add_node_change_handler("paths", _node_changed, invalidate_path_cache, invalidate_path_cache)
+
+    @event.listens_for(db.Session, "after_commit")
+    @event.listens_for(db.Session, "after_rollback")
+    def invalidate_path_cache_after_transaction(session):
+        global _node_mapping_changed_in_transaction
+        if _node_mapping_changed_in_transaction:
+            _node_mapping_changed_in_transaction = False
+            invalidate_path_cache()
+
+    _path_cache_invalidation_registered = True
+
+
+def get_accessible_id_paths(node_ids, group_ids=None, ip=None, date=None):
+    """Returns all container paths for the nodes `node_ids` that are accessible with the given access arguments
+    (see build_accessfunc_arguments()). The root node is never part of a path.
+    All paths that are not in the cache are fetched with a single query, access is checked once per container.
+    :returns: dict node id -> list of paths, a path is a list of node ids, starting with the top-most container
+    """
+    _register_path_cache_invalidation()
+    start_node_change_listener()
+
+    signature = _access_signature(group_ids, ip, date)
+    now = time.time()
+    id_paths = {}
+    missing_node_ids = []
+
+    for nid in set(node_ids):
+        cached = _id_paths_cache.get((nid, signature))
+        if cached is not None and cached[0] > now:
+            id_paths[nid] = cached[1]
+        else:
+            missing_node_ids.append(nid)
+
+    if missing_node_ids:
+        from core.nodecache import get_root_node
+        excluded_node_ids = [get_root_node().id]
+
+        fetched = {nid: [] for nid in missing_node_ids}
+        f = mediatumfunc.accessible_container_paths_for_nodes(missing_node_ids, excluded_node_ids, group_ids, ip, date)
+        stmt = sql.select([sql.column("node_id"), sql.column("path")]).select_from(f)
+        with reads_from_primary(db.session):
+            for nid, id_path in db.session.execute(stmt):
+                fetched[nid].append(id_path)
+
+        if len(_id_paths_cache) + len(fetched) > PATH_CACHE_SIZE:
+            _id_paths_cache.clear()
+
+        expires = now + PATH_CACHE_TTL
+        for nid, paths in iteritems(fetched):
+            _id_paths_cache[(nid, signature)] = (expires, paths)
+            _cached_path_node_ids.update(chain.from_iterable(paths))
+
+        id_paths.update(fetched)
+
+    return id_paths
+
+
+def get_accessible_paths_for_nodes(nodes, node_query=None, user=None, ip=None):
+    """Returns all accessible container paths for many nodes at once, see get_accessible_id_paths().
+    Access is checked for the current user if `user` is not given.
+    :returns: dict node id -> list of paths, a path is a list of nodes
+    """
     if node_query is None:
         node_query = q(Node)
 
-    group_ids, ip, date = build_accessfunc_arguments()
-    excluded_node_ids = [get_root_node().id]
+    group_ids, ip, date = build_accessfunc_arguments(user, ip)
+    id_paths = get_accessible_id_paths([n.id for n in nodes], group_ids, ip, date)
+
+    path_node_ids = set(chain.from_iterable(chain.from_iterable(id_paths.itervalues())))
+    if not path_node_ids:
+        return {nid: [] for nid in id_paths}
 
-    f = mediatumfunc.accessible_container_paths(node.id, excluded_node_ids, group_ids, ip, date)
-    id_paths = [t[0] for t in db.session.execute(f).fetchall()]
     # fetch all nodes at once to reduce DB load
-    
-    if not id_paths:
-        return []
-    
-    path_nodes = node_query.filter(Node.id.in_(chain(*id_paths)))
-
-    # convert node ids to nodes
-    nid_to_node ={n.id: n for n in path_nodes}
-    node_paths = [[nid_to_node.get(nid) for nid in id_path] for id_path in id_paths]
-    return node_paths
-    
\ No newline at end of file
+    nid_to_node = {n.id: n for n in node_query.filter(Node.id.in_(path_node_ids))}
+    return {nid: [[nid_to_node.get(path_nid) for path_nid in id_path] for id_path in paths]
+            for nid, paths in iteritems(id_paths)}
+
+
+def get_accessible_paths(node, node_query=None):
+    return get_accessible_paths_for_nodes([node], node_query)[node.id]
@@ -3,10 +3,18 @@
     :copyright: (c) 2016 by the mediaTUM authors
     :license: GPL3, see COPYING for details
 """
-from utils.pathutils import get_accessible_paths
+from pytest import fixture
+
+import utils.pathutils
+from utils.pathutils import get_accessible_paths, get_accessible_paths_for_nodes
 from utils.testing import make_node_public, append_chain_of_containers
 
 
+@fixture(autouse=True)
+def no_node_change_listener(monkeypatch):
+    monkeypatch.setattr(utils.pathutils, "start_node_change_listener", lambda: None)
+
+
 def test_get_accessible_paths_multiple(session, req, root, home_root, collections, content_node):
     node = content_node
     
@@ -28,3 +36,66 @@ def test_get_accessible_paths_multiple(session, req, root, home_root, collection
     
     # first node of path_nodes_2 is the collections root, the tested function omits this node because it's not public
     assert path == path_nodes_2[1:]
+
+
+
+def test_get_accessible_paths_for_nodes(session, req, root, collections, content_node, other_content_node):
+    root.children.append(collections)
+    path_nodes = append_chain_of_containers(2, collections)
+    path_nodes[-1].content_children.append(content_node)
+    path_nodes[1].content_children.append(other_content_node)
+    for node in path_nodes:
+        make_node_public(node, "read")
+    session.flush()
+
+    paths = get_accessible_paths_for_nodes([content_node, other_content_node])
+    assert paths[content_node.id] == [path_nodes]
+    assert paths[other_content_node.id] == [path_nodes[:2]]
+
+
+def test_get_accessible_paths_moved_node(session, req, root, collections, content_node):
+    root.children.append(collections)
+    path_nodes_1 = append_chain_of_containers(1, collections)
+    path_nodes_2 = append_chain_of_containers(1, collections)
+    for node in path_nodes_1 + path_nodes_2[1:]:
+        make_node_public(node, "read")
+    path_nodes_1[-1].content_children.append(content_node)
+    session.flush()
+    assert get_accessible_paths(content_node) == [path_nodes_1]
+
+    # move node, the cached path must not be returned anymore
+    path_nodes_1[-1].content_children.remove(content_node)
+    path_nodes_2[-1].content_children.append(content_node)
+    session.flush()
+    assert get_accessible_paths(content_node) == [path_nodes_2]
+
+
+def test_get_accessible_paths_access_changed(session, req, root, collections, content_node):
+    root.children.append(collections)
+    path_nodes = append_chain_of_containers(1, collections)
+    make_node_public(path_nodes[1], "read")
+    path_nodes[-1].content_children.append(content_node)
+    session.flush()
+    assert get_accessible_paths(content_node) == [path_nodes[1:]]
+
+    # collections becomes readable, the cached path must not be returned anymore
+    make_node_public(collections, "read")
+    session.flush()
+    assert get_accessible_paths(content_node) == [path_nodes]
+
+
+def test_node_changed_invalidates_path_cache(session, req, root, collections, content_node):
+    root.children.append(collections)
+    path_nodes = append_chain_of_containers(1, collections)
+    make_node_public(path_nodes[1], "read")
+    path_nodes[-1].content_children.append(content_node)
+    session.flush()
+    get_accessible_paths(content_node)
+
+    # changes of content nodes don't change paths
+    utils.pathutils._node_changed(content_node.id)
+    assert utils.pathutils._id_paths_cache
+
+    # access rules of a container in a cached path were changed by another process
+    utils.pathutils._node_changed(path_nodes[1].id)
+    assert not utils.pathutils._id_paths_cache
@@ -231,10 +231,11 @@ def get_hash(filename):
         if not os.path.exists(pathname):
             import core.config as config
             pathname = os.path.join(config.settings["paths.datadir"], filename)
-        fi = open(pathname, "rb")
-        s = fi.read()
-        fi.close()
-        return hashlib.md5(s).hexdigest()
+        md5 = hashlib.md5()
+        with open(pathname, "rb") as fi:
+            for block in iter(lambda: fi.read(1 << 20), ""):
+                md5.update(block)
+        return md5.hexdigest()
     except IOError:
         return hashlib.md5("").hexdigest()
 
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Admin view of the sampling profiler, see `core.athana_profiler`.
+"""
+from __future__ import absolute_import
+
+import logging
+import re
+
+from core.athana_profiler import get_profiler
+from core.transition.templating import make_template_functions
+
+
+logg = logging.getLogger(__name__)
+
+render_template, render_macro = make_template_functions("web/admin/modules")
+
+TOP_HANDLERS = 30
+TOP_STACKS = 10
+#: only the innermost frames of a stack are shown in the tables
+SHOWN_FRAMES = 8
+
+
+def getInformation():
+    return {"version": "1.0"}
+
+
+def validate(req, op):
+    profiler = get_profiler()
+    error = None
+    written_file = None
+
+    if req.method == "POST":
+        action = req.params.get("action")
+        if action == "start":
+            try:
+                profiler.sample_rate = min(max(float(req.params.get("sample_rate") or 0), 0.), 1.)
+                profiler.url_pattern = req.params.get("url_pattern", "").strip()
+            except (ValueError, re.error) as e:
+                error = u"invalid setting: {}".format(e)
+            else:
+                profiler.start()
+        elif action == "stop":
+            profiler.stop()
+        elif action == "reset":
+            profiler.reset()
+        elif action == "write":
+            written_file = profiler.write_collapsed(req.params.get("handler") or None)
+
+    return view(req, profiler, error, written_file)
+
+
+def view(req, profiler, error=None, written_file=None):
+    sort_key = req.params.get("sort", "total")
+    if sort_key not in ("total", "max", "mean", "count", "samples"):
+        sort_key = "total"
+
+    handlers = profiler.handler_stats(sort_key=sort_key, limit=TOP_HANDLERS)
+    stacks = {}
+    for handler, stats in handlers:
+        if stats.samples:
+            stacks[handler] = [(u" ; ".join(stack.split(";")[-SHOWN_FRAMES:]), count)
+                               for stack, count in profiler.top_stacks(handler, TOP_STACKS)]
+
+    return render_template("profiling.j2.jade",
+                           profiler=profiler,
+                           handlers=handlers,
+                           stacks=stacks,
+                           sort_key=sort_key,
+                           error=error,
+                           written_file=written_file)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Admin view of the slow statements recorded by `core.database.postgres.slowqueries`.
+"""
+from __future__ import absolute_import
+
+import json
+import time
+
+from core import db
+from core.transition.templating import make_template_functions
+
+
+render_template, render_macro = make_template_functions("web/admin/modules")
+
+TOP_FINGERPRINTS = 50
+
+
+def getInformation():
+    return {"version": "1.0"}
+
+
+def validate(req, op):
+    store = getattr(db, "slow_query_store", None)
+    if store is not None and req.method == "POST" and req.params.get("action") == "clear":
+        store.clear()
+    return view(req, store)
+
+
+def view(req, store):
+    fingerprints = []
+    plans = []
+    selected = req.params.get("fingerprint")
+    if store is not None:
+        fingerprints = store.top_fingerprints(TOP_FINGERPRINTS)
+        if selected:
+            plans = store.plans(selected)
+
+    return render_template("slowqueries.j2.jade",
+                           store=store,
+                           fingerprints=fingerprints,
+                           selected=selected,
+                           plans=plans,
+                           format_plan=lambda plan: json.dumps(plan, indent=2),
+                           format_time=lambda t: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)))
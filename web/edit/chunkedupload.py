@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Resumable upload of large files in chunks, following the tus protocol (http://tus.io).
+
+    * POST /edit/upload/chunked creates an upload. Headers: Upload-Length and Upload-Metadata with the
+      base64 encoded keys `filename`, `node` (id of the target node) and optionally `schema`.
+    * HEAD /edit/upload/chunked/<id> returns the current Upload-Offset, a client resumes from there.
+    * PATCH /edit/upload/chunked/<id> appends a chunk at Upload-Offset. An optional Upload-Checksum header
+      ("<algorithm> <base64 digest>") is verified and the chunk is discarded if it doesn't match.
+
+    The request body of a PATCH is streamed by athana directly to the final file in the import dir.
+    When the last chunk arrives, the file is attached to the target node. If a schema was given,
+    a new content node is created below the target node instead and processed in the background.
+
+    The SHA-256 of the file is computed while the chunks are written. Hash objects cannot be shared between processes,
+    so the running hash is only available if all chunks of an upload were written by the same process;
+    otherwise, the complete file is hashed when it's attached.
+"""
+from __future__ import absolute_import
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from core import db, Node, File, config, filestore
+from core.transition import current_user, httpstatus
+from utils.fileutils import createImportFile
+from utils.utils import getMimeType
+
+
+logg = logging.getLogger(__name__)
+q = db.query
+
+TUS_VERSION = "1.0.0"
+#: path pattern for chunks, the body of matching requests is passed to open_chunk_stream()
+CHUNK_PATH_PATTERN = r"/edit/upload/chunked/[0-9a-f]{32}$"
+#: a PATCH that didn't send data for this time (seconds) doesn't block the upload anymore
+WRITER_TIMEOUT = 600
+
+_writers = {}
+#: upload id -> (offset, sha256 hash object of the data before offset), guarded by _writers_lock
+_sha256_states = {}
+_writers_lock = threading.Lock()
+
+
+def _get_state_dir():
+    state_dir = config.resolve_datadir_path("incoming/chunked")
+    if not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    return state_dir
+
+
+class ChunkedUpload(object):
+
+    """State of a chunked upload, stored as small JSON file next to the import dir.
+    The upload offset is the size of the target file, which is always up to date, even after a crash.
+    """
+
+    def __init__(self, id, filename, filepath, length, node_id, schema, user_id, user_login, created=None):
+        self.id = id
+        self.filename = filename
+        self.filepath = filepath
+        self.length = length
+        self.node_id = node_id
+        self.schema = schema
+        self.user_id = user_id
+        self.user_login = user_login
+        self.created = created or time.time()
+
+    @staticmethod
+    def _state_filepath(upload_id):
+        return os.path.join(_get_state_dir(), upload_id + ".json")
+
+    @classmethod
+    def create(cls, filename, length, node_id, schema, user):
+        filepath = createImportFile(filename.replace(" ", "_").encode("utf8"))
+        upload = cls(uuid.uuid4().hex, filename, filepath, length, node_id, schema, user.id, user.login_name)
+        upload.save()
+        return upload
+
+    @classmethod
+    def load(cls, upload_id):
+        """Returns the upload with `upload_id` or None if it doesn't exist."""
+        try:
+            with open(cls._state_filepath(upload_id)) as f:
+                return cls(**json.load(f))
+        except IOError:
+            return None
+
+    def save(self):
+        state_filepath = self._state_filepath(self.id)
+        with open(state_filepath + ".tmp", "w") as f:
+            json.dump(self.__dict__, f)
+        os.rename(state_filepath + ".tmp", state_filepath)
+
+    def remove(self, remove_file=False):
+        with _writers_lock:
+            _sha256_states.pop(self.id, None)
+        os.remove(self._state_filepath(self.id))
+        if remove_file and os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+    @property
+    def offset(self):
+        return os.path.getsize(self.filepath)
+
+    @property
+    def complete(self):
+        return self.offset == self.length
+
+
+class ChunkWriter(object):
+
+    """Writes a chunk to the upload file, starting at `offset`. Created by open_chunk_stream().
+    The upload stays locked for other chunks until release() is called.
+    `sha256` continues the running hash of the upload, it's None if the previous chunks were written by another process.
+    """
+
+    def __init__(self, upload, offset, checksum_algorithm=None):
+        self.upload = upload
+        self.offset = offset
+        self.written = 0
+        self.last_write = time.time()
+        self.hash = hashlib.new(checksum_algorithm) if checksum_algorithm else None
+        self.sha256 = _continue_sha256(upload.id, offset)
+        self._file = open(upload.filepath, "r+b")
+        self._file.seek(offset)
+
+    def write(self, data):
+        self._file.write(data)
+        if self.hash is not None:
+            self.hash.update(data)
+        if self.sha256 is not None:
+            self.sha256.update(data)
+        self.written += len(data)
+        self.last_write = time.time()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def truncate(self):
+        """Removes the data written by this chunk"""
+        # the running hash now contains data that isn't in the file anymore
+        self.sha256 = None
+        self.close()
+        with open(self.upload.filepath, "r+b") as f:
+            f.truncate(self.offset)
+
+    def abort(self):
+        """Called if the client closed the connection before the chunk was complete"""
+        # a partial chunk can be kept and resumed, but not if we cannot verify its checksum
+        if self.hash is not None:
+            self.truncate()
+        else:
+            self.close()
+        self.release()
+
+    def release(self):
+        with _writers_lock:
+            if _writers.get(self.upload.id) is self:
+                del _writers[self.upload.id]
+            if self.sha256 is not None:
+                _sha256_states[self.upload.id] = (self.offset + self.written, self.sha256)
+
+    @property
+    def stale(self):
+        return time.time() - self.last_write > WRITER_TIMEOUT
+
+
+def _continue_sha256(upload_id, offset):
+    """Returns a copy of the running hash of an upload if it ends at `offset`, else None. Must hold _writers_lock.
+    The stored state stays valid if the new chunk is discarded."""
+    if offset == 0:
+        return hashlib.sha256()
+    state = _sha256_states.get(upload_id)
+    if state is not None and state[0] == offset:
+        return state[1].copy()
+    return None
+
+
+def parse_upload_metadata(value):
+    """Decodes a tus Upload-Metadata header ("key base64value,key2 base64value2") to a dict of unicode values"""
+    metadata = {}
+    for pair in value.split(","):
+        parts = pair.strip().split(" ", 1)
+        if not parts[0]:
+            continue
+        metadata[parts[0]] = base64.b64decode(parts[1]).decode("utf8") if len(parts) == 2 else u""
+    return metadata
+
+
+def parse_upload_checksum(value):
+    """Returns the (algorithm, digest) tuple for a tus Upload-Checksum header.
+    :raises ValueError: for malformed headers or unsupported algorithms
+    """
+    algorithm, b64digest = value.strip().split(" ", 1)
+    algorithm = algorithm.lower()
+    if algorithm not in hashlib.algorithms:
+        raise ValueError("unsupported checksum algorithm " + algorithm)
+    return algorithm, base64.b64decode(b64digest)
+
+
+def open_chunk_stream(request):
+    """Stream body opener for athana, called when the headers of a PATCH request are complete.
+    Returns a ChunkWriter or None if the chunk cannot be accepted. The reason is stored as
+    `request.chunk_status` and sent to the client by the handler.
+    The user and the upload are checked here, nothing is written for rejected requests.
+    """
+    session = getattr(request, "stream_session", None)
+    user_id = session.get("user_id") if session is not None else None
+    if user_id is None:
+        request.chunk_status = httpstatus.HTTP_FORBIDDEN
+        return None
+
+    upload = ChunkedUpload.load(request.split_uri()[0].rsplit("/", 1)[-1])
+    # uploads of other users are not revealed
+    if upload is None or upload.user_id != user_id:
+        request.chunk_status = httpstatus.HTTP_NOT_FOUND
+        return None
+
+    headers = request.request_headers
+    if headers.get("content-type") != "application/offset+octet-stream":
+        request.chunk_status = 415
+        return None
+
+    try:
+        offset = int(headers.get("upload-offset"))
+        checksum = headers.get("upload-checksum")
+        checksum_algorithm = parse_upload_checksum(checksum)[0] if checksum else None
+    except (TypeError, ValueError):
+        request.chunk_status = httpstatus.HTTP_BAD_REQUEST
+        return None
+
+    if offset + int(headers["content-length"]) > upload.length:
+        request.chunk_status = 413
+        return None
+
+    with _writers_lock:
+        writer = _writers.get(upload.id)
+        if writer is not None and not writer.stale:
+            # another chunk for this upload is still being written
+            request.chunk_status = 409
+            return None
+        # the size of the file is the offset, we must check it while holding the lock
+        if offset != upload.offset:
+            request.chunk_status = 409
+            return None
+        writer = _writers[upload.id] = ChunkWriter(upload, offset, checksum_algorithm)
+
+    return writer
+
+
+def _send_status(req, upload, status):
+    req.reply_headers["Tus-Resumable"] = TUS_VERSION
+    if upload is not None and os.path.exists(upload.filepath):
+        req.reply_headers["Upload-Offset"] = str(upload.offset)
+    req.reply_headers["Content-Length"] = "0"
+    return status
+
+
+def _process_node(node_id):
+    try:
+        node = q(Node).get(node_id)
+        node.event_files_changed()
+        db.session.commit()
+    except Exception:
+        logg.exception("chunked upload: processing of node %s failed", node_id)
+        db.session.rollback()
+    finally:
+        db.session.close()
+
+
+def finish_upload(upload, sha256=None):
+    """Attaches the complete file to the target node or creates a new node for it.
+    The file is only hashed again if `sha256` (hex digest of the running hash) is not given.
+    Returns the id of the node the file belongs to."""
+    basenode = q(Node).get(upload.node_id)
+    mimetype, datatype = getMimeType(upload.filename.lower())
+    f = File(upload.filepath, datatype, mimetype)
+    f.sha256, f.filesize = filestore.ingest(upload.filepath, sha256, upload.length)
+
+    if not upload.schema:
+        basenode.files.append(f)
+        db.session.commit()
+        logg.info("%s uploaded file %s (%s bytes) to node %s", upload.user_login, upload.filepath, upload.length, basenode.id)
+        return basenode.id
+
+    content_class = Node.get_class_for_typestring(datatype)
+    node = content_class(name=upload.filename, schema=upload.schema)
+    node.set("creator", upload.user_login)
+    node.set("creationtime", unicode(time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time()))))
+    f.filetype = content_class.get_upload_filetype()
+    node.files.append(f)
+    basenode.children.append(node)
+    db.session.commit()
+    logg.info("%s created new node id=%s (name=%s, type=%s) by uploading file %s in chunks, node is child of base node id=%s",
+              upload.user_login, node.id, node.name, node.type, upload.filepath, basenode.id)
+
+    # thumbnails, fulltext etc. may take a while, the client doesn't have to wait for it
+    thread = threading.Thread(target=_process_node, args=(node.id, ), name="chunkedupload-" + upload.id)
+    thread.daemon = True
+    thread.start()
+    return node.id
+
+
+def remove_expired_uploads():
+    """Removes incomplete uploads that were started more than `edit.chunked_upload_expire_hours` ago."""
+    max_age = config.getint("edit.chunked_upload_expire_hours", 24) * 3600
+    now = time.time()
+    for state_filename in os.listdir(_get_state_dir()):
+        if not state_filename.endswith(".json"):
+            continue
+        upload = ChunkedUpload.load(state_filename[:-5])
+        if upload is not None and now - upload.created > max_age:
+            logg.info("removing expired chunked upload %s of %s", upload.filepath, upload.user_login)
+            upload.remove(remove_file=True)
+
+
+def _create_upload(req):
+    headers = req.request_headers
+    try:
+        length = int(headers["upload-length"])
+        metadata = parse_upload_metadata(headers.get("upload-metadata", ""))
+        filename = os.path.basename(metadata["filename"])
+        node_id = int(metadata["node"])
+    except (KeyError, TypeError, ValueError):
+        return _send_status(req, None, httpstatus.HTTP_BAD_REQUEST)
+
+    max_size = config.getint("edit.chunked_upload_max_size", 0)
+    if not filename or length < 0 or (max_size and length > max_size):
+        return _send_status(req, None, httpstatus.HTTP_BAD_REQUEST)
+
+    basenode = q(Node).get(node_id)
+    if basenode is None or not basenode.has_write_access():
+        return _send_status(req, None, httpstatus.HTTP_FORBIDDEN)
+
+    remove_expired_uploads()
+    upload = ChunkedUpload.create(filename, length, node_id, metadata.get("schema"), current_user)
+    logg.info("%s started chunked upload %s of %s (%s bytes) for node %s",
+              upload.user_login, upload.id, upload.filepath, length, node_id)
+
+    req.reply_headers["Location"] = "/edit/upload/chunked/" + upload.id
+    if length == 0:
+        finish_upload(upload, hashlib.sha256().hexdigest())
+        upload.remove()
+    return _send_status(req, upload, 201)
+
+
+def _discard_chunk(req):
+    """Removes the data of a chunk that is not accepted by the handler and unlocks the upload"""
+    writer = getattr(req, "stream_body", None)
+    if writer is not None:
+        try:
+            writer.truncate()
+        except (IOError, OSError):
+            # the upload was removed in the meantime
+            writer.close()
+        writer.release()
+        req.stream_body = None
+
+
+def _write_chunk(req, upload):
+    writer = getattr(req, "stream_body", None)
+    if writer is None:
+        return _send_status(req, upload, getattr(req, "chunk_status", 409))
+
+    try:
+        if upload.user_id != current_user.id:
+            writer.truncate()
+            return _send_status(req, None, httpstatus.HTTP_NOT_FOUND)
+
+        checksum = req.request_headers.get("upload-checksum")
+        if checksum and writer.hash.digest() != parse_upload_checksum(checksum)[1]:
+            logg.warn("chunked upload %s: checksum mismatch for chunk at offset %s", upload.id, writer.offset)
+            writer.truncate()
+            return _send_status(req, upload, 460)
+
+        if upload.complete:
+            sha256 = writer.sha256.hexdigest() if writer.sha256 is not None else None
+            # the upload is removed, release() must not store the hash state again
+            writer.sha256 = None
+            node_id = finish_upload(upload, sha256)
+            upload.remove()
+            req.reply_headers["Upload-Node-Id"] = str(node_id)
+    finally:
+        writer.release()
+
+    return _send_status(req, upload, 204)
+
+
+def chunked_upload(req):
+    """Handles the POST, HEAD and PATCH requests of the tus protocol, see module docstring."""
+    req.reply_headers["Cache-Control"] = "no-store"
+
+    if req.method == "OPTIONS":
+        req.reply_headers["Tus-Version"] = TUS_VERSION
+        req.reply_headers["Tus-Extension"] = "creation,checksum"
+        req.reply_headers["Tus-Checksum-Algorithm"] = ",".join(sorted(hashlib.algorithms))
+        return _send_status(req, None, 204)
+
+    if current_user.is_anonymous:
+        _discard_chunk(req)
+        return _send_status(req, None, httpstatus.HTTP_FORBIDDEN)
+
+    if req.method == "POST":
+        return _create_upload(req)
+
+    upload = ChunkedUpload.load(req.path.rsplit("/", 1)[-1])
+
+    if req.method == "PATCH":
+        if upload is None:
+            _discard_chunk(req)
+            return _send_status(req, None, httpstatus.HTTP_NOT_FOUND)
+        return _write_chunk(req, upload)
+
+    if req.method == "HEAD":
+        if upload is None or upload.user_id != current_user.id:
+            return _send_status(req, None, httpstatus.HTTP_NOT_FOUND)
+        req.reply_headers["Upload-Length"] = str(upload.length)
+        return _send_status(req, upload, httpstatus.HTTP_OK)
+
+    return _send_status(req, None, 405)
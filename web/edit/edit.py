@@ -90,10 +90,11 @@ def getIDPaths(nid, sep="/", containers_only=True):
             return []
     except:
         return []
-    from web.frontend.content import getPaths
-    paths = getPaths(node)
+    paths = get_accessible_paths(node)
     res = []
     for path in paths:
+        # paths start below the collections node
+        path = [p for p in path if not isinstance(p, Collections)]
         if containers_only:
             pids = [("%s" % p.id)
                     for p in path if isinstance(p, Container)]
@@ -336,7 +337,7 @@ def getIDs(req):
         nodelist = []
         for id in req.params.get("nodelist").split(","):
             nodelist.append(q(Node).get(id))
-        req.session["nodelist"] = EditorNodeList(nodelist)
+        req.session["nodelist"] = editor_nodelist_ids(nodelist)
 
     # look for one "id" parameter, containing an id or a list of ids
     id = req.params.get("id")
@@ -668,7 +669,8 @@ def action(req):
 
 
 def showPaging(req, tab, ids):
-    nodelist = req.session.get("nodelist", None)
+    nodeids = req.session.get("nodelist")
+    nodelist = EditorNodeList(nodeids) if nodeids else None
     nextid = previd = None
     position = absitems = '&nbsp;'
     combodata = ""
@@ -76,20 +76,23 @@ class EditorNavList:
         return '/edit/edit_content?' + urllib.urlencode(params)
 
 
+def editor_nodelist_ids(nodes):
+    """Returns the ids of the content nodes in `nodes`, stored as "nodelist" in the session for EditorNodeList"""
+    nodeids = []
+    for node in nodes:
+        try:
+            if not node.isContainer():
+                nodeids.append(node.id)
+        except TypeError:
+            continue
+    return nodeids
+
+
 class EditorNodeList:
 
-    def __init__(self, nodes):
-        self.nodeids = []
-        self.nodeid2pos = {}
-        i = 0
-        for node in nodes:
-            try:
-                if not node.isContainer():
-                    self.nodeids.append(node.id)
-                    self.nodeid2pos[node.id] = i
-                    i += 1
-            except TypeError:
-                continue
+    def __init__(self, nodeids):
+        self.nodeids = nodeids
+        self.nodeid2pos = {nid: pos for pos, nid in enumerate(nodeids)}
 
     def getNext(self, nodeid):
         try:
@@ -307,7 +310,7 @@ def shownavlist(req, node, nodes, page, dir=None):
 
 @dec_entry_log
 def shownodelist(req, nodes, page, publishwarn=True, markunpublished=False, dir=None, item_count=None, all_nodes=None):
-    req.session["nodelist"] = EditorNodeList(nodes)
+    req.session["nodelist"] = editor_nodelist_ids(nodes)
     script_array = "allobjects = new Array();\n"
     nodelist = []
     nodes_per_page = get_nodes_per_page(req, dir)
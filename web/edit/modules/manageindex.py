@@ -20,9 +20,11 @@
 
 from schema.schema import loadTypesFromDB, getMetaType
 from utils.utils import u, dec_entry_log
+from itertools import chain
 from core import Node
 from core import db
-from utils.pathutils import getPaths
+from core.database.postgres import build_accessfunc_arguments
+from utils.pathutils import get_accessible_id_paths
 
 q = db.query
 
@@ -117,20 +119,23 @@ def getContent(req, ids):
             fieldname = req.params.get("action", "").split("__")[2]
             values = req.params.get("action", "").split("__")[3].split(";")[:-1]
             all_values = getAllAttributeValues(fieldname, scheme)
+            values = [u(value) for value in values]
 
-            def isChildOf(access, node, basenodeid):
-                for ls in getPaths(node):
-                    if basenodeid in [unicode(n.id) for n in ls]:
-                        return 1
-                return 0
+            # paths of all nodes are fetched at once
+            node_ids = set(chain.from_iterable(all_values[value] for value in values if value in all_values))
+            group_ids, ip, date = build_accessfunc_arguments()
+            id_paths = get_accessible_id_paths(node_ids, group_ids, ip, date)
+            basenode_id = int(ids)
+
+            def isChildOf(nid):
+                return any(basenode_id in path for path in id_paths[nid])
 
             subitems = {}
             for value in values:
-                value = u(value)
                 if value in all_values:
                     subitems[value] = []
                     for l in all_values[value]:
-                        if isChildOf(AccessData(req), q(Node).get(l), ids):
+                        if isChildOf(l):
                             subitems[value].append(l)
 
             v["items"] = subitems
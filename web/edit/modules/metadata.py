@@ -25,6 +25,7 @@ from core.translation import lang, t, getDefaultLanguage
 from pprint import pformat as pf
 from core.transition import httpstatus, current_user
 from core import Node, db
+from core.database.postgres.bulkedit import bulk_edit, group_by_next_version_tag
 from contenttypes import Container
 from core.users import user_from_session
 import datetime
@@ -114,18 +115,19 @@ def _handle_edit_metadata(req, mask, nodes):
             # Create new node version
             comment = u'({})\n{}'.format(t(req, "document_new_version_comment"), form.get('version_comment', ''))
 
-            for node in nodes:
-                with node.new_tagged_version(comment=comment, user=user):
-                    mask.update_node(node, req, user)
+            # nodes with the same next version number share one versioning transaction
+            for tag, tag_nodes in group_by_next_version_tag(nodes).iteritems():
+                with bulk_edit(tag_nodes, tag=tag, comment=comment, user=user, tag_untagged_versions=True):
+                    for node in tag_nodes:
+                        mask.update_node(node, req, user)
         else:
             # XXX: why check here?
             # if nodes:
             old_nodename = nodes[0].name
 
-            for node in nodes:
-                mask.update_node(node, req, user)
-
-            db.session.commit()
+            with bulk_edit(nodes, user=user):
+                for node in nodes:
+                    mask.update_node(node, req, user)
 
             # XXX: why check here?
             # if nodes:
@@ -33,6 +33,7 @@ from core.transition import httpstatus, current_user
 from core import Node
 from core import db
 from core import File
+from core import filestore
 
 q = db.query
 logg = logging.getLogger(__name__)
@@ -76,7 +77,9 @@ def getContent(req, ids):
                     filename = 'html/%s_%s.html' % (req.params.get('id'), maxid)
                 with codecs.open(config.get("paths.datadir") + filename, "w", encoding='utf8') as fil:
                     fil.write(req.params.get('data'))
-                node.files.append(File(filename, u"content", u"text/html"))
+                new_file = File(filename, u"content", u"text/html")
+                new_file.content_changed()
+                node.files.append(new_file)
                 db.session.commit()
                 req.write(json.dumps({'filename': '', 'state': 'ok'}))
                 logg.info("%s added startpage %s for node %s (%s, %s)", user.login_name, filename, node.id, node.name, node.type)
@@ -85,10 +88,14 @@ def getContent(req, ids):
                 for f in [f for f in node.files if f.mimetype == "text/html"]:
                     filepath = f.abspath.replace(config.get("paths.datadir"), '')
                     if req.params.get('filename') == filepath and os.path.exists(config.get("paths.datadir") + filepath):
-                        with open(config.get("paths.datadir") + filepath, "w") as fil:
-                            fil.write(req.params.get('data'))
+                        # the file may share its blob with other startpages, it must not be written in place
+                        with filestore.replacement_path(f.abspath) as tmp_filepath:
+                            with codecs.open(tmp_filepath, "w", encoding='utf8') as fil:
+                                fil.write(req.params.get('data'))
+                        f.content_changed()
+                        db.session.commit()
                         req.write(json.dumps(
-                            {'filesize': format_filesize(os.path.getsize(config.get("paths.datadir") + filepath)),
+                            {'filesize': format_filesize(f.filesize),
                              'filename': req.params.get('filename'), 'state': 'ok'}, ensure_ascii=False))
                         logg.info("%s saved startpage %s for node %s (%s, %s)", user.login_name, filepath, node.id, node.name, node.type)
                         break
@@ -151,8 +158,14 @@ def getContent(req, ids):
                 content = req.params.get(key, "")
                 break
 
-        with open(req.params.get('file_path'), "w", encoding='utf8') as fi:
-            fi.writelines(content)
+        for f in node.files:
+            if f.abspath == req.params.get('file_path'):
+                with filestore.replacement_path(f.abspath) as tmp_filepath:
+                    with codecs.open(tmp_filepath, "w", encoding='utf8') as fi:
+                        fi.writelines(content)
+                f.content_changed()
+                db.session.commit()
+                break
 
         del req.params['save_page']
         del req.params['file_to_edit']
@@ -19,9 +19,8 @@
 
 import core.config as config
 
-from core.stats import StatisticFile
+from core.statsstore import ACCESS_TYPES, AccessStatistics, stats_periods
 from core.translation import t, lang
-from utils.utils import splitpath
 from utils.date import format_date, now
 from core.transition import httpstatus, current_user
 from core import Node
@@ -41,13 +40,6 @@ except:
     reportlab = 0
 
 
-def getPeriod(filename):
-    filename = splitpath(filename)[-1]
-    period = filename[:-4].split("_")[2]
-    type = filename[:-4].split("_")[3]
-    return period, type
-
-
 def getContent(req, ids):
     if len(ids) > 0:
         ids = ids[0]
@@ -63,30 +55,19 @@ def getContent(req, ids):
         getPopupWindow(req, ids)
         return ""
 
-    statfiles = {}
-    p = ""
-
-    for file in node.files:
-        if file.filetype == "statistic":
-            period, type = getPeriod(file.abspath)
-            if period > p:
-                p = period
-
-            if type not in statfiles.keys():
-                statfiles[type] = {}
-
-            if period not in statfiles[type].keys():
-                statfiles[type][period] = []
-            statfiles[type][period].append(file)
+    periods = stats_periods()
+    statfiles = {access_type: periods for access_type in ACCESS_TYPES} if periods else {}
+    p = periods[0] if periods else ""
 
     v = {}
     v["id"] = ids
     v["files"] = statfiles
     v["current_period"] = req.params.get("select_period", "frontend_" + p)
-    if len(statfiles) > 0:
-        v["current_file"] = StatisticFile(statfiles[v["current_period"].split("_")[0]][v["current_period"].split("_")[1]][0])
+    access_type, _, period = v["current_period"].partition("_")
+    if access_type in ACCESS_TYPES and period in periods:
+        v["current_file"] = AccessStatistics(node, period, access_type)
     else:
-        v["current_file"] = StatisticFile(None)
+        v["current_file"] = AccessStatistics(node, None, "frontend")
     v["nodename"] = node.name
 
     return req.getTAL("web/edit/modules/statsaccess.html", v, macro="edit_stats")
@@ -227,7 +208,7 @@ class StatsAccessPDF:
             # header country
             items.append(Frame(1 * cm, 26.0 * cm, 19 * cm, 1 * cm, leftPadding=0, rightPadding=0, id='normal', showBoundary=0))
             i = 0
-            for v in sorted([(len(d[k]['items']), k) for k in filter(lambda x:x != 0, d.keys())], reverse=True):
+            for v in sorted([(d[k]['items'], k) for k in filter(lambda x:x != 0, d.keys())], reverse=True):
                 if v[0] != 0:
                     items.append(Frame(1 * cm,
                                        (25.1 - (i * 0.5)) * cm,
@@ -253,7 +234,7 @@ class StatsAccessPDF:
             items.append(Paragraph(t(self.language, "edit_stats_country"), self.chartheader))
             items.append((FrameBreak()))
 
-            for v in sorted([(len(d[k]['items']), k) for k in filter(lambda x:x != 0, d.keys())], reverse=True)[:50]:
+            for v in sorted([(d[k]['items'], k) for k in filter(lambda x:x != 0, d.keys())], reverse=True)[:50]:
                 if v[0] != 0:
                     items.append(Paragraph(ustr(v[1]), self.bv))
                     items.append((FrameBreak()))
@@ -281,7 +262,7 @@ class StatsAccessPDF:
                 items.append(Frame(1 * cm + (k - 1) * 17 + 9 + x,
                                    18.9 * cm,
                                    5,
-                                   len(d[k]["visitors"]) * (6 * cm) / max["max_u"] + 16,
+                                   d[k]["visitors"] * (6 * cm) / max["max_u"] + 16,
                                    leftPadding=0,
                                    rightPadding=0,
                                    id='normal',
@@ -289,7 +270,7 @@ class StatsAccessPDF:
                 items.append(Frame(1 * cm + (k - 1) * 17 + 14 + x,
                                    18.9 * cm,
                                    5,
-                                   len(d[k]["different"]) * (6 * cm) / max["max_p"] + 16,
+                                   d[k]["different"] * (6 * cm) / max["max_p"] + 16,
                                    leftPadding=0,
                                    rightPadding=0,
                                    id='normal',
@@ -297,7 +278,7 @@ class StatsAccessPDF:
                 items.append(Frame(1 * cm + (k - 1) * 17 + 19 + x,
                                    18.9 * cm,
                                    5,
-                                   len(d[k]["items"]) * (6 * cm) / max["max"] + 16,
+                                   d[k]["items"] * (6 * cm) / max["max"] + 16,
                                    leftPadding=0,
                                    rightPadding=0,
                                    id='normal',
@@ -316,13 +297,13 @@ class StatsAccessPDF:
                 if k == 0:
                     continue
                 items.append(PdfImage(config.basedir + "/web/img/stat_baruser_vert.png", width=5,
-                                      height=((len(d[k]["visitors"]) * (6 * cm) / max["max_u"] + 1) or 1)))
+                                      height=((d[k]["visitors"] * (6 * cm) / max["max_u"] + 1) or 1)))
                 items.append(FrameBreak())
                 items.append(PdfImage(config.basedir + "/web/img/stat_barpage_vert.png", width=5,
-                                      height=((len(d[k]["different"]) * (6 * cm) / max["max_p"] + 1) or 1)))
+                                      height=((d[k]["different"] * (6 * cm) / max["max_p"] + 1) or 1)))
                 items.append(FrameBreak())
                 items.append(PdfImage(config.basedir + "/web/img/stat_bar_vert.gif", width=5,
-                                      height=((len(d[k]["items"]) * (6 * cm) / max["max"] + 1) or 1)))
+                                      height=((d[k]["items"] * (6 * cm) / max["max"] + 1) or 1)))
                 items.append(FrameBreak())
 
             t_data = []
@@ -352,7 +333,7 @@ class StatsAccessPDF:
                     if self.stats.getWeekDay(k) > 4:
                         weekend.append(('BACKGROUND', (0, k), (-1, k), colors.HexColor('#E6E6E6')))
                     t_data.append(['%02d.%s %s' % (k, t(self.language, "monthname_" + ustr(int(self.period[-2:])) + "_short"),
-                                                   self.period[:4]), len(d[k]["visitors"]), len(d[k]["different"]), len(d[k]["items"])])
+                                                   self.period[:4]), d[k]["visitors"], d[k]["different"], d[k]["items"]])
 
             tb = Table(t_data, 4 * [100], [25] + (len(d) - 1) * [12])
             tb.setStyle(TableStyle([('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
@@ -386,7 +367,7 @@ class StatsAccessPDF:
                 items.append(Frame(l + (k - 1) * 17,
                                    b,
                                    16,
-                                   len(d[k]["visitors"]) * h / max["max_u"] + 16,
+                                   d[k]["visitors"] * h / max["max_u"] + 16,
                                    leftPadding=0,
                                    rightPadding=0,
                                    id='normal',
@@ -394,7 +375,7 @@ class StatsAccessPDF:
                 items.append(Frame(l + (k - 1) * 17 + 5,
                                    b,
                                    16,
-                                   len(d[k]["different"]) * h / max["max_p"] + 16,
+                                   d[k]["different"] * h / max["max_p"] + 16,
                                    leftPadding=0,
                                    rightPadding=0,
                                    id='normal',
@@ -402,7 +383,7 @@ class StatsAccessPDF:
                 items.append(Frame(l + (k - 1) * 17 + 10,
                                    b,
                                    16,
-                                   len(d[k]["items"]) * h / max["max"] + 16,
+                                   d[k]["items"] * h / max["max"] + 16,
                                    leftPadding=0,
                                    rightPadding=0,
                                    id='normal',
@@ -422,8 +403,7 @@ class StatsAccessPDF:
                         config.basedir +
                         "/web/img/stat_baruser_vert.png",
                         width=5,
-                        height=len(
-                            d[k]["visitors"]) *
+                        height=d[k]["visitors"] *
                         h /
                         max["max_u"] +
                         1))
@@ -433,14 +413,13 @@ class StatsAccessPDF:
                         config.basedir +
                         "/web/img/stat_barpage_vert.png",
                         width=5,
-                        height=len(
-                            d[k]["different"]) *
+                        height=d[k]["different"] *
                         h /
                         max["max_p"] +
                         1))
                 items.append(FrameBreak())
                 items.append(
-                    PdfImage(config.basedir + "/web/img/stat_bar_vert.gif", width=6, height=len(d[k]["items"]) * h / max["max"] + 1))
+                    PdfImage(config.basedir + "/web/img/stat_bar_vert.gif", width=6, height=d[k]["items"] * h / max["max"] + 1))
                 items.append(FrameBreak())
 
             tb = Table([[t(self.language, "dayname_" + ustr(x) + "_short") for x in range(0, 7)]], 7 * [17], 17)
@@ -460,7 +439,7 @@ class StatsAccessPDF:
             for k in d:
                 if k == 0:
                     continue
-                t_data[k - 1] += [len(d[k][key]) for key in d[k].keys()]
+                t_data[k - 1] += [d[k]["visitors"], d[k]["different"], d[k]["items"]]
             t_data = [[t(self.language, "edit_stats_weekday"), t(self.language, "edit_stats_diffusers").replace(
                 "<br/>", "\n"), t(self.language, "edit_stats_pages"), t(self.language, "edit_stats_access")]] + t_data
 
@@ -494,7 +473,7 @@ class StatsAccessPDF:
                 items.append(Frame(1.67 * cm + (k - 1) * 21,
                                    14.8 * cm,
                                    6,
-                                   (len(d[k]["visitors"]) * h / max["max_u"]) + 16,
+                                   (d[k]["visitors"] * h / max["max_u"]) + 16,
                                    leftPadding=0,
                                    rightPadding=0,
                                    id='normal',
@@ -502,7 +481,7 @@ class StatsAccessPDF:
                 items.append(Frame(1.67 * cm + (k - 1) * 21 + 6,
                                    14.8 * cm,
                                    6,
-                                   (len(d[k]["different"]) * h / max["max_p"]) + 16,
+                                   (d[k]["different"] * h / max["max_p"]) + 16,
                                    leftPadding=0,
                                    rightPadding=0,
                                    id='normal',
@@ -510,7 +489,7 @@ class StatsAccessPDF:
                 items.append(Frame(1.67 * cm + (k - 1) * 21 + 12,
                                    14.8 * cm,
                                    6,
-                                   (len(d[k]["items"]) * h / max["max"]) + 16,
+                                   (d[k]["items"] * h / max["max"]) + 16,
                                    leftPadding=0,
                                    rightPadding=0,
                                    id='normal',
@@ -531,8 +510,7 @@ class StatsAccessPDF:
                         config.basedir +
                         "/web/img/stat_baruser_vert.png",
                         width=6,
-                        height=len(
-                            d[k]["visitors"]) *
+                        height=d[k]["visitors"] *
                         h /
                         max["max_u"] +
                         1))
@@ -542,14 +520,13 @@ class StatsAccessPDF:
                         config.basedir +
                         "/web/img/stat_barpage_vert.png",
                         width=6,
-                        height=len(
-                            d[k]["different"]) *
+                        height=d[k]["different"] *
                         h /
                         max["max_p"] +
                         1))
                 items.append(FrameBreak())
                 items.append(
-                    PdfImage(config.basedir + "/web/img/stat_bar_vert.gif", width=6, height=len(d[k]["items"]) * h / max["max"] + 1))
+                    PdfImage(config.basedir + "/web/img/stat_bar_vert.gif", width=6, height=d[k]["items"] * h / max["max"] + 1))
                 items.append(FrameBreak())
 
             t_data = []
@@ -572,7 +549,7 @@ class StatsAccessPDF:
             for k in d:
                 if k == 0:
                     continue
-                t_data[k - 1] += [len(d[k][key]) for key in d[k].keys()]
+                t_data[k - 1] += [d[k]["visitors"], d[k]["different"], d[k]["items"]]
             t_data = [[t(self.language, "edit_stats_daytime"), t(self.language, "edit_stats_diffusers").replace(
                 "<br/>", "\n"), t(self.language, "edit_stats_pages"), t(self.language, "edit_stats_access")]] + t_data
 
@@ -672,11 +649,10 @@ class StatsAccessPDF:
 
 def getPrintView(nid, p, req):
     node = q(Node).get(nid)
-    for f in node.files:
-        if f.filetype == "statistic":
-            period, type = getPeriod(f.abspath)
-            if type == p.split("_")[0] and period == p.split("_")[1]:
-                data = StatisticFile(f)
+    access_type, _, period = p.partition("_")
+    data = None
+    if access_type in ACCESS_TYPES and period in stats_periods():
+        data = AccessStatistics(node, period, access_type)
 
     if data:
         pdf = StatsAccessPDF(data, p.split("_")[1], nid, lang(req))
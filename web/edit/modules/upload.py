@@ -33,6 +33,7 @@ import json
 
 from web.edit.edit_common import showdir, shownav, showoperations, searchbox_navlist_height
 from web.edit.edit import getTreeLabel, get_ids_from_req
+from web.edit.zipimport import clean_zip_entry_name, start_zip_import, get_zip_import_status
 from utils.url import build_url_from_path_and_params
 from utils.utils import join_paths, getMimeType, funcname, get_user_id, dec_entry_log
 from utils.fileutils import importFileToRealname, importFileRandom
@@ -232,6 +233,36 @@ def getContent(req, ids):
             req.write(res)
             return None
 
+        # import all files from an uploaded zip file in the background
+        if req.params.get('action') == "zipimport":
+            basenode = q(Node).get(req.params.get('id'))
+            if not basenode.has_write_access():
+                req.write(json.dumps({'state': 'error', 'error': 'permission_denied'}, ensure_ascii=False))
+                return None
+
+            type_to_schema = {k.replace('scheme_', '', 1): v for k, v in req.params.items() if k.startswith("scheme_")}
+            for f in basenode.files:
+                if f.abspath.endswith(req.params.get('file')):
+                    zip_filepath = f.abspath
+                    # the job removes the zip file when it's finished
+                    basenode.files.remove(f)
+                    db.session.commit()
+                    job = start_zip_import(zip_filepath, basenode.id, type_to_schema, user.login_name)
+                    req.write(json.dumps({'state': state, 'job': job.id}, ensure_ascii=False))
+                    break
+            else:
+                req.write(json.dumps({'state': 'error', 'error': 'file_not_found'}, ensure_ascii=False))
+            return None
+
+        # poll the state of a zip import job
+        if req.params.get('action') == "zipimport_status":
+            status = get_zip_import_status(req.params.get('job'))
+            if status is None or status.pop('user_login') != user.login_name:
+                req.write(json.dumps({'state': 'error', 'error': 'job_not_found'}, ensure_ascii=False))
+            else:
+                req.write(json.dumps(status, ensure_ascii=False))
+            return None
+
         # add new object, only metadata
         if req.params.get('action') == "addmeta":
             schemes = get_permitted_schemas()
@@ -370,7 +401,7 @@ def getContent(req, ids):
                     macro = "uploadzipfileok_plupload"
                 else:
                     macro = "uploadzipfileok"
-                content = req.getTAL('web/edit/modules/upload.html', upload_ziphandler(req), macro=macro)
+                content = req.getTAL('web/edit/modules/upload.html', upload_zip_schemes(req), macro=macro)
             elif mime[1] == "bibtex":  # bibtex file
                 if req.params.get('uploader', '') == 'plupload':
                     macro = "uploadbibfileok_plupload"
@@ -512,52 +543,31 @@ def upload_to_filetype_filehandler(req):
 
 
 @dec_entry_log
-def upload_ziphandler(req):
+def upload_zip_schemes(req):
+    """Lists the files of an uploaded zip file and the schemes for their datatypes.
+    Nothing is extracted here, the files are imported by the 'zipimport' action."""
     schemes = get_permitted_schemas()
     files = []
     scheme_type = {}
     basenode = q(Node).get(req.params.get('id'))
     for file in basenode.files:
         if file.abspath.endswith(req.params.get('file')):
-            z = zipfile.ZipFile(file.abspath)
-            for f in z.namelist():
-                #strip unwanted garbage from string
-                name = mybasename(f).decode('utf8', 'ignore').encode('utf8')
-                random_str = ustr(random.random())[2:]
-                if name.startswith("._"):  # ignore Mac OS X junk
-                    continue
-                if name.split('.')[0] == '':
-                    name = random_str + name
-
-                files.append(name.replace(" ", "_"))
-                _m = getMimeType(name)
-
-                if random_str in name:
-                    newfilename = join_paths(config.get("paths.tempdir"), name.replace(" ", "_"))
-                else:
-                    newfilename = join_paths(config.get("paths.tempdir"),  random_str + name.replace(" ", "_"))
-
-                with codecs.open(newfilename, "wb") as fi:
-                    fi.write(z.read(f))
-
-                fn = importFileToRealname(mybasename(name.replace(" ", "_")), newfilename)
-                basenode.files.append(fn)
-                if os.path.exists(newfilename):
-                    os.unlink(newfilename)
-
-                if _m[1] not in scheme_type:
-                    scheme_type[_m[1]] = []
-                    for scheme in schemes:
-                        if _m[1] in scheme.getDatatypes():
-                            scheme_type[_m[1]].append(scheme)
-            try:
-                z.close()
-                os.remove(file.abspath)
-            except:
-                pass
-            basenode.files.remove(file)
-            db.session.commit()
-    return {'files': files, 'schemes': scheme_type}
+            with zipfile.ZipFile(file.abspath) as z:
+                for info in z.infolist():
+                    name = clean_zip_entry_name(info.filename)
+                    if name is None:
+                        continue
+
+                    files.append(name)
+                    _m = getMimeType(name)
+
+                    if _m[1] not in scheme_type:
+                        scheme_type[_m[1]] = []
+                        for scheme in schemes:
+                            if _m[1] in scheme.getDatatypes():
+                                scheme_type[_m[1]].append(scheme)
+            break
+    return {'files': files, 'schemes': scheme_type, 'zipfile': req.params.get('file')}
 
 
 @dec_entry_log
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import base64
+import hashlib
+
+from pytest import fixture, raises
+
+import core.config
+import web.edit.chunkedupload
+from web.edit.chunkedupload import ChunkedUpload, ChunkWriter, open_chunk_stream, parse_upload_metadata, \
+    parse_upload_checksum, chunked_upload, _writers
+
+
+class FakeRequest(object):
+
+    def __init__(self, upload_id, headers, user_id=1):
+        self.uri = self.path = "/edit/upload/chunked/" + upload_id
+        self.request_headers = headers
+        self.stream_session = {"user_id": user_id} if user_id is not None else None
+        self.method = "PATCH"
+        self.reply_headers = {}
+
+    def split_uri(self):
+        return self.uri, None, None, None
+
+
+@fixture
+def upload(tmpdir, monkeypatch):
+    monkeypatch.setattr(core.config, "settings", {"paths.datadir": str(tmpdir)})
+    monkeypatch.setattr(web.edit.chunkedupload, "_sha256_states", {})
+    filepath = tmpdir.join("upload.bin")
+    filepath.write("")
+    upload = ChunkedUpload("a" * 32, u"upload.bin", str(filepath), 10, 1, None, 1, "testuser")
+    upload.save()
+    return upload
+
+
+def chunk_headers(offset, data, **kwargs):
+    headers = {"content-type": "application/offset+octet-stream",
+               "content-length": str(len(data)),
+               "upload-offset": str(offset)}
+    headers.update(kwargs)
+    return headers
+
+
+def test_parse_upload_metadata():
+    value = "filename {},node {},empty".format(base64.b64encode(u"bild ä.tif".encode("utf8")), base64.b64encode("42"))
+    assert parse_upload_metadata(value) == {"filename": u"bild ä.tif", "node": u"42", "empty": u""}
+
+
+def test_parse_upload_checksum():
+    assert parse_upload_checksum("sha1 " + base64.b64encode(hashlib.sha1("x").digest())) == ("sha1", hashlib.sha1("x").digest())
+    with raises(ValueError):
+        parse_upload_checksum("crc1234 AAAA")
+
+
+def test_load_upload(upload):
+    loaded = ChunkedUpload.load(upload.id)
+    assert loaded.__dict__ == upload.__dict__
+    assert ChunkedUpload.load("b" * 32) is None
+
+
+def test_write_chunks(upload):
+    writer = ChunkWriter(upload, 0, "sha1")
+    writer.write("hello")
+    writer.close()
+    writer.release()
+    assert upload.offset == 5
+    assert writer.hash.digest() == hashlib.sha1("hello").digest()
+
+    writer = ChunkWriter(upload, 5)
+    writer.write("world")
+    writer.close()
+    writer.release()
+    assert upload.complete
+    with open(upload.filepath) as f:
+        assert f.read() == "helloworld"
+
+
+def test_running_sha256(upload):
+    writer = ChunkWriter(upload, 0)
+    writer.write("hello")
+    writer.close()
+    writer.release()
+
+    writer = ChunkWriter(upload, 5)
+    writer.write("xxxxx")
+    writer.truncate()
+    writer.release()
+
+    writer = ChunkWriter(upload, 5)
+    writer.write("world")
+    writer.close()
+    writer.release()
+    assert writer.sha256.hexdigest() == hashlib.sha256("helloworld").hexdigest()
+
+
+def test_running_sha256_unknown_state(upload):
+    with open(upload.filepath, "w") as f:
+        f.write("hello")
+    # previous chunk written by another process
+    writer = ChunkWriter(upload, 5)
+    assert writer.sha256 is None
+    writer.close()
+    writer.release()
+
+
+def test_truncate_chunk(upload):
+    writer = ChunkWriter(upload, 0)
+    writer.write("hello")
+    writer.truncate()
+    assert upload.offset == 0
+
+
+def test_abort_with_checksum_discards_chunk(upload):
+    writer = ChunkWriter(upload, 0, "md5")
+    writer.write("hel")
+    writer.abort()
+    assert upload.offset == 0
+
+
+def test_open_chunk_stream(upload):
+    req = FakeRequest(upload.id, chunk_headers(0, "hello"))
+    writer = open_chunk_stream(req)
+    assert writer is not None
+
+    # upload is locked while the first chunk is written
+    req2 = FakeRequest(upload.id, chunk_headers(0, "hello"))
+    assert open_chunk_stream(req2) is None
+    assert req2.chunk_status == 409
+
+    writer.write("hello")
+    writer.close()
+    writer.release()
+
+    # wrong offset
+    req3 = FakeRequest(upload.id, chunk_headers(0, "world"))
+    assert open_chunk_stream(req3) is None
+    assert req3.chunk_status == 409
+
+
+def test_open_chunk_stream_rejected(upload):
+    req = FakeRequest(upload.id, chunk_headers(0, "too long for this upload"))
+    assert open_chunk_stream(req) is None
+    assert req.chunk_status == 413
+
+    req = FakeRequest("b" * 32, chunk_headers(0, "hello"))
+    assert open_chunk_stream(req) is None
+    assert req.chunk_status == 404
+
+    req = FakeRequest(upload.id, chunk_headers(0, "hello", **{"content-type": "text/plain"}))
+    assert open_chunk_stream(req) is None
+    assert req.chunk_status == 415
+
+
+def test_open_chunk_stream_checks_user(upload):
+    req = FakeRequest(upload.id, chunk_headers(0, "hello"), user_id=None)
+    assert open_chunk_stream(req) is None
+    assert req.chunk_status == 403
+
+    req = FakeRequest(upload.id, chunk_headers(0, "hello"), user_id=2)
+    assert open_chunk_stream(req) is None
+    assert req.chunk_status == 404
+    assert upload.id not in _writers
+
+
+class FakeUser(object):
+
+    def __init__(self, id, is_anonymous=False):
+        self.id = id
+        self.is_anonymous = is_anonymous
+
+
+def _open_and_write_chunk(upload):
+    req = FakeRequest(upload.id, chunk_headers(0, "hello"))
+    req.stream_body = open_chunk_stream(req)
+    req.stream_body.write("hello")
+    req.stream_body.close()
+    return req
+
+
+def test_chunked_upload_anonymous_discards_chunk(upload, monkeypatch):
+    monkeypatch.setattr(web.edit.chunkedupload, "current_user", FakeUser(None, is_anonymous=True))
+    req = _open_and_write_chunk(upload)
+    assert chunked_upload(req) == 403
+    assert upload.offset == 0
+    assert upload.id not in _writers
+
+
+def test_chunked_upload_unknown_upload_discards_chunk(upload, monkeypatch):
+    monkeypatch.setattr(web.edit.chunkedupload, "current_user", FakeUser(1))
+    req = _open_and_write_chunk(upload)
+    # upload removed after the chunk was opened
+    upload.remove()
+    assert chunked_upload(req) == 404
+    assert upload.offset == 0
+    assert upload.id not in _writers
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+"""
+import zipfile
+
+from pytest import fixture
+
+import web.edit.zipimport
+from web.edit.zipimport import clean_zip_entry_name, get_zip_import_status, ZipImportJob
+
+
+@fixture
+def status_dir(tmpdir, monkeypatch):
+    status_dir = tmpdir.mkdir("zipimport")
+    monkeypatch.setattr(web.edit.zipimport, "_get_status_dir", lambda: str(status_dir))
+    return status_dir
+
+
+def test_clean_zip_entry_name():
+    assert clean_zip_entry_name("dir/sub dir/my image.jpg") == "my_image.jpg"
+    assert clean_zip_entry_name("dir\\windows.pdf") == "windows.pdf"
+
+
+def test_clean_zip_entry_name_ignored():
+    assert clean_zip_entry_name("dir/") is None
+    assert clean_zip_entry_name("__MACOSX/._image.jpg") is None
+
+
+def test_clean_zip_entry_name_hidden_file():
+    name = clean_zip_entry_name(".hidden.jpg")
+    assert name.endswith(".hidden.jpg")
+    assert name.split(".")[0] != ""
+
+
+def test_zip_import_job_missing_schema(tmpdir, status_dir):
+    zip_filepath = str(tmpdir.join("test.zip"))
+    with zipfile.ZipFile(zip_filepath, "w") as z:
+        z.writestr("test.jpg", "no image")
+
+    job = ZipImportJob(zip_filepath, 1, {}, "testuser")
+    assert job._extract() == []
+    status = job.status()
+    assert status["total"] == 1
+    assert status["errors"] == 1
+    assert status["entries"][0]["name"] == "test.jpg"
+    assert status["entries"][0]["filename"] == "test.jpg"
+
+
+def test_zip_import_job_duplicate_names(tmpdir, status_dir, monkeypatch):
+    zip_filepath = str(tmpdir.join("test.zip"))
+    with zipfile.ZipFile(zip_filepath, "w") as z:
+        z.writestr("first/image.jpg", "first")
+        z.writestr("second/image.jpg", "second")
+
+    def import_file_from_stream(realname, fileobj):
+        return fileobj.read()
+
+    monkeypatch.setattr(web.edit.zipimport, "importFileFromStream", import_file_from_stream)
+    job = ZipImportJob(zip_filepath, 1, {"image": "testschema"}, "testuser")
+    imported = job._extract()
+    assert imported == [(u"first/image.jpg", "image.jpg", "first"), (u"second/image.jpg", "image.jpg", "second")]
+    status = job.status()
+    assert status["total"] == 2
+    assert [e["name"] for e in status["entries"]] == [u"first/image.jpg", u"second/image.jpg"]
+    assert all(e["filename"] == "image.jpg" and e["state"] == "extracted" for e in status["entries"])
+
+
+def test_zip_import_status_from_file(tmpdir, status_dir):
+    zip_filepath = str(tmpdir.join("test.zip"))
+    with zipfile.ZipFile(zip_filepath, "w") as z:
+        z.writestr("test.jpg", "no image")
+
+    job = ZipImportJob(zip_filepath, 1, {}, "testuser")
+    job._extract()
+    job.save_status()
+    status = get_zip_import_status(job.id)
+    assert status["user_login"] == "testuser"
+    assert status["total"] == 1
+    assert status["errors"] == 1
+
+
+def test_zip_import_status_invalid_job_id(status_dir):
+    assert get_zip_import_status("../" + "0" * 32) is None
+    assert get_zip_import_status("0" * 32) is None
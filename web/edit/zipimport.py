@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+    :copyright: (c) 2016 by the mediaTUM authors
+    :license: GPL3, see COPYING for details
+
+    Background import of zip archives uploaded in the edit area.
+
+    A ZipImportJob streams the archive members directly to the import dir, creates the content nodes in batches
+    and runs the postprocessing (`event_files_changed`) in a pool of worker threads.
+    The state of a job can be polled with the 'zipimport_status' action of the upload module.
+    Jobs run in the worker process that received the 'zipimport' request, so the state is written to a JSON file
+    in the data dir where every worker can read it.
+    Failures are recorded per archive member and don't stop the rest of the import.
+    Entries are identified by the full member path because members in different directories can have the same name.
+"""
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import logging
+from multiprocessing.pool import ThreadPool
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import zipfile
+
+from core import db, Node, config
+from utils.fileutils import importFileFromStream
+from utils.utils import getMimeType
+
+
+logg = logging.getLogger(__name__)
+q = db.query
+
+#: commit new nodes after this number of archive members
+NODE_BATCH_SIZE = 200
+#: status files of jobs are removed after this time (seconds)
+FINISHED_JOB_LIFETIME = 3600
+#: minimum time between two status file updates while entries are processed (seconds)
+STATUS_SAVE_INTERVAL = 1.
+
+_JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _get_status_dir():
+    status_dir = config.resolve_datadir_path("incoming/zipimport")
+    if not os.path.exists(status_dir):
+        os.makedirs(status_dir)
+    return status_dir
+
+
+def _status_filepath(job_id):
+    return os.path.join(_get_status_dir(), job_id + ".json")
+
+
+def clean_zip_entry_name(zip_entry_name):
+    """Returns the file name to be used for an archive member or None if the member should be ignored."""
+    if zip_entry_name.endswith("/"):
+        # directory
+        return None
+    name = re.split(r"[/\\]", zip_entry_name)[-1]
+    # strip unwanted garbage from string
+    name = name.decode("utf8", "ignore").encode("utf8")
+    if name.startswith("._"):  # ignore Mac OS X junk
+        return None
+    if name.split(".")[0] == "":
+        name = str(random.random())[2:] + name
+    return name.replace(" ", "_")
+
+
+class ZipImportJob(object):
+
+    """Imports all members of a zip archive as children of a base node.
+    :param type_to_schema: maps datatype names (image, document, ...) to the schema that should be used for new nodes
+    """
+
+    def __init__(self, zip_filepath, basenode_id, type_to_schema, user_login):
+        self.id = uuid.uuid4().hex
+        self.zip_filepath = zip_filepath
+        self.basenode_id = basenode_id
+        self.type_to_schema = type_to_schema
+        self.user_login = user_login
+        self.state = "waiting"
+        self.started = time.time()
+        self.finished = None
+        self.error = None
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved = 0
+
+    def _set_entry(self, member_path, state, filename=None, node_id=None, error=None):
+        with self._lock:
+            entry = self.entries.setdefault(member_path, {})
+            entry["state"] = state
+            if filename is not None:
+                entry["filename"] = filename
+            if node_id is not None:
+                entry["node_id"] = node_id
+            if error is not None:
+                entry["error"] = error
+
+        self.save_status(force=False)
+
+    def _set_state(self, state):
+        self.state = state
+        self.save_status()
+
+    def save_status(self, force=True):
+        """Writes the job state to the status file, see `get_zip_import_status`.
+        Without `force`, the file is not written again before STATUS_SAVE_INTERVAL has passed."""
+        with self._save_lock:
+            now = time.time()
+            if not force and now - self._saved < STATUS_SAVE_INTERVAL:
+                return
+            self._saved = now
+            status = self.status()
+            status["user_login"] = self.user_login
+            status_filepath = _status_filepath(self.id)
+            tmp_filepath = status_filepath + ".tmp"
+            with open(tmp_filepath, "w") as wf:
+                json.dump(status, wf)
+            os.rename(tmp_filepath, status_filepath)
+
+    def _extract(self):
+        """Streams archive members to the import dir, returns a list of (member path, name, File) tuples.
+        Files with the same name get unique paths in the import dir."""
+        imported = []
+        with zipfile.ZipFile(self.zip_filepath) as z:
+            for info in z.infolist():
+                name = clean_zip_entry_name(info.filename)
+                if name is None:
+                    continue
+
+                member_path = info.filename
+                if not isinstance(member_path, unicode):
+                    member_path = member_path.decode("utf8", "replace")
+
+                datatype = getMimeType(name)[1]
+                if datatype not in self.type_to_schema:
+                    self._set_entry(member_path, "error", name, error="no schema given for type " + datatype)
+                    continue
+
+                try:
+                    with z.open(info) as member:
+                        imported.append((member_path, name, importFileFromStream(name, member)))
+                except Exception as e:
+                    logg.exception("zip import %s: failed to extract %s", self.id, member_path)
+                    self._set_entry(member_path, "error", name, error=unicode(e))
+                else:
+                    self._set_entry(member_path, "extracted", name)
+
+        return imported
+
+    def _create_nodes(self, imported):
+        """Creates a node for each imported file, commits after NODE_BATCH_SIZE nodes.
+        Returns the list of (member path, node id) tuples."""
+        basenode = q(Node).get(self.basenode_id)
+        creationtime = unicode(time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time())))
+        node_ids = []
+
+        for start in range(0, len(imported), NODE_BATCH_SIZE):
+            batch = []
+            for member_path, name, f in imported[start:start + NODE_BATCH_SIZE]:
+                datatype = getMimeType(name)[1]
+                content_class = Node.get_class_for_typestring(datatype)
+                node = content_class(name=name.decode("utf8"), schema=self.type_to_schema[datatype])
+                node.set("creator", self.user_login)
+                node.set("creationtime", creationtime)
+                f.filetype = content_class.get_upload_filetype()
+                node.files.append(f)
+                batch.append((member_path, node))
+
+            basenode.children.extend(node for _, node in batch)
+            db.session.commit()
+
+            for member_path, node in batch:
+                node_ids.append((member_path, node.id))
+                self._set_entry(member_path, "created", node_id=node.id)
+
+        return node_ids
+
+    def _postprocess(self, member_path_and_node_id):
+        member_path, node_id = member_path_and_node_id
+        try:
+            node = q(Node).get(node_id)
+            node.event_files_changed()
+            db.session.commit()
+        except Exception as e:
+            logg.exception("zip import %s: postprocessing failed for node %s (%s)", self.id, node_id, member_path)
+            db.session.rollback()
+            self._set_entry(member_path, "error", error=unicode(e))
+        else:
+            self._set_entry(member_path, "ok")
+        finally:
+            db.session.close()
+
+    def run(self):
+        try:
+            self._set_state("extracting")
+            imported = self._extract()
+            self._set_state("creating")
+            node_ids = self._create_nodes(imported)
+            db.session.close()
+
+            self._set_state("processing")
+            pool = ThreadPool(config.getint("edit.zipimport_workers", 4))
+            try:
+                for _ in pool.imap_unordered(self._postprocess, node_ids):
+                    pass
+            finally:
+                pool.close()
+                pool.join()
+
+            self.state = "finished"
+            logg.info("%s imported zip file %s with %s entries into node %s, %s failed",
+                      self.user_login, self.zip_filepath, len(self.entries), self.basenode_id, self.error_count)
+        except Exception as e:
+            logg.exception("zip import %s failed", self.id)
+            db.session.rollback()
+            self.state = "failed"
+            self.error = unicode(e)
+        finally:
+            db.session.close()
+            self.finished = time.time()
+            if os.path.exists(self.zip_filepath):
+                os.remove(self.zip_filepath)
+            self.save_status()
+
+    @property
+    def error_count(self):
+        with self._lock:
+            return sum(1 for e in self.entries.itervalues() if e["state"] == "error")
+
+    def status(self):
+        """Returns the job state as dict that can be serialized to JSON."""
+        with self._lock:
+            entries = [dict(name=name, **entry) for name, entry in self.entries.iteritems()]
+        done = sum(1 for e in entries if e["state"] in ("ok", "error"))
+        return {
+            "id": self.id,
+            "state": self.state,
+            "error": self.error,
+            "total": len(entries),
+            "done": done,
+            "errors": sum(1 for e in entries if e["state"] == "error"),
+            "entries": entries
+        }
+
+
+def _remove_old_status_files():
+    now = time.time()
+    status_dir = _get_status_dir()
+    for status_filename in os.listdir(status_dir):
+        status_filepath = os.path.join(status_dir, status_filename)
+        try:
+            if now - os.path.getmtime(status_filepath) > FINISHED_JOB_LIFETIME:
+                os.remove(status_filepath)
+        except OSError:
+            # removed by another worker
+            pass
+
+
+def start_zip_import(zip_filepath, basenode_id, type_to_schema, user_login):
+    """Starts a ZipImportJob in a background thread and returns it.
+    The job owns `zip_filepath` and deletes the file when finished."""
+    _remove_old_status_files()
+    job = ZipImportJob(zip_filepath, basenode_id, type_to_schema, user_login)
+    job.save_status()
+
+    thread = threading.Thread(target=job.run, name="zipimport-" + job.id)
+    thread.daemon = True
+    thread.start()
+    return job
+
+
+def get_zip_import_status(job_id):
+    """Returns the last saved state of a job as dict (see `ZipImportJob.status`) or None if the job is unknown.
+    The dict also contains the login name of the user who started the job as 'user_login'."""
+    if not job_id or not _JOB_ID_PATTERN.match(job_id):
+        return None
+    try:
+        with open(_status_filepath(job_id)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
@@ -18,6 +18,7 @@
  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import logging
+import threading
 from collections import OrderedDict
 from warnings import warn
 from dogpile.cache import make_region
@@ -25,7 +26,7 @@ from sqlalchemy import event
 from markupsafe import Markup
 
 import core.config as config
-from core import db, Node
+from core import db, Node, metrics, invalidation
 from core.translation import lang, t
 from core.metatype import Context
 from core import webconfig
@@ -39,6 +40,7 @@ from utils.utils import Link
 from utils.url import build_url_from_path_and_params
 from schema.searchmask import SearchMask
 from mediatumtal import tal
+from core.database.postgres.replicas import reads_from_primary
 from core.nodecache import get_collections_node
 
 
@@ -55,6 +57,10 @@ navtree_cache = make_region().configure(
 q = db.query
 logg = logging.getLogger(__name__)
 
+metrics.register_cache_size("navtree", lambda: navtree_cache.backend.client.dbsize())
+# set by the cached navtree function if it had to render the tree
+_navtree_cache_state = threading.local()
+
 child_count_cache = None
 
 
@@ -63,10 +69,16 @@ def init_child_count_cache():
     """
     global child_count_cache
     child_count_cache = {}
+    metrics.register_cache_size("child_count", lambda: len(child_count_cache))
+
+    @invalidation.register_handler("child_count")
+    def clear_directory_child_count_cache(arg=None):
+        child_count_cache.clear()
 
     @event.listens_for(db.Session, "after_commit")
     def clear_directory_child_count_cache_after_commit(session):
-        child_count_cache.clear()
+        clear_directory_child_count_cache()
+        invalidation.broadcast("child_count")
 
 
 def getSearchMask(collection):
@@ -251,8 +263,11 @@ class NavTreeEntry(object):
 
         if self.id in child_count_cache:
             self.count = child_count_cache[self.id]
+            metrics.cache_lookup("child_count", True)
         else:
-            child_count_cache[self.id] = self.count = self.node.childcount()
+            with reads_from_primary(db.session):
+                child_count_cache[self.id] = self.count = self.node.childcount()
+            metrics.cache_lookup("child_count", False)
 
         if self.count:
             self.hassubdir = 1
@@ -363,6 +378,7 @@ def _render_navtree_cached_for_anon(language, node_id):
 
     TODO: cache invalidation / timeout
     """
+    _navtree_cache_state.missed = True
     return _render_navtree(language, node_id)
 
 
@@ -383,7 +399,9 @@ def render_navtree(language, node_id, user):
     They all see the same tree, so it's feasible to cache the HTML.
     """
     if user.is_anonymous:
+        _navtree_cache_state.missed = False
         html = _render_navtree_cached_for_anon(language, node_id)
+        metrics.cache_lookup("navtree", not _navtree_cache_state.missed)
         return html
     else:
         return _render_navtree(language, node_id)
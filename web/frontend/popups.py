@@ -29,8 +29,8 @@ from utils.utils import getCollection
 from core import webconfig
 from core import db
 from core import Node
-from contenttypes import Container
-from utils.pathutils import getPaths
+from contenttypes import Container, Collections
+from utils.pathutils import get_accessible_paths, get_accessible_paths_for_nodes
 from utils import userinput
 from core.transition import httpstatus
 
@@ -157,6 +157,8 @@ def show_printview(req):
     if isinstance(node, Container):
         ret = []
         getPrintChildren(req, node, ret)
+        # paths of all child containers are fetched at once
+        paths_by_node_id = get_accessible_paths_for_nodes([c for c in ret if isinstance(c, Container)])
 
         for c in ret:
             if not isinstance(c, Container):
@@ -170,10 +172,11 @@ def show_printview(req):
                     children.append(_c)
             else:
                 # header
-                items = getPaths(c)
+                items = paths_by_node_id[c.id]
                 p = []
                 for item in items[0]:
-                    p.append(item.getName())
+                    if not isinstance(item, Collections):
+                        p.append(item.getName())
                 p.append(c.getName())
                 children.append([(c.id, " > ".join(p[1:]), c.getName(), "header")])
 
@@ -237,7 +240,7 @@ def show_printview(req):
 
     req.reply_headers['Content-Type'] = "application/pdf"
     req.reply_headers['Content-Disposition'] = u'inline; filename="{}_printview.pdf"'.format(node.id)
-    req.write(printview.getPrintView(lang(req), imagepath, metadata, getPaths(node), style, children, getCollection(node)))
+    req.write(printview.getPrintView(lang(req), imagepath, metadata, get_accessible_paths(node), style, children, getCollection(node)))
 
 
 # use popup method of  metadatatype
@@ -26,7 +26,7 @@ from core import db
 from web.edit.edit import get_special_dir_type
 from web.edit.edit_common import get_edit_label
 from core.systemtypes import Root
-from utils.pathutils import getPaths
+from utils.pathutils import get_accessible_paths
 
 logg = logging.getLogger(__name__)
 q = db.query
@@ -117,7 +117,7 @@ def getPathTo(req):
     items = []
     checked = []
 
-    for path in getPaths(node):
+    for path in get_accessible_paths(node, q(Node).prefetch_attrs()):
         if node.id not in path and node.isContainer():  # add node if container
             path.append(node)
 
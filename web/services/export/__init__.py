@@ -51,6 +51,9 @@ logg = logging.getLogger(__name__)
 SERVICES_URL_HAS_HANDLER = 1
 SERVICES_URL_SIMPLE_REWRITE = 2
 
+# the request handler doesn't write to the database, see core.webconfig.loadServices
+READ_ONLY = True
+
 urls = [
     ["GET", "/index.html$", handlers.serve_file, ("/static/index.html", {}, {'filepath': 'index.html'}), SERVICES_URL_SIMPLE_REWRITE, None],
     ["GET", "/$", handlers.serve_file,
@@ -29,11 +29,11 @@ import time
 from sqlalchemy.orm import undefer, joinedload
 
 from core.users import get_guest_user
-from core import config, search
+from core import config, search, metrics
 from core import Node, db, User
 from schema.schema import VIEW_DATA_ONLY, Metadatatype
 from utils.date import format_date
-from utils.pathutils import getBrowsingPathList
+from utils.pathutils import get_accessible_paths_for_nodes
 from utils.utils import esc, getMimeType, modify_tex
 import web.services.jsonnode as jsonnode
 from web.services.rssnode import template_rss_channel, template_rss_item, feed_channel_dict, try_node_date
@@ -64,6 +64,7 @@ from web.services.cache import Cache
 from web.services.cache import date2string as cache_date2string
 
 resultcache = Cache(maxcount=25, verbose=True)
+metrics.register_cache_size("export_result", resultcache.getKeysCount)
 
 SEND_TIMETABLE = False
 DEFAULT_NODEQUERY_LIMIT = config.getint("services.default_limit", 1000)
@@ -387,6 +388,9 @@ def struct2rss(req, path, params, data, struct, debug=False, singlenode=False, s
     host = u"http://" + unicode(req.get_header("HOST") or configured_host)
     collections = get_collections_node()
     user = get_guest_user()
+    paths_by_node_id = get_accessible_paths_for_nodes(nodelist, user=user)
+    # paths only contain readable containers
+    collections_readable = collections.has_read_access(user=user)
 
     for n in nodelist:
         nodename = n.name
@@ -416,8 +420,11 @@ def struct2rss(req, path, params, data, struct, debug=False, singlenode=False, s
         # no rss export mask: build default item from nodesmall mask
         item_d = {}
 
-        browsingPathList = getBrowsingPathList(n)
-        browsingPathList = [x for x in browsingPathList if x[-1].has_read_access(user=user) and x[-1].is_descendant_of(collections)]
+        # paths below the collections node, without the collections node itself
+        if collections_readable:
+            browsingPathList = [p[1:] for p in paths_by_node_id[n.id] if len(p) > 1 and p[0] == collections]
+        else:
+            browsingPathList = [p for p in paths_by_node_id[n.id] if p and p[0].is_descendant_of(collections)]
         browsingPathList_names = [map(lambda x: x.name, browsingPath) for browsingPath in browsingPathList]
 
         # assumption: longest path is most detailled and illustrative for being used in the title
@@ -851,6 +858,7 @@ def write_formatted_response(
     result_from_cache = None
     if acceptcached > 0.0:
         resultcode, cachecontent = resultcache.retrieve(cache_key, acceptcached)
+        metrics.cache_lookup("export_result", resultcode == 'hit')
         if resultcode == 'hit':
             cache_name = 'resultcache'
             timestamp_from_cache = time_cached = resultcache.getTimestamp(cache_key)
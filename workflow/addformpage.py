@@ -40,6 +40,7 @@ import utils.process
 
 from core import db
 from core import File
+from core import filestore
 
 logg = logging.getLogger(__name__)
 
@@ -166,7 +167,9 @@ def fillPDFForm(formPdf, fields, outputPdf="filled.pdf", input_is_fullpath=False
 def addPagesToPDF(prefile, pdffile):
     outfile = pdffile[:-4] + "1.pdf"
     try:
-        utils.process.call(("pdftk", prefile, pdffile, "output", outfile))
+        # outfile may exist from an earlier run and share its blob with other files
+        with filestore.replacement_path(outfile) as tmp_filepath:
+            utils.process.check_call(("pdftk", prefile, pdffile, "output", tmp_filepath))
         os.remove(prefile)
     except Exception:
         logg.exception("exception in workflow step addformpage, error while adding pages, ignoring")
@@ -278,6 +281,7 @@ class WorkflowStep_AddFormPage(WorkflowStep):
             for f in node.files:
                 node.files.remove(f)
             fnode.path = outfile.replace(config.get("paths.datadir"), "")
+            fnode.content_changed()
             node.files.append(fnode)
             node.files.append(File(origname, 'upload', 'application/pdf'))  # store original filename
             node.event_files_changed()
@@ -300,8 +304,9 @@ class WorkflowStep_AddFormPage(WorkflowStep):
                     while os.path.isfile(new_form_path):
                         counter += 1
                         new_form_path = join_paths(importdir, "%s_%s_%s" % (node.id, counter, f_name))
-                # copy new file and remove tmp
-                shutil.copy(pages, new_form_path)
+                # copy new file and remove tmp, an overwritten form may share its blob with other files
+                with filestore.replacement_path(new_form_path) as tmp_filepath:
+                    shutil.copyfile(pages, tmp_filepath)
                 if os.path.exists(pages):
                     os.remove(pages)
             except Exception:
@@ -313,7 +318,12 @@ class WorkflowStep_AddFormPage(WorkflowStep):
                     found = 1
                     break
             if found == 0 or (found == 1 and not pdf_form_overwrite):
-                node.files.append(File(new_form_path, 'pdf_form', 'application/pdf'))
+                form_file = File(new_form_path, 'pdf_form', 'application/pdf')
+                form_file.content_changed()
+                node.files.append(form_file)
+                db.session.commit()
+            else:
+                fn.content_changed()
                 db.session.commit()
 
             logg.info(